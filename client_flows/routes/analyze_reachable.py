@@ -10,6 +10,7 @@ from auth import auth_admin
 from itgs import Itgs
 
 import lib.client_flows.analysis as analysis
+import lib.client_flows.reachability as reachability
 
 
 class ClientFlowsSearchReadableRequest(BaseModel):
@@ -102,6 +103,9 @@ class ClientFlowsSearchReadableResponse(BaseModel):
 
 router = APIRouter()
 
+TARGETS_PAGE_SIZE = 100
+"""The maximum number of targets returned per page when no target is specified"""
+
 SUCCESS_204_TYPES = Literal["no_paths"]
 SUCCESS_NO_PATHS_RESPONSE = Response(status_code=204)
 
@@ -144,7 +148,8 @@ async def client_flows_analyze_reachable(
 
     - Iterating over targets: don't set `target`, `offset_paths`, or `limit_paths`. On the first
       call don't set `targets_cursor`. On subsequent calls, use the `next_targets_cursor` from the
-      previous response. You are done when `next_targets_cursor` is None.
+      previous response. You are done when `next_targets_cursor` is None. No paths are included
+      in this mode; use the next mode to explain how a particular target is reached.
 
     - Iterating over paths between a specific source and target: set `target` and `limit_paths`.
       Initially, keep `offset_paths` to 0. On subsequent calls, use the `next_offset` from the previous
@@ -218,11 +223,11 @@ async def _partially_blocking_acquire_lock(
 
 
 async def _handle_no_target(itgs: Itgs, args: ClientFlowsSearchReadableRequest):
-    # we will ignore paths offset and paths limit; we will use paths offset 0 and paths limit 1
+    # we will ignore paths offset and paths limit; paths are only enumerated when
+    # a target is specified
 
     try:
-        if args.targets_cursor is not None:
-            int(args.targets_cursor)
+        cursor = 0 if args.targets_cursor is None else int(args.targets_cursor)
     except ValueError:
         await handle_warning(
             f"{__name__}:bad_targets_cursor",
@@ -230,165 +235,36 @@ async def _handle_no_target(itgs: Itgs, args: ClientFlowsSearchReadableRequest):
         )
         return ERROR_RATELIMITED_RESPONSE
 
-    try:
-        read_lock_result = await _partially_blocking_acquire_lock(
-            itgs, graph=args.settings, lock_type="reader"
-        )
-    except asyncio.TimeoutError:
-        return ERROR_RATELIMITED_RESPONSE
-
-    if read_lock_result.type == "not_found":
-        return await _handle_no_target_with_write_lock(itgs, args)
-
-    try:
-        read_result = await analysis.try_read_reachable_flows_page_from_cache(
-            itgs,
-            lock=read_lock_result.lock,
-            source=args.source,
-            max_steps=args.max_steps,
-            cursor=0 if args.targets_cursor is None else int(args.targets_cursor),
-            inverted=args.inverted,
-            now=int(time.time()),
-        )
-        if read_result.type == "success":
-            return _format_no_target_result(args, read_result)
-        if read_result.type == "lock_lost":
-            await handle_warning(
-                f"{__name__}:read_lock_stolen",
-                "read lock was stolen while reading, probably because we took too long. not dangerous if so",
-            )
-            return ERROR_RATELIMITED_RESPONSE
-        assert read_result.type == "not_initialized", read_result
-    finally:
-        unlock_result = await analysis.try_release_lock(
-            itgs, lock=read_lock_result.lock, now=int(time.time())
-        )
-        if unlock_result.type != "success":
-            await handle_warning(
-                f"{__name__}:read_lock_stolen",
-                "read lock was stolen before release, probably because we took too long. not dangerous if so",
-            )
-            return ERROR_RATELIMITED_RESPONSE
-
-    return await _handle_no_target_with_write_lock(itgs, args)
-
-
-async def _handle_no_target_with_write_lock(
-    itgs: Itgs, args: ClientFlowsSearchReadableRequest
-) -> Response:
-    try:
-        write_lock_result = await _partially_blocking_acquire_lock(
-            itgs, graph=args.settings, lock_type="writer"
+    if cursor < 0:
+        await handle_warning(
+            f"{__name__}:bad_targets_cursor",
+            "targets_cursor is negative, ignoring request",
         )
-    except asyncio.TimeoutError:
         return ERROR_RATELIMITED_RESPONSE
 
-    assert write_lock_result.type == "success", write_lock_result
-    try:
-        # always need to recheck read whenever there was a period of not having the
-        # lock
-        read_result = await analysis.try_read_reachable_flows_page_from_cache(
-            itgs,
-            lock=write_lock_result.lock,
-            source=args.source,
-            max_steps=args.max_steps,
-            cursor=0 if args.targets_cursor is None else int(args.targets_cursor),
-            inverted=args.inverted,
-            now=int(time.time()),
-        )
-        if read_result.type == "success":
-            return _format_no_target_result(args, read_result)
-        if read_result.type == "lock_lost":
-            await handle_warning(
-                f"{__name__}:no_target_with_write_lock:recheck_read:lock_lost",
-                "write lock was stolen during recheck read",
-            )
-            return ERROR_RATELIMITED_RESPONSE
-
-        fill_result = await analysis.transfer_reachable_flows_from_db(
-            itgs,
-            lock=write_lock_result.lock,
-            source=args.source,
-            max_steps=args.max_steps,
-            inverted=args.inverted,
-        )
-        if fill_result.type == "lock_lost":
-            await handle_warning(
-                f"{__name__}:no_target_with_write_lock:fill:lock_lost",
-                "write lock was stolen while filling, probably because we took too long. not dangerous if so",
-            )
-            return ERROR_RATELIMITED_RESPONSE
-        assert fill_result.type == "success", fill_result
-
-        read_result = await analysis.try_read_reachable_flows_page_from_cache(
-            itgs,
-            lock=write_lock_result.lock,
-            source=args.source,
-            max_steps=args.max_steps,
-            cursor=0 if args.targets_cursor is None else int(args.targets_cursor),
-            inverted=args.inverted,
-            now=int(time.time()),
-        )
-        if read_result.type != "success":
-            await handle_warning(
-                f"{__name__}:no_target_with_write_lock:read_after_fill:{read_result.type}",
-                "failed to read after fill, probably not dangerous",
-            )
-            return ERROR_RATELIMITED_RESPONSE
-
-        return _format_no_target_result(args, read_result)
-    finally:
-        write_lock_result = await analysis.try_release_lock(
-            itgs, lock=write_lock_result.lock, now=int(time.time())
-        )
-        if write_lock_result.type != "success":
-            await handle_warning(
-                f"{__name__}:no_target_with_write_lock:release_failed:{write_lock_result.type}",
-                "write lock was stolen before release, probably because we took too long. not dangerous if so",
-            )
-            return ERROR_RATELIMITED_RESPONSE
-
+    matrix = await reachability.get_client_flow_graph_matrix(itgs, graph=args.settings)
+    natural_targets = matrix.get_reachable(
+        args.source, max_steps=args.max_steps, inverted=args.inverted
+    )
+    page = natural_targets[cursor : cursor + TARGETS_PAGE_SIZE]
+    next_cursor = cursor + len(page)
 
-def _format_no_target_result(
-    args: ClientFlowsSearchReadableRequest,
-    read_result: analysis.ReachableFlowsResultSuccess,
-) -> Response:
     items: Dict[str, ClientFlowsSearchReadableResultItem] = {}
-    for natural_target, natural_peeked_paths in read_result.flows.items.items():
-        if natural_peeked_paths.first.type == "done":
-            items[natural_target] = ClientFlowsSearchReadableResultItem(
-                source=natural_target if args.inverted else args.source,
-                target=args.source if args.inverted else natural_target,
-                paths=[],
-                offset=0,
-                next_offset=None,
-            )
-        else:
-            items[natural_target] = ClientFlowsSearchReadableResultItem(
-                source=natural_target if args.inverted else args.source,
-                target=args.source if args.inverted else natural_target,
-                paths=(
-                    [natural_peeked_paths.first]
-                    if not args.inverted
-                    else [
-                        analysis.FlowPath(
-                            type="path",
-                            nodes=list(reversed(natural_peeked_paths.first.nodes)),
-                        )
-                    ]
-                ),
-                offset=0,
-                next_offset=1 if natural_peeked_paths.count > 1 else None,
-            )
+    for natural_target in page:
+        items[natural_target] = ClientFlowsSearchReadableResultItem(
+            source=natural_target if args.inverted else args.source,
+            target=args.source if args.inverted else natural_target,
+            paths=[],
+            offset=0,
+            next_offset=0,
+        )
 
     return Response(
         content=ClientFlowsSearchReadableResponse.__pydantic_serializer__.to_json(
             ClientFlowsSearchReadableResponse(
                 items=items,
                 next_targets_cursor=(
-                    None
-                    if read_result.flows.cursor is None
-                    else str(read_result.flows.cursor)
+                    None if next_cursor >= len(natural_targets) else str(next_cursor)
                 ),
             )
         )
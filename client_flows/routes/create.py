@@ -142,7 +142,9 @@ WHERE
 
         await purge_client_flow_cache(itgs, slug=flow.slug)
         await purge_valid_client_flows_cache(itgs)
-        await lib.client_flows.analysis.evict(itgs)
+        await lib.client_flows.analysis.evict_flow(
+            itgs, slug=flow.slug, screens=flow.screens, rules=flow.rules
+        )
         return Response(
             content=ClientFlow.__pydantic_serializer__.to_json(flow),
             headers={"Content-Type": "application/json; charset=utf-8"},
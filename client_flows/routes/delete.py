@@ -66,5 +66,7 @@ async def delete_client_flow(
         slug = cast(str, response[0].results[0][0])
         await purge_client_flow_cache(itgs, slug=slug)
         await purge_valid_client_flows_cache(itgs)
-        await lib.client_flows.analysis.evict(itgs)
+        await lib.client_flows.analysis.evict_flow(
+            itgs, slug=slug, screens=None, rules=None
+        )
         return Response(status_code=204)
@@ -37,6 +37,7 @@ from lib.client_flows.client_flow_screen import ClientFlowScreen
 from lib.client_flows.flow_cache import (
     purge_client_flow_cache,
     purge_valid_client_flows_cache,
+    refresh_client_flow_cache,
 )
 from lib.client_flows.helper import (
     check_oas_30_schema,
@@ -188,9 +189,14 @@ async def patch_client_flow(
                 assert args.precondition.slug is not NotSetEnum.NOT_SET
                 await purge_client_flow_cache(itgs, slug=args.precondition.slug)
                 await purge_valid_client_flows_cache(itgs)
+                await lib.client_flows.analysis.evict_flow(
+                    itgs, slug=args.precondition.slug, screens=None, rules=None
+                )
 
-            await purge_client_flow_cache(itgs, slug=flow.slug)
-            await lib.client_flows.analysis.evict(itgs)
+            await refresh_client_flow_cache(itgs, slug=flow.slug)
+            await lib.client_flows.analysis.evict_flow(
+                itgs, slug=flow.slug, screens=flow.screens, rules=flow.rules
+            )
 
         return Response(
             content=flow.__pydantic_serializer__.to_json(flow),
@@ -23,6 +23,7 @@ from lib.client_flows.helper import (
     produce_screen_input_parameters,
     handle_trigger_time_server_transformations,
 )
+from lib.client_flows.queue_head_cache import evict_client_screen_queue_head
 from lib.client_flows.screen_cache import ClientScreen, get_client_screen
 from lib.client_flows.screen_schema import UNSAFE_SCREEN_SCHEMA_TYPES, SpecialIndex
 from models import STANDARD_ERRORS_BY_CODE, StandardErrorResponse
@@ -608,6 +609,7 @@ async def test_screen(
         if args.dry_run:
             return Response(status_code=202)
 
+        await evict_client_screen_queue_head(itgs, user_sub=auth_result.result.sub)
         conn = await itgs.conn()
         cursor = conn.cursor()
 
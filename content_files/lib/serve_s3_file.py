@@ -195,8 +195,12 @@ async def serve_s3_file(
         local_cache = await itgs.local_cache()
         with temp_file() as tmp_file:
             async with aiofiles.open(tmp_file, "wb") as f:
-                await files.download(
-                    f, bucket=files.default_bucket, key=file.key, sync=False
+                await files.download_parallel(
+                    f,
+                    bucket=files.default_bucket,
+                    key=file.key,
+                    sync=False,
+                    size=file.file_size,
                 )
 
             with open(tmp_file, "rb") as f:
@@ -22,6 +22,8 @@ import time
 import courses.auth
 from users.lib.timezones import get_user_timezone
 import unix_dates
+from personalization.lib.user_profile import record_journey_started
+from users.lib.streak import purge_user_streak_cache
 
 router = APIRouter()
 
@@ -252,6 +254,11 @@ async def start_journey(
             await handle_contextless_error(
                 extra_info="while starting next journey in course, failed to store user_journeys record"
             )
+        else:
+            await purge_user_streak_cache(itgs, sub=auth_result.result.sub)
+            await record_journey_started(
+                itgs, user_sub=auth_result.result.sub, user_journey_uid=user_journey_uid
+            )
 
         await on_entering_lobby(
             itgs,
@@ -14,6 +14,8 @@ from content_files.auth import create_jwt as create_content_file_jwt
 from journeys.lib.notifs import on_entering_lobby
 from users.lib.timezones import get_user_timezone
 import unix_dates
+from personalization.lib.user_profile import record_journey_started
+from users.lib.streak import purge_user_streak_cache
 
 router = APIRouter()
 
@@ -149,6 +151,11 @@ async def start_journey_download(
             await handle_contextless_error(
                 extra_info=f"failed to store that user {auth_result.result.sub} started journey {args.journey_uid} via download"
             )
+        else:
+            await purge_user_streak_cache(itgs, sub=auth_result.result.sub)
+            await record_journey_started(
+                itgs, user_sub=auth_result.result.sub, user_journey_uid=user_journey_uid
+            )
 
         await on_entering_lobby(
             itgs,
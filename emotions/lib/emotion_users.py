@@ -6,6 +6,7 @@ from itgs import Itgs
 from dataclasses import dataclass
 import time
 from users.lib.streak import purge_user_streak_cache
+from personalization.lib.user_profile import record_journey_started
 from users.lib.timezones import get_user_timezone
 import unix_dates
 
@@ -256,6 +257,10 @@ WHERE
         await handle_contextless_error(
             extra_info=f"failed to insert into user_journeys; {emotion_user_uid=}, {user_sub=}"
         )
+    else:
+        await record_journey_started(
+            itgs, user_sub=user_sub, user_journey_uid=user_journey_uid
+        )
 
 
 async def get_emotion_pictures(itgs: Itgs, *, word: str) -> List[str]:
@@ -1,18 +1,26 @@
 from fastapi import APIRouter, Header
 from fastapi.responses import Response
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Optional, Set
 from emotions.lib.emotion_content import get_emotion_content_statistics
+from error_middleware import handle_error
 from models import STANDARD_ERRORS_BY_CODE, validator
 from emotions.routes.read import Emotion
 from itgs import Itgs
 from auth import auth_any
+from personalization.lib.pipeline import select_journeys
+import asyncio
 import random
 import numpy as np
 
 
 router = APIRouter()
 
+_pending_selections: Set[asyncio.Task] = set()
+"""Strong references to the journey selections started alongside the response, so
+they are not garbage collected before they finish
+"""
+
 
 class LocalTime(BaseModel):
     hour_24: int = Field(
@@ -80,7 +88,7 @@ async def retrieve_daily_emotions(
     """
     async with Itgs() as itgs:
         auth_result = await auth_any(itgs, authorization)
-        if not auth_result.success:
+        if auth_result.result is None:
             return auth_result.error_response
 
         stats = await get_emotion_content_statistics(itgs)
@@ -132,6 +140,15 @@ async def retrieve_daily_emotions(
                 emotion_words.remove(selected_emotions[remove_idx].word)
                 selected_emotions[remove_idx] = lookup["sleepy"].emotion
 
+        task = asyncio.create_task(
+            _select_journeys_in_background(
+                emotions=[emotion.word for emotion in selected_emotions],
+                user_sub=auth_result.result.sub,
+            )
+        )
+        _pending_selections.add(task)
+        task.add_done_callback(_pending_selections.discard)
+
         return Response(
             content=RetrieveDailyEmotionsResponse(
                 items=selected_emotions
@@ -139,3 +156,18 @@ async def retrieve_daily_emotions(
             headers={"Content-Type": "application/json; charset=utf-8"},
             status_code=200,
         )
+
+
+async def _select_journeys_in_background(*, emotions: List[str], user_sub: str) -> None:
+    """Makes start_related_journey a cache hit for the given emotions. This is
+    not needed for the response, so it's started as a task just before the
+    handler returns and may run at the same time as the response is sent. It
+    uses its own integrations, since the handler's are closed once it returns.
+    """
+    try:
+        async with Itgs() as itgs:
+            await select_journeys(
+                itgs, emotions=emotions, user_sub=user_sub, premium=False
+            )
+    except Exception as e:
+        await handle_error(e, extra_info="selecting journeys in advance")
@@ -1,10 +1,20 @@
-from typing import Union, Protocol, cast as typing_cast
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    Protocol,
+    cast as typing_cast,
+)
 import aioboto3
+import asyncio
 import botocore.exceptions
 import aiofiles
 import os
+import secrets
 from loguru import logger as logging
-from temp_files import temp_file
 import io
 
 
@@ -62,6 +72,162 @@ class SyncWritableBytesIO(Protocol):
         raise NotImplementedError()
 
 
+class SyncSeekableWritableBytesIO(Protocol):
+    """A type that represents a stream that can be written synchronously at
+    arbitrary offsets, e.g., a file opened in "wb" mode or a BytesIO
+    """
+
+    def seek(self, offset: int, whence: int = 0, /) -> int:
+        """Moves the stream position to the given offset"""
+        raise NotImplementedError()
+
+    def write(self, b: Union[bytes, bytearray], /) -> int:
+        """Writes the given bytes to the file-like object"""
+        raise NotImplementedError()
+
+
+class AsyncSeekableWritableBytesIO(Protocol):
+    """A type that represents a stream that can be written asynchronously at
+    arbitrary offsets, e.g., a file opened in "wb" mode via aiofiles
+    """
+
+    async def seek(self, offset: int, whence: int = 0, /) -> int:
+        """Moves the stream position to the given offset"""
+        raise NotImplementedError()
+
+    async def write(self, b: Union[bytes, bytearray], /) -> int:
+        """Writes the given bytes to the file-like object"""
+        raise NotImplementedError()
+
+
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+"""The default size of each part when streaming an upload via a multipart upload.
+S3 requires that every part except the last is at least 5 MiB, and limits uploads
+to 10,000 parts, so this supports objects up to about 80 GB
+"""
+
+MULTIPART_CONCURRENCY = 4
+"""The default maximum number of parts that are uploaded concurrently when
+streaming an upload. Since each in-flight part is held in memory, this
+bounds the memory used by a streaming upload to roughly
+`(MULTIPART_CONCURRENCY + 1) * MULTIPART_PART_SIZE`
+"""
+
+MULTIPART_PART_ATTEMPTS = 3
+"""The maximum number of attempts for uploading a single part of a multipart
+upload before the entire upload is aborted
+"""
+
+
+PARALLEL_DOWNLOAD_THRESHOLD = 32 * 1024 * 1024
+"""The default minimum object size, in bytes, before `download_parallel` splits
+the download into multiple ranged requests. Smaller objects are downloaded with
+a single request, since the additional round trips would outweigh the benefit
+"""
+
+PARALLEL_DOWNLOAD_PART_SIZE = 8 * 1024 * 1024
+"""The default size of each range requested by `download_parallel`"""
+
+PARALLEL_DOWNLOAD_CONCURRENCY = 8
+"""The default maximum number of ranges a single `download_parallel` call will
+fetch at once
+"""
+
+PARALLEL_DOWNLOAD_BUDGET = int(os.environ.get("OSEH_S3_PARALLEL_DOWNLOAD_BUDGET", "32"))
+"""The maximum number of ranged requests that may be in flight at once across
+all `download_parallel` calls within this process, so that many concurrent
+large downloads cannot exhaust the connection pool
+"""
+
+_parallel_download_budget: Optional[asyncio.Semaphore] = None
+"""The semaphore enforcing `PARALLEL_DOWNLOAD_BUDGET`; initialized lazily so
+that it's created within the running event loop
+"""
+
+
+def _get_parallel_download_budget() -> asyncio.Semaphore:
+    """Gets the process-wide semaphore which limits the number of concurrent
+    ranged requests across all parallel downloads
+    """
+    global _parallel_download_budget
+    if _parallel_download_budget is None:
+        _parallel_download_budget = asyncio.Semaphore(PARALLEL_DOWNLOAD_BUDGET)
+    return _parallel_download_budget
+
+
+def _split_ranges(size: int, part_size: int) -> List[Tuple[int, int]]:
+    """Splits [0, size) into consecutive half-open ranges of at most part_size bytes"""
+    return [
+        (start, min(start + part_size, size)) for start in range(0, size, part_size)
+    ]
+
+
+async def _gather_or_cancel(tasks: List[asyncio.Task]) -> None:
+    """Waits for all the given tasks to complete. If any of them fails, the
+    remaining tasks are cancelled and the first error is raised
+    """
+    if not tasks:
+        return
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks, return_when=asyncio.ALL_COMPLETED)
+        raise
+
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending, return_when=asyncio.ALL_COMPLETED)
+    for task in done:
+        task.result()
+
+
+async def _write_at(
+    f: Union[SyncSeekableWritableBytesIO, AsyncSeekableWritableBytesIO],
+    offset: int,
+    data: bytes,
+    *,
+    sync: bool,
+    lock: asyncio.Lock,
+) -> None:
+    """Writes the given data at the given offset in the given stream. For
+    asynchronous streams, other ranges may write between the seek and the write,
+    so the caller provides a lock shared by every writer to the stream
+    """
+    if sync:
+        sync_file = typing_cast(SyncSeekableWritableBytesIO, f)
+        sync_file.seek(offset)
+        sync_file.write(data)
+        return
+
+    async_file = typing_cast(AsyncSeekableWritableBytesIO, f)
+    async with lock:
+        await async_file.seek(offset)
+        await async_file.write(data)
+
+
+async def _read_up_to(
+    f: Union[SyncReadableBytesIO, AsyncReadableBytesIO], n: int, *, sync: bool
+) -> bytes:
+    """Reads from the given stream until either n bytes have been read or the
+    stream is exhausted. Unlike a single `read(n)`, this will not return a short
+    result just because the underlying stream (e.g., a request body) delivered
+    the data in smaller chunks.
+    """
+    result = bytearray()
+    while len(result) < n:
+        if sync:
+            chunk = typing_cast(SyncReadableBytesIO, f).read(n - len(result))
+        else:
+            chunk = await typing_cast(AsyncReadableBytesIO, f).read(n - len(result))
+        if not chunk:
+            break
+        result.extend(chunk)
+    return bytes(result)
+
+
 class S3:
     """Adapts S3 via aioboto3 to act as a file service.
 
@@ -106,39 +272,154 @@ class S3:
     ) -> None:
         logging.info(f"[file_service/s3]: upload {bucket=}, {key=}")
         assert self._s3 is not None
-        if not sync:
-            async_file = typing_cast(AsyncReadableBytesIO, f)
-            with temp_file() as tmp:
-                async with aiofiles.open(tmp, "wb") as f2:
-                    data = await async_file.read(8192)
-                    while data:
-                        await f2.write(data)
-                        data = await async_file.read(8192)
-
-                with open(tmp, "rb") as f2:
-                    await self._s3.put_object(Bucket=bucket, Key=key, Body=f2)
+        if not sync or not isinstance(f, io.IOBase):
+            # Either we can't hand the stream to boto3 directly (it's async), or
+            # it's not quite an io-like file (e.g., SpooledTemporaryFile). Rather
+            # than copying the stream to disk first, stream it via a multipart
+            # upload
+            await self.upload_streaming(f, bucket=bucket, key=key, sync=sync)
             return
 
-        if not isinstance(f, io.IOBase):
-            # Typically this is from e.g., SpooledTemporaryFile, which is nearly an io-like
-            # file since introduced, but not actually one until python 3.11. We take a pretty
-            # big performance hit for converting spooled files this way, but since it goes
-            # away once our python version is higher, we can live with it.
-
-            sync_file = typing_cast(SyncReadableBytesIO, f)
-            with temp_file() as tmp:
-                async with aiofiles.open(tmp, "wb") as f2:
-                    data = sync_file.read(8192)
-                    while data:
-                        await f2.write(data)
-                        data = sync_file.read(8192)
+        await self._s3.put_object(Bucket=bucket, Key=key, Body=f)
 
-                with open(tmp, "rb") as f2:
-                    await self._s3.put_object(Bucket=bucket, Key=key, Body=f2)
+    async def upload_streaming(
+        self,
+        f: Union[SyncReadableBytesIO, AsyncReadableBytesIO],
+        *,
+        bucket: str,
+        key: str,
+        sync: bool,
+        part_size: int = MULTIPART_PART_SIZE,
+        concurrency: int = MULTIPART_CONCURRENCY,
+    ) -> None:
+        """Uploads the given stream to the given key without first copying it
+        to disk. If the stream fits within a single part it is uploaded with a
+        single `put_object`; otherwise it's uploaded via a multipart upload with
+        up to `concurrency` parts in flight at a time, each of which is retried
+        independently. If the upload fails, the multipart upload is aborted so
+        that no partial object is left behind.
+
+        The stream is read sequentially and only `part_size` bytes at a time,
+        so memory usage is bounded by roughly `(concurrency + 1) * part_size`
+        regardless of the size of the stream.
+
+        Args:
+            f (SyncReadableBytesIO, AsyncReadableBytesIO): the stream to upload
+            bucket (str): the bucket to upload to
+            key (str): the key to upload to
+            sync (bool): True if `f` is read synchronously, False if `f` is read
+                asynchronously
+            part_size (int): the size of each part, in bytes. Must be at least
+                5 MiB for S3 to accept the multipart upload
+            concurrency (int): the maximum number of parts to upload at once
+        """
+        logging.info(f"[file_service/s3]: upload_streaming {bucket=}, {key=}")
+        assert self._s3 is not None
+        assert concurrency >= 1, concurrency
 
+        data = await _read_up_to(f, part_size, sync=sync)
+        if len(data) < part_size:
+            await self._s3.put_object(Bucket=bucket, Key=key, Body=data)
             return
 
-        await self._s3.put_object(Bucket=bucket, Key=key, Body=f)
+        create_response = await self._s3.create_multipart_upload(Bucket=bucket, Key=key)
+        upload_id = typing_cast(str, create_response["UploadId"])
+        etags: Dict[int, str] = dict()
+        pending: Set[asyncio.Task] = set()
+        try:
+            part_number = 1
+            while data:
+                if len(pending) >= concurrency:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        task.result()
+
+                pending.add(
+                    asyncio.create_task(
+                        self._upload_part(
+                            data,
+                            bucket=bucket,
+                            key=key,
+                            upload_id=upload_id,
+                            part_number=part_number,
+                            etags=etags,
+                        )
+                    )
+                )
+                part_number += 1
+                data = await _read_up_to(f, part_size, sync=sync)
+
+            if pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.ALL_COMPLETED
+                )
+                for task in done:
+                    task.result()
+
+            parts: List[dict] = [
+                {"ETag": etags[num], "PartNumber": num} for num in sorted(etags.keys())
+            ]
+            await self._s3.complete_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending, return_when=asyncio.ALL_COMPLETED)
+            try:
+                await self._s3.abort_multipart_upload(
+                    Bucket=bucket, Key=key, UploadId=upload_id
+                )
+            except Exception:
+                logging.exception(
+                    f"[file_service/s3]: failed to abort multipart upload {bucket=}, {key=}, {upload_id=}"
+                )
+            raise
+
+    async def _upload_part(
+        self,
+        data: bytes,
+        *,
+        bucket: str,
+        key: str,
+        upload_id: str,
+        part_number: int,
+        etags: Dict[int, str],
+    ) -> None:
+        """Uploads a single part of a multipart upload, retrying with backoff
+        on failure, and stores the resulting etag in `etags`
+        """
+        assert self._s3 is not None
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = await self._s3.upload_part(
+                    Bucket=bucket,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=data,
+                )
+                etags[part_number] = typing_cast(str, response["ETag"])
+                return
+            except (
+                botocore.exceptions.ClientError,
+                botocore.exceptions.BotoCoreError,
+            ):
+                if attempt >= MULTIPART_PART_ATTEMPTS:
+                    raise
+                logging.warning(
+                    f"[file_service/s3]: failed to upload part {part_number} of {bucket=}, {key=} "
+                    f"on attempt {attempt}/{MULTIPART_PART_ATTEMPTS}, retrying"
+                )
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))
 
     async def download(
         self,
@@ -176,6 +457,93 @@ class S3:
                 return False
             raise
 
+    async def download_parallel(
+        self,
+        f: Union[SyncSeekableWritableBytesIO, AsyncSeekableWritableBytesIO],
+        *,
+        bucket: str,
+        key: str,
+        sync: bool,
+        size: Optional[int] = None,
+        threshold: int = PARALLEL_DOWNLOAD_THRESHOLD,
+        part_size: int = PARALLEL_DOWNLOAD_PART_SIZE,
+        concurrency: int = PARALLEL_DOWNLOAD_CONCURRENCY,
+    ) -> bool:
+        """Downloads the given object into the given seekable destination. If
+        the object is at least `threshold` bytes, it's split into ranges of
+        `part_size` bytes which are fetched with up to `concurrency` concurrent
+        ranged GETs (further limited by the process-wide
+        `PARALLEL_DOWNLOAD_BUDGET`), each written at its offset in `f`.
+        Otherwise, this is equivalent to `download`.
+
+        Finding the size of the object takes a HEAD request, so if the caller
+        already knows it is below `threshold` it can pass `size` to skip
+        straight to a single GET.
+
+        The ranged GETs are conditioned on the etag from the initial HEAD, so
+        if the object is replaced mid-download this raises rather than
+        producing a mix of the two versions. If this raises, the contents of
+        `f` are unspecified.
+
+        Returns:
+            bool: True if the object was found and downloaded, False if it
+                does not exist
+        """
+        logging.info(f"[file_service/s3]: download_parallel {bucket=}, {key=}")
+        assert self._s3 is not None
+        assert concurrency >= 1, concurrency
+        if size is not None and size < threshold:
+            return await self.download(f, bucket=bucket, key=key, sync=sync)
+
+        try:
+            head = await self._s3.head_object(Bucket=bucket, Key=key)
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+        size = typing_cast(int, head["ContentLength"])
+        if size < threshold:
+            return await self.download(f, bucket=bucket, key=key, sync=sync)
+
+        etag = typing_cast(str, head["ETag"])
+        limit = asyncio.Semaphore(concurrency)
+        budget = _get_parallel_download_budget()
+        write_lock = asyncio.Lock()
+
+        async def _fetch(start: int, end: int) -> None:
+            assert self._s3 is not None
+            async with limit, budget:
+                s3_ob = await self._s3.get_object(
+                    Bucket=bucket,
+                    Key=key,
+                    Range=f"bytes={start}-{end - 1}",
+                    IfMatch=etag,
+                )
+                stream = s3_ob["Body"]
+                try:
+                    offset = start
+                    data = await stream.read(65536)
+                    while data:
+                        await _write_at(f, offset, data, sync=sync, lock=write_lock)
+                        offset += len(data)
+                        data = await stream.read(65536)
+                finally:
+                    stream.close()
+
+                if offset != end:
+                    raise ValueError(
+                        f"expected bytes [{start}, {end}) of {bucket=}, {key=}, but the stream ended at {offset}"
+                    )
+
+        await _gather_or_cancel(
+            [
+                asyncio.create_task(_fetch(start, end))
+                for start, end in _split_ranges(size, part_size)
+            ]
+        )
+        return True
+
     async def delete(self, *, bucket: str, key: str) -> bool:
         logging.info(f"[file_service/s3]: delete {bucket=}, {key=}")
         assert self._s3 is not None
@@ -229,6 +597,41 @@ class LocalFiles:
                     await f2.write(chunk)
                     chunk = await async_file.read(8192)
 
+    async def upload_streaming(
+        self,
+        f: Union[SyncReadableBytesIO, AsyncReadableBytesIO],
+        *,
+        bucket: str,
+        key: str,
+        sync: bool,
+        part_size: int = MULTIPART_PART_SIZE,
+        concurrency: int = MULTIPART_CONCURRENCY,
+    ) -> None:
+        """Equivalent to `S3.upload_streaming`: the stream is read `part_size`
+        bytes at a time and written to a temporary file beside the destination,
+        which is only moved into place once the stream is exhausted, so that a
+        failed upload never leaves a partial file at the key. `concurrency` is
+        accepted for parity but unused, since the parts are written in order.
+        """
+        logging.info(f"[file_service/local_files]: upload_streaming {bucket=}, {key=}")
+        dst = os.path.join(self._root, bucket, key)
+        dst_folder = os.path.dirname(dst)
+        os.makedirs(dst_folder, exist_ok=True)
+        partial = f"{dst}.{secrets.token_hex(8)}.partial"
+        try:
+            async with aiofiles.open(partial, "wb") as f2:
+                data = await _read_up_to(f, part_size, sync=sync)
+                while data:
+                    await f2.write(data)
+                    data = await _read_up_to(f, part_size, sync=sync)
+            os.replace(partial, dst)
+        except BaseException:
+            try:
+                os.unlink(partial)
+            except FileNotFoundError:
+                pass
+            raise
+
     async def download(
         self,
         f: Union[SyncWritableBytesIO, AsyncWritableBytesIO],
@@ -256,6 +659,61 @@ class LocalFiles:
         except FileNotFoundError:
             return False
 
+    async def download_parallel(
+        self,
+        f: Union[SyncSeekableWritableBytesIO, AsyncSeekableWritableBytesIO],
+        *,
+        bucket: str,
+        key: str,
+        sync: bool,
+        size: Optional[int] = None,
+        threshold: int = PARALLEL_DOWNLOAD_THRESHOLD,
+        part_size: int = PARALLEL_DOWNLOAD_PART_SIZE,
+        concurrency: int = PARALLEL_DOWNLOAD_CONCURRENCY,
+    ) -> bool:
+        """Equivalent to `S3.download_parallel`: files of at least `threshold`
+        bytes are read in `part_size` ranges by up to `concurrency` concurrent
+        readers (subject to the same process-wide budget), each written at its
+        offset in `f`. `size` is accepted for parity but unused, since the size
+        of a local file is always cheap to find.
+        """
+        logging.info(f"[file_service/local_files]: download_parallel {bucket=}, {key=}")
+        assert concurrency >= 1, concurrency
+        src = os.path.join(self._root, bucket, key)
+        try:
+            size = os.path.getsize(src)
+        except FileNotFoundError:
+            return False
+
+        if size < threshold:
+            return await self.download(f, bucket=bucket, key=key, sync=sync)
+
+        limit = asyncio.Semaphore(concurrency)
+        budget = _get_parallel_download_budget()
+        write_lock = asyncio.Lock()
+
+        async def _fetch(start: int, end: int) -> None:
+            async with limit, budget:
+                async with aiofiles.open(src, "rb") as f2:
+                    await f2.seek(start)
+                    offset = start
+                    while offset < end:
+                        data = await f2.read(min(65536, end - offset))
+                        if not data:
+                            raise ValueError(
+                                f"expected bytes [{start}, {end}) of {bucket=}, {key=}, but the file ended at {offset}"
+                            )
+                        await _write_at(f, offset, data, sync=sync, lock=write_lock)
+                        offset += len(data)
+
+        await _gather_or_cancel(
+            [
+                asyncio.create_task(_fetch(start, end))
+                for start, end in _split_ranges(size, part_size)
+            ]
+        )
+        return True
+
     async def delete(self, *, bucket: str, key: str) -> bool:
         logging.info(f"[file_service/local_files]: delete {bucket=}, {key=}")
         try:
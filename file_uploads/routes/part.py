@@ -1,11 +1,11 @@
 import asyncio
-import os
+import hashlib
 import secrets
 import time
-from fastapi import APIRouter, UploadFile, Header
+from fastapi import APIRouter, Request, UploadFile, Header
 from fastapi.responses import Response
 from pydantic import BaseModel, Field
-from typing import BinaryIO, Literal, Optional, cast as typing_cast
+from typing import AsyncIterator, Literal, Optional, cast as typing_cast
 from file_uploads.auth import auth_any
 from itgs import Itgs
 from models import (
@@ -31,27 +31,114 @@ ERROR_409_TYPE = Literal["part_already_uploaded", "part_does_not_match"]
 """The error codes for the 409 response"""
 
 
-class BinaryIOAdapter:
-    """Adapts BinaryIO to SyncReadableFile"""
+class PartDoesNotMatch(Exception):
+    """Raised by `HashingLengthCheckedReader` when the streamed part is not the
+    expected length or does not have the expected hash
+    """
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+class HashingLengthCheckedReader:
+    """Adapts an async iterator of byte chunks (e.g., `request.stream()`) to an
+    AsyncReadableBytesIO, hashing and counting the bytes as they pass through.
+    Raises `PartDoesNotMatch` from `read` as soon as more than `expected_length`
+    bytes are seen, or upon reaching the end of the stream if fewer bytes were
+    seen or the sha256 doesn't match `expected_sha256`, so the file service
+    never completes the upload of a mismatched part.
+    """
+
+    def __init__(
+        self,
+        chunks: AsyncIterator[bytes],
+        *,
+        expected_length: int,
+        expected_sha256: Optional[str],
+    ) -> None:
+        self.chunks = chunks
+        self.expected_length = expected_length
+        self.expected_sha256 = expected_sha256
+        self.sha256 = hashlib.sha256()
+        """The hash of the bytes read so far"""
+        self.length = 0
+        """The number of bytes read so far"""
+        self._buffer = b""
+        self._exhausted = False
+
+    async def read(self, n: int) -> bytes:
+        while not self._buffer and not self._exhausted:
+            try:
+                chunk = await self.chunks.__anext__()
+            except StopAsyncIteration:
+                self._exhausted = True
+                self._check_complete()
+                break
+
+            self.length += len(chunk)
+            if self.length > self.expected_length:
+                raise PartDoesNotMatch(
+                    f"You provided more than the expected {self.expected_length} bytes for this part."
+                )
+            self.sha256.update(chunk)
+            self._buffer = chunk
+
+        result = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return result
+
+    def _check_complete(self) -> None:
+        if self.length != self.expected_length:
+            raise PartDoesNotMatch(
+                f"You provided a file with {self.length} bytes, but the server expected "
+                f"{self.expected_length} bytes for this part."
+            )
+        if (
+            self.expected_sha256 is not None
+            and self.sha256.hexdigest() != self.expected_sha256.lower()
+        ):
+            raise PartDoesNotMatch(
+                "The sha256 of the provided part does not match the X-Content-SHA256 header."
+            )
 
-    def __init__(self, file: BinaryIO) -> None:
-        self.file = file
 
-    def read(self, n: int) -> bytes:
-        return self.file.read(n)
+async def _iter_upload_file(file: UploadFile) -> AsyncIterator[bytes]:
+    """Iterates the contents of a multipart/form-data upload in chunks"""
+    chunk = await file.read(65536)
+    while chunk:
+        yield chunk
+        chunk = await file.read(65536)
 
 
 @router.post(
     "/{uid}/{part}",
     status_code=202,
     response_model=FileUploadPartResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/octet-stream": {
+                    "schema": {"type": "string", "format": "binary"}
+                },
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "required": ["file"],
+                        "properties": {"file": {"type": "string", "format": "binary"}},
+                    }
+                },
+            },
+        },
+    },
     responses={
         "404": {
             "description": "One of: the upload was aborted or completed, or there is no part with that number for the upload",
             "model": StandardErrorResponse[ERROR_404_TYPE],
         },
         "409": {
-            "description": "One of: the part has already been uploaded, the provided file is not the correct length for that part",
+            "description": "One of: the part has already been uploaded, the provided file is not the correct length or hash for that part",
             "model": StandardErrorResponse[ERROR_409_TYPE],
         },
         **STANDARD_ERRORS_BY_CODE,
@@ -60,9 +147,10 @@ class BinaryIOAdapter:
 async def upload_part(
     uid: str,
     part: int,
-    file: UploadFile,
+    request: Request,
     jwt: Optional[str] = None,
     authorization: Optional[str] = Header(None),
+    x_content_sha256: Optional[str] = Header(None),
 ):
     """The primary endpoint to upload a single part of a multipart upload.
 
@@ -71,6 +159,12 @@ async def upload_part(
     standard authorization - rather, it's a JWT specifically for this file
     upload, returned from a more contextful endpoint (such as
     [create journey background image](#/journeys/create_journey_background_image_api_1_journeys_background_images__post))
+
+    The part should be sent as the raw request body with the content type
+    `application/octet-stream`, in which case it's streamed directly to
+    storage. For backwards compatibility, it may instead be sent as the `file`
+    field of a `multipart/form-data` body. If the `X-Content-SHA256` header is
+    set, it must be the hex-encoded sha256 of the part.
     """
     token: Optional[str] = authorization
     if token is None and jwt is not None:
@@ -88,7 +182,10 @@ async def upload_part(
             return AUTHORIZATION_UNKNOWN_TOKEN
 
         conn = await itgs.conn()
-        cursor = conn.cursor("strong")
+        # the writes below are guarded by their own conditions, so this read
+        # doesn't need to go through consensus; this keeps concurrent parts
+        # for the same upload from contending on it
+        cursor = conn.cursor("weak")
 
         now = time.time()
         response = await cursor.execute(
@@ -154,24 +251,35 @@ async def upload_part(
                 status_code=409,
             )
 
-        file.file.seek(0, os.SEEK_END)
-        file_size = file.file.tell()
-        file.file.seek(0)
-        if end_byte - start_byte != file_size:
-            return Response(
-                content=StandardErrorResponse[ERROR_409_TYPE](
-                    type="part_does_not_match",
-                    message=(
-                        "The referenced part does not match the expected length. The server "
-                        "decides how the parts are split up, and the parts and corresponding byte ranges "
-                        "should have been returned from the same endpoint you used to get the JWT. You provided "
-                        f"a file with {file_size} bytes, but the server expected {end_byte - start_byte} "
-                        f"bytes for this part; bytes [{start_byte}, {end_byte})."
-                    ),
-                ).model_dump_json(),
-                headers={"Content-Type": "application/json; charset=utf-8"},
-                status_code=409,
-            )
+        expected_length = end_byte - start_byte
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            form_file = form.get("file")
+            if not isinstance(form_file, UploadFile):
+                return _part_does_not_match(
+                    "Expected the part in the file field of the multipart/form-data body.",
+                    start_byte=start_byte,
+                    end_byte=end_byte,
+                )
+            chunks = _iter_upload_file(form_file)
+        else:
+            content_length = request.headers.get("content-length")
+            if content_length is not None and content_length != str(expected_length):
+                return _part_does_not_match(
+                    f"You provided a file with {content_length} bytes, but the server expected "
+                    f"{expected_length} bytes for this part.",
+                    start_byte=start_byte,
+                    end_byte=end_byte,
+                )
+            chunks = request.stream()
+
+        reader = HashingLengthCheckedReader(
+            chunks,
+            expected_length=expected_length,
+            expected_sha256=x_content_sha256,
+        )
+
         files = await itgs.files()
         redis = await itgs.redis()
         key = f"s3_files/uploads/{uid}/{part}/{secrets.token_urlsafe(8)}"
@@ -180,9 +288,16 @@ async def upload_part(
         )
 
         await redis.zadd("files:purgatory", {purgatory_key: now + 600})
-        await files.upload(
-            BinaryIOAdapter(file.file), bucket=files.default_bucket, key=key, sync=True
-        )
+        try:
+            await files.upload_streaming(
+                reader, bucket=files.default_bucket, key=key, sync=False
+            )
+        except PartDoesNotMatch as e:
+            await redis.zrem("files:purgatory", purgatory_key)
+            return _part_does_not_match(
+                e.message, start_byte=start_byte, end_byte=end_byte
+            )
+        file_size = reader.length
         s3_file_uid = f"oseh_s3f_{secrets.token_urlsafe(16)}"
         response = await cursor.executemany3(
             (
@@ -218,7 +333,9 @@ async def upload_part(
                         part,
                     ),
                 ),
-                # mark complete if all parts uploaded (we'll check rows_affected)
+                # mark complete if all parts uploaded (we'll check rows_affected); this
+                # is atomic with accepting the part, so exactly one request sees the
+                # upload complete even when the last parts finish concurrently
                 (
                     """
                     UPDATE s3_file_uploads
@@ -323,3 +440,19 @@ async def upload_part(
             headers={"Content-Type": "application/json; charset=utf-8"},
             status_code=202,
         )
+
+
+def _part_does_not_match(message: str, *, start_byte: int, end_byte: int) -> Response:
+    return Response(
+        content=StandardErrorResponse[ERROR_409_TYPE](
+            type="part_does_not_match",
+            message=(
+                "The referenced part does not match the expected length or hash. The server "
+                "decides how the parts are split up, and the parts and corresponding byte ranges "
+                "should have been returned from the same endpoint you used to get the JWT. "
+                f"{message} Bytes [{start_byte}, {end_byte})."
+            ),
+        ).model_dump_json(),
+        headers={"Content-Type": "application/json; charset=utf-8"},
+        status_code=409,
+    )
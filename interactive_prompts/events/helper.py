@@ -1,4 +1,6 @@
 from dataclasses import dataclass
+import asyncio
+import json
 import math
 import re
 import secrets
@@ -31,6 +33,22 @@ from interactive_prompts.events.models import (
     ERROR_INTERACTIVE_PROMPT_SESSION_NOT_STARTED_RESPONSE,
     CreateInteractivePromptEventResponse,
 )
+from interactive_prompts.lib.fenwick_deltas import (
+    STATS_SEQ_TTL_SECONDS,
+    FenwickTreeDelta,
+    InteractivePromptEventStatsUpdate,
+    fenwick_node_indices,
+    get_stats_seq_key,
+)
+from interactive_prompts.lib.event_buffer import (
+    BUFFER_KEY,
+    BUFFERED_INGESTION_ENABLED,
+    SESSION_STATE_TTL_SECONDS,
+    BufferedInteractivePromptEvent,
+    flush_buffered_events,
+    get_session_state_key,
+    schedule_flush,
+)
 from interactive_prompts.lib.read_interactive_prompt_meta import (
     read_interactive_prompt_meta,
 )
@@ -44,6 +62,11 @@ from pypika.terms import Term, ExistsCriterion, ContainsCriterion
 from pypika.queries import QueryBuilder
 import auth
 import interactive_prompts.auth
+from redis_helpers.interactive_prompt_session_accept_event import (
+    ensure_interactive_prompt_session_accept_event_script_exists,
+    interactive_prompt_session_accept_event,
+)
+from redis_helpers.run_with_prep import run_with_prep
 
 
 @dataclass
@@ -301,6 +324,19 @@ class InteractivePromptEventPubSubMessage(BaseModel, Generic[EventTypeT, EventDa
     created_at: float = Field(
         description="the unix timestamp of when the event was created"
     )
+    stats: Optional[InteractivePromptEventStatsUpdate] = Field(
+        None, description="how the event changed the stats of the interactive prompt"
+    )
+
+
+def compute_bin_index(
+    prompt_time: int, interactive_prompt_meta: InteractivePromptAugmentedMeta
+) -> int:
+    """Determines which 0-indexed bin an event at the given prompt time
+    falls into
+    """
+    bin_width = interactive_prompt_meta.duration_seconds / interactive_prompt_meta.bins
+    return min(max(0, int(prompt_time / bin_width)), interactive_prompt_meta.bins - 1)
 
 
 @dataclass
@@ -477,18 +513,9 @@ class PrefixSumUpdate:
         Returns:
             The queries to execute, in the form of (query, params) tuples.
         """
-        bin_width = (
-            interactive_prompt_meta.duration_seconds / interactive_prompt_meta.bins
-        )
-        bin_idx = min(
-            max(0, int(prompt_time / bin_width)), interactive_prompt_meta.bins - 1
-        )
+        bin_idx = compute_bin_index(prompt_time, interactive_prompt_meta)
 
-        indices = []
-        one_based_idx = bin_idx + 1
-        while one_based_idx <= interactive_prompt_meta.bins:
-            indices.append(one_based_idx - 1)
-            one_based_idx += one_based_idx & -one_based_idx
+        indices = fenwick_node_indices(bin_idx, interactive_prompt_meta.bins)
 
         qmark_list = ", ".join(["(?)"] * len(indices))
 
@@ -583,6 +610,122 @@ class PrefixSumUpdate:
         ]
 
 
+async def get_prefix_sum_update_deltas(
+    itgs: Itgs,
+    updates: List[PrefixSumUpdate],
+    *,
+    interactive_prompt_event_uid: str,
+    prompt_time: int,
+    interactive_prompt_meta: InteractivePromptAugmentedMeta,
+) -> List[FenwickTreeDelta]:
+    """Determines which changes were made by the queries from `to_queries` for
+    each of the given prefix sum updates. Simple updates don't require any io;
+    the earlier events for the rest are looked up in a single query, the same
+    way their queries find them. Since the lookup excludes the event being
+    inserted, it gives the same result whether it runs before or after that
+    event is stored, so it can run alongside the insert.
+
+    Args:
+        itgs (Itgs): The integrations to (re)use
+        updates (list[PrefixSumUpdate]): The prefix sum updates for the event
+        interactive_prompt_event_uid (str): The UID of the interactive
+            prompt event being inserted
+        prompt_time (float): The prompt time of the event being inserted
+        interactive_prompt_meta (InteractivePromptAugmentedMeta): Cached meta
+            information about the interactive prompt
+
+    Returns:
+        The changes made to the fenwick trees, as bin-level changes
+    """
+    bin_idx = compute_bin_index(prompt_time, interactive_prompt_meta)
+    result: List[FenwickTreeDelta] = []
+    lookups: List[PrefixSumUpdate] = []
+    for update in updates:
+        if update.simple:
+            result.append(
+                FenwickTreeDelta(
+                    category=update.category,
+                    category_value=update.category_value,
+                    bin=bin_idx,
+                    amount=update.amount,
+                )
+            )
+        else:
+            lookups.append(update)
+
+    if not lookups:
+        return result
+
+    query_parts: List[str] = []
+    qargs: List[Any] = []
+    for lookup_idx, update in enumerate(lookups):
+        query_parts.append(
+            """
+            SELECT ?, json_extract(interactive_prompt_events.data, ?)
+            FROM interactive_prompt_events
+            WHERE
+                interactive_prompt_events.uid != ?
+                AND EXISTS (
+                    SELECT 1 FROM interactive_prompt_events AS ipe
+                    WHERE ipe.interactive_prompt_session_id = interactive_prompt_events.interactive_prompt_session_id
+                      AND ipe.uid = ?
+                )
+                AND interactive_prompt_events.evtype = ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM interactive_prompt_events AS ipe
+                    WHERE ipe.interactive_prompt_session_id = interactive_prompt_events.interactive_prompt_session_id
+                      AND ipe.evtype = ?
+                      AND ipe.prompt_time > interactive_prompt_events.prompt_time
+                      AND ipe.uid != ?
+                )
+            """
+        )
+        qargs.extend(
+            [
+                lookup_idx,
+                f"$.{update.event_data_field}",
+                interactive_prompt_event_uid,
+                interactive_prompt_event_uid,
+                update.event_type,
+                update.event_type,
+                interactive_prompt_event_uid,
+            ]
+        )
+
+    conn = await itgs.conn()
+    cursor = conn.cursor("weak")
+    response = await cursor.execute(" UNION ALL ".join(query_parts), qargs)
+    for lookup_idx, category_value in response.results or []:
+        update = lookups[lookup_idx]
+        result.append(
+            FenwickTreeDelta(
+                category=update.category,
+                category_value=category_value,
+                bin=bin_idx,
+                amount=update.amount,
+            )
+        )
+    return result
+
+
+_BUFFERED_REJECTION_RESPONSES: Dict[str, Response] = {
+    "session_not_found": ERROR_INTERACTIVE_PROMPT_SESSION_NOT_FOUND_RESPONSE,
+    "session_already_started": ERROR_INTERACTIVE_PROMPT_SESSION_ALREADY_STARTED_RESPONSE,
+    "session_already_ended": ERROR_INTERACTIVE_PROMPT_SESSION_ALREADY_ENDED_RESPONSE,
+    "session_has_later_event": ERROR_INTERACTIVE_PROMPT_SESSION_HAS_LATER_EVENT_RESPONSE,
+    "session_has_same_event_at_same_time": ERROR_INTERACTIVE_PROMPT_SESSION_HAS_SAME_EVENT_AT_SAME_TIME_RESPONSE,
+}
+"""The responses for when a buffered session rejects an event, by error type"""
+
+
+def _buffered_rejection(error_type: str) -> CreateInteractivePromptEventResult:
+    return CreateInteractivePromptEventResult(
+        result=None,
+        error_type=error_type,  # type: ignore
+        error_response=_BUFFERED_REJECTION_RESPONSES[error_type],
+    )
+
+
 async def create_interactive_prompt_event(
     itgs: Itgs,
     *,
@@ -598,6 +741,8 @@ async def create_interactive_prompt_event(
     ] = None,
     prefix_sum_updates: Optional[List[PrefixSumUpdate]] = None,
     store_event_data: Optional[BaseModel] = None,
+    prompt_check: Optional[Callable[[Prompt], bool]] = None,
+    press_transition: Optional[Literal["start", "end"]] = None,
 ) -> CreateInteractivePromptEventResult[EventTypeT, EventDataT]:
     """Creates a new interactive prompt event for the given interactive prompt by
     the given user with the given type, data and prompt time. This will assign a
@@ -722,9 +867,26 @@ async def create_interactive_prompt_event(
             database. Useful if there is redundant data in the event which is helpful for
             clients but not for us.
 
+        prompt_check ((Prompt) -> bool, None): If specified, the part of the
+            bonus terms which only depends on the interactive prompt, e.g., that
+            it has a numeric prompt and the rating is within range. Checked
+            before anything else, and required for sessions whose events are
+            buffered (see `interactive_prompts.lib.event_buffer`), since the
+            bonus terms can't be checked until the event is written.
+
+        press_transition ("start", "end", None): If specified, the part of the
+            bonus terms which depends on whether the user is pressing the press
+            prompt: `start` requires they are not pressing and `end` requires
+            they are. Only used for buffered sessions, where it's checked against
+            the session state in redis.
+
     Returns:
         CreateINteractivePromptEventResult: The result of the operation
     """
+    assert (
+        not bonus_terms or prompt_check is not None or press_transition is not None
+    ), "bonus terms must also be described for buffered sessions"
+
     if prompt_time < 0:
         return CreateInteractivePromptEventResult(
             result=None,
@@ -932,8 +1094,10 @@ async def create_interactive_prompt_event(
     conn = await itgs.conn()
     cursor = conn.cursor("weak")
 
-    response = (await cursor.executemany3(queries))[0]
-    if response.rows_affected is None or response.rows_affected < 1:
+    async def explain_failure() -> CreateInteractivePromptEventResult:
+        """Determines why the event was rejected. For buffered sessions, the
+        buffer must have been flushed so that the database is up to date.
+        """
 
         def wrap_with_interactive_prompt_sessions(
             term: Optional[Term], term_args: List[Any], *, is_strict: bool = True
@@ -1069,9 +1233,12 @@ async def create_interactive_prompt_event(
             error_response=ERROR_INTERACTIVE_PROMPT_IMPOSSIBLE_PROMPT_TIME_RESPONSE,
         )
 
+    if prompt_check is not None and not prompt_check(interactive_prompt_meta.prompt):
+        await flush_buffered_events(itgs, wait=True)
+        return await explain_failure()
+
     icon: Optional[ImageFileRef] = None
-    cursor = conn.cursor("none")
-    response = await cursor.execute(
+    response = await conn.cursor("none").execute(
         """
         SELECT
             image_files.uid
@@ -1107,6 +1274,148 @@ async def create_interactive_prompt_event(
         error_response=None,
     )
 
+    redis = await itgs.redis()
+    state_key = get_session_state_key(session_uid)
+    if event_type == "join" and not BUFFERED_INGESTION_ENABLED:
+        if await redis.exists(state_key):
+            return _buffered_rejection("session_already_started")
+    else:
+        if event_type == "join":
+            response = await cursor.execute(
+                """
+                SELECT
+                    EXISTS (
+                        SELECT 1 FROM interactive_prompt_events
+                        WHERE interactive_prompt_events.interactive_prompt_session_id = interactive_prompt_sessions.id
+                    )
+                FROM interactive_prompt_sessions, users, interactive_prompts
+                WHERE
+                    interactive_prompt_sessions.uid = ?
+                    AND users.id = interactive_prompt_sessions.user_id
+                    AND users.sub = ?
+                    AND interactive_prompts.id = interactive_prompt_sessions.interactive_prompt_id
+                    AND interactive_prompts.uid = ?
+                """,
+                (session_uid, user_sub, interactive_prompt_uid),
+            )
+            if not response.results:
+                return _buffered_rejection("session_not_found")
+            if response.results[0][0]:
+                return _buffered_rejection("session_already_started")
+
+        bin_idx = compute_bin_index(int(prompt_time), interactive_prompt_meta)
+        buffered_deltas: List[FenwickTreeDelta] = []
+        previous_value_deltas: List[FenwickTreeDelta] = []
+        tracked_value: Optional[str] = None
+        for update in prefix_sum_updates or []:
+            if update.simple:
+                buffered_deltas.append(
+                    FenwickTreeDelta(
+                        category=update.category,
+                        category_value=update.category_value,
+                        bin=bin_idx,
+                        amount=update.amount,
+                    )
+                )
+                continue
+
+            assert (
+                update.event_type == event_type
+            ), "buffered sessions only track the previous event of the same type"
+            assert update.event_data_field is not None
+            previous_value_deltas.append(
+                FenwickTreeDelta(
+                    category=update.category,
+                    category_value=None,
+                    bin=bin_idx,
+                    amount=update.amount,
+                )
+            )
+            tracked_value = json.dumps(
+                json.loads(serd_event_data)[update.event_data_field]
+            )
+
+        buffered_message = InteractivePromptEventPubSubMessage(
+            uid=event_uid,
+            user_sub=user_sub,
+            session_uid=session_uid,
+            evtype=event_type,
+            data=event_data,
+            icon=icon.uid if icon is not None else None,
+            prompt_time=prompt_time,
+            created_at=created_at,
+            stats=None,
+        )
+        buffered_event = BufferedInteractivePromptEvent(
+            uid=event_uid,
+            interactive_prompt_uid=interactive_prompt_uid,
+            bins=interactive_prompt_meta.bins,
+            session_uid=session_uid,
+            evtype=event_type,
+            data=serd_event_data,
+            prompt_time=prompt_time,
+            created_at=created_at,
+            deltas=buffered_deltas,
+            previous_value_deltas=previous_value_deltas,
+            message=buffered_message.__pydantic_serializer__.to_json(
+                buffered_message
+            ).decode("utf-8"),
+        )
+
+        accept_result = await run_with_prep(
+            lambda force: ensure_interactive_prompt_session_accept_event_script_exists(
+                redis, force=force
+            ),
+            lambda: interactive_prompt_session_accept_event(
+                redis,
+                state_key,
+                BUFFER_KEY,
+                interactive_prompt_uid=interactive_prompt_uid,
+                user_sub=user_sub,
+                evtype=event_type,
+                prompt_time=prompt_time,
+                require_pressing=(
+                    None if press_transition is None else press_transition == "end"
+                ),
+                set_pressing=(
+                    None if press_transition is None else press_transition == "start"
+                ),
+                tracked_value=tracked_value,
+                entry=buffered_event.__pydantic_serializer__.to_json(buffered_event),
+                ttl=SESSION_STATE_TTL_SECONDS,
+            ),
+        )
+        assert accept_result is not None
+        if accept_result == "accepted":
+            schedule_flush()
+            return result
+        if accept_result == "press_mismatch":
+            await flush_buffered_events(itgs, wait=True)
+            return await explain_failure()
+        if accept_result != "unbuffered":
+            return _buffered_rejection(accept_result)
+
+    write_responses, deltas = await asyncio.gather(
+        cursor.executemany3(queries),
+        get_prefix_sum_update_deltas(
+            itgs,
+            prefix_sum_updates or [],
+            interactive_prompt_event_uid=event_uid,
+            prompt_time=int(prompt_time),
+            interactive_prompt_meta=interactive_prompt_meta,
+        ),
+    )
+    response = write_responses[0]
+    if response.rows_affected is None or response.rows_affected < 1:
+        return await explain_failure()
+
+    seq_key = get_stats_seq_key(interactive_prompt_uid)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.multi()
+        await pipe.incr(seq_key)
+        await pipe.expire(seq_key, STATS_SEQ_TTL_SECONDS)
+        seq = int((await pipe.execute())[0])
+
     message = InteractivePromptEventPubSubMessage(
         uid=event_uid,
         user_sub=user_sub,
@@ -1116,9 +1425,9 @@ async def create_interactive_prompt_event(
         icon=icon.uid if icon is not None else None,
         prompt_time=prompt_time,
         created_at=created_at,
+        stats=InteractivePromptEventStatsUpdate(seq=seq, deltas=deltas),
     )
 
-    redis = await itgs.redis()
     await redis.publish(
         f"ps:interactive_prompts:{interactive_prompt_uid}:events".encode("utf-8"),
         message.__pydantic_serializer__.to_json(message),
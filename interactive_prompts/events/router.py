@@ -8,6 +8,7 @@ import interactive_prompts.events.routes.press_prompt_end_response
 import interactive_prompts.events.routes.press_prompt_start_response
 import interactive_prompts.events.routes.read
 import interactive_prompts.events.routes.stats
+import interactive_prompts.events.routes.stats_range
 import interactive_prompts.events.routes.word_prompt_response
 
 
@@ -25,4 +26,5 @@ router.include_router(
 )
 router.include_router(interactive_prompts.events.routes.read.router)
 router.include_router(interactive_prompts.events.routes.stats.router)
+router.include_router(interactive_prompts.events.routes.stats_range.router)
 router.include_router(interactive_prompts.events.routes.word_prompt_response.router)
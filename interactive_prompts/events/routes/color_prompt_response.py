@@ -9,6 +9,7 @@ from interactive_prompts.events.models import (
     CREATE_INTERACTIVE_PROMPT_EVENT_409_TYPES,
 )
 import interactive_prompts.events.helper as evhelper
+from interactive_prompts.models.prompt import ColorPrompt
 from itgs import Itgs
 from models import StandardErrorResponse
 from pypika import Query, Table, Parameter
@@ -158,6 +159,9 @@ async def respond_to_interactive_prompt_color_prompt(
                     ),
                 ),
             ],
+            prompt_check=lambda prompt: (
+                isinstance(prompt, ColorPrompt) and args.data.index < len(prompt.colors)
+            ),
             prefix_sum_updates=[
                 evhelper.PrefixSumUpdate(
                     category="color_active",
@@ -9,6 +9,7 @@ from interactive_prompts.events.models import (
     CREATE_INTERACTIVE_PROMPT_EVENT_409_TYPES,
 )
 import interactive_prompts.events.helper as evhelper
+from interactive_prompts.models.prompt import NumericPrompt
 from itgs import Itgs
 from models import StandardErrorResponse
 from pypika import Query, Table, Parameter
@@ -166,6 +167,10 @@ async def respond_to_interactive_prompt_numeric_prompt(
                     ),
                 ),
             ],
+            prompt_check=lambda prompt: (
+                isinstance(prompt, NumericPrompt)
+                and prompt.min <= args.data.rating <= prompt.max
+            ),
             prefix_sum_updates=[
                 evhelper.PrefixSumUpdate(
                     category="numeric_active",
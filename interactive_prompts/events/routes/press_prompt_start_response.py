@@ -9,6 +9,7 @@ from interactive_prompts.events.models import (
     CREATE_INTERACTIVE_PROMPT_EVENT_409_TYPES,
 )
 import interactive_prompts.events.helper as evhelper
+from interactive_prompts.models.prompt import PressPrompt
 from itgs import Itgs
 from models import StandardErrorResponse
 from pypika import Query, Table, Parameter
@@ -199,6 +200,8 @@ async def respond_to_interactive_prompt_press_prompt_start(
                     ),
                 ),
             ],
+            prompt_check=lambda prompt: isinstance(prompt, PressPrompt),
+            press_transition="start",
             prefix_sum_updates=[
                 evhelper.PrefixSumUpdate(
                     category="press_active",
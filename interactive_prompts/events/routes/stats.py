@@ -1,17 +1,4 @@
-import time
-from typing import (
-    Any,
-    Awaitable,
-    Callable,
-    Dict,
-    List,
-    Literal,
-    Optional,
-    Tuple,
-    Protocol,
-    TypeVar,
-    cast as typing_cast,
-)
+from typing import Any, Dict, List, Literal, Optional
 from fastapi import APIRouter, Header
 from fastapi.responses import Response, JSONResponse
 from pydantic import BaseModel, Field
@@ -19,13 +6,12 @@ from interactive_prompts.models.prompt import Prompt
 from itgs import Itgs
 from interactive_prompts.auth import auth_any
 import interactive_prompts.events.helper as evhelper
+from interactive_prompts.lib.fenwick_replicas import FenwickReplica, fenwick_replicas
 from models import (
     STANDARD_ERRORS_BY_CODE,
     AUTHORIZATION_UNKNOWN_TOKEN,
     StandardErrorResponse,
 )
-import functools
-import asyncio
 
 router = APIRouter()
 
@@ -124,6 +110,9 @@ async def get_interactive_prompt_stats(
 
     This endpoint requires non-standard authentication: in particular, the
     provided authorization should be a JWT for the interactive prompt with the given uid.
+
+    Clients which need several upcoming bins should prefer the stats_range
+    endpoint, which returns the stats for a range of bins in one request.
     """
     async with Itgs() as itgs:
         auth_result = await auth_any(itgs, authorization)
@@ -174,16 +163,11 @@ async def get_interactive_prompt_stats(
                 headers={"Content-Type": "application/json; charset=utf-8"},
             )
 
-        parts = await asyncio.gather(
-            get_likes(itgs, uid, bin),
-            get_users(itgs, uid, bin),
-            get_for_prompt(itgs, uid, bin, prompt=interactive_prompt_meta.prompt),
+        replica = await fenwick_replicas.get(uid=uid, bins=interactive_prompt_meta.bins)
+        result = get_stats_from_replica(
+            replica, bin, prompt=interactive_prompt_meta.prompt
         )
 
-        result = dict()
-        for part in parts:
-            result.update(part)
-
         bin_width = (
             interactive_prompt_meta.duration_seconds / interactive_prompt_meta.bins
         )
@@ -196,211 +180,76 @@ async def get_interactive_prompt_stats(
         )
 
 
-async def get_single_from_tree(itgs: Itgs, uid: str, bin: int, category: str) -> int:
-    """Fetches the prefix sum associated with the given bin for the given category
-    and a null category value in the interactive prompt with the given uid. This requires log(n)
-    rows to be fetched from the database, where n is the number of bins in the
-    interactive prompt.
+async def get_users(itgs: Itgs, uid: str, bin: int) -> Dict[str, Any]:
+    """Fetches how many users are active in the interactive prompt with the given
+    uid at the given bin, i.e., the number of join events minus the number of
+    leave events, as `{"users": int}`. Uses the fenwick tree replica for the
+    prompt, so this usually doesn't require any networking calls.
     """
+    interactive_prompt_meta = await evhelper.get_interactive_prompt_meta(itgs, uid)
+    if interactive_prompt_meta is None:
+        return {"users": 0}
 
-    one_based_index = bin + 1
-    indices = []
-    while one_based_index > 0:
-        indices.append(one_based_index - 1)
-        one_based_index -= one_based_index & -one_based_index
+    replica = await fenwick_replicas.get(uid=uid, bins=interactive_prompt_meta.bins)
+    return {"users": replica.prefix_sum("users", None, bin)}
 
-    conn = await itgs.conn()
-    cursor = conn.cursor("none")
-
-    qmark_list = ",".join(["?"] * len(indices))
-    response = await cursor.execute(
-        f"""
-        SELECT SUM(val) FROM interactive_prompt_event_fenwick_trees
-        WHERE
-            EXISTS (
-                SELECT 1 FROM interactive_prompts
-                WHERE interactive_prompts.uid = ?
-                  AND interactive_prompts.id = interactive_prompt_event_fenwick_trees.interactive_prompt_id
-            )
-            AND category = ?
-            AND category_value IS NULL
-            AND idx IN ({qmark_list})
-        """,
-        [uid, category, *indices],
-    )
-    assert response.results is not None, response
-    return response.results[0][0] or 0
 
-
-async def get_by_category_from_tree(
-    itgs: Itgs, uid: str, bin: int, category: str
-) -> Dict[int, int]:
-    """Similar to get_single_from_tree, but the result is broken down by category
-    value
+def get_stats_from_replica(
+    replica: FenwickReplica, bin: int, *, prompt: Prompt
+) -> Dict[str, Any]:
+    """Computes the stats for the given bin from the given fenwick tree replica,
+    returning the keyword arguments for InteractivePromptStatsResponse other than
+    the prompt time and bin width. O(m log n) where n is the number of bins and
+    m is the number of category values.
     """
-
-    one_based_index = bin + 1
-    indices = []
-    while one_based_index > 0:
-        indices.append(one_based_index - 1)
-        one_based_index -= one_based_index & -one_based_index
-
-    conn = await itgs.conn()
-    cursor = conn.cursor("none")
-
-    qmark_list = ",".join(["?"] * len(indices))
-    response = await cursor.execute(
-        f"""
-        SELECT category_value, SUM(val) FROM interactive_prompt_event_fenwick_trees
-        WHERE
-            EXISTS (
-                SELECT 1 FROM interactive_prompts
-                WHERE interactive_prompts.uid = ?
-                  AND interactive_prompts.id = interactive_prompt_event_fenwick_trees.interactive_prompt_id
-            )
-            AND category = ?
-            AND idx IN ({qmark_list})
-        GROUP BY category_value
-        """,
-        [uid, category, *indices],
-    )
-
-    result: Dict[int, int] = dict()
-    for category_value, val in response.results or []:
-        result[category_value] = val
-
-    return dict(result or [])
-
-
-class StatsFuncInner(Protocol):
-    def __call__(
-        self, itgs: Itgs, uid: str, bin: int, *args, **kwargs
-    ) -> Awaitable[Dict[str, Any]]: ...
-
-
-TCallable = TypeVar("TCallable", bound=StatsFuncInner)
-
-
-def stats_func(func: TCallable) -> TCallable:
-    """Decorator for functions that fetch stats from the database. This decorator
-    will cache the result in memory for a short duration.
+    return get_stats_range_from_replica(replica, bin, bin, prompt=prompt)[0]
+
+
+def get_stats_range_from_replica(
+    replica: FenwickReplica, start_bin: int, end_bin: int, *, prompt: Prompt
+) -> List[Dict[str, Any]]:
+    """Computes the stats for each bin from the start bin to the end bin,
+    inclusive, from the given fenwick tree replica, returning the keyword
+    arguments for InteractivePromptStatsResponse other than the prompt time
+    and bin width for each bin in order. Each tree is walked once for the
+    whole range, so this is O(m (log n + k)) where n is the number of bins, m
+    is the number of category values, and k is the number of bins requested.
     """
-    cache_time_seconds: float = 1
+    users = replica.prefix_sums("users", None, start_bin, end_bin)
+    likes = replica.prefix_sums("likes", None, start_bin, end_bin)
+    result: List[Dict[str, Any]] = [
+        {"users": users[i], "likes": likes[i]} for i in range(len(users))
+    ]
 
-    def handler_for_fixed_uid_bin():
-        lock = asyncio.Lock()
-        cached_value: Optional[Dict[str, Any]] = None
-        cached_time: Optional[float] = None
-        clear_future: Optional[asyncio.Future] = None
-
-        async def clear_cache() -> None:
-            nonlocal cached_value, cached_time, clear_future
-            await asyncio.sleep(cache_time_seconds)
-            async with lock:
-                cached_value = None
-                cached_time = None
-                clear_future = None
-
-        @functools.wraps(func)
-        async def wrapper(
-            itgs: Itgs, uid: str, bin: int, *args, **kwargs
-        ) -> Dict[str, Any]:
-            nonlocal cached_time
-            nonlocal cached_value
-            nonlocal clear_future
-            async with lock:
-                now = time.time()
-                if (
-                    cached_value is None
-                    or cached_time is None
-                    or now > cached_time + cache_time_seconds
-                ):
-                    cached_value = await func(itgs, uid, bin, *args, **kwargs)
-                    cached_time = now
-                    if clear_future is not None:
-                        clear_future.cancel()
-                    clear_future = asyncio.create_task(clear_cache())
-                return cached_value
-
-        return wrapper
-
-    handler_and_cleaner_for_uid_bin: Dict[
-        Tuple[str, int], Tuple[Callable, asyncio.Future]
-    ] = dict()
-
-    async def cleaner_for_uid_bin(uid: str, bin: int) -> None:
-        await asyncio.sleep(cache_time_seconds * 3)
-        del handler_and_cleaner_for_uid_bin[(uid, bin)]
-
-    @functools.wraps(func)
-    async def general_wrapper(
-        itgs: Itgs, uid: str, bin: int, *args, **kwargs
-    ) -> Dict[str, Any]:
-        key = (uid, bin)
-        if key not in handler_and_cleaner_for_uid_bin:
-            handler = handler_for_fixed_uid_bin()
-            cleaner = asyncio.create_task(cleaner_for_uid_bin(uid, bin))
-            handler_and_cleaner_for_uid_bin[key] = (handler, cleaner)
-            return await handler(itgs, uid, bin, *args, **kwargs)
-
-        handler, cleaner = handler_and_cleaner_for_uid_bin[key]
-        cleaner.cancel()
-        cleaner = asyncio.create_task(cleaner_for_uid_bin(uid, bin))
-        handler_and_cleaner_for_uid_bin[key] = (handler, cleaner)
-        return await handler(itgs, uid, bin, *args, **kwargs)
-
-    return typing_cast(TCallable, general_wrapper)
-
-
-@stats_func
-async def get_users(itgs: Itgs, uid: str, bin: int, *args, **kwargs) -> Dict[str, Any]:
-    assert not args
-    assert not kwargs
-    res = await get_single_from_tree(itgs, uid, bin, "users")
-    return {"users": res}
-
-
-@stats_func
-async def get_likes(itgs: Itgs, uid: str, bin: int, *args, **kwargs) -> Dict[str, Any]:
-    assert not args
-    assert not kwargs
-    res = await get_single_from_tree(itgs, uid, bin, "likes")
-    return {"likes": res}
-
-
-@stats_func
-async def get_for_prompt(
-    itgs: Itgs, uid: str, bin: int, *args, prompt: Prompt, **kwargs
-) -> Dict[str, Any]:
-    assert not args
-    assert not kwargs
     if prompt.style == "numeric":
-        return {
-            "numeric_active": await get_by_category_from_tree(
-                itgs, uid, bin, "numeric_active"
-            ),
-        }
-
-    if prompt.style == "press":
-        press, press_active = await asyncio.gather(
-            get_single_from_tree(itgs, uid, bin, "press"),
-            get_single_from_tree(itgs, uid, bin, "press_active"),
+        by_value = replica.prefix_sums_by_value_range(
+            "numeric_active", start_bin, end_bin
         )
-        return {
-            "press": press,
-            "press_active": press_active,
-        }
-
-    if prompt.style == "color":
-        lookup = await get_by_category_from_tree(itgs, uid, bin, "color_active")
-        return {
-            "color_active": list(lookup.get(i, 0) for i in range(len(prompt.colors)))
-        }
-
-    if prompt.style == "word":
-        lookup = await get_by_category_from_tree(itgs, uid, bin, "word_active")
-        return {
-            "word_active": list(lookup.get(i, 0) for i in range(len(prompt.options)))
-        }
-
-    raise ValueError(f"Unknown prompt style: {repr(prompt.style)}")
+        for i, item in enumerate(result):
+            item["numeric_active"] = dict(
+                (value, sums[i]) for value, sums in by_value.items()
+            )
+    elif prompt.style == "press":
+        press = replica.prefix_sums("press", None, start_bin, end_bin)
+        press_active = replica.prefix_sums("press_active", None, start_bin, end_bin)
+        for i, item in enumerate(result):
+            item["press"] = press[i]
+            item["press_active"] = press_active[i]
+    elif prompt.style == "color":
+        by_color = [
+            replica.prefix_sums("color_active", color_idx, start_bin, end_bin)
+            for color_idx in range(len(prompt.colors))
+        ]
+        for i, item in enumerate(result):
+            item["color_active"] = [sums[i] for sums in by_color]
+    elif prompt.style == "word":
+        by_word = [
+            replica.prefix_sums("word_active", word_idx, start_bin, end_bin)
+            for word_idx in range(len(prompt.options))
+        ]
+        for i, item in enumerate(result):
+            item["word_active"] = [sums[i] for sums in by_word]
+    else:
+        raise ValueError(f"Unknown prompt style: {repr(prompt.style)}")
+
+    return result
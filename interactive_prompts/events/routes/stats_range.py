@@ -0,0 +1,163 @@
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Header
+from fastapi.responses import Response, JSONResponse
+from pydantic import BaseModel, Field
+from itgs import Itgs
+from interactive_prompts.auth import auth_any
+import interactive_prompts.events.helper as evhelper
+from interactive_prompts.events.routes.stats import (
+    InteractivePromptStatsResponse,
+    get_stats_range_from_replica,
+)
+from interactive_prompts.lib.fenwick_replicas import fenwick_replicas
+from models import (
+    STANDARD_ERRORS_BY_CODE,
+    AUTHORIZATION_UNKNOWN_TOKEN,
+    StandardErrorResponse,
+)
+
+router = APIRouter()
+
+
+MAX_BINS_PER_REQUEST = 256
+"""The maximum number of bins that can be requested at once"""
+
+
+class InteractivePromptStatsRangeResponse(BaseModel):
+    start_bin: int = Field(description="The first bin included in the response")
+    end_bin: int = Field(
+        description=(
+            "The last bin included in the response. This may be less than the "
+            "requested end bin if the interactive prompt has fewer bins"
+        )
+    )
+    bin_width: float = Field(
+        description="The width of each bin in seconds; see the stats endpoint"
+    )
+    bins: List[InteractivePromptStatsResponse] = Field(
+        description=(
+            "The stats for each bin from the start bin to the end bin, inclusive, "
+            "in order. Each item is exactly what the stats endpoint would return "
+            "for that bin"
+        )
+    )
+
+
+ERROR_404_TYPES = Literal["interactive_prompt_not_found", "bin_not_found"]
+
+
+def _validation_error(loc: str, msg: str, type: str) -> Response:
+    return JSONResponse(
+        status_code=422,
+        content={"detail": [{"loc": ["query", loc], "msg": msg, "type": type}]},
+    )
+
+
+@router.get(
+    "/stats_range",
+    response_model=InteractivePromptStatsRangeResponse,
+    responses={
+        "404": {
+            "description": "The interactive prompt was not found, or the start bin was not found",
+            "model": StandardErrorResponse[ERROR_404_TYPES],
+        },
+        **STANDARD_ERRORS_BY_CODE,
+    },
+)
+async def get_interactive_prompt_stats_range(
+    uid: str,
+    start_bin: int,
+    end_bin: int,
+    authorization: Optional[str] = Header(None),
+):
+    """Fetches statistics for each bin from the start bin to the end bin,
+    inclusive, for the interactive prompt with the given uid. This is
+    equivalent to calling the stats endpoint for each bin in the range, but
+    allows clients to fetch a window of upcoming bins in a single request.
+    At most 256 bins can be requested at once, and an end bin past the last bin
+    of the prompt is clamped to the last bin.
+
+    This endpoint requires non-standard authentication: in particular, the
+    provided authorization should be a JWT for the interactive prompt with the given uid.
+    """
+    async with Itgs() as itgs:
+        auth_result = await auth_any(itgs, authorization)
+        if auth_result.result is None:
+            return auth_result.error_response
+
+        if uid != auth_result.result.interactive_prompt_uid:
+            return AUTHORIZATION_UNKNOWN_TOKEN
+
+        interactive_prompt_meta = await evhelper.get_interactive_prompt_meta(itgs, uid)
+        if interactive_prompt_meta is None:
+            return Response(
+                status_code=404,
+                content=StandardErrorResponse[ERROR_404_TYPES](
+                    type="interactive_prompt_not_found",
+                    message=(
+                        "Although your authorization was valid, the prompt with "
+                        "the given uid was not found: it may have been deleted"
+                    ),
+                ).model_dump_json(),
+                headers={"Content-Type": "application/json; charset=utf-8"},
+            )
+
+        if start_bin < 0:
+            return _validation_error(
+                "start_bin",
+                "ensure this value is greater than or equal to 0",
+                "value_error.number.not_ge",
+            )
+
+        if end_bin < start_bin:
+            return _validation_error(
+                "end_bin",
+                "ensure this value is greater than or equal to start_bin",
+                "value_error.number.not_ge",
+            )
+
+        if end_bin - start_bin >= MAX_BINS_PER_REQUEST:
+            return _validation_error(
+                "end_bin",
+                f"ensure at most {MAX_BINS_PER_REQUEST} bins are requested",
+                "value_error.number.not_le",
+            )
+
+        if start_bin >= interactive_prompt_meta.bins:
+            return Response(
+                status_code=404,
+                content=StandardErrorResponse[ERROR_404_TYPES](
+                    type="bin_not_found",
+                    message=(
+                        "The start bin you requested was not found; the interactive prompt only has "
+                        f"{interactive_prompt_meta.bins} bins"
+                    ),
+                ).model_dump_json(),
+                headers={"Content-Type": "application/json; charset=utf-8"},
+            )
+
+        end_bin = min(end_bin, interactive_prompt_meta.bins - 1)
+
+        replica = await fenwick_replicas.get(uid=uid, bins=interactive_prompt_meta.bins)
+        results = get_stats_range_from_replica(
+            replica, start_bin, end_bin, prompt=interactive_prompt_meta.prompt
+        )
+
+        bin_width = (
+            interactive_prompt_meta.duration_seconds / interactive_prompt_meta.bins
+        )
+
+        return Response(
+            InteractivePromptStatsRangeResponse(
+                start_bin=start_bin,
+                end_bin=end_bin,
+                bin_width=bin_width,
+                bins=[
+                    InteractivePromptStatsResponse(
+                        prompt_time=bin * bin_width, bin_width=bin_width, **result
+                    )
+                    for bin, result in enumerate(results, start=start_bin)
+                ],
+            ).model_dump_json(),
+            headers={"Content-Type": "application/json; charset=utf-8"},
+        )
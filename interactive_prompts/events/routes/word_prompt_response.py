@@ -9,6 +9,7 @@ from interactive_prompts.events.models import (
     CREATE_INTERACTIVE_PROMPT_EVENT_409_TYPES,
 )
 import interactive_prompts.events.helper as evhelper
+from interactive_prompts.models.prompt import WordPrompt
 from itgs import Itgs
 from models import StandardErrorResponse
 from pypika import Query, Table, Parameter
@@ -158,6 +159,9 @@ async def respond_to_interactive_prompt_word_prompt(
                     ),
                 ),
             ],
+            prompt_check=lambda prompt: (
+                isinstance(prompt, WordPrompt) and args.data.index < len(prompt.options)
+            ),
             prefix_sum_updates=[
                 evhelper.PrefixSumUpdate(
                     category="word_active",
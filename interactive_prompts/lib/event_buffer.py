@@ -0,0 +1,496 @@
+"""Buffered ingestion for interactive prompt events.
+
+Popular interactive prompts receive bursts of events, each of which would
+otherwise be written in its own transaction alongside several fenwick tree
+upserts. Instead, sessions which were joined while buffering is enabled are
+validated against their state in redis (see
+`redis_helpers/interactive_prompt_session_accept_event.py`), and accepted
+events are appended to a single redis list in the order they were accepted.
+
+Whichever instance holds the flush lock then writes the buffered events in
+that order, one transaction per batch, merging the fenwick tree and event
+count changes per interactive prompt and bin into a handful of upserts. Only
+after a batch is written are its events published to
+`ps:interactive_prompts:{uid}:events`, so the stats sequence numbers are still
+assigned after the events are stored.
+
+Sessions without state in redis (e.g., started before buffering was enabled,
+or idle long enough for the state to expire) are written directly, so any
+given session is always either entirely buffered or entirely unbuffered.
+"""
+
+import asyncio
+from collections import Counter
+import json
+import secrets
+import time
+from typing import Dict, List, Optional, Set, Tuple, cast
+
+from pydantic import BaseModel, Field
+
+import perpetual_pub_sub as pps
+from error_middleware import handle_error
+from interactive_prompts.lib.fenwick_deltas import (
+    STATS_SEQ_TTL_SECONDS,
+    FenwickTreeDelta,
+    InteractivePromptEventStatsUpdate,
+    fenwick_node_indices,
+    get_stats_seq_key,
+)
+from itgs import Itgs
+from mp_helper import adapt_threading_event_to_asyncio
+from redis_helpers.del_if_match import del_if_match, ensure_del_if_match_script_exists
+from redis_helpers.ltrim_if_match import (
+    ensure_ltrim_if_match_script_exists,
+    ltrim_if_match,
+)
+from redis_helpers.run_with_prep import run_with_prep
+
+
+BUFFERED_INGESTION_ENABLED = True
+"""Whether new sessions have their events buffered. Sessions which are already
+buffered remain buffered regardless of this value
+"""
+
+SESSION_STATE_TTL_SECONDS = 60 * 60 * 24
+"""How long the state of a buffered session is kept after its last event"""
+
+BUFFER_KEY = b"interactive_prompts:events:buffer"
+"""The key of the list containing the events which have been accepted but not
+yet written to the database
+"""
+
+FLUSH_LOCK_KEY = b"interactive_prompts:events:buffer:lock"
+"""The key of the lock held while flushing the buffer"""
+
+FLUSH_LOCK_TTL_SECONDS = 30
+"""How long the flush lock is held at most"""
+
+FLUSH_MAX_DURATION_SECONDS = 10
+"""How long we flush for before releasing the lock, so that the lock is never
+held past its expiration
+"""
+
+FLUSH_DELAY_SECONDS = 0.1
+"""How long after accepting an event we wait before flushing, so that events
+accepted around the same time are written together
+"""
+
+FLUSH_BATCH_SIZE = 500
+"""The maximum number of events written in a single transaction"""
+
+FLUSH_WAIT_TIMEOUT_SECONDS = 5
+"""When waiting for the flush lock, how long we wait at most"""
+
+SWEEP_INTERVAL_SECONDS = 1
+"""How often each instance checks for events which weren't flushed by the
+instance that accepted them
+"""
+
+MAX_ROWS_PER_UPSERT = 1000
+"""The maximum number of rows in a single upsert, to stay well below the
+sqlite parameter limit
+"""
+
+
+def get_session_state_key(session_uid: str) -> bytes:
+    """The redis key containing the state of the buffered interactive prompt
+    session with the given uid
+    """
+    return f"interactive_prompts:sessions:{session_uid}:state".encode("utf-8")
+
+
+class BufferedInteractivePromptEvent(BaseModel):
+    """An interactive prompt event which has been accepted but not yet written
+    to the database
+    """
+
+    uid: str = Field(description="the uid of the event")
+    interactive_prompt_uid: str = Field(
+        description="the uid of the interactive prompt the event is for"
+    )
+    bins: int = Field(description="the number of bins in the fenwick trees")
+    session_uid: str = Field(description="the uid of the session the event is in")
+    evtype: str = Field(description="the type of the event")
+    data: str = Field(description="the data to store for the event, as json")
+    prompt_time: float = Field(description="the prompt time of the event")
+    created_at: float = Field(description="when the event was created")
+    deltas: List[FenwickTreeDelta] = Field(
+        description="the changes to make to the fenwick trees"
+    )
+    previous_value_deltas: List[FenwickTreeDelta] = Field(
+        description=(
+            "the changes to make to the fenwick trees for the value of the "
+            "previous event of the same type in the session, if there was one. "
+            "The category value is replaced with that value"
+        )
+    )
+    message: str = Field(
+        description=(
+            "the message to publish once the event is written, without "
+            "stats, as json"
+        )
+    )
+
+
+class _FlushableEvent:
+    def __init__(
+        self, event: BufferedInteractivePromptEvent, deltas: List[FenwickTreeDelta]
+    ) -> None:
+        self.event = event
+        """The buffered event"""
+        self.deltas = deltas
+        """The resolved changes to the fenwick trees"""
+
+
+def _parse_buffered_item(item: bytes) -> _FlushableEvent:
+    previous_value, raw_event = json.loads(item)
+    event = BufferedInteractivePromptEvent.model_validate(raw_event)
+    deltas = list(event.deltas)
+    if previous_value is not None:
+        assert isinstance(previous_value, int), item
+        for delta in event.previous_value_deltas:
+            deltas.append(
+                FenwickTreeDelta(
+                    category=delta.category,
+                    category_value=previous_value,
+                    bin=delta.bin,
+                    amount=delta.amount,
+                )
+            )
+    return _FlushableEvent(event, deltas)
+
+
+async def flush_buffered_events(itgs: Itgs, *, wait: bool = False) -> int:
+    """Writes buffered events to the database, in the order they were accepted,
+    until the buffer is empty or we've been flushing for a while. If another
+    instance is flushing, this does nothing unless `wait` is set, in which case
+    we wait up to `FLUSH_WAIT_TIMEOUT_SECONDS` for it to finish.
+
+    Args:
+        itgs (Itgs): The integrations to (re)use
+        wait (bool): True to wait for the lock if it's held, False to return
+            immediately
+
+    Returns:
+        int: The number of buffered events that were flushed
+    """
+    redis = await itgs.redis()
+    lock_id = secrets.token_urlsafe(16).encode("utf-8")
+    started_at = time.time()
+    while not await redis.set(
+        FLUSH_LOCK_KEY, lock_id, nx=True, ex=FLUSH_LOCK_TTL_SECONDS
+    ):
+        if not wait or time.time() - started_at > FLUSH_WAIT_TIMEOUT_SECONDS:
+            return 0
+        await asyncio.sleep(FLUSH_DELAY_SECONDS)
+
+    started_at = time.time()
+    num_flushed = 0
+    try:
+        while time.time() - started_at < FLUSH_MAX_DURATION_SECONDS:
+            items = cast(
+                List[bytes],
+                await redis.lrange(BUFFER_KEY, 0, FLUSH_BATCH_SIZE - 1),  # type: ignore
+            )
+            if not items:
+                break
+            await _flush_batch(itgs, items)
+            num_flushed += len(items)
+    finally:
+        await run_with_prep(
+            lambda force: ensure_del_if_match_script_exists(redis, force=force),
+            lambda: del_if_match(redis, FLUSH_LOCK_KEY, lock_id),
+        )
+    return num_flushed
+
+
+async def _flush_batch(itgs: Itgs, items: List[bytes]) -> None:
+    """Writes the given items from the front of the buffer to the database,
+    removes them from the buffer, then publishes them. Must hold the flush lock.
+    """
+    events: List[_FlushableEvent] = []
+    for item in items:
+        try:
+            events.append(_parse_buffered_item(item))
+        except Exception as e:
+            await handle_error(
+                e, extra_info=f"dropping malformed buffered event: {item[:512]!r}"
+            )
+
+    if events:
+        # a previous flush may have written the front of the buffer but failed
+        # to remove it (e.g., it crashed before trimming), in which case those
+        # events must not contribute to the fenwick trees or counts again
+        written = await _get_written_event_uids(itgs, [e.event.uid for e in events])
+        events = [e for e in events if e.event.uid not in written]
+
+    if events:
+        queries = _batch_to_queries(events)
+        conn = await itgs.conn()
+        cursor = conn.cursor("weak")
+        responses = await cursor.executemany3(queries)
+        # the event inserts are last; if none were inserted another flush
+        # wrote these events concurrently (e.g., because our lock expired)
+        num_inserted = sum(
+            r.rows_affected or 0
+            for r in responses.items[-_num_event_insert_queries(events) :]
+        )
+    else:
+        num_inserted = 0
+
+    redis = await itgs.redis()
+    await run_with_prep(
+        lambda force: ensure_ltrim_if_match_script_exists(redis, force=force),
+        lambda: ltrim_if_match(redis, BUFFER_KEY, len(items), items[-1]),
+    )
+
+    if num_inserted == 0:
+        return
+
+    num_by_prompt = Counter(e.event.interactive_prompt_uid for e in events)
+    prompt_uids = list(num_by_prompt.keys())
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.multi()
+        for prompt_uid in prompt_uids:
+            seq_key = get_stats_seq_key(prompt_uid)
+            await pipe.incrby(seq_key, num_by_prompt[prompt_uid])
+            await pipe.expire(seq_key, STATS_SEQ_TTL_SECONDS)
+        seq_result = await pipe.execute()
+
+    next_seq: Dict[str, int] = dict()
+    for idx, prompt_uid in enumerate(prompt_uids):
+        next_seq[prompt_uid] = int(seq_result[idx * 2]) - num_by_prompt[prompt_uid] + 1
+
+    async with redis.pipeline(transaction=False) as pipe:
+        for flushable in events:
+            event = flushable.event
+            seq = next_seq[event.interactive_prompt_uid]
+            next_seq[event.interactive_prompt_uid] = seq + 1
+
+            message = json.loads(event.message)
+            message["stats"] = InteractivePromptEventStatsUpdate(
+                seq=seq, deltas=flushable.deltas
+            ).model_dump()
+            await pipe.publish(
+                f"ps:interactive_prompts:{event.interactive_prompt_uid}:events".encode(
+                    "utf-8"
+                ),
+                json.dumps(message).encode("utf-8"),
+            )
+        await pipe.execute()
+
+
+async def _get_written_event_uids(itgs: Itgs, uids: List[str]) -> Set[str]:
+    """Returns which of the given event uids are already stored in the database"""
+    conn = await itgs.conn()
+    cursor = conn.cursor("weak")
+    result: Set[str] = set()
+    for start in range(0, len(uids), MAX_ROWS_PER_UPSERT):
+        chunk = uids[start : start + MAX_ROWS_PER_UPSERT]
+        response = await cursor.execute(
+            "SELECT uid FROM interactive_prompt_events WHERE uid IN ({})".format(
+                ", ".join(["?"] * len(chunk))
+            ),
+            chunk,
+        )
+        result.update(uid for (uid,) in response.results or [])
+    return result
+
+
+def _num_event_insert_queries(events: List[_FlushableEvent]) -> int:
+    return (len(events) + MAX_ROWS_PER_UPSERT - 1) // MAX_ROWS_PER_UPSERT
+
+
+def _batch_to_queries(events: List[_FlushableEvent]) -> List[Tuple[str, list]]:
+    """Produces the queries which write the given events in order, plus their
+    merged fenwick tree and event count changes. None of the events may have
+    been written already (see `_get_written_event_uids`). As a guard against
+    another instance concurrently writing the same events, the changes are
+    skipped if the last event has been written by the time the queries run.
+    """
+    assert events
+    last_uid = events[-1].event.uid
+
+    bin_amounts: Dict[Tuple[str, int, str, Optional[int], int], int] = dict()
+    bucket_totals: Dict[Tuple[str, int], int] = dict()
+    for flushable in events:
+        event = flushable.event
+        for delta in flushable.deltas:
+            key = (
+                event.interactive_prompt_uid,
+                event.bins,
+                delta.category,
+                delta.category_value,
+                delta.bin,
+            )
+            bin_amounts[key] = bin_amounts.get(key, 0) + delta.amount
+
+        bucket_key = (event.interactive_prompt_uid, int(event.prompt_time))
+        bucket_totals[bucket_key] = bucket_totals.get(bucket_key, 0) + 1
+
+    node_amounts: Dict[Tuple[str, str, Optional[int], int], int] = dict()
+    for (
+        prompt_uid,
+        bins,
+        category,
+        category_value,
+        bin,
+    ), amount in bin_amounts.items():
+        if amount == 0:
+            continue
+        for idx in fenwick_node_indices(bin, bins):
+            key = (prompt_uid, category, category_value, idx)
+            node_amounts[key] = node_amounts.get(key, 0) + amount
+
+    queries: List[Tuple[str, list]] = []
+
+    node_rows = [(key, amount) for key, amount in node_amounts.items() if amount != 0]
+    for start in range(0, len(node_rows), MAX_ROWS_PER_UPSERT):
+        chunk = node_rows[start : start + MAX_ROWS_PER_UPSERT]
+        qargs: list = []
+        for (prompt_uid, category, category_value, idx), amount in chunk:
+            qargs.extend((prompt_uid, category, category_value, idx, amount))
+        qargs.append(last_uid)
+        values = ", ".join(["(?, ?, ?, ?, ?)"] * len(chunk))
+        queries.append(
+            (
+                f"WITH deltas(interactive_prompt_uid, category, category_value, idx, amount) AS (VALUES {values}) "
+                "INSERT INTO interactive_prompt_event_fenwick_trees ("
+                " interactive_prompt_id, category, category_value, idx, val"
+                ") "
+                "SELECT"
+                " interactive_prompts.id, deltas.category, deltas.category_value, deltas.idx, deltas.amount "
+                "FROM deltas, interactive_prompts "
+                "WHERE"
+                " interactive_prompts.uid = deltas.interactive_prompt_uid"
+                " AND NOT EXISTS (SELECT 1 FROM interactive_prompt_events WHERE interactive_prompt_events.uid = ?) "
+                "ON CONFLICT (interactive_prompt_id, category, category_value, idx) "
+                "DO UPDATE SET val = val + excluded.val "
+                "ON CONFLICT (interactive_prompt_id, category, idx) WHERE category_value IS NULL "
+                "DO UPDATE SET val = val + excluded.val",
+                qargs,
+            )
+        )
+
+    bucket_rows = list(bucket_totals.items())
+    for start in range(0, len(bucket_rows), MAX_ROWS_PER_UPSERT):
+        chunk = bucket_rows[start : start + MAX_ROWS_PER_UPSERT]
+        qargs = []
+        for (prompt_uid, bucket), total in chunk:
+            qargs.extend((prompt_uid, bucket, total))
+        qargs.append(last_uid)
+        values = ", ".join(["(?, ?, ?)"] * len(chunk))
+        queries.append(
+            (
+                f"WITH counts(interactive_prompt_uid, bucket, total) AS (VALUES {values}) "
+                "INSERT INTO interactive_prompt_event_counts ("
+                " interactive_prompt_id, bucket, total"
+                ") "
+                "SELECT interactive_prompts.id, counts.bucket, counts.total "
+                "FROM counts, interactive_prompts "
+                "WHERE"
+                " interactive_prompts.uid = counts.interactive_prompt_uid"
+                " AND NOT EXISTS (SELECT 1 FROM interactive_prompt_events WHERE interactive_prompt_events.uid = ?) "
+                "ON CONFLICT (interactive_prompt_id, bucket) "
+                "DO UPDATE SET total = interactive_prompt_event_counts.total + excluded.total",
+                qargs,
+            )
+        )
+
+    for start in range(0, len(events), MAX_ROWS_PER_UPSERT):
+        chunk = events[start : start + MAX_ROWS_PER_UPSERT]
+        qargs = []
+        for position, flushable in enumerate(chunk):
+            event = flushable.event
+            qargs.extend(
+                (
+                    position,
+                    event.uid,
+                    event.session_uid,
+                    event.evtype,
+                    event.data,
+                    event.prompt_time,
+                    event.created_at,
+                )
+            )
+        values = ", ".join(["(?, ?, ?, ?, ?, ?, ?)"] * len(chunk))
+        queries.append(
+            (
+                f"WITH batch(ord, uid, session_uid, evtype, data, prompt_time, created_at) AS (VALUES {values}) "
+                "INSERT INTO interactive_prompt_events ("
+                " uid, interactive_prompt_session_id, evtype, data, prompt_time, created_at"
+                ") "
+                "SELECT"
+                " batch.uid, interactive_prompt_sessions.id, batch.evtype, batch.data, batch.prompt_time, batch.created_at "
+                "FROM batch, interactive_prompt_sessions "
+                "WHERE interactive_prompt_sessions.uid = batch.session_uid "
+                "ORDER BY batch.ord "
+                "ON CONFLICT (uid) DO NOTHING",
+                qargs,
+            )
+        )
+
+    return queries
+
+
+_scheduled_flush: Optional[asyncio.Task] = None
+"""The task which will flush the buffer shortly, if one is scheduled"""
+
+
+def schedule_flush() -> None:
+    """Ensures this instance flushes the buffer within about
+    `FLUSH_DELAY_SECONDS`, so that events accepted around the same time are
+    written together. Must be called from the main event loop.
+    """
+    global _scheduled_flush
+
+    if _scheduled_flush is not None:
+        return
+
+    _scheduled_flush = asyncio.create_task(_flush_soon())
+
+
+async def _flush_soon() -> None:
+    global _scheduled_flush
+
+    try:
+        await asyncio.sleep(FLUSH_DELAY_SECONDS)
+        # events accepted from here on need another flush, as we may have
+        # already read the end of the buffer by the time they are appended
+        _scheduled_flush = None
+        async with Itgs() as itgs:
+            await flush_buffered_events(itgs)
+    except Exception as e:
+        await handle_error(e, extra_info="flushing buffered interactive prompt events")
+    finally:
+        if _scheduled_flush is asyncio.current_task():
+            _scheduled_flush = None
+
+
+async def sweep_buffered_events_forever() -> None:
+    """Periodically flushes the buffer, in case the instance which accepted an
+    event failed to (e.g., because it shut down). Runs until the perpetual pub
+    sub instance is shutting down.
+    """
+    assert pps.instance is not None
+    exit_event = adapt_threading_event_to_asyncio(pps.instance.exit_event)
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(
+                    exit_event.wait(), timeout=SWEEP_INTERVAL_SECONDS
+                )
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                async with Itgs() as itgs:
+                    await flush_buffered_events(itgs)
+            except Exception as e:
+                await handle_error(
+                    e, extra_info="sweeping buffered interactive prompt events"
+                )
+    finally:
+        print("interactive prompt events sweep loop exiting")
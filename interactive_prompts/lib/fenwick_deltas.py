@@ -0,0 +1,60 @@
+"""Describes changes to the fenwick trees in
+`interactive_prompt_event_fenwick_trees`, as they are passed between
+instances
+"""
+
+from typing import List, Optional
+from pydantic import BaseModel, Field
+
+
+class FenwickTreeDelta(BaseModel):
+    """Describes a change that was made to a fenwick tree in
+    interactive_prompt_event_fenwick_trees as a result of an event
+    """
+
+    category: str = Field(description="the category of the tree, e.g., likes")
+    category_value: Optional[int] = Field(
+        description="the category value of the tree, if the category has values"
+    )
+    bin: int = Field(description="the 0-indexed bin that was changed")
+    amount: int = Field(description="how much the bin was changed by")
+
+
+class InteractivePromptEventStatsUpdate(BaseModel):
+    """Describes how an event changed the stats of an interactive prompt, so
+    that in-memory replicas of the fenwick trees can be kept up to date
+    """
+
+    seq: int = Field(
+        description=(
+            "the sequence number of the event within the interactive prompt, "
+            "starting at 1; a gap indicates a missed event"
+        )
+    )
+    deltas: List[FenwickTreeDelta] = Field(
+        description="the changes made to the fenwick trees"
+    )
+
+
+def get_stats_seq_key(interactive_prompt_uid: str) -> bytes:
+    """The redis key used to assign sequence numbers to the events in the
+    interactive prompt with the given uid
+    """
+    return f"interactive_prompts:{interactive_prompt_uid}:stats_seq".encode("utf-8")
+
+
+STATS_SEQ_TTL_SECONDS = 60 * 60 * 24
+"""How long the sequence number key is kept after the last event"""
+
+
+def fenwick_node_indices(bin: int, bins: int) -> List[int]:
+    """Returns the 0-based indices of the nodes in a fenwick tree with the
+    given number of bins which must be updated when the given 0-based bin
+    changes. O(log n)
+    """
+    indices = []
+    one_based_idx = bin + 1
+    while one_based_idx <= bins:
+        indices.append(one_based_idx - 1)
+        one_based_idx += one_based_idx & -one_based_idx
+    return indices
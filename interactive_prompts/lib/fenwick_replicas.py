@@ -0,0 +1,409 @@
+"""Maintains in-memory replicas of the fenwick trees in
+`interactive_prompt_event_fenwick_trees` for the interactive prompts whose
+stats are being requested on this instance, so that stats can be served
+without querying the database.
+
+A replica is seeded from the database the first time it's needed and is then
+kept up to date from the stats updates attached to the messages published to
+`ps:interactive_prompts:{uid}:events` by `create_interactive_prompt_event`.
+A single dedicated pubsub connection pattern-subscribes to those channels
+while any replica is in use.
+
+Every event is assigned a sequence number; if a sequence number is skipped
+for longer than `GAP_TIMEOUT_SECONDS`, or the subscription is interrupted, the
+replica is reseeded. Since the sequence number is assigned after the database
+transaction, a replica may very rarely count an event twice or not at all if
+it was seeded while that event was being created, so replicas are also
+reseeded every `RESYNC_INTERVAL_SECONDS` while in use.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from pydantic import BaseModel, Field
+
+from error_middleware import handle_error
+from interactive_prompts.lib.fenwick_deltas import (
+    InteractivePromptEventStatsUpdate,
+    get_stats_seq_key,
+)
+from itgs import Itgs
+from loguru import logger
+
+
+EVENTS_CHANNEL_PATTERN = b"ps:interactive_prompts:*:events"
+"""The pattern matching the channels interactive prompt events are published to"""
+
+IDLE_TIMEOUT_SECONDS = 60
+"""How long a replica is kept after it was last read"""
+
+RESYNC_INTERVAL_SECONDS = 60 * 5
+"""How long a replica is used before it's reseeded from the database"""
+
+GAP_TIMEOUT_SECONDS = 5
+"""How long we wait for a skipped sequence number to arrive (messages may be
+published out of order) before reseeding the replica
+"""
+
+SUBSCRIBE_TIMEOUT_SECONDS = 3
+"""How long we wait for the subscription to be established before seeding. If
+it's not established in time, the replica is only used briefly
+"""
+
+
+class FenwickReplica:
+    """An in-memory copy of the fenwick trees for one interactive prompt, one
+    tree per (category, category_value), each with the same number of bins
+    """
+
+    def __init__(self, bins: int) -> None:
+        self.bins = bins
+        """The number of bins in each tree"""
+
+        self.trees: Dict[Tuple[str, Optional[int]], List[int]] = dict()
+        """The trees by (category, category_value), where index `i` is the
+        value at `idx = i` in the database
+        """
+
+    def add_to_node(
+        self, category: str, category_value: Optional[int], idx: int, amount: int
+    ) -> None:
+        """Adds the given amount directly to the node at the given 0-based index,
+        as when seeding from the database
+        """
+        if idx < 0 or idx >= self.bins:
+            return
+        tree = self.trees.get((category, category_value))
+        if tree is None:
+            tree = [0] * self.bins
+            self.trees[(category, category_value)] = tree
+        tree[idx] += amount
+
+    def add(
+        self, category: str, category_value: Optional[int], bin: int, amount: int
+    ) -> None:
+        """Adds the given amount to the given 0-based bin. O(log n)"""
+        one_based_idx = bin + 1
+        while one_based_idx <= self.bins:
+            self.add_to_node(category, category_value, one_based_idx - 1, amount)
+            one_based_idx += one_based_idx & -one_based_idx
+
+    def prefix_sum(self, category: str, category_value: Optional[int], bin: int) -> int:
+        """Returns the sum of the given tree from the first bin through the given
+        0-based bin, inclusive. O(log n)
+        """
+        tree = self.trees.get((category, category_value))
+        if tree is None:
+            return 0
+
+        result = 0
+        one_based_idx = min(bin, self.bins - 1) + 1
+        while one_based_idx > 0:
+            result += tree[one_based_idx - 1]
+            one_based_idx -= one_based_idx & -one_based_idx
+        return result
+
+    def prefix_sums_by_value(self, category: str, bin: int) -> Dict[int, int]:
+        """Returns the prefix sum through the given bin for every category value
+        of the given category which has a tree. O(m log n) for m values
+        """
+        return dict(
+            (category_value, self.prefix_sum(category, category_value, bin))
+            for (tree_category, category_value) in self.trees.keys()
+            if tree_category == category and category_value is not None
+        )
+
+    def prefix_sums(
+        self,
+        category: str,
+        category_value: Optional[int],
+        start_bin: int,
+        end_bin: int,
+    ) -> List[int]:
+        """Returns the prefix sums of the given tree through each 0-based bin
+        from the start bin to the end bin, inclusive. Only the first prefix
+        sum is computed from scratch; each later one adds the value of the
+        next bin to the previous one. O(log n + k) amortized for k bins
+        """
+        end_bin = min(end_bin, self.bins - 1)
+        if end_bin < start_bin:
+            return []
+
+        tree = self.trees.get((category, category_value))
+        if tree is None:
+            return [0] * (end_bin - start_bin + 1)
+
+        running = self.prefix_sum(category, category_value, start_bin)
+        result = [running]
+        for one_based_idx in range(start_bin + 2, end_bin + 2):
+            # the node at one_based_idx covers (parent, one_based_idx]; removing
+            # the nodes covering (parent, one_based_idx - 1] leaves the bin
+            bin_value = tree[one_based_idx - 1]
+            parent = one_based_idx - (one_based_idx & -one_based_idx)
+            other_idx = one_based_idx - 1
+            while other_idx > parent:
+                bin_value -= tree[other_idx - 1]
+                other_idx -= other_idx & -other_idx
+            running += bin_value
+            result.append(running)
+        return result
+
+    def prefix_sums_by_value_range(
+        self, category: str, start_bin: int, end_bin: int
+    ) -> Dict[int, List[int]]:
+        """Returns the prefix sums through each bin from the start bin to the
+        end bin, inclusive, for every category value of the given category
+        which has a tree. O(m (log n + k)) for m values and k bins
+        """
+        return dict(
+            (
+                category_value,
+                self.prefix_sums(category, category_value, start_bin, end_bin),
+            )
+            for (tree_category, category_value) in self.trees.keys()
+            if tree_category == category and category_value is not None
+        )
+
+
+class _StatsOnlyMessage(BaseModel):
+    """The part of `InteractivePromptEventPubSubMessage` that we need"""
+
+    stats: Optional[InteractivePromptEventStatsUpdate] = Field(None)
+
+
+@dataclass
+class _ReplicaState:
+    bins: int
+    """The number of bins for the interactive prompt"""
+    replica: Optional[FenwickReplica] = None
+    """The replica, if it's been seeded"""
+    applied_through: int = 0
+    """Every sequence number up to and including this one has been applied"""
+    pending: Set[int] = field(default_factory=set)
+    """Sequence numbers after `applied_through` which have been applied"""
+    gap_since: Optional[float] = None
+    """If `pending` is not empty, when it became non-empty"""
+    valid_until: float = 0
+    """When the replica must be reseeded"""
+    connection_generation: int = -1
+    """The dispatcher connection generation the replica was seeded during"""
+    last_read_at: float = 0
+    """When the replica was last read"""
+    syncing: Optional["asyncio.Task[None]"] = None
+    """The task seeding the replica, if it's being seeded"""
+    buffered: List[InteractivePromptEventStatsUpdate] = field(default_factory=list)
+    """Updates received while seeding"""
+
+    def apply(self, update: InteractivePromptEventStatsUpdate) -> None:
+        assert self.replica is not None
+        if update.seq <= self.applied_through or update.seq in self.pending:
+            return
+
+        for delta in update.deltas:
+            self.replica.add(
+                delta.category, delta.category_value, delta.bin, delta.amount
+            )
+
+        self.pending.add(update.seq)
+        while self.applied_through + 1 in self.pending:
+            self.applied_through += 1
+            self.pending.remove(self.applied_through)
+
+        if not self.pending:
+            self.gap_since = None
+        elif self.gap_since is None:
+            self.gap_since = time.time()
+
+
+class FenwickReplicas:
+    """Keeps the fenwick tree replicas for this instance. Not thread-safe; use
+    from the main event loop only.
+    """
+
+    def __init__(self) -> None:
+        self.states: Dict[str, _ReplicaState] = dict()
+        """The replica states by interactive prompt uid"""
+
+        self.task: Optional[asyncio.Task] = None
+        """The task holding the subscription, if it's running"""
+
+        self.subscribed: Optional[asyncio.Event] = None
+        """Set while the current task is subscribed"""
+
+        self.connection_generation: int = 0
+        """Incremented whenever the subscription is (re)established, since
+        messages may have been missed
+        """
+
+    async def get(self, *, uid: str, bins: int) -> FenwickReplica:
+        """Returns an up-to-date replica of the fenwick trees for the interactive
+        prompt with the given uid, seeding it from the database if necessary
+        """
+        now = time.time()
+        state = self.states.get(uid)
+        if state is None or state.bins != bins:
+            state = _ReplicaState(bins=bins)
+            self.states[uid] = state
+        state.last_read_at = now
+
+        if self.task is None:
+            self.subscribed = asyncio.Event()
+            self.task = asyncio.create_task(self._run(self.subscribed))
+
+        while state.replica is None or self._needs_sync(state, now):
+            if state.syncing is None:
+                state.syncing = asyncio.create_task(self._sync(uid, state))
+            await asyncio.shield(state.syncing)
+            now = time.time()
+
+        assert state.replica is not None
+        return state.replica
+
+    def _needs_sync(self, state: _ReplicaState, now: float) -> bool:
+        if state.syncing is not None:
+            return True
+        if state.valid_until <= now:
+            return True
+        if state.connection_generation != self.connection_generation:
+            return True
+        if state.gap_since is not None and now - state.gap_since > GAP_TIMEOUT_SECONDS:
+            return True
+        return False
+
+    async def _sync(self, uid: str, state: _ReplicaState) -> None:
+        try:
+            subscribed = self.subscribed
+            is_subscribed = False
+            if subscribed is not None:
+                try:
+                    await asyncio.wait_for(
+                        subscribed.wait(), timeout=SUBSCRIBE_TIMEOUT_SECONDS
+                    )
+                    is_subscribed = True
+                except asyncio.TimeoutError:
+                    pass
+
+            connection_generation = self.connection_generation
+            state.buffered = []
+
+            async with Itgs() as itgs:
+                redis = await itgs.redis()
+                raw_seq = await redis.get(get_stats_seq_key(uid))
+                seq = int(raw_seq) if raw_seq is not None else 0
+
+                conn = await itgs.conn()
+                cursor = conn.cursor("weak")
+                response = await cursor.execute(
+                    """
+                    SELECT category, category_value, idx, val
+                    FROM interactive_prompt_event_fenwick_trees
+                    WHERE
+                        interactive_prompt_id = (
+                            SELECT interactive_prompts.id FROM interactive_prompts
+                            WHERE interactive_prompts.uid = ?
+                        )
+                    """,
+                    (uid,),
+                )
+
+            replica = FenwickReplica(state.bins)
+            for category, category_value, idx, val in response.results or []:
+                replica.add_to_node(category, category_value, idx, val)
+
+            now = time.time()
+            state.replica = replica
+            state.applied_through = seq
+            state.pending = set()
+            state.gap_since = None
+            state.connection_generation = connection_generation
+            state.valid_until = now + (
+                RESYNC_INTERVAL_SECONDS if is_subscribed else GAP_TIMEOUT_SECONDS
+            )
+            buffered = state.buffered
+            state.buffered = []
+            for update in buffered:
+                state.apply(update)
+            logger.debug(
+                f"seeded fenwick replica for {uid=} at {seq=} with {len(buffered)} buffered updates"
+            )
+        finally:
+            state.syncing = None
+
+    def _handle_message(self, channel: bytes, data: bytes) -> None:
+        uid = channel[len(b"ps:interactive_prompts:") : -len(b":events")].decode(
+            "utf-8"
+        )
+        state = self.states.get(uid)
+        if state is None:
+            return
+
+        update = _StatsOnlyMessage.model_validate_json(data).stats
+        if update is None:
+            return
+
+        if state.syncing is not None:
+            state.buffered.append(update)
+        elif state.replica is not None:
+            state.apply(update)
+
+    def _evict_idle(self, now: float) -> None:
+        for uid, state in list(self.states.items()):
+            if (
+                state.syncing is None
+                and now - state.last_read_at > IDLE_TIMEOUT_SECONDS
+            ):
+                del self.states[uid]
+
+    async def _run(self, subscribed: asyncio.Event) -> None:
+        try:
+            while True:
+                try:
+                    async with Itgs() as itgs:
+                        redis = await itgs.redis()
+                        pubsub = redis.pubsub()
+                        try:
+                            await pubsub.psubscribe(EVENTS_CHANNEL_PATTERN)
+                            self.connection_generation += 1
+                            subscribed.set()
+                            while True:
+                                message = await pubsub.get_message(
+                                    ignore_subscribe_messages=True, timeout=5
+                                )
+                                if message is not None:
+                                    channel = message.get("channel")
+                                    data = message.get("data")
+                                    if isinstance(channel, bytes) and isinstance(
+                                        data, bytes
+                                    ):
+                                        try:
+                                            self._handle_message(channel, data)
+                                        except Exception as e:
+                                            await handle_error(
+                                                e,
+                                                extra_info="fenwick replica message",
+                                            )
+
+                                self._evict_idle(time.time())
+                                if not self.states:
+                                    # detach synchronously so the next get
+                                    # starts a fresh task
+                                    self.task = None
+                                    return
+                        finally:
+                            subscribed.clear()
+                            await pubsub.aclose()
+                except Exception as e:
+                    await handle_error(e, extra_info="fenwick replica subscription")
+                    if not self.states:
+                        return
+                    await asyncio.sleep(1)
+        finally:
+            if self.task is asyncio.current_task():
+                self.task = None
+            logger.debug("fenwick replica subscription exiting")
+
+
+fenwick_replicas = FenwickReplicas()
+"""The fenwick tree replicas for this instance"""
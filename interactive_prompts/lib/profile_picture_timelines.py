@@ -0,0 +1,224 @@
+"""Packs the standard profile pictures for every time bucket of an interactive
+prompt into a single compact blob, so that the whole timeline can be computed
+with one query and cached as one value, while reading a single bucket only
+touches the bytes for that bucket.
+
+The blob is laid out as follows, with all numbers big-endian and unsigned
+unless otherwise noted:
+
+- 1 byte: the format version, currently 1
+- 8 bytes: when the timeline was fetched, as a (signed) double, in seconds
+  since the unix epoch
+- 2 bytes: the width of each bucket in seconds
+- 4 bytes: the number of buckets, `B`
+- 4 bytes: the number of picture refs, `R`
+- `(B + 1) * 4` bytes: the offset of each bucket within the index array; bucket
+  `i` is `indices[offsets[i]:offsets[i + 1]]`
+- `(R + 1) * 4` bytes: the offset of each ref within the ref data
+- `offsets[B] * 2` bytes: the index array, where each entry is the index of a
+  ref
+- the ref data, where each ref is the utf-8 encoded user sub, a space, and the
+  utf-8 encoded image file uid
+"""
+
+import bisect
+import random
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple
+
+BUCKET_WIDTH_SECONDS = 2
+"""The width of each bucket in seconds. Bucket `i` covers prompt times in
+`[i * BUCKET_WIDTH_SECONDS, (i + 1) * BUCKET_WIDTH_SECONDS)`
+"""
+
+PICTURES_PER_BUCKET = 25
+"""How many pictures we try to store for each bucket, which is more than we
+would ever return to account for suppressed pictures
+"""
+
+MAX_REFS = 65535
+"""The maximum number of refs in a timeline, since indices are 2 bytes"""
+
+_HEADER = struct.Struct(">BdHII")
+_VERSION = 1
+
+
+def get_num_buckets(duration_seconds: float) -> int:
+    """Returns the number of buckets in the timeline for an interactive prompt
+    with the given duration, which is enough to cover every prompt time from 0
+    through the duration, inclusive
+    """
+    return int(duration_seconds // BUCKET_WIDTH_SECONDS) + 1
+
+
+def build_timeline(
+    attendance: Sequence[Tuple[str, str, float, Optional[float]]],
+    *,
+    duration_seconds: float,
+    fetched_at: float,
+) -> bytes:
+    """Builds the encoded timeline from the given attendance.
+
+    Each user gets a random priority, and each bucket gets the (up to)
+    `PICTURES_PER_BUCKET` users with the lowest priority who are present at the
+    start of the bucket. This tends to appear random, while keeping the
+    pictures stable from one bucket to the next.
+
+    The buckets are filled in a single sweep over the join and leave times, so
+    this is O(E log E + B) for E sessions and B buckets rather than checking
+    every user for every bucket.
+
+    Args:
+        attendance (list[tuple[str, str, float, float or None]]): One item per
+            interactive prompt session with a join event, as
+            (user sub, image file uid, join prompt time, leave prompt time or
+            None). The user is present at time t if they have a session which
+            joined at or before t and hadn't left by t. Users with more than
+            one session must have the same image file uid for each.
+        duration_seconds (float): The duration of the interactive prompt
+        fetched_at (float): When the attendance was fetched
+
+    Returns:
+        bytes: The encoded timeline
+    """
+    intervals_by_user: Dict[Tuple[str, str], List[Tuple[float, float]]] = dict()
+    for user_sub, image_file_uid, joined_at, left_at in attendance:
+        intervals = intervals_by_user.get((user_sub, image_file_uid))
+        if intervals is None:
+            intervals = []
+            intervals_by_user[(user_sub, image_file_uid)] = intervals
+        intervals.append((joined_at, left_at if left_at is not None else float("inf")))
+
+    users = list(intervals_by_user.items())
+    random.shuffle(users)
+    del users[MAX_REFS:]
+
+    # (prompt time, change in sessions present, user index), where the user
+    # index is also the user's priority
+    changes: List[Tuple[float, int, int]] = []
+    for user_idx, (_, intervals) in enumerate(users):
+        for joined_at, left_at in intervals:
+            if left_at <= joined_at:
+                continue
+            changes.append((joined_at, 1, user_idx))
+            changes.append((left_at, -1, user_idx))
+    changes.sort()
+
+    sessions_by_user: List[int] = [0] * len(users)
+    # the indices of the users with at least one session present, ascending
+    present: List[int] = []
+    next_change_idx = 0
+
+    ref_index_by_user: Dict[int, int] = dict()
+    refs: List[Tuple[str, str]] = []
+    buckets: List[List[int]] = []
+    for bucket in range(get_num_buckets(duration_seconds)):
+        prompt_time = bucket * BUCKET_WIDTH_SECONDS
+        while (
+            next_change_idx < len(changes)
+            and changes[next_change_idx][0] <= prompt_time
+        ):
+            _, change, user_idx = changes[next_change_idx]
+            next_change_idx += 1
+            sessions_by_user[user_idx] += change
+            if change > 0 and sessions_by_user[user_idx] == 1:
+                bisect.insort(present, user_idx)
+            elif change < 0 and sessions_by_user[user_idx] == 0:
+                del present[bisect.bisect_left(present, user_idx)]
+
+        indices: List[int] = []
+        for user_idx in present[:PICTURES_PER_BUCKET]:
+            ref_index = ref_index_by_user.get(user_idx)
+            if ref_index is None:
+                ref_index = len(refs)
+                refs.append(users[user_idx][0])
+                ref_index_by_user[user_idx] = ref_index
+            indices.append(ref_index)
+        buckets.append(indices)
+
+    return encode_timeline(buckets=buckets, refs=refs, fetched_at=fetched_at)
+
+
+def encode_timeline(
+    *, buckets: List[List[int]], refs: List[Tuple[str, str]], fetched_at: float
+) -> bytes:
+    """Encodes the timeline with the given buckets, where each bucket is a list
+    of indices into the given (user sub, image file uid) refs
+    """
+    assert len(refs) <= MAX_REFS, len(refs)
+
+    encoded_refs = [
+        f"{user_sub} {image_file_uid}".encode("utf-8")
+        for user_sub, image_file_uid in refs
+    ]
+
+    bucket_offsets = [0]
+    for indices in buckets:
+        bucket_offsets.append(bucket_offsets[-1] + len(indices))
+
+    ref_offsets = [0]
+    for encoded_ref in encoded_refs:
+        ref_offsets.append(ref_offsets[-1] + len(encoded_ref))
+
+    all_indices = [idx for indices in buckets for idx in indices]
+
+    return b"".join(
+        [
+            _HEADER.pack(
+                _VERSION, fetched_at, BUCKET_WIDTH_SECONDS, len(buckets), len(refs)
+            ),
+            struct.pack(f">{len(bucket_offsets)}I", *bucket_offsets),
+            struct.pack(f">{len(ref_offsets)}I", *ref_offsets),
+            struct.pack(f">{len(all_indices)}H", *all_indices),
+            *encoded_refs,
+        ]
+    )
+
+
+def get_fetched_at(timeline: bytes) -> float:
+    """Returns when the given encoded timeline was fetched"""
+    return _HEADER.unpack_from(timeline, 0)[1]
+
+
+def read_timeline_bucket(
+    timeline: bytes, prompt_time: float
+) -> Optional[List[Tuple[str, str]]]:
+    """Reads the (user sub, image file uid) refs for the bucket containing the
+    given prompt time from the given encoded timeline, without decoding the
+    other buckets. O(k) for k refs in the bucket
+
+    Returns:
+        list[tuple[str, str]], None: The refs for the bucket, or None if the
+            prompt time is after the last bucket
+    """
+    version, _, bucket_width, num_buckets, num_refs = _HEADER.unpack_from(timeline, 0)
+    assert version == _VERSION, version
+
+    bucket = int(prompt_time // bucket_width)
+    if bucket < 0 or bucket >= num_buckets:
+        return None
+
+    bucket_offsets_at = _HEADER.size
+    ref_offsets_at = bucket_offsets_at + (num_buckets + 1) * 4
+    indices_at = ref_offsets_at + (num_refs + 1) * 4
+
+    start, end = struct.unpack_from(">II", timeline, bucket_offsets_at + bucket * 4)
+    total_indices = struct.unpack_from(
+        ">I", timeline, bucket_offsets_at + num_buckets * 4
+    )[0]
+    refs_at = indices_at + total_indices * 2
+
+    result: List[Tuple[str, str]] = []
+    for ref_index in struct.unpack_from(
+        f">{end - start}H", timeline, indices_at + start * 2
+    ):
+        ref_start, ref_end = struct.unpack_from(
+            ">II", timeline, ref_offsets_at + ref_index * 4
+        )
+        user_sub, image_file_uid = (
+            timeline[refs_at + ref_start : refs_at + ref_end]
+            .decode("utf-8")
+            .split(" ", 1)
+        )
+        result.append((user_sub, image_file_uid))
+    return result
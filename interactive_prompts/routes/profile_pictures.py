@@ -11,7 +11,6 @@ from typing import (
     NoReturn,
     Optional,
     Tuple,
-    Union,
     cast as typing_cast,
 )
 from error_middleware import handle_contextless_error, handle_error
@@ -19,6 +18,11 @@ from image_files.models import ImageFileRef
 import auth
 import interactive_prompts.auth
 import image_files.auth
+from interactive_prompts.lib.profile_picture_timelines import (
+    build_timeline,
+    get_fetched_at,
+    read_timeline_bucket,
+)
 from interactive_prompts.lib.read_interactive_prompt_meta import (
     read_interactive_prompt_meta,
 )
@@ -258,20 +262,12 @@ async def get_standard_profile_pictures(
     ever return to make it highly unlikely that suppressed pictures would cause
     too few to be returned.
 
-    Through collaborative caching, this can usually be accomplished without any networking
-    calls, though this does deserialize as it will need to be logically merged with the
-    users customization. For this to work best it's recommended the prompt time be an
+    This reads the bucket containing the given prompt time from the profile
+    picture timeline for the interactive prompt (see `get_profile_picture_timeline`),
+    so through collaborative caching this can usually be accomplished without any
+    networking calls. For this to work best it's recommended the prompt time be an
     integer multiple of 2 seconds.
 
-    This uses the following keys to produce a multi-layer, collaborative cache:
-
-    - DISKCACHE: `interactive_prompts:profile_pictures:{uid}:{prompt_time}` layer 1 (local)
-    - REDIS: `interactive_prompts:profile_pictures:{uid}:{prompt_time}` layer 2 (regional)
-    - REDIS: `interactive_prompts:profile_pictures:cache_lock:{uid}:{prompt_time}` prevents multiple
-      instances filling regional cache at the same time
-    - REDIS: `ps:interactive_prompts:profile_pictures:push_cache` ensures filling one instance
-      cache fills all the instance caches, and allows purging local caches
-
     Args:
         itgs (Itgs): The integrations to (re)use
         interactive_prompt_uid (str): The UID of the interactive prompt to get profile pictures for
@@ -283,21 +279,62 @@ async def get_standard_profile_pictures(
             prompt at that time are returned. Otherwise None is returned. The
             result is semi-random but somewhat stable due to caching.
     """
-    res = await get_standard_profile_pictures_from_local_cache(
-        itgs, interactive_prompt_uid, prompt_time
+    timeline = await get_profile_picture_timeline(itgs, interactive_prompt_uid)
+    if timeline is None:
+        return None
+
+    refs = read_timeline_bucket(timeline, prompt_time)
+    if refs is None:
+        return None
+
+    return StandardUserProfilePictures(
+        interactive_prompt_uid=interactive_prompt_uid,
+        prompt_time=prompt_time,
+        fetched_at=get_fetched_at(timeline),
+        profile_pictures=[
+            InternalProfilePictureRef(user_sub=user_sub, image_file_uid=image_file_uid)
+            for (user_sub, image_file_uid) in refs
+        ],
+    )
+
+
+async def get_profile_picture_timeline(
+    itgs: Itgs, interactive_prompt_uid: str
+) -> Optional[bytes]:
+    """Fetches the encoded profile picture timeline for the given interactive
+    prompt, which contains the standard profile pictures for every time bucket
+    within the prompt. See `interactive_prompts.lib.profile_picture_timelines`
+    for the format.
+
+    The whole timeline is filled at once, so as playback progresses no further
+    database queries are required. This uses the following keys to produce a
+    multi-layer, collaborative cache:
+
+    - DISKCACHE: `interactive_prompts:profile_picture_timelines:{uid}` layer 1 (local)
+    - REDIS: `interactive_prompts:profile_picture_timelines:{uid}` layer 2 (regional)
+    - REDIS: `interactive_prompts:profile_picture_timelines:cache_lock:{uid}` prevents multiple
+      instances filling regional cache at the same time
+    - REDIS: `ps:interactive_prompts:profile_picture_timelines:push_cache` ensures filling one
+      instance cache fills all the instance caches, and allows purging local caches
+
+    Args:
+        itgs (Itgs): The integrations to (re)use
+        interactive_prompt_uid (str): The UID of the interactive prompt to get the timeline for
+
+    Returns:
+        bytes, None: The encoded timeline, or None if the interactive prompt does
+            not exist
+    """
+    res = await get_profile_picture_timeline_from_local_cache(
+        itgs, interactive_prompt_uid
     )
     if res is not None:
         return res
 
-    res = await get_standard_profile_pictures_from_redis(
-        itgs, interactive_prompt_uid, prompt_time
-    )
+    res = await get_profile_picture_timeline_from_redis(itgs, interactive_prompt_uid)
     if res is not None:
-        await set_standard_profile_pictures_to_local_cache(
-            itgs,
-            interactive_prompt_uid,
-            prompt_time,
-            encoded_pictures=res.__pydantic_serializer__.to_json(res),
+        await set_profile_picture_timeline_to_local_cache(
+            itgs, interactive_prompt_uid, encoded_timeline=res
         )
         return res
 
@@ -308,33 +345,26 @@ async def get_standard_profile_pictures(
     if prompt_meta is None:
         return None
 
-    if prompt_time > prompt_meta.duration_seconds:
-        return None
-
     redis = await itgs.redis()
-    got_lock = await redis.set(
-        f"interactive_prompts:profile_pictures:cache_lock:{interactive_prompt_uid}:{prompt_time}".encode(
-            "ascii"
-        ),
-        1,
-        nx=True,
-        ex=3,
+    lock_key = f"interactive_prompts:profile_picture_timelines:cache_lock:{interactive_prompt_uid}".encode(
+        "ascii"
     )
+    got_lock = await redis.set(lock_key, 1, nx=True, ex=5)
     if not got_lock:
         got_data_event = asyncio.Event()
         got_data_task = asyncio.create_task(got_data_event.wait())
 
-        arr = waiting_for_cache.get((interactive_prompt_uid, prompt_time))
+        arr = waiting_for_cache.get(interactive_prompt_uid)
         if arr is None:
             arr = []
-            waiting_for_cache[(interactive_prompt_uid, prompt_time)] = arr
+            waiting_for_cache[interactive_prompt_uid] = arr
 
         arr.append(got_data_event)
 
         try:
-            await asyncio.wait_for(got_data_task, timeout=3)
-            new_data = await get_standard_profile_pictures_from_local_cache(
-                itgs, interactive_prompt_uid, prompt_time
+            await asyncio.wait_for(got_data_task, timeout=5)
+            new_data = await get_profile_picture_timeline_from_local_cache(
+                itgs, interactive_prompt_uid
             )
             if new_data is not None:
                 return new_data
@@ -348,7 +378,7 @@ async def get_standard_profile_pictures(
             await handle_error(
                 e,
                 extra_info=(
-                    "Timeout waiting for standard profile pictures to be filled in, "
+                    "Timeout waiting for the profile picture timeline to be filled in, "
                     "either instance died (this should recover), or it's taking a long "
                     "time (check db health)"
                 ),
@@ -361,203 +391,158 @@ async def get_standard_profile_pictures(
                     e, extra_info="Failed to remove event from waiting list"
                 )
 
-            if (
-                not arr
-                and waiting_for_cache.get((interactive_prompt_uid, prompt_time)) is arr
-            ):
-                waiting_for_cache.pop((interactive_prompt_uid, prompt_time), None)
+            if not arr and waiting_for_cache.get(interactive_prompt_uid) is arr:
+                waiting_for_cache.pop(interactive_prompt_uid, None)
 
             # fall down to as if we got the lock
 
-    new_data = await get_standard_profile_pictures_from_database(
-        itgs, interactive_prompt_uid, prompt_time
+    fetched_at = time.time()
+    new_data = await get_profile_picture_timeline_from_database(
+        itgs, interactive_prompt_uid, duration_seconds=prompt_meta.duration_seconds
     )
-    new_data_encoded = new_data.__pydantic_serializer__.to_json(new_data)
-    await set_standard_profile_pictures_to_redis(
-        itgs, interactive_prompt_uid, prompt_time, encoded_pictures=new_data_encoded
+    await set_profile_picture_timeline_to_redis(
+        itgs, interactive_prompt_uid, encoded_timeline=new_data
     )
-    await push_standard_profile_pictures_to_local_caches(
+    await push_profile_picture_timeline_to_local_caches(
         itgs,
         interactive_prompt_uid,
-        prompt_time,
-        fetched_at=new_data.fetched_at,
-        encoded_pictures=new_data_encoded,
-    )
-    await redis.delete(
-        f"interactive_prompts:profile_pictures:cache_lock:{interactive_prompt_uid}:{prompt_time}".encode(
-            "ascii"
-        )
+        fetched_at=fetched_at,
+        encoded_timeline=new_data,
     )
+    await redis.delete(lock_key)
     return new_data
 
 
-async def get_standard_profile_pictures_from_local_cache(
-    itgs: Itgs, interactive_prompt_uid: str, prompt_time: int
-) -> Optional[StandardUserProfilePictures]:
-    """Fetches the standard profile pictures stored in our local cache for the given
-    interactive prompt at the given time, if any.
+async def get_profile_picture_timeline_from_local_cache(
+    itgs: Itgs, interactive_prompt_uid: str
+) -> Optional[bytes]:
+    """Fetches the encoded profile picture timeline stored in our local cache for
+    the given interactive prompt, if any.
 
     Args:
         itgs (Itgs): The integrations to (re)use
-        interactive_prompt_uid (str): The UID of the interactive prompt to get profile pictures for
-        prompt_time (int): The time within the prompt to get profile pictures for
+        interactive_prompt_uid (str): The UID of the interactive prompt to get the timeline for
 
     Returns:
-        StandardUserProfilePictures, None: The pictures, or None if not found in the
-            local cache
+        bytes, None: The encoded timeline, or None if not found in the local cache
     """
     local_cache = await itgs.local_cache()
-    raw = typing_cast(
-        bytes,
+    return typing_cast(
+        Optional[bytes],
         local_cache.get(
-            f"interactive_prompts:profile_pictures:{interactive_prompt_uid}:{prompt_time}".encode(
+            f"interactive_prompts:profile_picture_timelines:{interactive_prompt_uid}".encode(
                 "ascii"
             )
         ),
     )
-    if raw is None:
-        return None
-    return StandardUserProfilePictures.model_validate_json(raw)
 
 
-async def set_standard_profile_pictures_to_local_cache(
+async def set_profile_picture_timeline_to_local_cache(
     itgs: Itgs,
     interactive_prompt_uid: str,
-    prompt_time: int,
     *,
-    encoded_pictures: bytes,
+    encoded_timeline: bytes,
     expire: int = 120,
 ) -> None:
-    """Inserts or updates the standard profile pictures stored in our local cache for
-    the given prompt at the given time, expiring after the given number of seconds.
-    This tags the cache entry with 'collab', ensuring it's evicted if the instance
+    """Inserts or updates the profile picture timeline stored in our local cache
+    for the given prompt, expiring after the given number of seconds. This tags
+    the cache entry with 'collab', ensuring it's evicted if the instance
     restarts, regardless of the expiration time.
 
     Args:
         itgs (Itgs): The integrations to (re)use
-        interactive_prompt_uid (str): The UID of the prompt to set the profile pictures of
-        prompt_time (int): The time within the prompt to set the profile pictures of
-        encoded_pictures (bytes): The pictures to set, encoded already
+        interactive_prompt_uid (str): The UID of the prompt to set the timeline of
+        encoded_timeline (bytes): The timeline to set, encoded already
         expire (int): The number of seconds to expire the cache entry after
     """
     local_cache = await itgs.local_cache()
     local_cache.set(
-        f"interactive_prompts:profile_pictures:{interactive_prompt_uid}:{prompt_time}".encode(
+        f"interactive_prompts:profile_picture_timelines:{interactive_prompt_uid}".encode(
             "ascii"
         ),
-        encoded_pictures,
+        encoded_timeline,
         expire=expire,
         tag="collab",
     )
 
 
-async def delete_standard_profile_pictures_from_local_cache(
-    itgs: Itgs, interactive_prompt_uid: str, prompt_time: int
+async def delete_profile_picture_timeline_from_local_cache(
+    itgs: Itgs, interactive_prompt_uid: str
 ) -> None:
-    """Deletes the standard profile pictures stored in our local cache for the given
-    interactive prompt at the given time, if any.
+    """Deletes the profile picture timeline stored in our local cache for the given
+    interactive prompt, if any.
 
     Args:
         itgs (Itgs): The integrations to (re)use
-        interactive_prompt_uid (str): The UID of the interactive prompt to delete the profile pictures of
-        prompt_time (int): The time within the interactive prompt to delete the profile pictures of
+        interactive_prompt_uid (str): The UID of the interactive prompt to delete the timeline of
     """
     local_cache = await itgs.local_cache()
     local_cache.delete(
-        f"interactive_prompts:profile_pictures:{interactive_prompt_uid}:{prompt_time}".encode(
+        f"interactive_prompts:profile_picture_timelines:{interactive_prompt_uid}".encode(
             "ascii"
         )
     )
 
 
-async def get_standard_profile_pictures_from_redis(
-    itgs: Itgs, interactive_prompt_uid: str, prompt_time: int
-) -> Optional[StandardUserProfilePictures]:
-    """Gets the standard profile pictures stored in redis for the given prompt at the
-    given time, if any.
+async def get_profile_picture_timeline_from_redis(
+    itgs: Itgs, interactive_prompt_uid: str
+) -> Optional[bytes]:
+    """Gets the encoded profile picture timeline stored in redis for the given
+    prompt, if any.
 
     Args:
         itgs (Itgs): The integrations to (re)use
-        interactive_prompt_uid (str): The UID of the prompt to get profile pictures for
-        prompt_time (int): The time within the prompt to get profile pictures for
+        interactive_prompt_uid (str): The UID of the prompt to get the timeline for
     """
     redis = await itgs.redis()
-    pictures = await redis.get(
-        f"interactive_prompts:profile_pictures:{interactive_prompt_uid}:{prompt_time}".encode(
+    return await redis.get(
+        f"interactive_prompts:profile_picture_timelines:{interactive_prompt_uid}".encode(
             "ascii"
         )
     )
-    if pictures is None:
-        return None
-    return StandardUserProfilePictures.model_validate_json(pictures)
 
 
-async def set_standard_profile_pictures_to_redis(
+async def set_profile_picture_timeline_to_redis(
     itgs: Itgs,
     interactive_prompt_uid: str,
-    prompt_time: int,
     *,
-    encoded_pictures: bytes,
+    encoded_timeline: bytes,
     expire: int = 120,
 ) -> None:
-    """Inserts or updates the standard profile pictures for the given prompt uid at
-    the given time into the redis cache.
+    """Inserts or updates the profile picture timeline for the given prompt uid
+    into the redis cache.
 
     Args:
         itgs (Itgs): The integrations to (re)use
-        interactive_prompt_uid (str): The UID of the interactive prompt to get profile pictures for
-        prompt_time (int): The time within the prompt to get profile pictures for
-        encoded_pictures (bytes): The pictures to cache, encoded already
-        expire (int): How long to cache the pictures for, in seconds. Defaults to 120.
+        interactive_prompt_uid (str): The UID of the interactive prompt to set the timeline of
+        encoded_timeline (bytes): The timeline to cache, encoded already
+        expire (int): How long to cache the timeline for, in seconds. Defaults to 120.
     """
     redis = await itgs.redis()
     await redis.set(
-        f"interactive_prompts:profile_pictures:{interactive_prompt_uid}:{prompt_time}".encode(
+        f"interactive_prompts:profile_picture_timelines:{interactive_prompt_uid}".encode(
             "ascii"
         ),
-        encoded_pictures,
+        encoded_timeline,
         ex=expire,
     )
 
 
-async def delete_standard_profile_pictures_from_redis(
-    itgs: Itgs, interactive_prompt_uid: str, prompt_time: int
-) -> None:
-    """Deletes the standard profile pictures for the given prompt uid at the given
-    time from the redis cache. This should not typically be called directly - for
-    eviction, such as because a profile picture was found to be against our TOS, use
-    evict_standard_profile_pictures which hits all the caches much more efficiently.
-
-    Arguments:
-        itgs (Itgs): The integrations to (re)use
-        interactive_prompt_uid (str): The UID of the prompt to get profile pictures for
-        prompt_time (int): The time within the prompt to get profile pictures for
-    """
-    redis = await itgs.redis()
-    await redis.delete(
-        f"interactive_prompts:profile_pictures:{interactive_prompt_uid}:{prompt_time}".encode(
-            "ascii"
-        )
-    )
-
-
-async def get_standard_profile_pictures_from_database(
-    itgs: Itgs, interactive_prompt_uid: str, prompt_time: int
-) -> StandardUserProfilePictures:
-    """Finds standard profile pictures for the given interactive prompt uid at the given
-    time, using the database. This isn't truly random for performance reasons,
-    but tends to appear random enough.
+async def get_profile_picture_timeline_from_database(
+    itgs: Itgs, interactive_prompt_uid: str, *, duration_seconds: float
+) -> bytes:
+    """Computes the profile picture timeline for the given interactive prompt uid
+    using a single database query. The users considered aren't truly random for
+    performance reasons, but tend to appear random enough.
 
     Args:
         itgs (Itgs): The integrations to (re)use
-        interactive_prompt_uid (str): The UID of the prompt to get profile pictures for
-        prompt_time (int): The time within the prompt to get profile pictures for
+        interactive_prompt_uid (str): The UID of the prompt to get the timeline for
+        duration_seconds (float): The duration of the prompt
 
     Returns:
-        StandardUserProfilePictures: The standard profile pictures to use for that
-            offset within the interactive prompt. If the prompt does not exist, this returns
-            an empty list. If the prompt exists but the time is illogical, the
-            result will be nonsense.
+        bytes: The encoded timeline. If the prompt does not exist, every bucket
+            is empty.
     """
     conn = await itgs.conn()
     cursor = conn.cursor("none")
@@ -567,54 +552,50 @@ async def get_standard_profile_pictures_from_database(
     # that range. This is generally an O(Nlog(M)) operation, where N is the
     # number of rows we are plucking and M is the size of the table. Contrast
     # this to an augment-with-random-and-sort, which is O(Mlog(M)) (much worse).
-    # Our actual performance will differ based on the work we have to do on each
-    # row, e.g., something like O(Nlog(M)(log(K))^2log(O)(log(P))^2) where K is
-    # the number of prompt sessions, O is the number of prompt events, and P
-    # is the number of users should be an upper bound. This makes the difference
-    # between an N vs M linear factor very dramatic.
+    # Since the whole timeline is built from one sample, N is the number of
+    # attendees we consider across all buckets, which is far more than we would
+    # return for any one bucket.
 
     # we can't use user sub since we don't want to guarrantee they are random.
     # we can't use user revenue_cat_id since a client who knows we're
     # doing this can use it to deduce ids given enough samples, and
     # revenue_cat_id is treated as a secret
 
+    # the offset is only applied when the prompt has more sessions than the
+    # limit, so smaller prompts get every session from the first query
+
     uid_offset = f"oseh_if_{secrets.token_urlsafe(16)}"
     sort_dir = random.choice(typing_cast(List[Literal["ASC", "DESC"]], ["ASC", "DESC"]))
-    limit = 25
-    query_str, qargs = _make_query(
-        interactive_prompt_uid, prompt_time, uid_offset, sort_dir, limit
-    )
+    limit = 1000
+    query_str, qargs = _make_query(interactive_prompt_uid, uid_offset, sort_dir, limit)
     fetched_at = time.time()
     response = await cursor.execute(query_str, qargs)
 
-    if response.results is None or len(response.results) < limit:
+    if not response.results or (
+        len(response.results) < limit and response.results[0][4] > limit
+    ):
         # retry, removing the offset
-        query_str, qargs = _make_query(
-            interactive_prompt_uid, prompt_time, None, None, limit
-        )
+        query_str, qargs = _make_query(interactive_prompt_uid, None, None, limit)
         fetched_at = time.time()
         response = await cursor.execute(query_str, qargs)
 
-    profile_picture_refs = [
-        InternalProfilePictureRef(
-            user_sub=user_sub,
-            image_file_uid=image_file_uid,
-        )
-        for (user_sub, image_file_uid) in (response.results or [])
-    ]
-    random.shuffle(profile_picture_refs)
-
-    return StandardUserProfilePictures(
-        interactive_prompt_uid=interactive_prompt_uid,
-        prompt_time=prompt_time,
+    return build_timeline(
+        [
+            (
+                typing_cast(str, row[0]),
+                typing_cast(str, row[1]),
+                typing_cast(float, row[2]),
+                typing_cast(Optional[float], row[3]),
+            )
+            for row in response.results or []
+        ],
+        duration_seconds=duration_seconds,
         fetched_at=fetched_at,
-        profile_pictures=profile_picture_refs,
     )
 
 
 def _make_query(
     interactive_prompt_uid: str,
-    prompt_time: int,
     uid_offset: Optional[str],
     sort_dir: Optional[Literal["ASC", "DESC"]],
     limit: int,
@@ -622,14 +603,17 @@ def _make_query(
     query = io.StringIO()
     qargs = []
 
-    # --CO-ROUTINE prompt_users
+    # --MATERIALIZE num_sessions
+    #   |--SEARCH interactive_prompt_sessions USING COVERING INDEX interactive_prompt_sessions_ip_id_user_id_idx (interactive_prompt_id=?)
+    # --CO-ROUTINE session_times
     #   |--SEARCH interactive_prompts USING COVERING INDEX sqlite_autoindex_interactive_prompts_1 (uid=?)
     #   |--SEARCH interactive_prompt_sessions USING COVERING INDEX interactive_prompt_sessions_ip_id_user_id_idx (interactive_prompt_id=?)
     #   |--CORRELATED SCALAR SUBQUERY 2
-    #      |--SEARCH interactive_prompt_events USING INDEX interactive_prompt_events_ips_id_prompt_time_idx (interactive_prompt_session_id=? AND prompt_time<?)
+    #      |--SEARCH interactive_prompt_events USING INDEX interactive_prompt_events_ips_id_prompt_time_idx (interactive_prompt_session_id=?)
     #   |--CORRELATED SCALAR SUBQUERY 3
-    #      |--SEARCH interactive_prompt_events USING INDEX interactive_prompt_events_ips_id_prompt_time_idx (interactive_prompt_session_id=? AND prompt_time<?)
-    # --SCAN prompt_users
+    #      |--SEARCH interactive_prompt_events USING INDEX interactive_prompt_events_ips_id_prompt_time_idx (interactive_prompt_session_id=?)
+    # --SCAN session_times
+    # --SCAN num_sessions
     # --SEARCH user_profile_pictures USING INDEX user_profile_pictures_user_id_latest_idx (user_id=? AND latest=?)
     # --SEARCH users USING INTEGER PRIMARY KEY (rowid=?)
     # --SEARCH image_files USING INTEGER PRIMARY KEY (rowid=?)
@@ -639,66 +623,66 @@ def _make_query(
     qargs.append(interactive_prompt_uid)
 
     query.write(
-        ", prompt_users(id) AS ("
-        "SELECT DISTINCT interactive_prompt_sessions.user_id "
-        "FROM"
-        " interactive_prompt_sessions,"
-        " prompt "
-        "WHERE"
-        " interactive_prompt_sessions.interactive_prompt_id = prompt.id"
-        " AND EXISTS ("
+        ", session_times(user_id, joined_at, left_at) AS ("
+        "SELECT"
+        " interactive_prompt_sessions.user_id,"
+        " ("
         "SELECT"
-        " 1 "
+        " MIN(interactive_prompt_events.prompt_time) "
         "FROM"
         " interactive_prompt_events "
         "WHERE"
         " interactive_prompt_events.interactive_prompt_session_id = interactive_prompt_sessions.id"
         " AND interactive_prompt_events.evtype = ?"
-        " AND interactive_prompt_events.prompt_time <= ?"
-        ")"
-        " AND NOT EXISTS ("
+        "),"
+        " ("
         "SELECT"
-        " 1 "
+        " MIN(interactive_prompt_events.prompt_time) "
         "FROM"
         " interactive_prompt_events "
         "WHERE"
         " interactive_prompt_events.interactive_prompt_session_id = interactive_prompt_sessions.id"
         " AND interactive_prompt_events.evtype = ?"
-        " AND interactive_prompt_events.prompt_time <= ?"
-        ")"
+        ") "
+        "FROM"
+        " interactive_prompt_sessions,"
+        " prompt "
+        "WHERE"
+        " interactive_prompt_sessions.interactive_prompt_id = prompt.id"
         ")"
     )
-    qargs.extend(["join", prompt_time, "leave", prompt_time])
+    qargs.extend(["join", "leave"])
 
     query.write(
-        ", users_with_profile_pictures(user_id, image_file_id) AS ("
-        "SELECT"
-        " prompt_users.id,"
-        " user_profile_pictures.image_file_id "
-        "FROM prompt_users, user_profile_pictures "
-        "WHERE"
-        " prompt_users.id = user_profile_pictures.user_id"
-        " AND user_profile_pictures.latest = 1"
+        ", num_sessions(n) AS ("
+        "SELECT COUNT(*) FROM interactive_prompt_sessions, prompt "
+        "WHERE interactive_prompt_sessions.interactive_prompt_id = prompt.id"
         ")"
     )
 
     query.write(
-        " SELECT users.sub, image_files.uid "
+        " SELECT users.sub, image_files.uid, session_times.joined_at, session_times.left_at, num_sessions.n "
         "FROM"
-        " users_with_profile_pictures,"
+        " session_times,"
+        " num_sessions,"
+        " user_profile_pictures,"
         " users,"
         " image_files "
         "WHERE"
-        " users_with_profile_pictures.user_id = users.id"
-        " AND users_with_profile_pictures.image_file_id = image_files.id"
+        " session_times.joined_at IS NOT NULL"
+        " AND user_profile_pictures.user_id = session_times.user_id"
+        " AND user_profile_pictures.latest = 1"
+        " AND users.id = session_times.user_id"
+        " AND image_files.id = user_profile_pictures.image_file_id"
     )
 
     if uid_offset is not None:
-        query.write(" AND image_files.uid")
+        query.write(" AND (num_sessions.n <= ? OR image_files.uid")
+        qargs.append(limit)
         if sort_dir == "ASC":
-            query.write(" > ?")
+            query.write(" > ?)")
         else:
-            query.write(" < ?")
+            query.write(" < ?)")
         qargs.append(uid_offset)
 
     if sort_dir is not None:
@@ -712,103 +696,60 @@ def _make_query(
 
 
 async def evict_standard_profile_pictures(
-    itgs: Itgs,
-    interactive_prompt_uid: str,
-    prompt_times: Optional[Union[int, List[int]]] = None,
+    itgs: Itgs, interactive_prompt_uid: str
 ) -> None:
-    """Evicts the standard profile pictures for the given interactive prompt at the
-    given time, or if no time is given, all times. All times eviction is done by
-    querying the database for the length of the prompt, and then evicting all
-    integer times. A slower SCAN/KEYS approach can be used if non-integer times
-    were accidentally cached. If the interactive prompt is not found, this falls
-    back to KEYS, raising ValueError on non-integer timed keys.
+    """Evicts the standard profile pictures for the given interactive prompt at
+    all times, i.e., the profile picture timeline, from the redis cache and the
+    local cache of every instance.
 
     Args:
         itgs (Itgs): The integrations to (re)use
         interactive_prompt_uid (str): The UID of the interactive prompt to evict profile pictures for
-        prompt_times (int, List[int], None): If specified, evicts only the given time(s), otherwise
-            evicts all times
     """
-    redis = await itgs.redis()
-    if prompt_times is None:
-        meta = await read_interactive_prompt_meta(
-            itgs, interactive_prompt_uid=interactive_prompt_uid
-        )
-        if meta is not None:
-            return await evict_standard_profile_pictures(
-                itgs,
-                interactive_prompt_uid,
-                list(range(0, int(meta.duration_seconds + 1))),
-            )
-
-        matching_keys = await redis.keys(
-            f"interactive_prompts:profile_pictures:{interactive_prompt_uid}:*".encode(
-                "ascii"
-            )
-        )
-        matching_keys = [
-            str(key, "ascii") if not isinstance(key, str) else key
-            for key in matching_keys
-        ]
-        matching_times = [int(key.split(":")[-1]) for key in matching_keys]
-        return await evict_standard_profile_pictures(
-            itgs, interactive_prompt_uid, matching_times
+    msg_body = (
+        InteractivePromptProfilePictureTimelinePushCachePubSubMessage(
+            uid=interactive_prompt_uid,
+            min_checked_at=time.time(),
+            have_updated=False,
         )
+        .model_dump_json()
+        .encode("utf-8")
+    )
+    msg = len(msg_body).to_bytes(4, "big", signed=False) + msg_body
 
-    if isinstance(prompt_times, int):
-        prompt_times = [prompt_times]
-    if not prompt_times:
-        return
-
-    now = time.time()
+    redis = await itgs.redis()
     async with redis.pipeline() as pipe:
         pipe.multi()
         await pipe.delete(
-            *[
-                f"interactive_prompts:profile_pictures:{interactive_prompt_uid}:{prompt_time}".encode(
-                    "ascii"
-                )
-                for prompt_time in prompt_times
-            ]
-        )
-        for prompt_time in prompt_times:
-            msg_body = InteractivePromptProfilePicturesPushCachePubSubMessage(
-                uid=interactive_prompt_uid,
-                prompt_time=prompt_time,
-                min_checked_at=now,
-                have_updated=False,
-            ).model_dump_json()
-            msg = len(msg_body).to_bytes(4, "big", signed=False) + msg_body.encode(
-                "utf-8"
-            )
-            await pipe.publish(
-                b"ps:interactive_prompts:profile_pictures:push_cache", msg
+            f"interactive_prompts:profile_picture_timelines:{interactive_prompt_uid}".encode(
+                "ascii"
             )
+        )
+        await pipe.publish(
+            b"ps:interactive_prompts:profile_picture_timelines:push_cache", msg
+        )
         await pipe.execute()
 
 
-async def push_standard_profile_pictures_to_local_caches(
+async def push_profile_picture_timeline_to_local_caches(
     itgs: Itgs,
     interactive_prompt_uid: str,
-    prompt_time: int,
     *,
     fetched_at: float,
-    encoded_pictures: bytes,
+    encoded_timeline: bytes,
 ) -> None:
-    """Pushes the given encoded pictures to the local cache for all instances, including
-    our own. This does not write to the redis cache.
+    """Pushes the given encoded timeline to the local cache for all instances,
+    including our own. This does not write to the redis cache.
 
     Args:
         itgs (Itgs): The integrations to (re)use
         interactive_prompt_uid (str): The UID of the interactive prompt
-        prompt_time (int): The time within the interactive prompt
-        fetched_at (float): The time at which the pictures were fetched
-        encoded_pictures (bytes): The pictures, already json-encoded
+        fetched_at (float): The time at which the timeline was fetched
+        encoded_timeline (bytes): The timeline, already encoded
     """
     first_part = (
-        InteractivePromptProfilePicturesPushCachePubSubMessage(
+        InteractivePromptProfilePictureTimelinePushCachePubSubMessage(
             uid=interactive_prompt_uid,
-            prompt_time=prompt_time,
             min_checked_at=fetched_at,
             have_updated=True,
         )
@@ -816,31 +757,32 @@ async def push_standard_profile_pictures_to_local_caches(
         .encode("utf-8")
     )
 
-    message = io.BytesIO(bytearray(4 + len(first_part) + len(encoded_pictures)))
+    message = io.BytesIO(bytearray(4 + len(first_part) + len(encoded_timeline)))
     message.write(len(first_part).to_bytes(4, "big", signed=False))
     message.write(first_part)
-    message.write(encoded_pictures)
+    message.write(encoded_timeline)
 
     message = message.getvalue()
 
     redis = await itgs.redis()
-    await redis.publish(b"ps:interactive_prompts:profile_pictures:push_cache", message)
+    await redis.publish(
+        b"ps:interactive_prompts:profile_picture_timelines:push_cache", message
+    )
 
 
-class InteractivePromptProfilePicturesPushCachePubSubMessage(BaseModel):
+class InteractivePromptProfilePictureTimelinePushCachePubSubMessage(BaseModel):
     uid: str = Field(description="The UID of the interactive prompt")
-    prompt_time: int = Field(description="The time within the prompt")
     min_checked_at: float = Field(
         description="The minimum checked at time; caches older should be purged"
     )
     have_updated: bool = Field(
-        description="If this is followed by the new StandardUserProfilePictures"
+        description="If this is followed by the new encoded timeline"
     )
 
 
-waiting_for_cache: Dict[Tuple[str, int], List[asyncio.Event]] = dict()
-"""A mutable dictionary mapping from (uid, prompt_time) to the list of asyncio
-events to set if we receive new standard user profile pictures for that prompt.
+waiting_for_cache: Dict[str, List[asyncio.Event]] = dict()
+"""A mutable dictionary mapping from interactive prompt uid to the list of asyncio
+events to set if we receive a new profile picture timeline for that prompt.
 The list is removed before the events are set, so the events are only set once.
 However, the push cache loop never cleans this if it doesn't receive a relevant
 message, so callee's should set a timeout and clean up if they don't receive
@@ -850,22 +792,22 @@ a response in time.
 
 async def cache_push_loop() -> NoReturn:
     """Loops until the perpetual pub sub shuts down, handling any messages from other
-    instances regarding standard profile pictures that have been updated and writing
+    instances regarding profile picture timelines that have been updated and writing
     them to our internal cache.
     """
     assert pps.instance is not None
     try:
         async with pps.PPSSubscription(
             pps.instance,
-            "ps:interactive_prompts:profile_pictures:push_cache",
-            "ip_pp_pcl",
+            "ps:interactive_prompts:profile_picture_timelines:push_cache",
+            "ip_ppt_pcl",
         ) as sub:
             async for raw_message_bytes in sub:
                 raw_message = io.BytesIO(raw_message_bytes)
                 first_part_len = int.from_bytes(
                     raw_message.read(4), "big", signed=False
                 )
-                first_part = InteractivePromptProfilePicturesPushCachePubSubMessage.model_validate_json(
+                first_part = InteractivePromptProfilePictureTimelinePushCachePubSubMessage.model_validate_json(
                     raw_message.read(first_part_len)
                 )
 
@@ -876,21 +818,18 @@ async def cache_push_loop() -> NoReturn:
 
                 async with Itgs() as itgs:
                     if not first_part.have_updated:
-                        await delete_standard_profile_pictures_from_local_cache(
-                            itgs, first_part.uid, first_part.prompt_time
+                        await delete_profile_picture_timeline_from_local_cache(
+                            itgs, first_part.uid
                         )
                         continue
 
-                    await set_standard_profile_pictures_to_local_cache(
+                    await set_profile_picture_timeline_to_local_cache(
                         itgs,
                         first_part.uid,
-                        first_part.prompt_time,
-                        encoded_pictures=updated_part,
+                        encoded_timeline=updated_part,
                     )
 
-                    events = waiting_for_cache.pop(
-                        (first_part.uid, first_part.prompt_time), []
-                    )
+                    events = waiting_for_cache.pop(first_part.uid, [])
                     for event in events:
                         event.set()
     except Exception as e:
@@ -14,6 +14,7 @@ import journals.entries.routes.regenerate_summary
 import journals.entries.routes.retry_system_response
 import journals.entries.routes.show_journal_entry_metadata
 import journals.entries.routes.sync_journal_entry
+import journals.entries.routes.sync_journal_entry_delta
 
 router = APIRouter()
 router.include_router(journals.entries.routes.create_journal_entry_user_chat.router)
@@ -33,3 +34,4 @@ router.include_router(journals.entries.routes.regenerate_summary.router)
 router.include_router(journals.entries.routes.retry_system_response.router)
 router.include_router(journals.entries.routes.show_journal_entry_metadata.router)
 router.include_router(journals.entries.routes.sync_journal_entry.router)
+router.include_router(journals.entries.routes.sync_journal_entry_delta.router)
@@ -1,5 +1,4 @@
 from dataclasses import dataclass
-import gzip
 import io
 from pypika import Table, Query, Parameter, Order
 from pypika.queries import QueryBuilder
@@ -22,6 +21,10 @@ from lib.journals.data_to_client import (
     data_to_client,
     inspect_data_to_client,
 )
+from lib.journals.decrypt_items import (
+    EncryptedJournalEntryItem,
+    decrypt_journal_entry_items,
+)
 from lib.journals.journal_entry_item_data import (
     JournalEntryItemData,
     JournalEntryItemDataClient,
@@ -406,6 +409,8 @@ async def raw_read_journal_entries(
     )
 
     current_item: Optional[PendingJournalEntry] = None
+    to_decrypt: List[EncryptedJournalEntryItem] = []
+    to_decrypt_targets: List[Tuple[PendingJournalEntry, int]] = []
 
     for row in response.results or []:
         row_journal_entry_uid = cast(str, row[0])
@@ -450,26 +455,33 @@ async def raw_read_journal_entries(
                 master_keys_by_uid[row_user_journal_master_key_uid] = _row_master_key
                 row_master_key = _row_master_key
 
-            try:
-                decrypted_data = JournalEntryItemData.model_validate_json(
-                    gzip.decompress(
-                        row_master_key.journal_master_key.decrypt(
-                            row_journal_entry_item_master_encrypted_data, ttl=None
-                        )
-                    )
-                )
-                current_item.server_items.append(decrypted_data)
-            except Exception as e:
-                await handle_warning(
-                    f"{__name__}:failed_decrypt",
-                    f"failed to decrypt journal entry `{row_journal_entry_uid}`, entry counter `{row_journal_entry_item_counter}` for user `{client_key.user_sub}`",
-                    exc=e,
+            to_decrypt.append(
+                (
+                    row_master_key.journal_master_key,
+                    row_journal_entry_item_master_encrypted_data,
                 )
+            )
+            to_decrypt_targets.append((current_item, row_journal_entry_item_counter))
 
     if current_item is not None:
         pending_items.append(current_item)
         current_item = None
 
+    # decrypting is cpu-bound, so we defer it until we know every item and
+    # then do it off the event loop; results come back in entry_counter order
+    decrypted_items = await decrypt_journal_entry_items(to_decrypt)
+    for (target, entry_counter), decrypted_data in zip(
+        to_decrypt_targets, decrypted_items
+    ):
+        if isinstance(decrypted_data, Exception):
+            await handle_warning(
+                f"{__name__}:failed_decrypt",
+                f"failed to decrypt journal entry `{target.uid}`, entry counter `{entry_counter}` for user `{client_key.user_sub}`",
+                exc=decrypted_data,
+            )
+            continue
+        target.server_items.append(decrypted_data)
+
     inspect_result = DataToClientInspectResult(
         pro=False, journeys=set(), voice_notes=set()
     )
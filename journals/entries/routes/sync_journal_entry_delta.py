@@ -0,0 +1,417 @@
+import hashlib
+from dataclasses import dataclass
+from fastapi import APIRouter, Header, Response
+from typing import Annotated, Dict, List, Literal, Optional, cast
+from error_middleware import handle_warning
+from lib.journals.client_keys import get_journal_client_key
+from lib.journals.data_to_client import (
+    DataToClientContext,
+    DataToClientInspectResult,
+    bulk_prepare_data_to_client,
+    data_to_client,
+    inspect_data_to_client,
+)
+from lib.journals.decrypt_items import decrypt_journal_entry_items
+from lib.journals.journal_entry_item_data import JournalEntryItemDataClient
+from lib.journals.master_keys import (
+    GetJournalMasterKeyForEncryptionResultSuccess,
+    get_journal_master_key_from_s3,
+)
+from models import (
+    STANDARD_ERRORS_BY_CODE,
+    StandardErrorResponse,
+    AUTHORIZATION_UNKNOWN_TOKEN,
+)
+from pydantic import BaseModel, Field, validator
+import journals.entry_auth
+import auth as std_auth
+from itgs import Itgs
+from visitors.lib.get_or_create_visitor import VisitorSource
+
+
+router = APIRouter()
+
+
+class SyncJournalEntryDeltaRequest(BaseModel):
+    platform: VisitorSource = Field(description="The platform the client is on")
+    journal_entry_uid: str = Field(description="The UID of the journal entry to sync")
+    journal_entry_jwt: str = Field(
+        description="The JWT which provides access to the journal entry"
+    )
+    journal_client_key_uid: str = Field(
+        description="The journal client key to use as an additional layer of encryption for the response"
+    )
+    known_entry_counter: Optional[int] = Field(
+        None,
+        description=(
+            "The highest entry counter of the journal entry items the client already "
+            "has, or None if the client has none and wants the full conversation"
+        ),
+    )
+    known_content_hash: Optional[str] = Field(
+        None,
+        description=(
+            "The `content_hash` from the response that provided the items the client "
+            "already has. Required if `known_entry_counter` is set"
+        ),
+    )
+
+    @validator("known_content_hash", always=True)
+    def validate_known_content_hash(cls, v, values):
+        if (v is None) != (values.get("known_entry_counter") is None):
+            raise ValueError(
+                "known_content_hash must be set if and only if known_entry_counter is set"
+            )
+        return v
+
+
+class SyncJournalEntryDeltaResponsePayloadItem(BaseModel):
+    entry_counter: int = Field(
+        description="The canonical sort value for this item within the entry"
+    )
+    data: JournalEntryItemDataClient = Field(description="The item")
+
+
+class SyncJournalEntryDeltaResponsePayload(BaseModel):
+    full_resync_required: bool = Field(
+        description=(
+            "True if the items the client has are no longer accurate (e.g., an item "
+            "was edited, regenerated, or removed), in which case `items` is the entire "
+            "conversation and the client should discard what it has. False if `items` "
+            "only contains the items after `known_entry_counter`"
+        )
+    )
+    items: List[SyncJournalEntryDeltaResponsePayloadItem] = Field(
+        description="The items the client does not have, in ascending entry counter order"
+    )
+    entry_counter: Optional[int] = Field(
+        description=(
+            "The highest entry counter in the journal entry, or None if it has no items. "
+            "Use as `known_entry_counter` on the next sync"
+        )
+    )
+    content_hash: Optional[str] = Field(
+        description=(
+            "An opaque value identifying the current contents of the journal entry. "
+            "Use as `known_content_hash` on the next sync"
+        )
+    )
+
+
+class SyncJournalEntryDeltaResponse(BaseModel):
+    encrypted_payload: str = Field(
+        description="The delta encrypted with the journal client key. The decrypted contents are a json object in the form indicated by `payload`"
+    )
+    payload: Optional[SyncJournalEntryDeltaResponsePayload] = Field(
+        None,
+        description="Never set. Used to show what the contents of the encrypted payload are in the documentation",
+    )
+
+    @validator("payload", pre=True)
+    def validate_payload_is_none(cls, v):
+        if v is not None:
+            raise ValueError("The payload field must be None")
+        return v
+
+
+ERROR_404_TYPES = Literal["journal_entry_not_found", "key_unavailable"]
+ERROR_JOURNAL_ENTRY_NOT_FOUND_RESPONSE = Response(
+    content=StandardErrorResponse[ERROR_404_TYPES](
+        type="journal_entry_not_found",
+        message="The indicated journal entry was not found despite valid authorization. It was deleted.",
+    ).model_dump_json(),
+    headers={
+        "Content-Type": "application/json; charset=utf-8",
+    },
+    status_code=404,
+)
+ERROR_KEY_UNAVAILABLE_RESPONSE = Response(
+    content=StandardErrorResponse[ERROR_404_TYPES](
+        type="key_unavailable",
+        message="The indicated journal client key was not found or is not acceptable for this request. Generate a new one.",
+    ).model_dump_json(),
+    headers={
+        "Content-Type": "application/json; charset=utf-8",
+    },
+    status_code=404,
+)
+
+
+@router.post(
+    "/sync_delta",
+    response_model=SyncJournalEntryDeltaResponse,
+    responses={
+        **STANDARD_ERRORS_BY_CODE,
+        "404": {
+            "description": "Either the journal entry has been deleted or the client key needs to be regenerated",
+            "model": StandardErrorResponse[ERROR_404_TYPES],
+        },
+    },
+)
+async def sync_journal_entry_delta(
+    args: SyncJournalEntryDeltaRequest,
+    authorization: Annotated[Optional[str], Header()] = None,
+):
+    """Returns the items in the journal entry with the given uid that the client
+    does not already have, based on the highest entry counter it has and the
+    content hash it was given alongside those items. If the items the client has
+    are no longer accurate, returns the entire conversation and indicates that
+    the client should discard what it has.
+
+    Unlike `/sync`, this does not queue a job and only decrypts the items that
+    are returned, so it is much cheaper for re-opening a long journal entry that
+    the client has already seen. Items that a chat job has not finished writing
+    yet are picked up by the next sync.
+
+    Requires standard authorization for the same user who owns the journal entry
+    and the journal entry JWT was issued to.
+    """
+    async with Itgs() as itgs:
+        std_auth_result = await std_auth.auth_any(itgs, authorization)
+        if std_auth_result.result is None:
+            return std_auth_result.error_response
+
+        entry_auth_result = await journals.entry_auth.auth_any(
+            itgs, f"bearer {args.journal_entry_jwt}"
+        )
+        if entry_auth_result.result is None:
+            return entry_auth_result.error_response
+
+        if std_auth_result.result.sub != entry_auth_result.result.user_sub:
+            return AUTHORIZATION_UNKNOWN_TOKEN
+
+        if entry_auth_result.result.journal_entry_uid != args.journal_entry_uid:
+            return AUTHORIZATION_UNKNOWN_TOKEN
+
+        if (
+            entry_auth_result.result.journal_client_key_uid is not None
+            and entry_auth_result.result.journal_client_key_uid
+            != args.journal_client_key_uid
+        ):
+            return AUTHORIZATION_UNKNOWN_TOKEN
+
+        journal_client_key = await get_journal_client_key(
+            itgs,
+            user_sub=std_auth_result.result.sub,
+            journal_client_key_uid=args.journal_client_key_uid,
+            read_consistency="none",
+        )
+        if journal_client_key.type == "not_found":
+            journal_client_key = await get_journal_client_key(
+                itgs,
+                user_sub=std_auth_result.result.sub,
+                journal_client_key_uid=args.journal_client_key_uid,
+                read_consistency="weak",
+            )
+
+        if journal_client_key.type != "success":
+            await handle_warning(
+                f"{__name__}:client_key:{journal_client_key.type}",
+                f"User `{std_auth_result.result.sub}` tried to sync a journal entry with a journal client key that was not found or not acceptable for this request. The journal client key uid was `{args.journal_client_key_uid}`",
+            )
+            return ERROR_KEY_UNAVAILABLE_RESPONSE
+
+        if journal_client_key.platform != args.platform:
+            await handle_warning(
+                f"{__name__}:client_key:platform",
+                f"User `{std_auth_result.result.sub}` tried to sync a journal entry with "
+                f"client key `{args.journal_client_key_uid}`, which is for platform `{journal_client_key.platform}`, "
+                f"but they indicated they are on {args.platform}",
+            )
+            return ERROR_KEY_UNAVAILABLE_RESPONSE
+
+        rows = await _get_journal_entry_rows(
+            itgs,
+            journal_entry_uid=args.journal_entry_uid,
+            user_sub=std_auth_result.result.sub,
+        )
+        if rows is None:
+            return ERROR_JOURNAL_ENTRY_NOT_FOUND_RESPONSE
+
+        full_resync_required = True
+        rows_to_send = rows
+        if args.known_entry_counter is not None:
+            known_rows = [
+                r for r in rows if r.entry_counter <= args.known_entry_counter
+            ]
+            if (
+                known_rows
+                and known_rows[-1].entry_counter == args.known_entry_counter
+                and compute_content_hash(known_rows) == args.known_content_hash
+            ):
+                full_resync_required = False
+                rows_to_send = rows[len(known_rows) :]
+
+        master_keys_by_uid: Dict[str, GetJournalMasterKeyForEncryptionResultSuccess] = (
+            dict()
+        )
+        for row in rows_to_send:
+            if row.journal_master_key_uid in master_keys_by_uid:
+                continue
+            master_key = await get_journal_master_key_from_s3(
+                itgs,
+                user_journal_master_key_uid=row.journal_master_key_uid,
+                user_sub=std_auth_result.result.sub,
+                s3_key=row.journal_master_key_s3_key,
+            )
+            if master_key.type != "success":
+                await handle_warning(
+                    f"{__name__}:master_key:{master_key.type}",
+                    f"While syncing journal entry `{args.journal_entry_uid}` for user `{std_auth_result.result.sub}`, the master key `{row.journal_master_key_uid}` was unavailable",
+                )
+                return Response(status_code=503)
+            master_keys_by_uid[row.journal_master_key_uid] = master_key
+
+        decrypted_items = await decrypt_journal_entry_items(
+            [
+                (
+                    master_keys_by_uid[row.journal_master_key_uid].journal_master_key,
+                    row.master_encrypted_data,
+                )
+                for row in rows_to_send
+            ]
+        )
+        for row, decrypted in zip(rows_to_send, decrypted_items):
+            if isinstance(decrypted, Exception):
+                await handle_warning(
+                    f"{__name__}:failed_decrypt",
+                    f"failed to decrypt journal entry `{args.journal_entry_uid}`, entry counter `{row.entry_counter}` for user `{std_auth_result.result.sub}`",
+                    exc=decrypted,
+                )
+                return Response(status_code=503)
+
+        inspect_result = DataToClientInspectResult(
+            pro=False, journeys=set(), voice_notes=set()
+        )
+        for decrypted in decrypted_items:
+            assert not isinstance(decrypted, Exception)
+            inspect_data_to_client(decrypted, out=inspect_result)
+
+        ctx = DataToClientContext(
+            user_sub=std_auth_result.result.sub,
+            has_pro=None,
+            memory_cached_journeys=dict(),
+            memory_cached_voice_notes=dict(),
+        )
+        await bulk_prepare_data_to_client(itgs, ctx=ctx, inspect=inspect_result)
+
+        items: List[SyncJournalEntryDeltaResponsePayloadItem] = []
+        for row, decrypted in zip(rows_to_send, decrypted_items):
+            assert not isinstance(decrypted, Exception)
+            items.append(
+                SyncJournalEntryDeltaResponsePayloadItem(
+                    entry_counter=row.entry_counter,
+                    data=await data_to_client(itgs, ctx=ctx, item=decrypted),
+                )
+            )
+
+        payload = SyncJournalEntryDeltaResponsePayload(
+            full_resync_required=full_resync_required,
+            items=items,
+            entry_counter=rows[-1].entry_counter if rows else None,
+            content_hash=compute_content_hash(rows) if rows else None,
+        )
+        encrypted_payload = journal_client_key.journal_client_key.encrypt(
+            SyncJournalEntryDeltaResponsePayload.__pydantic_serializer__.to_json(
+                payload
+            )
+        ).decode("ascii")
+        return Response(
+            content=SyncJournalEntryDeltaResponse.__pydantic_serializer__.to_json(
+                SyncJournalEntryDeltaResponse(
+                    encrypted_payload=encrypted_payload, payload=None
+                )
+            ),
+            headers={
+                "Content-Type": "application/json; charset=utf-8",
+            },
+            status_code=200,
+        )
+
+
+@dataclass
+class JournalEntryItemRow:
+    uid: str
+    """The uid of the journal entry item"""
+    entry_counter: int
+    """The canonical sort value for the item within the entry"""
+    master_encrypted_data: str
+    """The item, encrypted with the journal master key"""
+    journal_master_key_uid: str
+    """The uid of the journal master key used to encrypt the item"""
+    journal_master_key_s3_key: str
+    """Where the journal master key is stored in s3"""
+
+
+def compute_content_hash(rows: List[JournalEntryItemRow]) -> str:
+    """Computes an opaque value which changes whenever any of the given rows
+    are added, removed, or rewritten. Since fernet tokens include a random iv,
+    every time an item is re-encrypted (which is the only way to change it) its
+    encrypted data changes, so we don't need to decrypt the items to detect
+    edits.
+    """
+    hasher = hashlib.sha256(b"v1")
+    for row in rows:
+        hasher.update(b"\0")
+        hasher.update(row.uid.encode("utf-8"))
+        hasher.update(b"\0")
+        hasher.update(row.entry_counter.to_bytes(8, "big", signed=False))
+        hasher.update(row.master_encrypted_data.encode("ascii"))
+    return hasher.hexdigest()
+
+
+async def _get_journal_entry_rows(
+    itgs: Itgs,
+    /,
+    *,
+    journal_entry_uid: str,
+    user_sub: str,
+) -> Optional[List[JournalEntryItemRow]]:
+    """Fetches the still-encrypted items within the journal entry with the
+    given uid, in ascending entry counter order, or None if the journal entry
+    does not exist or does not belong to the user with the given sub
+    """
+    conn = await itgs.conn()
+    cursor = conn.cursor("weak")
+    response = await cursor.executeunified3(
+        (
+            (
+                "SELECT 1 FROM users, journal_entries WHERE users.sub = ? AND journal_entries.uid = ? AND journal_entries.user_id = users.id",
+                (user_sub, journal_entry_uid),
+            ),
+            (
+                """
+SELECT
+    journal_entry_items.uid,
+    journal_entry_items.entry_counter,
+    journal_entry_items.master_encrypted_data,
+    user_journal_master_keys.uid,
+    s3_files.key
+FROM users, journal_entries, journal_entry_items, user_journal_master_keys, s3_files
+WHERE
+    users.sub = ?
+    AND users.id = journal_entries.user_id
+    AND journal_entries.uid = ?
+    AND journal_entry_items.journal_entry_id = journal_entries.id
+    AND user_journal_master_keys.user_id = users.id
+    AND user_journal_master_keys.id = journal_entry_items.user_journal_master_key_id
+    AND s3_files.id = user_journal_master_keys.s3_file_id
+ORDER BY journal_entry_items.entry_counter ASC
+                """,
+                (user_sub, journal_entry_uid),
+            ),
+        )
+    )
+    if not response[0].results:
+        return None
+
+    return [
+        JournalEntryItemRow(
+            uid=cast(str, row[0]),
+            entry_counter=cast(int, row[1]),
+            master_encrypted_data=cast(str, row[2]),
+            journal_master_key_uid=cast(str, row[3]),
+            journal_master_key_s3_key=cast(str, row[4]),
+        )
+        for row in response[1].results or []
+    ]
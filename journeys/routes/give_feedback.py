@@ -19,6 +19,7 @@ from redis_helpers.hincrby_if_exists import (
     hincrby_if_exists,
 )
 from redis_helpers.run_with_prep import run_with_prep
+from personalization.lib.user_profile import record_journey_feedback
 
 
 RatingType = Literal["loved", "liked", "disliked", "hated"]
@@ -231,6 +232,12 @@ async def give_feedback(
                 },
             )
 
+        await record_journey_feedback(
+            itgs,
+            user_sub=std_auth_result.result.sub,
+            journey_feedback_uid=feedback_uid,
+        )
+
         rating_is_unique = not bool(response[0].results[0])
         rating_type = feedback_version.rating_types[args.response - 1]
         await _update_cached_ratings(
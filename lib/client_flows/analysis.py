@@ -49,6 +49,9 @@ from redis_helpers.client_flow_graph_analysis_acquire_read_lock import (
 from redis_helpers.client_flow_graph_analysis_acquire_write_lock import (
     safe_client_flow_graph_analysis_acquire_write_lock,
 )
+from redis_helpers.client_flow_graph_analysis_evict_flow import (
+    safe_client_flow_graph_analysis_evict_flow,
+)
 from redis_helpers.client_flow_graph_analysis_read_paths_page import (
     safe_client_flow_graph_analysis_read_paths_page,
 )
@@ -152,12 +155,47 @@ class ClientFlowAnalysisEnvironment(BaseModel):
 
 async def evict(itgs: Itgs, /):
     """Evicts all cached analysis results from redis. This should be called wheneever
-    a client flow or client screen changes.
+    a client screen changes. For changes to a client flow, prefer `evict_flow`
     """
     redis = await itgs.redis()
     await redis.incr(b"client_flow_graph_analysis:version")
 
 
+async def evict_flow(
+    itgs: Itgs,
+    /,
+    *,
+    slug: str,
+    screens: Optional[List[ClientFlowScreen]],
+    rules: Optional[ClientFlowRules],
+) -> None:
+    """Evicts only the cached analysis results which may depend on the outgoing
+    edges of the client flow with the given slug, leaving the rest of the cache
+    intact. This should be called whenever a client flow is created, changed,
+    or deleted, with the flows screens and rules after the change (None if it
+    was deleted). When a flow is renamed, call this for both the old slug (as
+    if it were deleted) and the new slug.
+
+    Since edges only depend on the source flows screens and rules (plus the
+    client screens, for which `evict` must still be used), this is sufficient
+    to keep every graph consistent.
+    """
+    targets: Set[bytes] = set()
+    for rule in rules or []:
+        if rule.effect.type == "replace":
+            targets.add(rule.effect.slug.encode("utf-8"))
+    for screen in screens or []:
+        for allowed_slug in screen.allowed_triggers:
+            targets.add(allowed_slug.encode("utf-8"))
+
+    await safe_client_flow_graph_analysis_evict_flow(
+        itgs,
+        slug=slug.encode("utf-8"),
+        targets=sorted(targets),
+        now=int(time.time()),
+    )
+
+
 @dataclass
 class ClientFlowAnalysisLock:
     """Information about a client flow graph analysis lock."""
@@ -1048,7 +1086,7 @@ async def _transfer_adjacency_list_from_db(
         iter=(
             _no_paths()
             if flow is None
-            else _iterate_adjacent_flows(
+            else iterate_adjacent_flows(
                 itgs,
                 graph=lock.graph,
                 source_slug=source,
@@ -1346,7 +1384,7 @@ async def _iterate_extended_paths(
         yield target.encode("utf-8"), FlowDone(type="done")
 
 
-async def _iterate_adjacent_flows(
+async def iterate_adjacent_flows(
     itgs: Itgs,
     /,
     *,
@@ -1355,6 +1393,11 @@ async def _iterate_adjacent_flows(
     source_screens: List[ClientFlowScreen],
     source_rules: ClientFlowRules,
 ) -> AsyncIterator[Tuple[bytes, FlowPathOrDone]]:
+    """Iterates the edges out of the flow with the given slug, screens, and rules
+    in the given graph, as (target slug, path) pairs where each path consists of
+    exactly one node, followed by a FlowDone for that target after all its paths.
+    The same target may be yielded multiple times if there are multiple edges to it.
+    """
     predicate_params = graph.to_predicate_params()
     for rule_index, rule in enumerate(source_rules):
         if await check_flow_predicate(itgs, rule.condition, **predicate_params):
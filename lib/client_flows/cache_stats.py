@@ -0,0 +1,53 @@
+"""Hit rate tracking for the in-process client flow and client screen caches"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class CacheHitStats:
+    """How often lookups against a tiered cache were answered by each tier since
+    this instance started (or the stats were reset)
+    """
+
+    memory_hits: int = 0
+    """How many lookups were answered from the in-memory cache"""
+
+    memory_misses: int = 0
+    """How many lookups fell through the in-memory cache"""
+
+    disk_hits: int = 0
+    """How many lookups which fell through the in-memory cache were answered from
+    the disk cache
+    """
+
+    disk_misses: int = 0
+    """How many lookups fell through the disk cache and had to be filled"""
+
+    fills_joined: int = 0
+    """How many lookups which fell through the disk cache waited on a fill that
+    was already in progress on this instance rather than starting their own
+    """
+
+    @property
+    def memory_hit_rate(self) -> Optional[float]:
+        """The fraction of lookups answered from memory, or None if there were none"""
+        total = self.memory_hits + self.memory_misses
+        return self.memory_hits / total if total > 0 else None
+
+    @property
+    def disk_hit_rate(self) -> Optional[float]:
+        """The fraction of lookups that reached the disk cache which were answered
+        by it, or None if none reached it
+        """
+        total = self.disk_hits + self.disk_misses
+        return self.disk_hits / total if total > 0 else None
+
+    def copy(self) -> "CacheHitStats":
+        return CacheHitStats(
+            memory_hits=self.memory_hits,
+            memory_misses=self.memory_misses,
+            disk_hits=self.disk_hits,
+            disk_misses=self.disk_misses,
+            fills_joined=self.fills_joined,
+        )
@@ -1,12 +1,24 @@
+from enum import IntFlag, auto
 from pydantic import BaseModel, Field
-from typing import Dict, Generic, Optional, TypeVar, cast
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Generic,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    cast,
+)
 from typing_extensions import TypedDict
 from itgs import Itgs
 from lib.opt_in_groups import check_if_user_in_opt_in_group
 from lib.sticky_random_groups import check_if_user_in_sticky_random_group
 from resources.filter_item import FilterItemModel
 import random
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import pytz
 
 import unix_dates
@@ -91,6 +103,8 @@ class CheckFlowPredicateContext:
     journeys_today: Optional[Wrapped[int]] = None
     journal_entries_in_history_today: Optional[Wrapped[int]] = None
     has_recoverable_identity: Optional[Wrapped[bool]] = None
+    sticky_random_groups: Dict[str, bool] = field(default_factory=dict)
+    opt_in_groups: Dict[str, bool] = field(default_factory=dict)
 
 
 class ClientFlowPredicateParams(TypedDict):
@@ -288,6 +302,9 @@ async def _get_journeys_today(
     itgs: Itgs, /, *, user_sub: str, now: int, ctx: CheckFlowPredicateContext
 ) -> int:
     """Determines the number of journeys the user has taken today"""
+    if ctx.journeys_today is not None:
+        return ctx.journeys_today.value
+
     user_tz = await _get_user_tz(itgs, user_sub=user_sub, ctx=ctx)
     user_unix_date_today = unix_dates.unix_timestamp_to_unix_date(now, tz=user_tz)
 
@@ -376,3 +393,316 @@ async def _get_user_tz(
     if ctx.user_tz is None:
         ctx.user_tz = Wrapped(await get_user_timezone(itgs, user_sub=user_sub))
     return ctx.user_tz.value
+
+
+class FlowPredicateFact(IntFlag):
+    """The facts about the user which a predicate may need beyond those which
+    are always available (version, queued at, account created at, and now).
+    Each of these is fetched on demand when evaluating a compiled predicate.
+    """
+
+    RANDOM_FLOAT = auto()
+    STICKY_RANDOM_GROUPS = auto()
+    OPT_IN_GROUPS = auto()
+    LAST_JOURNEY_RATING = auto()
+    JOURNEYS_TODAY = auto()
+    JOURNAL_ENTRIES_IN_HISTORY_TODAY = auto()
+    HAS_RECOVERABLE_IDENTITY = auto()
+
+
+@dataclass
+class FlowPredicateFacts:
+    """The flat context that compiled predicates are evaluated against. The
+    first four fields are always set; the remainder are only meaningful once
+    the corresponding `FlowPredicateFact` has been fetched
+    """
+
+    version: Optional[int]
+    queued_at: int
+    account_created_at: int
+    now: int
+    random_float: float = 0.0
+    sticky_random_groups: Dict[str, bool] = field(default_factory=dict)
+    opt_in_groups: Dict[str, bool] = field(default_factory=dict)
+    last_journey_rating: Optional[int] = None
+    journeys_today: int = 0
+    journal_entries_in_history_today: int = 0
+    has_recoverable_identity: bool = False
+
+
+FactCheck = Callable[[FlowPredicateFacts], bool]
+
+
+@dataclass(frozen=True)
+class CompiledFlowPredicateStep:
+    """A single check within a compiled predicate which requires fetching a fact"""
+
+    fact: FlowPredicateFact
+    """The fact that must be fetched before running the check"""
+
+    group_name: Optional[str]
+    """For sticky random groups or opt-in groups, the name of the group"""
+
+    check: FactCheck
+    """Checks the fact once it's been fetched"""
+
+
+@dataclass(frozen=True)
+class CompiledFlowPredicateClause:
+    """A compiled `ClientFlowPredicate` excluding its `or_predicate`"""
+
+    check_base: Optional[FactCheck]
+    """Checks the parts of the predicate which only use the always-available
+    facts, or None if there are no such parts
+    """
+
+    steps: Tuple[CompiledFlowPredicateStep, ...]
+    """The checks which require fetching additional facts, in the order they
+    should be fetched. Only reached if `check_base` passes, and short-circuits
+    """
+
+
+@dataclass(frozen=True)
+class CompiledFlowPredicate:
+    """A `ClientFlowPredicate` compiled into plain callables via
+    `compile_flow_predicate`. Equivalent to the original predicate when
+    evaluated with `check_compiled_flow_predicate`, but without walking the
+    model or re-dispatching on operators.
+    """
+
+    clauses: Tuple[CompiledFlowPredicateClause, ...]
+    """The predicate followed by each nested or_predicate; satisfied if any is"""
+
+    requires: FlowPredicateFact
+    """Every fact that may need to be fetched to evaluate this predicate"""
+
+    sticky_random_groups: FrozenSet[str]
+    """The names of the sticky random groups that may need to be checked"""
+
+    opt_in_groups: FrozenSet[str]
+    """The names of the opt-in groups that may need to be checked"""
+
+
+def _all_of(checks: List[FactCheck]) -> Optional[FactCheck]:
+    if not checks:
+        return None
+    if len(checks) == 1:
+        return checks[0]
+
+    checks_tuple = tuple(checks)
+
+    def _check(facts: FlowPredicateFacts) -> bool:
+        for check in checks_tuple:
+            if not check(facts):
+                return False
+        return True
+
+    return _check
+
+
+def _compile_clause(rule: ClientFlowPredicate) -> CompiledFlowPredicateClause:
+    base: List[FactCheck] = []
+    if rule.version is not None:
+        version_check = rule.version.to_result().compile_constant_check()
+        base.append(lambda f: version_check(f.version))
+    if rule.time_in_queue is not None:
+        time_in_queue_check = rule.time_in_queue.to_result().compile_constant_check()
+        base.append(lambda f: time_in_queue_check(f.now - f.queued_at))
+    if rule.queued_at is not None:
+        queued_at_check = rule.queued_at.to_result().compile_constant_check()
+        base.append(lambda f: queued_at_check(f.queued_at))
+    if rule.account_age is not None:
+        account_age_check = rule.account_age.to_result().compile_constant_check()
+        base.append(lambda f: account_age_check(f.now - f.account_created_at))
+    if rule.account_created_at is not None:
+        account_created_at_check = (
+            rule.account_created_at.to_result().compile_constant_check()
+        )
+        base.append(lambda f: account_created_at_check(f.account_created_at))
+
+    steps: List[CompiledFlowPredicateStep] = []
+
+    def _step(
+        fact: FlowPredicateFact,
+        check: Callable[[Any], bool],
+        get: Callable[[FlowPredicateFacts], Any],
+        group_name: Optional[str] = None,
+    ) -> None:
+        steps.append(
+            CompiledFlowPredicateStep(
+                fact=fact, group_name=group_name, check=lambda f: check(get(f))
+            )
+        )
+
+    if rule.sticky_random_groups is not None:
+        for group_name, filter_item in rule.sticky_random_groups.items():
+            _step(
+                FlowPredicateFact.STICKY_RANDOM_GROUPS,
+                filter_item.to_result().compile_constant_check(),
+                lambda f, name=group_name: int(f.sticky_random_groups[name]),
+                group_name,
+            )
+    if rule.opt_in_groups is not None:
+        for group_name, filter_item in rule.opt_in_groups.items():
+            _step(
+                FlowPredicateFact.OPT_IN_GROUPS,
+                filter_item.to_result().compile_constant_check(),
+                lambda f, name=group_name: int(f.opt_in_groups[name]),
+                group_name,
+            )
+    if rule.random_float is not None:
+        _step(
+            FlowPredicateFact.RANDOM_FLOAT,
+            rule.random_float.to_result().compile_constant_check(),
+            lambda f: f.random_float,
+        )
+    if rule.last_journey_rating is not None:
+        _step(
+            FlowPredicateFact.LAST_JOURNEY_RATING,
+            rule.last_journey_rating.to_result().compile_constant_check(),
+            lambda f: f.last_journey_rating,
+        )
+    if rule.journeys_today is not None:
+        _step(
+            FlowPredicateFact.JOURNEYS_TODAY,
+            rule.journeys_today.to_result().compile_constant_check(),
+            lambda f: f.journeys_today,
+        )
+    if rule.journal_entries_in_history_today is not None:
+        _step(
+            FlowPredicateFact.JOURNAL_ENTRIES_IN_HISTORY_TODAY,
+            rule.journal_entries_in_history_today.to_result().compile_constant_check(),
+            lambda f: f.journal_entries_in_history_today,
+        )
+    if rule.has_recoverable_identity is not None:
+        _step(
+            FlowPredicateFact.HAS_RECOVERABLE_IDENTITY,
+            rule.has_recoverable_identity.to_result().compile_constant_check(),
+            lambda f: f.has_recoverable_identity,
+        )
+
+    return CompiledFlowPredicateClause(check_base=_all_of(base), steps=tuple(steps))
+
+
+def compile_flow_predicate(rule: ClientFlowPredicate) -> CompiledFlowPredicate:
+    """Compiles the given predicate into plain callables, precomputing which
+    facts it may need. The result is immutable and can be cached alongside the
+    flow it came from.
+    """
+    clauses: List[CompiledFlowPredicateClause] = []
+    current: Optional[ClientFlowPredicate] = rule
+    while current is not None:
+        clauses.append(_compile_clause(current))
+        current = current.or_predicate
+
+    requires = FlowPredicateFact(0)
+    sticky_random_groups = set()
+    opt_in_groups = set()
+    for clause in clauses:
+        for step in clause.steps:
+            requires |= step.fact
+            if step.fact == FlowPredicateFact.STICKY_RANDOM_GROUPS:
+                sticky_random_groups.add(cast(str, step.group_name))
+            elif step.fact == FlowPredicateFact.OPT_IN_GROUPS:
+                opt_in_groups.add(cast(str, step.group_name))
+
+    return CompiledFlowPredicate(
+        clauses=tuple(clauses),
+        requires=requires,
+        sticky_random_groups=frozenset(sticky_random_groups),
+        opt_in_groups=frozenset(opt_in_groups),
+    )
+
+
+async def check_compiled_flow_predicate(
+    itgs: Itgs,
+    predicate: CompiledFlowPredicate,
+    facts: FlowPredicateFacts,
+    /,
+    *,
+    user_sub: str,
+    ctx: CheckFlowPredicateContext,
+) -> bool:
+    """Equivalent to `check_flow_predicate` for the predicate that was compiled,
+    where the always-available parameters are in `facts`. Facts which are not
+    always available are only fetched when a clause reaches a check that needs
+    them, and are stored in both `facts` and `ctx` for reuse.
+    """
+    for clause in predicate.clauses:
+        if clause.check_base is not None and not clause.check_base(facts):
+            continue
+
+        for step in clause.steps:
+            await _fetch_fact(
+                itgs,
+                step.fact,
+                facts,
+                group_name=step.group_name,
+                user_sub=user_sub,
+                ctx=ctx,
+            )
+            if not step.check(facts):
+                break
+        else:
+            return True
+
+    return False
+
+
+async def _fetch_fact(
+    itgs: Itgs,
+    fact: FlowPredicateFact,
+    facts: FlowPredicateFacts,
+    /,
+    *,
+    group_name: Optional[str],
+    user_sub: str,
+    ctx: CheckFlowPredicateContext,
+) -> None:
+    """Stores the given fact in `facts`, fetching it if it's not already in `ctx`"""
+    if fact == FlowPredicateFact.RANDOM_FLOAT:
+        facts.random_float = random.random()
+    elif fact == FlowPredicateFact.STICKY_RANDOM_GROUPS:
+        assert group_name is not None
+        in_group = ctx.sticky_random_groups.get(group_name)
+        if in_group is None:
+            in_group = await check_if_user_in_sticky_random_group(
+                itgs,
+                user_sub=user_sub,
+                group_name=group_name,
+                create_if_not_exists=True,
+            )
+            ctx.sticky_random_groups[group_name] = in_group
+        facts.sticky_random_groups[group_name] = in_group
+    elif fact == FlowPredicateFact.OPT_IN_GROUPS:
+        assert group_name is not None
+        in_group = ctx.opt_in_groups.get(group_name)
+        if in_group is None:
+            in_group = await check_if_user_in_opt_in_group(
+                itgs,
+                user_sub=user_sub,
+                group_name=group_name,
+                create_if_not_exists=True,
+            )
+            ctx.opt_in_groups[group_name] = in_group
+        facts.opt_in_groups[group_name] = in_group
+    elif fact == FlowPredicateFact.LAST_JOURNEY_RATING:
+        facts.last_journey_rating = await _get_last_journey_rating(
+            itgs, user_sub=user_sub, ctx=ctx
+        )
+    elif fact == FlowPredicateFact.JOURNEYS_TODAY:
+        facts.journeys_today = await _get_journeys_today(
+            itgs, user_sub=user_sub, now=facts.now, ctx=ctx
+        )
+    elif fact == FlowPredicateFact.JOURNAL_ENTRIES_IN_HISTORY_TODAY:
+        facts.journal_entries_in_history_today = (
+            await _get_journal_entries_in_history_today(
+                itgs, user_sub=user_sub, now=facts.now, ctx=ctx
+            )
+        )
+    elif fact == FlowPredicateFact.HAS_RECOVERABLE_IDENTITY:
+        facts.has_recoverable_identity = await _get_has_recoverable_identity(
+            itgs, user_sub=user_sub, ctx=ctx
+        )
+    else:
+        raise ValueError(f"Unknown fact: {fact}")
@@ -1,7 +1,12 @@
+from dataclasses import dataclass
 from pydantic import BaseModel, Field, TypeAdapter
 from typing import Literal, Union, List, cast
 
-from lib.client_flows.client_flow_predicate import ClientFlowPredicate
+from lib.client_flows.client_flow_predicate import (
+    ClientFlowPredicate,
+    CompiledFlowPredicate,
+    compile_flow_predicate,
+)
 
 
 class ClientFlowEffectReplaceParametersCopy(BaseModel):
@@ -57,3 +62,24 @@ ClientFlowRules = List[ClientFlowRule]
 client_flow_rules_adapter = cast(
     TypeAdapter[ClientFlowRules], TypeAdapter(ClientFlowRules)
 )
+
+
+@dataclass(frozen=True)
+class CompiledClientFlowRule:
+    """A client flow rule whose condition has been compiled"""
+
+    rule: ClientFlowRule
+    """The original rule, for its effect and for debugging"""
+
+    condition: CompiledFlowPredicate
+    """The compiled condition"""
+
+
+def compile_client_flow_rules(rules: ClientFlowRules) -> List[CompiledClientFlowRule]:
+    """Compiles the conditions of the given rules, preserving their order"""
+    return [
+        CompiledClientFlowRule(
+            rule=rule, condition=compile_flow_predicate(rule.condition)
+        )
+        for rule in rules
+    ]
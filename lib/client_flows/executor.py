@@ -11,6 +11,12 @@ from itgs import Itgs
 from lib.client_flows.client_flow_screen import ClientFlowScreen
 from lib.client_flows.client_flow_source import ClientFlowSource
 from lib.client_flows.client_screen_stats_preparer import ClientScreenStatsPreparer
+from lib.client_flows.queue_head_cache import (
+    ClientScreenQueueHead,
+    evict_client_screen_queue_head,
+    read_client_screen_queue_head,
+    write_client_screen_queue_head,
+)
 from lib.client_flows.screen_cache import get_client_screen
 from lib.client_flows.simulator import (
     ClientFlowSimulatorClientInfo,
@@ -39,6 +45,11 @@ in the peek/pop response body
 @dataclass
 class TryAndStoreSimulationResultSuccess:
     type: Literal["success"]
+    queue_head_version: Optional[int]
+    """If we wrote to the users queue, the version of their cached queue head
+    after it was evicted in preparation for the write, which can be used to
+    write back the new queue head. None if there were no mutations to store.
+    """
 
 
 @dataclass
@@ -73,14 +84,21 @@ async def try_and_store_simulation_result(
     Otherwise, when the clients screen queue has been modified, this does nothing and returns
     False.
 
+    Evicts the users cached queue head before writing; see `queue_head_cache`
+
     Args:
         itgs (Itgs): the integrations to (re)use
         client_info (ClientFlowSimulatorClientInfo): the client info for the simulation
         state (ClientFlowSimulatorState): the state of the simulation
     """
     if not state.mutations:
-        return TryAndStoreSimulationResultSuccess(type="success")
+        return TryAndStoreSimulationResultSuccess(
+            type="success", queue_head_version=None
+        )
 
+    queue_head_version = await evict_client_screen_queue_head(
+        itgs, user_sub=client_info.user_sub
+    )
     executed_at = time.time()
 
     conn = await itgs.conn()
@@ -249,7 +267,9 @@ async def try_and_store_simulation_result(
 
     response = await cursor.executemany3(queries)
     if response[0].rows_affected is not None and response[0].rows_affected > 0:
-        return TryAndStoreSimulationResultSuccess(type="success")
+        return TryAndStoreSimulationResultSuccess(
+            type="success", queue_head_version=queue_head_version
+        )
 
     updated_front_response = response[-2]
     updated_front: List[ClientFlowSimulatorScreen] = []
@@ -796,6 +816,10 @@ async def execute_peek(
     then performs any automatic triggers as a result of the front of the queue
     being peeked by the given platform, then returns the state that the client
     needs to display the front of their queue.
+
+    The front of the queue is read from the users cached queue head when
+    available (see `queue_head_cache`), so that a peek which doesn't change the
+    queue doesn't need the database at all.
     """
     client_info = ClientFlowSimulatorClientInfo(
         user_sub=user_sub, platform=platform, version=version, user_created_at=-1
@@ -807,12 +831,28 @@ async def execute_peek(
             raise Exception("Too many races")
         read_consistency = initial_read_consistency if num_races == 0 else "weak"
 
-        prepared_peek = await try_and_prepare_peek(
-            itgs,
-            client_info=client_info,
-            expecting_bad_screens=expecting_bad_screens,
-            read_consistency=read_consistency,
+        cached = await read_client_screen_queue_head(itgs, user_sub=user_sub)
+        cached_head = (
+            cached.head if num_races == 0 and not expecting_bad_screens else None
         )
+        if cached_head is not None:
+            prepared_peek: TryAndPreparePeekResult = TryAndPreparePeekResultSuccess(
+                type="success",
+                user_created_at=cached_head.user_created_at,
+                state=init_simulator_from_peek(front=cached_head.front),
+            )
+        else:
+            if read_consistency == "none":
+                # the queue head will be written back to the cache, which
+                # requires a read that sees every completed write
+                read_consistency = "weak"
+
+            prepared_peek = await try_and_prepare_peek(
+                itgs,
+                client_info=client_info,
+                expecting_bad_screens=expecting_bad_screens,
+                read_consistency=read_consistency,
+            )
         if prepared_peek.type == "user_not_found":
             raise ValueError(f"User not found: {user_sub}")
 
@@ -823,7 +863,8 @@ async def execute_peek(
             continue
 
         assert prepared_peek.type == "success"
-        client_info.user_created_at = int(prepared_peek.user_created_at)
+        user_created_at = prepared_peek.user_created_at
+        client_info.user_created_at = int(user_created_at)
 
         for _ in range(5):
             if trigger is not None:
@@ -853,9 +894,10 @@ async def execute_peek(
 
             num_races += 1
             read_consistency = "weak"
+            cached_head = None
             prepared_peek = TryAndPreparePeekResultSuccess(
                 type="success",
-                user_created_at=client_info.user_created_at,
+                user_created_at=user_created_at,
                 state=init_simulator_from_peek(
                     front=store_result.first,
                 ),
@@ -880,6 +922,12 @@ async def execute_peek(
         await prepared_peek.state.stats.store(itgs)
         trigger = None  # don't repeat trigger if prefetching fails
 
+        if cached_head is not None and store_result.queue_head_version is None:
+            return ClientScreenQueuePeekInfo(
+                front=prepared_peek.state.current,
+                prefetch=cached_head.prefetch,
+            )
+
         prefetch = get_prefetch_screens_from_state(prepared_peek.state)
         if prefetch is None:
             prefetch = await get_prefetch_screens(
@@ -898,6 +946,25 @@ async def execute_peek(
 
             assert prefetch.type == "success"
 
+        if store_result.queue_head_version is not None or (
+            cached_head is None and read_consistency != "none"
+        ):
+            await write_client_screen_queue_head(
+                itgs,
+                user_sub=user_sub,
+                expected_version=(
+                    store_result.queue_head_version
+                    if store_result.queue_head_version is not None
+                    else cached.version
+                ),
+                head=ClientScreenQueueHead(
+                    user_created_at=user_created_at,
+                    front=prepared_peek.state.current,
+                    prefetch=prefetch.prefetch,
+                ),
+                evict_on_mismatch=store_result.queue_head_version is not None,
+            )
+
         return ClientScreenQueuePeekInfo(
             front=prepared_peek.state.current,
             prefetch=prefetch.prefetch,
@@ -1151,6 +1218,19 @@ async def execute_pop(
 
             assert prefetch.type == "success"
 
+        if store_result.queue_head_version is not None:
+            await write_client_screen_queue_head(
+                itgs,
+                user_sub=user_sub,
+                expected_version=store_result.queue_head_version,
+                head=ClientScreenQueueHead(
+                    user_created_at=prepared_pop.user_created_at,
+                    front=prepared_pop.state.current,
+                    prefetch=prefetch.prefetch,
+                ),
+                evict_on_mismatch=True,
+            )
+
         return ClientScreenQueuePeekInfo(
             front=prepared_pop.state.current,
             prefetch=prefetch.prefetch,
@@ -3,21 +3,84 @@ time spent parsing schemas.
 """
 
 import asyncio
-from dataclasses import dataclass
+import dataclasses
+from dataclasses import dataclass, field
 import io
 import json
+import secrets
+import time
 from openapi_schema_validator import OAS30Validator
-from typing import Dict, List, Optional, Set, cast
+from typing import Dict, List, Literal, Optional, Set, Tuple, cast
 import jsonschema.protocols
 
 from client_flows.lib.parse_flow_screens import decode_flow_screens, encode_flow_screens
 from error_middleware import handle_error
 from itgs import Itgs
-from lib.client_flows.client_flow_rule import ClientFlowRules, client_flow_rules_adapter
+from lib.client_flows.cache_stats import CacheHitStats
+from lib.client_flows.client_flow_predicate import (
+    CompiledFlowPredicate,
+    FlowPredicateFact,
+    compile_flow_predicate,
+)
+from lib.client_flows.client_flow_rule import (
+    ClientFlowRules,
+    CompiledClientFlowRule,
+    client_flow_rules_adapter,
+    compile_client_flow_rules,
+)
 from lib.client_flows.client_flow_screen import ClientFlowScreen
 from lib.client_flows.flow_flags import ClientFlowFlag
 from lifespan import lifespan_handler
 import perpetual_pub_sub as pps
+from redis_helpers.del_if_match import del_if_match, ensure_del_if_match_script_exists
+from redis_helpers.run_with_prep import run_with_prep
+
+
+@dataclass
+class CompiledClientFlow:
+    """The predicates of a client flow, compiled once when the flow is loaded so
+    that triggering it doesn't need to walk the predicate models
+    """
+
+    rules: List[CompiledClientFlowRule]
+    """The compiled rules, in the same order as the flows rules"""
+
+    screen_triggers: List[Optional[CompiledFlowPredicate]]
+    """For each screen in the flow, in order, the compiled trigger predicate for
+    that screen, or None if it doesn't have one
+    """
+
+    requires: FlowPredicateFact
+    """Every fact beyond the always-available ones that may need to be fetched
+    to check the rules or screen triggers; empty if triggering this flow never
+    needs to fetch anything for its predicates
+    """
+
+
+def compile_client_flow(
+    rules: ClientFlowRules, screens: List[ClientFlowScreen]
+) -> CompiledClientFlow:
+    """Compiles the predicates within the given client flow rules and screens"""
+    compiled_rules = compile_client_flow_rules(rules)
+    screen_triggers = [
+        (
+            compile_flow_predicate(screen.rules.trigger)
+            if screen.rules.trigger is not None
+            else None
+        )
+        for screen in screens
+    ]
+
+    requires = FlowPredicateFact(0)
+    for rule in compiled_rules:
+        requires |= rule.condition.requires
+    for trigger in screen_triggers:
+        if trigger is not None:
+            requires |= trigger.requires
+
+    return CompiledClientFlow(
+        rules=compiled_rules, screen_triggers=screen_triggers, requires=requires
+    )
 
 
 @dataclass
@@ -62,6 +125,14 @@ class ClientFlow:
     rules: ClientFlowRules
     """The rules that should be checked at trigger time for this client flow"""
 
+    compiled: CompiledClientFlow = field(init=False, repr=False, compare=False)
+    """The rules and screen trigger predicates compiled into plain callables;
+    computed from `rules` and `screens` when the flow is constructed
+    """
+
+    def __post_init__(self) -> None:
+        self.compiled = compile_client_flow(self.rules, self.screens)
+
 
 valid_client_flows: Optional[Set[str]] = None
 memory_cache_size = 200
@@ -70,6 +141,21 @@ memory_cache_size = 200
 old_cache: Dict[str, ClientFlow] = {}
 latest_cache: Dict[str, ClientFlow] = {}
 
+stats = CacheHitStats()
+"""How often lookups via `get_client_flow` were answered by each cache tier"""
+
+FILL_LOCK_SECONDS = 3
+"""How long the fleet-wide lock on filling a client flow is held at most, which
+is also how long we will wait on another instance to fill it before falling back
+to the database ourselves
+"""
+
+# (slug, minimal) -> the fill in progress on this instance
+pending_fills: Dict[Tuple[str, bool], asyncio.Task] = {}
+
+# slug -> events to set when another instance fills or purges that slug
+waiting_for_fill: Dict[str, List[asyncio.Event]] = {}
+
 
 async def get_client_flow(
     itgs: Itgs, /, *, slug: str, minimal: bool = True
@@ -77,6 +163,11 @@ async def get_client_flow(
     """Fetches the client flow with the given slug from the nearest cache,
     filling any caches that were missed along the way.
 
+    Concurrent misses for the same slug on this instance share a single fill,
+    and only one instance at a time fills a given slug from the database (the
+    others wait for it to broadcast the result), so a purge doesn't cause a
+    spike of identical queries.
+
     Args:
         itgs (Itgs): the integrations to (re)use
         slug (str): the slug of the client flow to fetch
@@ -88,33 +179,131 @@ async def get_client_flow(
     if minimal:
         in_memory = read_client_flow_from_in_memory(slug)
         if in_memory is not None:
+            stats.memory_hits += 1
             return in_memory
+        stats.memory_misses += 1
 
     on_disk = await read_client_flow_from_disk(itgs, slug=slug, minimal=minimal)
     if on_disk is not None:
+        stats.disk_hits += 1
         parsed = convert_from_raw(on_disk)
         write_client_flow_to_in_memory(parsed)
         return parsed
+    stats.disk_misses += 1
+
+    key = (slug, minimal)
+    fill = pending_fills.get(key)
+    if fill is None:
+        fill = asyncio.create_task(_fill_client_flow(slug=slug, minimal=minimal))
+        pending_fills[key] = fill
+        fill.add_done_callback(
+            lambda task: (
+                pending_fills.pop(key, None) if pending_fills.get(key) is task else None
+            )
+        )
+    else:
+        stats.fills_joined += 1
 
+    return await asyncio.shield(fill)
+
+
+def get_client_flow_cache_stats() -> CacheHitStats:
+    """Returns a copy of the hit statistics for the client flow cache on this instance"""
+    return stats.copy()
+
+
+async def _fill_client_flow(*, slug: str, minimal: bool) -> Optional[ClientFlow]:
+    """Fills the client flow with the given slug after it was missed in both the
+    memory and disk caches, returning the result. If another instance is already
+    filling it, waits for that instance to broadcast the result instead of
+    hitting the database.
+
+    The fill is shared by every caller that missed while it was in progress, so
+    it uses its own integrations rather than borrowing those of whichever caller
+    happened to start it, which may be closed before the fill completes.
+    """
+    async with Itgs() as itgs:
+        return await _fill_client_flow_with_itgs(itgs, slug=slug, minimal=minimal)
+
+
+async def _fill_client_flow_with_itgs(
+    itgs: Itgs, /, *, slug: str, minimal: bool
+) -> Optional[ClientFlow]:
     valid = await get_valid_client_flow_slugs(itgs)
     if slug not in valid:
         return None
 
-    in_db = await read_full_client_flow_from_db(itgs, slug=slug)
-    if in_db is None:
-        await purge_valid_client_flows_cache(itgs)
-        return None
+    redis = await itgs.redis()
+    lock_key = _fill_lock_key(slug)
+    lock_id = secrets.token_urlsafe(16).encode("utf-8")
+
+    got_fill_event = asyncio.Event()
+    events = waiting_for_fill.get(slug)
+    if events is None:
+        events = []
+        waiting_for_fill[slug] = events
+    events.append(got_fill_event)
+
+    try:
+        got_lock = await redis.set(lock_key, lock_id, nx=True, ex=FILL_LOCK_SECONDS)
+        if not got_lock:
+            try:
+                await asyncio.wait_for(got_fill_event.wait(), timeout=FILL_LOCK_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        events.remove(got_fill_event)
+        if not events and waiting_for_fill.get(slug) is events:
+            del waiting_for_fill[slug]
+
+    if not got_lock:
+        on_disk = await read_client_flow_from_disk(itgs, slug=slug, minimal=minimal)
+        if on_disk is not None:
+            parsed = convert_from_raw(on_disk)
+            write_client_flow_to_in_memory(parsed)
+            return parsed
+        # the other instance failed, timed out, or found it was deleted; we
+        # will fall back to the database
+
+    try:
+        in_db = await read_full_client_flow_from_db(itgs, slug=slug)
+        if in_db is None:
+            await purge_valid_client_flows_cache(itgs)
+            if got_lock:
+                await publish_client_flow_delete(itgs, slug=slug)
+            return None
 
-    if not minimal:
         full_raw = convert_to_raw(in_db)
+        minimal_flow = get_minimal_copy(in_db)
+        minimal_raw = convert_to_raw(minimal_flow)
+
+        write_client_flow_to_in_memory(minimal_flow)
+        await write_client_flow_to_disk(itgs, slug=slug, minimal=True, raw=minimal_raw)
         await write_client_flow_to_disk(itgs, slug=slug, minimal=False, raw=full_raw)
-        return in_db
+        if got_lock:
+            await publish_client_flow_fill(
+                itgs, slug=slug, minimal_raw=minimal_raw, full_raw=full_raw
+            )
+        return minimal_flow if minimal else in_db
+    finally:
+        if got_lock:
+            await _release_fill_lock(itgs, lock_key=lock_key, lock_id=lock_id)
 
-    edit_flow_to_minimal_info(in_db)
-    write_client_flow_to_in_memory(in_db)
-    raw = convert_to_raw(in_db)
-    await write_client_flow_to_disk(itgs, slug=slug, raw=raw, minimal=True)
-    return in_db
+
+def _fill_lock_key(slug: str) -> bytes:
+    return f"client_flows:fill_lock:{slug}".encode("utf-8")
+
+
+async def _release_fill_lock(itgs: Itgs, /, *, lock_key: bytes, lock_id: bytes) -> None:
+    """Releases the fill lock with the given key if it's still held with the
+    given id. If the lock expired during a slow fill it may have since been
+    acquired by another filler, whose lock must not be released.
+    """
+    redis = await itgs.redis()
+    await run_with_prep(
+        lambda force: ensure_del_if_match_script_exists(redis, force=force),
+        lambda: del_if_match(redis, lock_key, lock_id),
+    )
 
 
 async def get_valid_client_flow_slugs(itgs: Itgs, /) -> Set[str]:
@@ -157,12 +346,55 @@ async def get_valid_client_flow_slugs(itgs: Itgs, /) -> Set[str]:
 async def purge_client_flow_cache(itgs: Itgs, /, *, slug: str) -> None:
     """Purges any cached client flows with the given slug, everywhere.
     Typically, if you are doing this, you also want to call
-    lib.client_flows.analysis#evict to clear the analysis cache,
+    lib.client_flows.analysis#evict_flow to clear the analysis cache,
     and you may want to call #purge_valid_client_flows_cache
+
+    If the flow still exists, prefer `refresh_client_flow_cache`
     """
     await publish_client_flow_delete(itgs, slug=slug)
 
 
+async def refresh_client_flow_cache(itgs: Itgs, /, *, slug: str) -> None:
+    """Replaces any cached client flows with the given slug, everywhere, with
+    the current version from the database. Unlike purging, the flow is fetched
+    and broadcast once and every instance parses it as soon as it's received,
+    so that triggers right after a change don't all miss the cache.
+
+    Holds the fleet-wide fill lock for the slug while reading and broadcasting,
+    so that a concurrent fill which read an older version cannot broadcast it
+    after us. If the lock cannot be acquired in time, this purges instead.
+    """
+    redis = await itgs.redis()
+    lock_key = _fill_lock_key(slug)
+    lock_id = secrets.token_urlsafe(16).encode("utf-8")
+    deadline = time.time() + FILL_LOCK_SECONDS
+    got_lock = await redis.set(lock_key, lock_id, nx=True, ex=FILL_LOCK_SECONDS)
+    while not got_lock and time.time() < deadline:
+        await asyncio.sleep(0.05)
+        got_lock = await redis.set(lock_key, lock_id, nx=True, ex=FILL_LOCK_SECONDS)
+
+    if not got_lock:
+        await publish_client_flow_delete(itgs, slug=slug)
+        return
+
+    try:
+        in_db = await read_full_client_flow_from_db(
+            itgs, slug=slug, consistency="strong"
+        )
+        if in_db is None:
+            await publish_client_flow_delete(itgs, slug=slug)
+            return
+
+        await publish_client_flow_fill(
+            itgs,
+            slug=slug,
+            minimal_raw=convert_to_raw(get_minimal_copy(in_db)),
+            full_raw=convert_to_raw(in_db),
+        )
+    finally:
+        await _release_fill_lock(itgs, lock_key=lock_key, lock_id=lock_id)
+
+
 async def purge_valid_client_flows_cache(itgs: Itgs) -> None:
     """Purges the cache of valid client flow slugs everywhere"""
     await publish_valid_client_flows_changed(itgs)
@@ -295,6 +527,27 @@ async def publish_client_flow_delete(itgs: Itgs, /, *, slug: str) -> None:
     )
 
 
+async def publish_client_flow_fill(
+    itgs: Itgs, /, *, slug: str, minimal_raw: bytes, full_raw: bytes
+) -> None:
+    """Publishes a message via redis that tells everyone to replace the client flow
+    with the given slug in all caches with the given raw values
+    """
+    encoded_slug = slug.encode("utf-8")
+    redis = await itgs.redis()
+    type_ = 2
+    await redis.publish(
+        b"ps:client_flows",
+        type_.to_bytes(1, "big", signed=False)
+        + len(encoded_slug).to_bytes(4, "big", signed=False)
+        + encoded_slug
+        + len(minimal_raw).to_bytes(4, "big", signed=False)
+        + minimal_raw
+        + len(full_raw).to_bytes(4, "big", signed=False)
+        + full_raw,
+    )
+
+
 async def publish_valid_client_flows_changed(itgs: Itgs, /) -> None:
     """Publishes a message via redis that tells everyone to delete the valid client flow
     slugs cache
@@ -314,6 +567,27 @@ async def handle_received_client_flow_delete(itgs: Itgs, /, *, slug: str) -> Non
     delete_client_flow_from_in_memory(slug)
     await delete_client_flow_from_disk(itgs, slug=slug, minimal=True)
     await delete_client_flow_from_disk(itgs, slug=slug, minimal=False)
+    _notify_fill_waiters(slug)
+
+
+async def handle_received_client_flow_fill(
+    itgs: Itgs, /, *, slug: str, minimal_raw: bytes, full_raw: bytes
+) -> None:
+    """Handles a received message that tells us to replace the client flow with the
+    given slug in all caches. The minimal flow is parsed immediately so that the
+    next lookup on this instance is a memory hit
+    """
+    write_client_flow_to_in_memory(convert_from_raw(minimal_raw))
+    await write_client_flow_to_disk(itgs, slug=slug, minimal=True, raw=minimal_raw)
+    await write_client_flow_to_disk(itgs, slug=slug, minimal=False, raw=full_raw)
+    _notify_fill_waiters(slug)
+
+
+def _notify_fill_waiters(slug: str) -> None:
+    events = waiting_for_fill.get(slug)
+    if events is not None:
+        for event in events:
+            event.set()
 
 
 async def handle_received_valid_client_flows_changed(itgs: Itgs, /) -> None:
@@ -345,6 +619,18 @@ async def _subscribe_client_flow_deletes() -> None:
                 elif msg_type == 1:
                     async with Itgs() as itgs:
                         await handle_received_valid_client_flows_changed(itgs)
+                elif msg_type == 2:
+                    slug_len = int.from_bytes(msg.read(4), "big", signed=False)
+                    slug = msg.read(slug_len).decode("utf-8")
+                    minimal_len = int.from_bytes(msg.read(4), "big", signed=False)
+                    minimal_raw = msg.read(minimal_len)
+                    full_len = int.from_bytes(msg.read(4), "big", signed=False)
+                    full_raw = msg.read(full_len)
+
+                    async with Itgs() as itgs:
+                        await handle_received_client_flow_fill(
+                            itgs, slug=slug, minimal_raw=minimal_raw, full_raw=full_raw
+                        )
     except Exception as e:
         if pps.instance.exit_event.is_set() and isinstance(e, pps.PPSShutdownException):
             return
@@ -360,13 +646,17 @@ async def _do_subscribe_client_flow_deletes():
 
 
 async def read_full_client_flow_from_db(
-    itgs: Itgs, /, *, slug: str
+    itgs: Itgs,
+    /,
+    *,
+    slug: str,
+    consistency: Literal["none", "weak", "strong"] = "weak",
 ) -> Optional[ClientFlow]:
     """Fetches the client flow with the given slug from the database, if it
     exists, otherwise returns None.
     """
     conn = await itgs.conn()
-    cursor = conn.cursor("weak")
+    cursor = conn.cursor(consistency)
     response = await cursor.execute(
         """
 SELECT
@@ -419,3 +709,15 @@ def edit_flow_to_minimal_info(client_flow: ClientFlow) -> None:
     """
     for screen in client_flow.screens:
         screen.name = None
+
+
+def get_minimal_copy(client_flow: ClientFlow) -> ClientFlow:
+    """Returns a copy of the given client flow with the information not required
+    for triggering it stripped, without modifying the original and without
+    reparsing its schemas
+    """
+    result = dataclasses.replace(
+        client_flow, screens=[screen.model_copy() for screen in client_flow.screens]
+    )
+    edit_flow_to_minimal_info(result)
+    return result
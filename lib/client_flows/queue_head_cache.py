@@ -0,0 +1,223 @@
+"""Maintains a write-through copy of the front of each users client screen queue
+in redis, so that peeks which don't change the queue can be answered without
+reading `user_client_screens` from the database.
+
+The database remains authoritative. Before writing to a users queue, the
+cached queue head is evicted, which bumps its version. Once the database write
+completes, the new queue head is written back via a compare-and-set on that
+version, so that if another write started in the meantime the queue head stays
+evicted. If that compare-and-set fails the queue head is evicted again, since
+it may have been filled from a read that raced the write. A cached queue head is otherwise only filled from a database read
+that was performed after the version it is conditioned on was read, at a read
+consistency that is guaranteed to see every completed write.
+"""
+
+import json
+from dataclasses import dataclass
+from typing import List, Optional, cast
+from itgs import Itgs
+from lib.client_flows.client_flow_screen import ClientFlowScreen
+from lib.client_flows.screen_cache import get_client_screen
+from lib.client_flows.simulator import ClientFlowSimulatorScreen
+from redis_helpers.client_screen_queue_head_cas import (
+    client_screen_queue_head_cas,
+    ensure_client_screen_queue_head_cas_script_exists,
+)
+from redis_helpers.run_with_prep import run_with_prep
+
+
+QUEUE_HEAD_EXPIRE_SECONDS = 60 * 60
+"""How long a cached queue head is kept after it was last written. This also
+bounds how long an evicted queue head remembers its version, so it must be
+much longer than any single peek or pop
+"""
+
+
+@dataclass
+class ClientScreenQueueHead:
+    """The cached front of a users client screen queue"""
+
+    user_created_at: float
+    """When the user was created, in seconds since the epoch"""
+
+    front: ClientFlowSimulatorScreen
+    """The screen at the front of the users queue"""
+
+    prefetch: List[ClientFlowSimulatorScreen]
+    """The screens the client should prefetch when showing the front, in the same
+    format returned from `get_prefetch_screens`
+    """
+
+
+@dataclass
+class ClientScreenQueueHeadRead:
+    """The result of reading the cached queue head for a user"""
+
+    version: int
+    """The version of the cached queue head, which must be passed back when
+    writing the queue head to detect races
+    """
+
+    head: Optional[ClientScreenQueueHead]
+    """The cached queue head, or None if it is not available"""
+
+
+def _key(user_sub: str) -> bytes:
+    return f"client_screens:queue_head:{user_sub}".encode("utf-8")
+
+
+def _serialize_screen(screen: ClientFlowSimulatorScreen) -> dict:
+    return {
+        "uid": screen.user_client_screen_uid,
+        "outer_counter": screen.outer_counter,
+        "screen": screen.flow_screen.model_dump_json(),
+        "flow_client_parameters": screen.flow_client_parameters,
+        "flow_server_parameters": screen.flow_server_parameters,
+        "queued_at": screen.queued_at,
+    }
+
+
+async def _parse_screen(itgs: Itgs, raw: dict) -> Optional[ClientFlowSimulatorScreen]:
+    flow_screen = ClientFlowScreen.model_validate_json(raw["screen"])
+    screen = await get_client_screen(itgs, slug=flow_screen.screen.slug)
+    if screen is None:
+        return None
+
+    return ClientFlowSimulatorScreen(
+        user_client_screen_uid=raw["uid"],
+        flow_screen=flow_screen,
+        screen=screen,
+        outer_counter=raw["outer_counter"],
+        flow_client_parameters=raw["flow_client_parameters"],
+        flow_server_parameters=raw["flow_server_parameters"],
+        queued_at=raw["queued_at"],
+    )
+
+
+async def read_client_screen_queue_head(
+    itgs: Itgs, /, *, user_sub: str
+) -> ClientScreenQueueHeadRead:
+    """Reads the cached front of the given users client screen queue. The
+    version is always returned, even if the queue head is not available, and
+    should be read before reading the queue from the database if the result
+    of that read may be written back via `write_client_screen_queue_head`
+
+    Args:
+        itgs (Itgs): the integrations to (re)use
+        user_sub (str): the sub of the user whose queue head to read
+    """
+    redis = await itgs.redis()
+    raw_version, raw_data = cast(
+        List[Optional[bytes]],
+        await redis.hmget(_key(user_sub), [b"version", b"data"]),  # type: ignore
+    )
+    version = int(raw_version) if raw_version is not None else 0
+    if raw_data is None:
+        return ClientScreenQueueHeadRead(version=version, head=None)
+
+    data = json.loads(raw_data)
+    front = await _parse_screen(itgs, data["front"])
+    if front is None:
+        # the front screen was deleted; fall back to the database, which
+        # knows how to handle bad screens
+        return ClientScreenQueueHeadRead(version=version, head=None)
+
+    prefetch: List[ClientFlowSimulatorScreen] = []
+    for raw_screen in data["prefetch"]:
+        screen = await _parse_screen(itgs, raw_screen)
+        if screen is not None:
+            prefetch.append(screen)
+
+    return ClientScreenQueueHeadRead(
+        version=version,
+        head=ClientScreenQueueHead(
+            user_created_at=data["user_created_at"],
+            front=front,
+            prefetch=prefetch,
+        ),
+    )
+
+
+async def write_client_screen_queue_head(
+    itgs: Itgs,
+    /,
+    *,
+    user_sub: str,
+    expected_version: int,
+    head: ClientScreenQueueHead,
+    evict_on_mismatch: bool = False,
+) -> bool:
+    """Replaces the cached front of the given users client screen queue if it
+    is still at the given version. If the version does not match, then either
+    a write to the users queue started after our read or write, or the queue
+    head was already replaced with a newer one, so it is left alone.
+
+    When `head` was determined from writing to the users queue, the newer
+    queue head may have been filled from a database read that raced our write
+    and hence be stale, so `evict_on_mismatch` should be set to evict it
+    instead.
+
+    Args:
+        itgs (Itgs): the integrations to (re)use
+        user_sub (str): the sub of the user whose queue head to write
+        expected_version (int): if `head` was determined from writing to the
+            users queue, the version returned from the eviction before the write.
+            Otherwise, the version from `read_client_screen_queue_head` which
+            was read before reading the queue from the database
+        head (ClientScreenQueueHead): the new queue head
+        evict_on_mismatch (bool): if True and the version does not match, the
+            cached queue head is evicted
+
+    Returns:
+        bool: True if the queue head was written, False if the version did not
+            match
+    """
+    data = json.dumps(
+        {
+            "user_created_at": head.user_created_at,
+            "front": _serialize_screen(head.front),
+            "prefetch": [_serialize_screen(s) for s in head.prefetch],
+        }
+    ).encode("utf-8")
+
+    redis = await itgs.redis()
+    key = _key(user_sub)
+
+    async def _prepare(force: bool):
+        await ensure_client_screen_queue_head_cas_script_exists(redis, force=force)
+
+    async def _execute():
+        return await client_screen_queue_head_cas(
+            redis, key, expected_version, data, QUEUE_HEAD_EXPIRE_SECONDS
+        )
+
+    new_version = await run_with_prep(_prepare, _execute)
+    if new_version is None and evict_on_mismatch:
+        await evict_client_screen_queue_head(itgs, user_sub=user_sub)
+    return new_version is not None
+
+
+async def evict_client_screen_queue_head(itgs: Itgs, /, *, user_sub: str) -> int:
+    """Evicts the cached front of the given users client screen queue, bumping
+    its version so that any in-flight writes conditioned on the old version
+    fail. Must be called before writing to the users `user_client_screens`,
+    so that the cached queue head is never stale even if the write is
+    interrupted before the new queue head can be written.
+
+    Args:
+        itgs (Itgs): the integrations to (re)use
+        user_sub (str): the sub of the user whose queue head to evict
+
+    Returns:
+        int: the new version, which can be used to write the queue head
+            after the write to the database completes
+    """
+    redis = await itgs.redis()
+    key = _key(user_sub)
+    async with redis.pipeline() as pipe:
+        pipe.multi()
+        await pipe.hincrby(key, b"version", 1)  # type: ignore
+        await pipe.hdel(key, b"data")  # type: ignore
+        await pipe.expire(key, QUEUE_HEAD_EXPIRE_SECONDS)
+        result = await pipe.execute()
+    return int(result[0])
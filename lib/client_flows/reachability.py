@@ -0,0 +1,191 @@
+"""Answers which client flows are reachable from (or can reach) a given flow
+using an in-memory copy of the client flow graph for a particular
+environment, encoded as a bit-packed adjacency matrix.
+
+Unlike `lib.client_flows.analysis`, this does not enumerate paths, so it can
+answer reachability for every target in a few milliseconds once the graph is
+loaded. Use `lib.client_flows.analysis` to explain how a specific target is
+reached.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, cast
+
+import numpy as np
+
+from itgs import Itgs
+from lib.client_flows.analysis import (
+    ClientFlowAnalysisEnvironment,
+    iterate_adjacent_flows,
+)
+from lib.client_flows.flow_cache import get_client_flow, get_valid_client_flow_slugs
+
+
+MAX_CACHED_GRAPHS = 32
+"""The maximum number of graphs kept in memory at once. Graphs are evicted in
+least-recently-used order
+"""
+
+
+@dataclass
+class ClientFlowGraphMatrix:
+    """The client flow graph within a particular environment"""
+
+    slugs: List[str]
+    """The slug of the flow at each index"""
+
+    indices: Dict[str, int]
+    """The index of each slug within `slugs`"""
+
+    forward: np.ndarray
+    """The adjacency matrix, as a uint8 array with one row per flow and the
+    columns bit-packed (big-endian within each byte), so that bit `j` of row `i`
+    is set if there is an edge from `slugs[i]` to `slugs[j]`
+    """
+
+    inverted: np.ndarray
+    """The transpose of `forward`, in the same format"""
+
+    reachable: Dict[Tuple[int, Optional[int], bool], List[str]] = field(
+        default_factory=dict
+    )
+    """Memoized results from `get_reachable`, keyed by source index, max steps,
+    and inverted
+    """
+
+    def get_reachable(
+        self, source: str, /, *, max_steps: Optional[int], inverted: bool
+    ) -> List[str]:
+        """Returns the slugs of the flows reachable from the given source within
+        the given number of steps, sorted by slug. When inverted, returns the
+        flows which can reach the source instead.
+
+        The source is only included if it has an edge to itself and max_steps
+        is 1, which matches the results from `lib.client_flows.analysis`.
+        """
+        source_index = self.indices.get(source)
+        if source_index is None:
+            return []
+
+        key = (source_index, max_steps, inverted)
+        result = self.reachable.get(key)
+        if result is None:
+            result = self._search(source_index, max_steps=max_steps, inverted=inverted)
+            self.reachable[key] = result
+        return result
+
+    def _search(
+        self, source_index: int, /, *, max_steps: Optional[int], inverted: bool
+    ) -> List[str]:
+        adjacency = self.inverted if inverted else self.forward
+        num_flows = len(self.slugs)
+
+        if max_steps == 1:
+            found = adjacency[source_index]
+        else:
+            visited = adjacency[source_index].copy()
+            frontier = visited
+            steps = 1
+            while max_steps is None or steps < max_steps:
+                frontier_indices = np.flatnonzero(
+                    np.unpackbits(frontier, count=num_flows)
+                )
+                if frontier_indices.size == 0:
+                    break
+                frontier = np.bitwise_or.reduce(adjacency[frontier_indices], axis=0)
+                frontier &= ~visited
+                visited |= frontier
+                steps += 1
+
+            found = visited.copy()
+            found[source_index >> 3] &= ~np.uint8(0x80 >> (source_index & 7))
+
+        return sorted(
+            self.slugs[idx]
+            for idx in np.flatnonzero(np.unpackbits(found, count=num_flows))
+        )
+
+
+_graphs: "OrderedDict[Tuple[bytes, int, int], ClientFlowGraphMatrix]" = OrderedDict()
+
+
+async def get_client_flow_graph_matrix(
+    itgs: Itgs, /, *, graph: ClientFlowAnalysisEnvironment
+) -> ClientFlowGraphMatrix:
+    """Fetches the client flow graph within the given environment, loading it
+    if it is not already in memory. Graphs are keyed by the environment and the
+    current values of `client_flow_graph_analysis:version` and
+    `client_flow_graph_analysis:flows_version`, so they are reloaded after any
+    eviction.
+    """
+    redis = await itgs.redis()
+    raw_version, raw_flows_version = cast(
+        List[Optional[bytes]],
+        await redis.mget(
+            b"client_flow_graph_analysis:version",  # type: ignore
+            b"client_flow_graph_analysis:flows_version",  # type: ignore
+        ),
+    )
+    key = (
+        graph.to_redis_identifier(),
+        int(raw_version) if raw_version is not None else 0,
+        int(raw_flows_version) if raw_flows_version is not None else 0,
+    )
+
+    cached = _graphs.get(key)
+    if cached is not None:
+        _graphs.move_to_end(key)
+        return cached
+
+    result = await _load_client_flow_graph_matrix(itgs, graph=graph)
+    _graphs[key] = result
+    while len(_graphs) > MAX_CACHED_GRAPHS:
+        _graphs.popitem(last=False)
+    return result
+
+
+async def _load_client_flow_graph_matrix(
+    itgs: Itgs, /, *, graph: ClientFlowAnalysisEnvironment
+) -> ClientFlowGraphMatrix:
+    slugs = sorted(await get_valid_client_flow_slugs(itgs))
+    indices = dict((slug, idx) for idx, slug in enumerate(slugs))
+
+    edges: List[Tuple[int, int]] = []
+    for source_index in range(len(slugs)):
+        # targets may be discovered (and appended to slugs) as we go; those are
+        # not valid flows and thus have no outgoing edges
+        source = slugs[source_index]
+        flow = await get_client_flow(itgs, slug=source, minimal=False)
+        if flow is None:
+            continue
+
+        async for target_bytes, path in iterate_adjacent_flows(
+            itgs,
+            graph=graph,
+            source_slug=source,
+            source_screens=flow.screens,
+            source_rules=flow.rules,
+        ):
+            if path.type == "done":
+                continue
+            target = target_bytes.decode("utf-8")
+            target_index = indices.get(target)
+            if target_index is None:
+                target_index = len(slugs)
+                slugs.append(target)
+                indices[target] = target_index
+            edges.append((source_index, target_index))
+
+    num_flows = len(slugs)
+    dense = np.zeros((num_flows, num_flows), dtype=np.bool_)
+    if edges:
+        edges_arr = np.array(edges, dtype=np.intp)
+        dense[edges_arr[:, 0], edges_arr[:, 1]] = True
+
+    return ClientFlowGraphMatrix(
+        slugs=slugs,
+        indices=indices,
+        forward=np.packbits(dense, axis=1),
+        inverted=np.packbits(np.ascontiguousarray(dense.T), axis=1),
+    )
@@ -12,6 +12,7 @@ from openapi_schema_validator import OAS30Validator
 
 from error_middleware import handle_error
 from itgs import Itgs
+from lib.client_flows.cache_stats import CacheHitStats
 from lib.client_flows.screen_flags import ClientScreenFlag
 from lib.client_flows.screen_schema import ScreenSchemaRealizer
 from lifespan import lifespan_handler
@@ -56,10 +57,17 @@ memory_cache_size = 200
 old_cache: Dict[str, ClientScreen] = {}
 latest_cache: Dict[str, ClientScreen] = {}
 
+stats = CacheHitStats()
+"""How often lookups via `get_client_screen` were answered by each cache tier"""
+
+# slug -> the fill in progress on this instance
+pending_fills: Dict[str, asyncio.Task] = {}
+
 
 async def get_client_screen(itgs: Itgs, /, *, slug: str) -> Optional[ClientScreen]:
     """Fetches the client screen with the given slug from the nearest cache,
-    filling any caches that were missed along the way.
+    filling any caches that were missed along the way. Concurrent misses for
+    the same slug on this instance share a single fill.
 
     Args:
         itgs (Itgs): the integrations to (re)use
@@ -71,14 +79,53 @@ async def get_client_screen(itgs: Itgs, /, *, slug: str) -> Optional[ClientScree
     """
     in_memory = read_client_screen_from_in_memory(slug)
     if in_memory is not None:
+        stats.memory_hits += 1
         return in_memory
+    stats.memory_misses += 1
 
     on_disk = await read_client_screen_from_disk(itgs, slug=slug)
     if on_disk is not None:
+        stats.disk_hits += 1
         parsed = convert_from_raw(on_disk)
         write_client_screen_to_in_memory(parsed)
         return parsed
+    stats.disk_misses += 1
+
+    fill = pending_fills.get(slug)
+    if fill is None:
+        fill = asyncio.create_task(_fill_client_screen(slug=slug))
+        pending_fills[slug] = fill
+        fill.add_done_callback(
+            lambda task: (
+                pending_fills.pop(slug, None)
+                if pending_fills.get(slug) is task
+                else None
+            )
+        )
+    else:
+        stats.fills_joined += 1
+
+    return await asyncio.shield(fill)
+
+
+def get_client_screen_cache_stats() -> CacheHitStats:
+    """Returns a copy of the hit statistics for the client screen cache on this instance"""
+    return stats.copy()
+
+
+async def _fill_client_screen(*, slug: str) -> Optional[ClientScreen]:
+    """Fills the client screen with the given slug after it was missed in both
+    the memory and disk caches, returning the result. The fill is shared by
+    every caller that missed while it was in progress, so it uses its own
+    integrations rather than borrowing those of whichever caller started it.
+    """
+    async with Itgs() as itgs:
+        return await _fill_client_screen_with_itgs(itgs, slug=slug)
 
+
+async def _fill_client_screen_with_itgs(
+    itgs: Itgs, /, *, slug: str
+) -> Optional[ClientScreen]:
     in_db = await read_client_screen_from_db(itgs, slug=slug)
     if in_db is None:
         return None
@@ -0,0 +1,571 @@
+"""Compiles client screen schemas into realization plans. A realization plan is
+the client screen schema with all the structural checks and lookups done up
+front: realizing screen parameters with a plan is then a single pass over the
+input which only branches on the input, never on the schema.
+
+The plan also records which subtrees contain extension formats (image, content,
+journey, etc.) that require conversion, so that subtrees without any
+conversions are realized synchronously without any per-node awaits.
+"""
+
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Protocol,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
+from lib.client_flows.helper import extract_schema_default_value, pretty_path
+from lib.client_flows.special_index import SpecialIndex
+from resources.patch.not_set import NotSetEnum
+
+
+UNSAFE_SCREEN_SCHEMA_TYPES: Set[Tuple[str, str]] = {
+    ("string", "image_uid"),
+    ("string", "content_uid"),
+    ("string", "journey_uid"),
+    ("string", "course_uid"),
+    ("string", "interactive_prompt_uid"),
+    ("string", "journal_entry_uid"),
+}
+KNOWN_COPY_STRING_FORMATS: Set[str] = {
+    "date",
+    "date-time",
+    "password",
+    "duration",
+    "time",
+    "email",
+    "idn-email",
+    "hostname",
+    "idn-hostname",
+    "ipv4",
+    "ipv6",
+    "uri",
+    "uri-reference",
+    "iri",
+    "iri-reference",
+    "uuid",
+    "uri-template",
+    "regex",
+    "flow_slug",
+}
+CONVERTED_STRING_FORMATS: Set[str] = {fmt for _, fmt in UNSAFE_SCREEN_SCHEMA_TYPES}
+"""The string formats whose values are converted during realization"""
+
+
+class ScreenParameterConverter(Protocol):
+    """Converts a single value with one of the `CONVERTED_STRING_FORMATS`"""
+
+    def __call__(
+        self,
+        fmt: str,
+        given: str,
+        /,
+        *,
+        thumbhash_width: int,
+        thumbhash_height: int,
+    ) -> Awaitable[Any]: ...
+
+
+@dataclass
+class _PlanContext:
+    convert: ScreenParameterConverter
+    raw_schema: dict
+    input: Any
+
+
+@dataclass
+class PlanNode:
+    """A node within a realization plan, corresponding to a schema object"""
+
+    path: List[Union[str, SpecialIndex]]
+    """The abstract path to this node, for error messages"""
+
+    nullable: bool
+    """True if None is accepted (and realized as None) for this node"""
+
+    has_default: bool
+    """True if the schema has a default value for this node"""
+
+    default: Any
+    """The default value for this node, if has_default"""
+
+    converts: bool
+    """True if this node or any descendant requires an async conversion"""
+
+    def realize_sync(self, given: Any) -> Any:
+        """Realizes the given value; only valid if not `converts`"""
+        if given is NotSetEnum.NOT_SET:
+            assert (
+                self.has_default
+            ), f"no default @ {pretty_path(self.path)}, despite not set in input"
+            given = self.default
+        if self.nullable and given is None:
+            return None
+        return self._realize_present_sync(given)
+
+    async def realize(self, ctx: _PlanContext, given: Any) -> Any:
+        """Realizes the given value, converting extension formats as necessary"""
+        if not self.converts:
+            return self.realize_sync(given)
+        if given is NotSetEnum.NOT_SET:
+            assert (
+                self.has_default
+            ), f"no default @ {pretty_path(self.path)}, despite not set in input"
+            given = self.default
+        if self.nullable and given is None:
+            return None
+        return await self._realize_present(ctx, given)
+
+    def _realize_present_sync(self, given: Any) -> Any:
+        raise NotImplementedError()
+
+    async def _realize_present(self, ctx: _PlanContext, given: Any) -> Any:
+        raise NotImplementedError()
+
+
+@dataclass
+class _ObjectNode(PlanNode):
+    properties: Optional[List[Tuple[str, PlanNode]]]
+    """The properties in the order they are realized, or None to copy as-is"""
+
+    def _realize_present_sync(self, given: Any) -> Any:
+        assert isinstance(
+            given, dict
+        ), f"expected dict, got {given} @ {pretty_path(self.path)}"
+        if self.properties is None:
+            return given
+        return {
+            key: node.realize_sync(given.get(key, NotSetEnum.NOT_SET))
+            for key, node in self.properties
+        }
+
+    async def _realize_present(self, ctx: _PlanContext, given: Any) -> Any:
+        assert isinstance(
+            given, dict
+        ), f"expected dict, got {given} @ {pretty_path(self.path)}"
+        assert self.properties is not None
+        val = dict()
+        for key, node in self.properties:
+            val[key] = await node.realize(ctx, given.get(key, NotSetEnum.NOT_SET))
+        return val
+
+
+@dataclass
+class _OneOfNode(PlanNode):
+    discriminator_field: str
+    default_discriminator_value: Optional[str]
+    options: Dict[str, PlanNode]
+
+    def _select(self, given: Any) -> PlanNode:
+        assert isinstance(
+            given, dict
+        ), f"expected dict, got {given} @ {pretty_path(self.path)}"
+        discriminator_value = given.get(self.discriminator_field)
+        if discriminator_value is None:
+            discriminator_value = self.default_discriminator_value
+            assert isinstance(
+                discriminator_value, str
+            ), f"bad default discriminator @ {pretty_path(self.path)}: {discriminator_value=}"
+        else:
+            assert isinstance(
+                discriminator_value, str
+            ), f"bad discriminator @ {pretty_path(self.path)}: {discriminator_value=}"
+
+        option = self.options.get(discriminator_value)
+        if option is None:
+            raise ValueError(
+                f"bad discriminator value @ {pretty_path(self.path)}: {discriminator_value=}"
+            )
+        return option
+
+    def _realize_present_sync(self, given: Any) -> Any:
+        return self._select(given).realize_sync(given)
+
+    async def _realize_present(self, ctx: _PlanContext, given: Any) -> Any:
+        return await self._select(given).realize(ctx, given)
+
+
+@dataclass
+class _ArrayNode(PlanNode):
+    items: Optional[PlanNode]
+
+    def _realize_present_sync(self, given: Any) -> Any:
+        assert isinstance(
+            given, list
+        ), f"expected list, got {given} @ {pretty_path(self.path)}"
+        if self.items is None:
+            return [None] * len(given)
+        items = self.items
+        return [items.realize_sync(v) for v in given]
+
+    async def _realize_present(self, ctx: _PlanContext, given: Any) -> Any:
+        assert isinstance(
+            given, list
+        ), f"expected list, got {given} @ {pretty_path(self.path)}"
+        assert self.items is not None
+        items = self.items
+        return [await items.realize(ctx, v) for v in given]
+
+
+@dataclass
+class _CopyNode(PlanNode):
+    check: Callable[[Any], bool]
+    """Checks that the value is of the expected type"""
+
+    expected: str
+    """Describes the expected type for error messages"""
+
+    def _realize_present_sync(self, given: Any) -> Any:
+        assert self.check(
+            given
+        ), f"expected {self.expected}, got {given} @ {pretty_path(self.path)}"
+        return given
+
+
+@dataclass
+class _ConvertNode(PlanNode):
+    fmt: str
+    thumbhash_width: int
+    thumbhash_height: int
+    dynamic_size: Optional[Tuple[List[str], List[str]]]
+    """For image_uid, the paths to the width and height in the input which, if
+    present, override the default thumbhash size of 1x1
+    """
+
+    async def _realize_present(self, ctx: _PlanContext, given: Any) -> Any:
+        assert isinstance(
+            given, str
+        ), f"expected str, got {given} @ {pretty_path(self.path)}"
+
+        thumbhash_width = self.thumbhash_width
+        thumbhash_height = self.thumbhash_height
+        if self.dynamic_size is not None:
+            width = extract_schema_default_value(
+                schema=ctx.raw_schema, fixed=ctx.input, path=self.dynamic_size[0]
+            )
+            if width.type == "success":
+                height = extract_schema_default_value(
+                    schema=ctx.raw_schema, fixed=ctx.input, path=self.dynamic_size[1]
+                )
+                if height.type == "success":
+                    thumbhash_width = width.value
+                    thumbhash_height = height.value
+            assert (
+                isinstance(thumbhash_width, int) and thumbhash_width > 0
+            ), f"bad x-thumbhash @ {pretty_path(self.path)} for format {self.fmt}"
+            assert (
+                isinstance(thumbhash_height, int) and thumbhash_height > 0
+            ), f"bad x-thumbhash @ {pretty_path(self.path)} for format {self.fmt}"
+
+        return await ctx.convert(
+            self.fmt,
+            given,
+            thumbhash_width=thumbhash_width,
+            thumbhash_height=thumbhash_height,
+        )
+
+
+def _is_int32(v: Any) -> bool:
+    return isinstance(v, int) and -(2**31) <= v <= 2**31 - 1
+
+
+def _is_int64(v: Any) -> bool:
+    return isinstance(v, int) and -(2**63) <= v <= 2**63 - 1
+
+
+@dataclass
+class ScreenRealizationPlan:
+    """A compiled client screen schema; see the module documentation"""
+
+    raw_schema: dict
+    """The raw OpenAPI 3.0.3 schema this plan was compiled from"""
+
+    root: PlanNode
+    """The node for the root of the schema"""
+
+    conversion_paths: List[Tuple[List[Union[str, SpecialIndex]], str]]
+    """The abstract paths to every value which requires conversion, alongside
+    the format of that value
+    """
+
+    safety_by_path: Dict[Tuple[Union[str, SpecialIndex], ...], bool]
+    """For every abstract path reachable without going through a oneOf, True
+    if the value at that path is safe for untrusted input and False if not.
+    Equivalent to the result of `ScreenSchemaRealizer.is_safe`
+    """
+
+    enum_discriminators: List[Tuple[List[Union[str, SpecialIndex]], List[str]]]
+    """The result of `ScreenSchemaRealizer.iter_enum_discriminators`"""
+
+    async def realize(self, input: Any, /, *, convert: ScreenParameterConverter) -> Any:
+        """Realizes the given validated input, using the given function to
+        convert values with extension formats
+        """
+        if not self.root.converts:
+            return self.root.realize_sync(input)
+        return await self.root.realize(
+            _PlanContext(convert=convert, raw_schema=self.raw_schema, input=input),
+            input,
+        )
+
+
+def compile_realization_plan(
+    raw_schema: dict,
+    /,
+    *,
+    enum_discriminators: List[Tuple[List[Union[str, SpecialIndex]], List[str]]],
+) -> ScreenRealizationPlan:
+    """Compiles the given client screen schema into a realization plan. Raises
+    an AssertionError or ValueError if the schema is not one that can be
+    realized.
+    """
+    conversion_paths: List[Tuple[List[Union[str, SpecialIndex]], str]] = []
+    root = _compile_node(raw_schema, [], conversion_paths)
+
+    safety_by_path: Dict[Tuple[Union[str, SpecialIndex], ...], bool] = dict()
+    _compute_safety(raw_schema, [], safety_by_path)
+
+    return ScreenRealizationPlan(
+        raw_schema=raw_schema,
+        root=root,
+        conversion_paths=conversion_paths,
+        safety_by_path=safety_by_path,
+        enum_discriminators=enum_discriminators,
+    )
+
+
+def _compile_node(
+    schema: dict,
+    path: List[Union[str, SpecialIndex]],
+    conversion_paths: List[Tuple[List[Union[str, SpecialIndex]], str]],
+) -> PlanNode:
+    assert isinstance(schema, dict), f"expected dict @ {pretty_path(path)}"
+    common: Dict[str, Any] = dict(
+        path=path,
+        nullable=schema.get("nullable", False) is True,
+        has_default="default" in schema,
+        default=schema.get("default"),
+    )
+    schema_type = schema.get("type")
+
+    if schema_type == "object" and "oneOf" in schema:
+        discriminator_field = schema.get("x-enum-discriminator")
+        assert isinstance(
+            discriminator_field, str
+        ), f"bad discriminator @ {pretty_path(path)}: {discriminator_field=}"
+        top_default = schema.get("default")
+        default_discriminator_value = (
+            top_default.get(discriminator_field)
+            if isinstance(top_default, dict)
+            else None
+        )
+
+        oneof = schema["oneOf"]
+        assert isinstance(oneof, list), f"bad oneOf @ {pretty_path(path)}: {oneof=}"
+        options: Dict[str, PlanNode] = dict()
+        for option in oneof:
+            assert isinstance(
+                option, dict
+            ), f"bad option @ {pretty_path(path)}: {option=}"
+            properties = option.get("properties")
+            assert isinstance(
+                properties, dict
+            ), f"bad properties @ {pretty_path(path)}: {properties=}"
+            discriminator = properties.get(discriminator_field)
+            assert isinstance(
+                discriminator, dict
+            ), f"bad discriminator @ {pretty_path(path)}: {discriminator=}"
+            enum = discriminator.get("enum")
+            assert isinstance(enum, list), f"bad enum @ {pretty_path(path)}: {enum=}"
+            assert len(enum) == 1, f"bad enum @ {pretty_path(path)}: {enum=}"
+            option_value = enum[0]
+            assert isinstance(
+                option_value, str
+            ), f"bad option value @ {pretty_path(path)}: {option_value=}"
+            if option_value not in options:
+                options[option_value] = _compile_node(option, path, conversion_paths)
+
+        return _OneOfNode(
+            **common,
+            converts=any(o.converts for o in options.values()),
+            discriminator_field=discriminator_field,
+            default_discriminator_value=default_discriminator_value,
+            options=options,
+        )
+
+    if schema_type == "object":
+        fmt = schema.get("format")
+        assert fmt is None, f"unknown object format {fmt} @ {pretty_path(path)}"
+        properties = schema.get("properties")
+        if properties is None:
+            return _ObjectNode(**common, converts=False, properties=None)
+
+        assert isinstance(
+            properties, dict
+        ), f"expected dict, got {properties} @ {pretty_path(path + ['properties'])}"
+
+        # properties are realized in reverse order to match the key order
+        # produced by realizing directly from the schema
+        compiled_properties = [
+            (key, _compile_node(sub_schema, path + [key], conversion_paths))
+            for key, sub_schema in reversed(list(properties.items()))
+        ]
+        return _ObjectNode(
+            **common,
+            converts=any(n.converts for _, n in compiled_properties),
+            properties=compiled_properties,
+        )
+
+    if schema_type == "array":
+        fmt = schema.get("format")
+        assert fmt is None, f"unknown array format {fmt} @ {pretty_path(path)}"
+        items = schema.get("items")
+        if items is None:
+            return _ArrayNode(**common, converts=False, items=None)
+        assert isinstance(
+            items, dict
+        ), f"expected dict, got {items} @ {pretty_path(path)} items"
+        items_node = _compile_node(
+            items, path + [SpecialIndex.ARRAY_INDEX], conversion_paths
+        )
+        return _ArrayNode(**common, converts=items_node.converts, items=items_node)
+
+    if schema_type == "string":
+        fmt = schema.get("format")
+        if fmt in CONVERTED_STRING_FORMATS:
+            conversion_paths.append((path, cast(str, fmt)))
+            thumbhash_width = 1
+            thumbhash_height = 1
+            dynamic_size: Optional[Tuple[List[str], List[str]]] = None
+            if fmt == "image_uid":
+                x_dynamic_size = schema.get("x-dynamic-size")
+                if x_dynamic_size is not None:
+                    assert isinstance(x_dynamic_size, dict)
+                    width_path = x_dynamic_size.get("width")
+                    assert isinstance(width_path, list)
+                    assert all(isinstance(x, str) for x in width_path)
+                    height_path = x_dynamic_size.get("height")
+                    assert isinstance(height_path, list)
+                    assert all(isinstance(x, str) for x in height_path)
+                    dynamic_size = (
+                        cast(List[str], width_path),
+                        cast(List[str], height_path),
+                    )
+
+                x_thumbhash = schema.get("x-thumbhash", {"width": 1, "height": 1})
+                assert isinstance(
+                    x_thumbhash, dict
+                ), f"bad x-thumbhash @ {pretty_path(path)} for format {fmt}"
+                thumbhash_width = x_thumbhash.get("width")
+                thumbhash_height = x_thumbhash.get("height")
+                if "x-thumbhash" in schema:
+                    # an explicit x-thumbhash takes precedence over x-dynamic-size
+                    dynamic_size = None
+                assert (
+                    isinstance(thumbhash_width, int) and thumbhash_width > 0
+                ), f"bad x-thumbhash @ {pretty_path(path)} for format {fmt}"
+                assert (
+                    isinstance(thumbhash_height, int) and thumbhash_height > 0
+                ), f"bad x-thumbhash @ {pretty_path(path)} for format {fmt}"
+
+            return _ConvertNode(
+                **common,
+                converts=True,
+                fmt=cast(str, fmt),
+                thumbhash_width=thumbhash_width,
+                thumbhash_height=thumbhash_height,
+                dynamic_size=dynamic_size,
+            )
+
+        assert (
+            fmt is None or fmt in KNOWN_COPY_STRING_FORMATS
+        ), f"unknown string format {fmt} @ {pretty_path(path)}"
+        return _CopyNode(
+            **common,
+            converts=False,
+            check=lambda v: isinstance(v, str),
+            expected="str",
+        )
+
+    if schema_type == "integer":
+        fmt = schema.get("format")
+        if fmt == "int32":
+            check, expected = _is_int32, "int32"
+        elif fmt == "int64":
+            check, expected = _is_int64, "int64"
+        else:
+            assert fmt is None, f"unknown integer format {fmt} @ {pretty_path(path)}"
+            check, expected = (lambda v: isinstance(v, int)), "int"
+        return _CopyNode(**common, converts=False, check=check, expected=expected)
+
+    if schema_type == "number":
+        fmt = schema.get("format")
+        assert fmt in (
+            "float",
+            "double",
+            None,
+        ), f"unknown number format {fmt} @ {pretty_path(path)}"
+        return _CopyNode(
+            **common,
+            converts=False,
+            check=lambda v: isinstance(v, (int, float)),
+            expected="number",
+        )
+
+    if schema_type == "boolean":
+        fmt = schema.get("format")
+        assert fmt is None, f"unknown boolean format {fmt} @ {pretty_path(path)}"
+        return _CopyNode(
+            **common,
+            converts=False,
+            check=lambda v: isinstance(v, bool),
+            expected="bool",
+        )
+
+    if schema_type == "null":
+        fmt = schema.get("format")
+        assert fmt is None, f"unknown null format {fmt} @ {pretty_path(path)}"
+        return _CopyNode(
+            **common, converts=False, check=lambda v: v is None, expected="None"
+        )
+
+    raise ValueError(f"unknown schema type {schema_type} @ {pretty_path(path)}")
+
+
+def _compute_safety(
+    schema: Any,
+    path: List[Union[str, SpecialIndex]],
+    out: Dict[Tuple[Union[str, SpecialIndex], ...], bool],
+) -> None:
+    """Fills `out` with the safety of every path reachable the same way
+    `ScreenSchemaRealizer.is_safe` walks the schema
+    """
+    out[tuple(path)] = (
+        schema.get("type"),
+        schema.get("format"),
+    ) not in UNSAFE_SCREEN_SCHEMA_TYPES
+
+    if schema.get("type") == "array":
+        items = schema.get("items")
+        if isinstance(items, dict):
+            _compute_safety(items, path + [SpecialIndex.ARRAY_INDEX], out)
+        return
+
+    if schema.get("type") != "object":
+        return
+
+    properties = schema.get("properties")
+    if not isinstance(properties, dict):
+        return
+
+    for key, sub_schema in properties.items():
+        if isinstance(sub_schema, dict):
+            _compute_safety(sub_schema, path + [key], out)
@@ -3,15 +3,22 @@ properties and a format option which we also use for determining how to convert
 parameters before realization
 """
 
+import asyncio
 from functools import partial
 import gzip
 import json
 import secrets
-from typing import Any, Callable, List, Optional, Set, Tuple, Union, cast
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union, cast
 from error_middleware import handle_contextless_error, handle_warning
 import image_files.auth
 import content_files.auth
 from lib.client_flows.helper import extract_schema_default_value, pretty_path
+from lib.client_flows.screen_realization_plan import (
+    KNOWN_COPY_STRING_FORMATS,
+    UNSAFE_SCREEN_SCHEMA_TYPES,
+    ScreenRealizationPlan,
+    compile_realization_plan,
+)
 from lib.client_flows.special_index import SpecialIndex
 from resources.patch.not_set import NotSetEnum
 from response_utils import response_to_bytes
@@ -31,37 +38,6 @@ import interactive_prompts.lib.read_one_external
 from dataclasses import dataclass
 
 
-UNSAFE_SCREEN_SCHEMA_TYPES: Set[Tuple[str, str]] = {
-    ("string", "image_uid"),
-    ("string", "content_uid"),
-    ("string", "journey_uid"),
-    ("string", "course_uid"),
-    ("string", "interactive_prompt_uid"),
-    ("string", "journal_entry_uid"),
-}
-KNOWN_COPY_STRING_FORMATS: Set[str] = {
-    "date",
-    "date-time",
-    "password",
-    "duration",
-    "time",
-    "email",
-    "idn-email",
-    "hostname",
-    "idn-hostname",
-    "ipv4",
-    "ipv6",
-    "uri",
-    "uri-reference",
-    "iri",
-    "iri-reference",
-    "uuid",
-    "uri-template",
-    "regex",
-    "flow_slug",
-}
-
-
 @dataclass(frozen=True)
 class _RealizeState:
     path: List[str]
@@ -75,6 +51,21 @@ class ScreenSchemaRealizer:
         self.raw_schema = raw_schema
         """The raw OpenAPI 3.0.3 schema object"""
 
+        self.plan: Optional[ScreenRealizationPlan] = None
+        """The realization plan compiled from the raw schema, or None if the
+        schema could not be compiled, in which case realization walks the raw
+        schema directly (and will raise the corresponding error when it reaches
+        the problematic part of the schema)
+        """
+
+        try:
+            self.plan = compile_realization_plan(
+                raw_schema,
+                enum_discriminators=list(self._iter_enum_discriminators_by_walking()),
+            )
+        except (AssertionError, ValueError, AttributeError, TypeError):
+            pass
+
     def is_safe(
         self, path: Union[List[Union[str, SpecialIndex]], List[str], List[SpecialIndex]]
     ) -> Optional[bool]:
@@ -83,6 +74,9 @@ class ScreenSchemaRealizer:
         extension formats) and False if it is not safe (e.g., it uses it within a
         JWT claim)
         """
+        if self.plan is not None:
+            return self.plan.safety_by_path.get(tuple(path))
+
         stack = list(path)
         schema = self.raw_schema
 
@@ -155,6 +149,14 @@ class ScreenSchemaRealizer:
 
         this will yield `("type", frozenset(("option-a", "option-b")))`
         """
+        if self.plan is not None:
+            yield from self.plan.enum_discriminators
+            return
+
+        yield from self._iter_enum_discriminators_by_walking()
+
+    def _iter_enum_discriminators_by_walking(self):
+        """Implements `iter_enum_discriminators` by walking the raw schema"""
         stack: List[Tuple[List[Union[str, SpecialIndex]], dict]] = [
             ([], self.raw_schema)
         ]
@@ -205,7 +207,13 @@ class ScreenSchemaRealizer:
                 stack.append((path + [key], sub_schema))
 
     async def convert_validated_to_realized(
-        self, itgs: Itgs, /, *, for_user_sub: str, input: Any
+        self,
+        itgs: Itgs,
+        /,
+        *,
+        for_user_sub: str,
+        input: Any,
+        memo: Optional["ScreenRealizationMemo"] = None,
     ) -> Any:
         """Converts input which has been validated against the schema already and
         for which the appropriate trust level has been determined (i.e., either
@@ -214,6 +222,29 @@ class ScreenSchemaRealizer:
 
         This is essentially the consumer of the schema, as all the screen input
         does is convert a few fields according to their format.
+
+        If a memo is provided, it must be for the same user, and conversions are
+        shared with every other screen realized with the same memo.
+        """
+        if self.plan is not None:
+            if memo is not None:
+                assert memo.for_user_sub == for_user_sub, "memo is for another user"
+                return await self.plan.realize(input, convert=memo.convert)
+            return await self.plan.realize(
+                input,
+                convert=partial(_convert_extension_format, itgs, for_user_sub),
+            )
+
+        return await self._convert_validated_to_realized_by_walking(
+            itgs, for_user_sub=for_user_sub, input=input
+        )
+
+    async def _convert_validated_to_realized_by_walking(
+        self, itgs: Itgs, /, *, for_user_sub: str, input: Any
+    ) -> Any:
+        """Implements `convert_validated_to_realized` by walking the raw schema.
+        Used when the schema could not be compiled into a realization plan, and
+        as the reference the realization plan is checked against.
         """
         result: Any = None
 
@@ -547,6 +578,94 @@ class ScreenSchemaRealizer:
         return result
 
 
+class ScreenRealizationMemo:
+    """Shares extension format conversions (e.g., resolving a journey uid) between
+    screens realized for the same user within a single request, so that values
+    referenced by multiple screens are only converted once even when the screens
+    are realized concurrently.
+
+    Only used by realization plans; screens whose schema could not be compiled
+    convert their values independently.
+    """
+
+    def __init__(self, itgs: Itgs, /, *, for_user_sub: str) -> None:
+        self.itgs = itgs
+        """The integrations to (re)use for conversions"""
+
+        self.for_user_sub = for_user_sub
+        """The sub of the user the screens are being realized for"""
+
+        self.conversions: Dict[Tuple[str, str, int, int], asyncio.Task] = dict()
+        """The started conversions, keyed by format, value, and thumbhash size"""
+
+    def convert(
+        self,
+        fmt: str,
+        given: str,
+        /,
+        *,
+        thumbhash_width: int,
+        thumbhash_height: int,
+    ) -> Awaitable[Any]:
+        """Converts the given value, reusing the result of any earlier conversion
+        of the same value. Cancelling the returned awaitable does not cancel the
+        conversion, since other screens may be waiting on it
+        """
+        key = (fmt, given, thumbhash_width, thumbhash_height)
+        task = self.conversions.get(key)
+        if task is None:
+            task = asyncio.create_task(
+                _convert_extension_format(
+                    self.itgs,
+                    self.for_user_sub,
+                    fmt,
+                    given,
+                    thumbhash_width=thumbhash_width,
+                    thumbhash_height=thumbhash_height,
+                )
+            )
+            self.conversions[key] = task
+        return asyncio.shield(task)
+
+    async def cancel_pending(self) -> None:
+        """Cancels any conversions which are still running, e.g., because the
+        only screens that needed them timed out, and waits for them to finish
+        """
+        pending = [task for task in self.conversions.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+
+async def _convert_extension_format(
+    itgs: Itgs,
+    for_user_sub: str,
+    fmt: str,
+    given: str,
+    /,
+    *,
+    thumbhash_width: int,
+    thumbhash_height: int,
+) -> Any:
+    """Converts a value with one of the extension string formats for the
+    given user; used as the converter for realization plans
+    """
+    if fmt == "image_uid":
+        return await convert_image_uid(itgs, given, thumbhash_width, thumbhash_height)
+    if fmt == "content_uid":
+        return await convert_content_uid(itgs, given)
+    if fmt == "journey_uid":
+        return await convert_journey_uid(itgs, given, for_user_sub)
+    if fmt == "course_uid":
+        return await convert_course_uid(itgs, given, for_user_sub)
+    if fmt == "interactive_prompt_uid":
+        return await convert_interactive_prompt_uid(itgs, given, for_user_sub)
+    if fmt == "journal_entry_uid":
+        return await convert_journal_entry_uid(itgs, given, for_user_sub)
+    raise ValueError(f"unknown extension format {fmt}")
+
+
 async def convert_image_uid(
     itgs: Itgs, image_uid: str, thumbhash_width: int, thumbhash_height: int
 ) -> Any:
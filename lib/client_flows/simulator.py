@@ -10,6 +10,8 @@ from error_middleware import handle_contextless_error, handle_error
 from itgs import Itgs
 from lib.client_flows.client_flow_predicate import (
     CheckFlowPredicateContext,
+    FlowPredicateFacts,
+    check_compiled_flow_predicate,
     check_flow_predicate,
 )
 from lib.client_flows.client_flow_screen import (
@@ -295,14 +297,18 @@ async def simulate_add_screens(
 
     screen_stats = ClientScreenStatsPreparer(state.stats)
     assigned_current = False
+    predicate_facts = FlowPredicateFacts(
+        version=version,
+        queued_at=int(state.created_at),
+        account_created_at=user_created_at,
+        now=int(state.created_at),
+    )
     for idx, raw_flow_screen in enumerate(flow.screens):
-        if raw_flow_screen.rules.trigger is not None and await check_flow_predicate(
+        trigger = flow.compiled.screen_triggers[idx]
+        if trigger is not None and await check_compiled_flow_predicate(
             itgs,
-            raw_flow_screen.rules.trigger,
-            version=version,
-            queued_at=int(state.created_at),
-            account_created_at=user_created_at,
-            now=int(state.created_at),
+            trigger,
+            predicate_facts,
             user_sub=user_sub,
             ctx=state.flow_predicate_ctx,
         ):
@@ -760,15 +766,19 @@ async def fetch_and_simulate_trigger(
                 is_pop_trigger=is_pop_trigger,
             )
 
-    for rule in flow.rules:
-        if await check_flow_predicate(
+    predicate_facts = FlowPredicateFacts(
+        version=client_info.version,
+        queued_at=int(state.created_at),
+        account_created_at=client_info.user_created_at,
+        now=int(state.created_at),
+    )
+    for compiled_rule in flow.compiled.rules:
+        rule = compiled_rule.rule
+        if await check_compiled_flow_predicate(
             itgs,
-            rule.condition,
-            version=client_info.version,
+            compiled_rule.condition,
+            predicate_facts,
             user_sub=client_info.user_sub,
-            queued_at=int(state.created_at),
-            account_created_at=client_info.user_created_at,
-            now=int(state.created_at),
             ctx=state.flow_predicate_ctx,
         ):
             logger.debug(
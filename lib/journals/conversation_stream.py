@@ -2,7 +2,7 @@ import asyncio
 import gzip
 import logging
 import time
-from typing import Dict, List, Literal, Optional, Set, Union, cast
+from typing import AsyncGenerator, Dict, List, Literal, Optional, Set, Union, cast
 
 from error_middleware import handle_error
 from itgs import Itgs
@@ -10,6 +10,10 @@ from lib.journals.data_to_client import (
     DataToClientContext,
     get_journal_chat_job_voice_note_metadata,
 )
+from lib.journals.decrypt_items import (
+    DecryptedJournalEntryItem,
+    iter_decrypted_journal_entry_items,
+)
 from lib.journals.get_processing_block_for_text import get_processing_block_for_text
 from lib.journals.journal_entry_item_data import (
     JournalEntryItemData,
@@ -351,6 +355,7 @@ class JournalChatJobConversationStream:
         if queue is None:
             raise RuntimeError("queue not set")
 
+        decrypted_iter: Optional[AsyncGenerator[DecryptedJournalEntryItem, None]] = None
         try:
             async with Itgs() as itgs:
                 conn = await itgs.conn()
@@ -397,10 +402,11 @@ LIMIT ?
                         ),
                     )
 
-                    for row in response.results or []:
-                        row_uid = cast(str, row[0])
-                        row_entry_counter = cast(int, row[1])
-                        row_master_encrypted_data_base64url = cast(str, row[2])
+                    rows = response.results or []
+                    row_master_keys: List[
+                        GetJournalMasterKeyForEncryptionResultSuccess
+                    ] = []
+                    for row in rows:
                         row_master_key_uid = cast(str, row[3])
                         row_s3_key = cast(str, row[4])
 
@@ -430,16 +436,28 @@ LIMIT ?
                             master_key = master_key_raw
                             master_keys_by_uid[row_master_key_uid] = master_key_raw
 
+                        row_master_keys.append(master_key)
+
+                    decrypted_iter = iter_decrypted_journal_entry_items(
+                        [
+                            (row_master_key.journal_master_key, cast(str, row[2]))
+                            for row, row_master_key in zip(rows, row_master_keys)
+                        ]
+                    )
+                    for row in rows:
+                        row_uid = cast(str, row[0])
+                        row_entry_counter = cast(int, row[1])
+                        row_master_encrypted_data_base64url = cast(str, row[2])
+                        row_master_key_uid = cast(str, row[3])
+
+                        row_data = await decrypted_iter.__anext__()
+                        if isinstance(row_data, Exception):
+                            raise row_data
+
                         item = JournalEntryItem(
                             uid=row_uid,
                             entry_counter=row_entry_counter,
-                            data=JournalEntryItemData.model_validate_json(
-                                gzip.decompress(
-                                    master_key.journal_master_key.decrypt(
-                                        row_master_encrypted_data_base64url, ttl=None
-                                    )
-                                )
-                            ),
+                            data=row_data,
                         )
 
                         if (
@@ -575,6 +593,8 @@ WHERE
                         last_entry_counter = item.entry_counter
                         await queue.put(item)
 
+                    await decrypted_iter.aclose()
+
                     if need_retry_loop:
                         need_retry_loop = False
                         continue
@@ -591,6 +611,9 @@ WHERE
                 exc_info=e,
             )
             await queue.put(e)
+        finally:
+            if decrypted_iter is not None:
+                await decrypted_iter.aclose()
 
     async def _item_as_text(self, itgs: Itgs, /, *, item: JournalEntryItem) -> str:
         if item.data.data.type == "summary" and item.data.data.version == "v1":
@@ -28,10 +28,17 @@ from lib.journals.journal_entry_item_data import (
     MinimalJourneyInstructor,
 )
 from journeys.lib.read_one_external import read_one_external
+import lib.journals.journey_metadata_cache as journey_metadata_cache
+from lib.journals.journey_metadata_cache import (
+    SharedJourneyMetadata,
+    read_shared_journey_metadata,
+    write_shared_journey_metadata,
+)
 from lib.journals.master_keys import (
     get_journal_master_key_for_decryption,
     get_journal_master_key_from_s3,
 )
+from lib.journals.voice_note_transcripts import voice_note_transcript_dispatcher
 from lib.transcripts.model import Transcript as InternalTranscript, parse_vtt_transcript
 from response_utils import response_to_bytes
 import image_files.auth
@@ -232,11 +239,14 @@ async def _bulk_load_journeys(
     (e.g., the title, description, etc) with active eviction (allowing for long TTLs)
 
     This will handle loading all that user-specific information within one request.
-    For the metadata about the journey itself, it will use the existing helpers
-    that access that 2-layer cache (journeys.lib.read_one_external), so a _very_ cold start
-    may require N queries anyway - but only for the first user. After that, even restarting
-    the instances would only require N redis queries to refill the local cache rather than
-    N database queries.
+    The information that is the same for every user is kept in a process-wide
+    cache (lib.journals.journey_metadata_cache), so popular journeys usually only
+    need the user-specific queries. On a miss, the metadata about the journey itself
+    comes from the existing helpers that access the 2-layer cache
+    (journeys.lib.read_one_external), so a _very_ cold start may require N queries
+    anyway - but only for the first user. After that, even restarting the instances
+    would only require N redis queries to refill the local cache rather than N
+    database queries.
     """
 
     uids_for_user = [
@@ -245,24 +255,26 @@ async def _bulk_load_journeys(
     if not uids_for_user:
         return
 
-    candidate_uids_for_user: List[str] = []
-    metadata_uids_for_user: List[ExternalJourney] = []
-
+    shared_by_uid: Dict[str, SharedJourneyMetadata] = dict()
+    missing_uids: List[str] = []
     for uid in uids_for_user:
-        raw_resp = await read_one_external(itgs, journey_uid=uid, jwt="")
-        if raw_resp is None:
+        found, shared = read_shared_journey_metadata(uid)
+        if not found:
+            missing_uids.append(uid)
+        elif shared is None:
             ctx.memory_cached_journeys[uid] = None
-            continue
-
-        raw_bytes = await response_to_bytes(raw_resp)
-        raw = ExternalJourney.model_validate_json(raw_bytes)
+        else:
+            shared_by_uid[uid] = shared
 
-        candidate_uids_for_user.append(uid)
-        metadata_uids_for_user.append(raw)
+    if missing_uids:
+        await _bulk_load_shared_journeys(
+            itgs, ctx=ctx, uids=missing_uids, out=shared_by_uid
+        )
 
-    if not candidate_uids_for_user:
+    if not shared_by_uid:
         return
 
+    candidate_uids_for_user = list(shared_by_uid.keys())
     batch_cte = io.StringIO()
 
     batch_cte.write("WITH batch(uid) AS (VALUES (?)")
@@ -276,35 +288,6 @@ async def _bulk_load_journeys(
 
     response = await cursor.executeunified3(
         (
-            (  # get which ones just don't actually exist anymore
-                f"""
-{batch_cte_sql}
-SELECT uid FROM batch 
-WHERE 
-    NOT EXISTS (
-        SELECT 1 FROM journeys 
-        WHERE 
-            journeys.uid = batch.uid 
-            AND journeys.deleted_at IS NULL
-    )
-                """,
-                candidate_uids_for_user,
-            ),
-            (  # get instructor profile image file uids
-                f"""
-{batch_cte_sql}
-SELECT 
-    batch.uid AS a,
-    image_files.uid AS b
-FROM batch, journeys, instructors, image_files
-WHERE
-    journeys.uid = batch.uid
-    AND journeys.deleted_at IS NULL
-    AND journeys.instructor_id = instructors.id
-    AND instructors.picture_image_file_id = image_files.id
-                """,
-                candidate_uids_for_user,
-            ),
             (  # last taken at
                 f"""
 {batch_cte_sql}
@@ -338,6 +321,124 @@ WHERE
                 """,
                 (*candidate_uids_for_user, ctx.user_sub),
             ),
+        )
+    )
+    last_taken_at_response = response[0]
+    liked_at_response = response[1]
+
+    last_taken_ats = dict(
+        (cast(str, a), cast(float, b))
+        for a, b in (last_taken_at_response.results or [])
+    )
+    liked_ats = dict(
+        (cast(str, a), cast(float, b)) for a, b in (liked_at_response.results or [])
+    )
+
+    for row_uid, row_shared in shared_by_uid.items():
+        ctx.memory_cached_journeys[row_uid] = JourneyMemoryCachedData(
+            uid=row_shared.uid,
+            title=row_shared.title,
+            description=row_shared.description,
+            darkened_background=RefMemoryCachedData(
+                uid=row_shared.darkened_background_image_uid,
+                jwt=await image_files.auth.create_jwt(
+                    itgs, row_shared.darkened_background_image_uid
+                ),
+            ),
+            duration_seconds=row_shared.duration_seconds,
+            instructor=InstructorMemoryCachedData(
+                name=row_shared.instructor_name,
+                image=(
+                    None
+                    if row_shared.instructor_image_uid is None
+                    else RefMemoryCachedData(
+                        uid=row_shared.instructor_image_uid,
+                        jwt=await image_files.auth.create_jwt(
+                            itgs, row_shared.instructor_image_uid
+                        ),
+                    )
+                ),
+            ),
+            last_taken_at=last_taken_ats.get(row_uid),
+            liked_at=liked_ats.get(row_uid),
+            requires_pro=row_shared.requires_pro,
+        )
+
+
+async def _bulk_load_shared_journeys(
+    itgs: Itgs,
+    /,
+    *,
+    ctx: DataToClientContext,
+    uids: List[str],
+    out: Dict[str, SharedJourneyMetadata],
+) -> None:
+    """Loads the information about the journeys with the given uids which is the
+    same for every user, storing it in the process-wide cache and in `out`. Journeys
+    which do not exist are stored as None in the context instead of `out`.
+    """
+    fill_generation = journey_metadata_cache.generation
+    candidate_uids: List[str] = []
+    metadata_for_candidates: List[ExternalJourney] = []
+
+    for uid in uids:
+        raw_resp = await read_one_external(itgs, journey_uid=uid, jwt="")
+        if raw_resp is None:
+            ctx.memory_cached_journeys[uid] = None
+            write_shared_journey_metadata(uid, None, fill_generation=fill_generation)
+            continue
+
+        raw_bytes = await response_to_bytes(raw_resp)
+        raw = ExternalJourney.model_validate_json(raw_bytes)
+
+        candidate_uids.append(uid)
+        metadata_for_candidates.append(raw)
+
+    if not candidate_uids:
+        return
+
+    batch_cte = io.StringIO()
+
+    batch_cte.write("WITH batch(uid) AS (VALUES (?)")
+    for _ in range(1, len(candidate_uids)):
+        batch_cte.write(", (?)")
+    batch_cte.write(")")
+    batch_cte_sql = batch_cte.getvalue()
+
+    conn = await itgs.conn()
+    cursor = conn.cursor("weak")
+
+    response = await cursor.executeunified3(
+        (
+            (  # get which ones just don't actually exist anymore
+                f"""
+{batch_cte_sql}
+SELECT uid FROM batch 
+WHERE 
+    NOT EXISTS (
+        SELECT 1 FROM journeys 
+        WHERE 
+            journeys.uid = batch.uid 
+            AND journeys.deleted_at IS NULL
+    )
+                """,
+                candidate_uids,
+            ),
+            (  # get instructor profile image file uids
+                f"""
+{batch_cte_sql}
+SELECT 
+    batch.uid AS a,
+    image_files.uid AS b
+FROM batch, journeys, instructors, image_files
+WHERE
+    journeys.uid = batch.uid
+    AND journeys.deleted_at IS NULL
+    AND journeys.instructor_id = instructors.id
+    AND instructors.picture_image_file_id = image_files.id
+                """,
+                candidate_uids,
+            ),
             (  # requires pro
                 f"""
 {batch_cte_sql}
@@ -350,15 +451,13 @@ WHERE
     AND course_journeys.course_id = courses.id
     AND (courses.flags & 256) = 0
                 """,
-                candidate_uids_for_user,
+                candidate_uids,
             ),
         )
     )
     non_existing_uids_response = response[0]
     instructor_profile_image_uids_response = response[1]
-    last_taken_at_response = response[2]
-    liked_at_response = response[3]
-    requires_pro_response = response[4]
+    requires_pro_response = response[2]
 
     non_existing = set(
         cast(str, x) for (x,) in (non_existing_uids_response.results or [])
@@ -367,54 +466,28 @@ WHERE
         (cast(str, a), cast(str, b))
         for a, b in (instructor_profile_image_uids_response.results or [])
     )
-    last_taken_ats = dict(
-        (cast(str, a), cast(float, b))
-        for a, b in (last_taken_at_response.results or [])
-    )
-    liked_ats = dict(
-        (cast(str, a), cast(float, b)) for a, b in (liked_at_response.results or [])
-    )
     requires_pro = set(cast(str, x) for (x,) in (requires_pro_response.results or []))
 
-    for row_uid, row_raw in zip(candidate_uids_for_user, metadata_uids_for_user):
+    for row_uid, row_raw in zip(candidate_uids, metadata_for_candidates):
         if row_uid in non_existing:
             ctx.memory_cached_journeys[row_uid] = None
+            write_shared_journey_metadata(
+                row_uid, None, fill_generation=fill_generation
+            )
             continue
 
-        row_instructor_profile_image_uid = instructor_profile_image_uids.get(row_uid)
-        row_last_taken_at = last_taken_ats.get(row_uid)
-        row_liked_at = liked_ats.get(row_uid)
-        row_requires_pro = row_uid in requires_pro
-
-        result = JourneyMemoryCachedData(
+        shared = SharedJourneyMetadata(
             uid=row_raw.uid,
             title=row_raw.title,
             description=row_raw.description.text,
-            darkened_background=RefMemoryCachedData(
-                uid=row_raw.darkened_background_image.uid,
-                jwt=await image_files.auth.create_jwt(
-                    itgs, row_raw.darkened_background_image.uid
-                ),
-            ),
+            darkened_background_image_uid=row_raw.darkened_background_image.uid,
             duration_seconds=row_raw.duration_seconds,
-            instructor=InstructorMemoryCachedData(
-                name=row_raw.instructor.name,
-                image=(
-                    None
-                    if row_instructor_profile_image_uid is None
-                    else RefMemoryCachedData(
-                        uid=row_instructor_profile_image_uid,
-                        jwt=await image_files.auth.create_jwt(
-                            itgs, row_instructor_profile_image_uid
-                        ),
-                    )
-                ),
-            ),
-            last_taken_at=row_last_taken_at,
-            liked_at=row_liked_at,
-            requires_pro=row_requires_pro,
+            instructor_name=row_raw.instructor.name,
+            instructor_image_uid=instructor_profile_image_uids.get(row_uid),
+            requires_pro=row_uid in requires_pro,
         )
-        ctx.memory_cached_journeys[row_uid] = result
+        write_shared_journey_metadata(row_uid, shared, fill_generation=fill_generation)
+        out[row_uid] = shared
 
 
 async def _bulk_load_voice_notes(
@@ -442,11 +515,17 @@ async def _bulk_load_voice_notes(
         remaining_uids.remove(row.uid)
 
     low_latency_rows: List[Union[_VoiceNoteFromDBRow, _VoiceNoteFromRedis]] = []
-    for remaining_uid in list(remaining_uids):
-        logger.debug(f"trying to load fast {remaining_uid=}")
-        low_latency_row = await _low_latency_load_potentially_processing_voice_note(
-            itgs, ctx=ctx, voice_note_uid=remaining_uid
-        )
+    remaining_uids_list = list(remaining_uids)
+    logger.debug(f"trying to load fast {remaining_uids_list=}")
+    low_latency_results = await asyncio.gather(
+        *[
+            _low_latency_load_potentially_processing_voice_note(
+                itgs, ctx=ctx, voice_note_uid=remaining_uid
+            )
+            for remaining_uid in remaining_uids_list
+        ]
+    )
+    for remaining_uid, low_latency_row in zip(remaining_uids_list, low_latency_results):
         if low_latency_row is not None:
             remaining_uids.remove(remaining_uid)
             low_latency_rows.append(low_latency_row)
@@ -563,13 +642,11 @@ async def _low_latency_load_potentially_processing_voice_note(
 
     started_at = time.time()
     redis = await itgs.redis()
-    pubsub = redis.pubsub()
+    ready_future = voice_note_transcript_dispatcher.register(voice_note_uid)
     try:
-        await pubsub.subscribe(b"ps:voice_notes:transcripts:" + voice_note_uid_bytes)
-
-        message_task = asyncio.create_task(
-            pubsub.get_message(ignore_subscribe_messages=True, timeout=5)
-        )
+        # if this times out we still find the transcript by polling redis below,
+        # just with more latency
+        await voice_note_transcript_dispatcher.wait_subscribed(timeout=1)
 
         while True:
             (
@@ -596,7 +673,6 @@ async def _low_latency_load_potentially_processing_voice_note(
                 )
                 # not in redis; either it's in the db at weak consistency or it doesn't exist anywhere
                 # (NOTE: the order we checked is important as we know it can go redis -> db but not db -> redis)
-                await _safe_cancel(message_task)
                 db_load = await _batch_load_voice_notes_from_db(
                     itgs,
                     ctx=ctx,
@@ -610,7 +686,6 @@ async def _low_latency_load_potentially_processing_voice_note(
                     f"fast load for {voice_note_uid=} stopping early: not for this user"
                 )
                 # weird this voice note isn't for the right user, treat it like it doesn't exist anywhere
-                await _safe_cancel(message_task)
                 return None
 
             if (
@@ -621,7 +696,6 @@ async def _low_latency_load_potentially_processing_voice_note(
                 logger.debug(
                     f"fast load for {voice_note_uid=} found transcript in redis"
                 )
-                await _safe_cancel(message_task)
                 return _VoiceNoteFromRedis(
                     src="redis",
                     uid=voice_note_uid,
@@ -634,9 +708,10 @@ async def _low_latency_load_potentially_processing_voice_note(
                     ),
                 )
 
-            logger.debug(f"fast load for {voice_note_uid=} waiting for message task")
-            message = await message_task
-            if message is None:
+            logger.debug(f"fast load for {voice_note_uid=} waiting for transcript")
+            try:
+                ready = await asyncio.wait_for(asyncio.shield(ready_future), timeout=5)
+            except asyncio.TimeoutError:
                 if time.time() - started_at > max_stall_time:
                     # we've waited too long for the voice note to finish processing
                     await handle_warning(
@@ -644,59 +719,18 @@ async def _low_latency_load_potentially_processing_voice_note(
                         f"Voice note `{voice_note_uid}` has been processing for too long to retrieve",
                     )
                     return None
-                message_task = asyncio.create_task(
-                    pubsub.get_message(ignore_subscribe_messages=True, timeout=5)
-                )
                 continue
 
             logger.info(f"fast load for {voice_note_uid=} got message")
-
-            msg_data = cast(bytes, message.get("data"))
-            assert isinstance(msg_data, bytes), msg_data
-            msg = io.BytesIO(msg_data)
-
-            msg_voice_note_uid_length = int.from_bytes(msg.read(4), "big", signed=False)
-            msg_voice_note_uid_bytes = msg.read(msg_voice_note_uid_length)
-            msg_journal_master_key_uid_length = int.from_bytes(
-                msg.read(4), "big", signed=False
-            )
-            msg_journal_master_key_uid = msg.read(
-                msg_journal_master_key_uid_length
-            ).decode("utf-8")
-            msg_encrypted_vtt_transcript_length = int.from_bytes(
-                msg.read(8), "big", signed=False
-            )
-            msg_encrypted_vtt_transcript = msg.read(
-                msg_encrypted_vtt_transcript_length
-            ).decode("utf-8")
-
-            assert msg_voice_note_uid_bytes == voice_note_uid_bytes, (
-                msg_voice_note_uid_bytes,
-                voice_note_uid_bytes,
-            )
             return _VoiceNoteFromRedis(
                 src="redis",
                 uid=voice_note_uid,
-                journal_master_key_uid=msg_journal_master_key_uid,
+                journal_master_key_uid=ready.journal_master_key_uid,
                 master_key_s3_file_key=None,
-                encrypted_vtt_transcript=msg_encrypted_vtt_transcript,
+                encrypted_vtt_transcript=ready.encrypted_vtt_transcript,
             )
     finally:
-        await pubsub.aclose()
-
-
-async def _safe_cancel(task: asyncio.Task) -> None:
-    if not task.cancel():
-        return
-
-    try:
-        await task
-    except asyncio.CancelledError:
-        # PY 3.11
-        # current_task = asyncio.current_task()
-        # if current_task is not None and current_task.cancelling() > 0:
-        #     raise
-        ...
+        voice_note_transcript_dispatcher.unregister(voice_note_uid, ready_future)
 
 
 async def _batch_load_voice_notes_from_db(
@@ -0,0 +1,145 @@
+"""Decrypts journal entry items off the event loop. Decrypting, decompressing and
+parsing a single journal entry item is cheap, but a long journal entry can have
+enough items that doing it inline blocks every other request on this instance
+for a noticeable amount of time.
+"""
+
+import asyncio
+import gzip
+from typing import AsyncGenerator, List, Sequence, Tuple, Union
+
+import cryptography.fernet
+from starlette.concurrency import run_in_threadpool
+
+from lib.journals.journal_entry_item_data import JournalEntryItemData
+
+
+INLINE_MAX_ITEMS = 4
+"""Up to this many journal entry items are decrypted directly on the event loop,
+provided they are also within `INLINE_MAX_BYTES`, since handing them to the
+worker pool would cost more than decrypting them
+"""
+
+INLINE_MAX_BYTES = 16 * 1024
+"""The maximum total size of the encrypted tokens, in bytes, for journal entry
+items to be decrypted directly on the event loop
+"""
+
+DECRYPT_BATCH_SIZE = 8
+"""The maximum number of journal entry items decrypted in a single call on the
+worker pool; larger batches have less overhead but delay the first result
+"""
+
+MAX_CONCURRENT_BATCHES = 4
+"""The maximum number of batches we hand to the worker pool at once for a single
+call to `iter_decrypted_journal_entry_items`
+"""
+
+EncryptedJournalEntryItem = Tuple[cryptography.fernet.Fernet, str]
+"""The journal master key to use and the base64url encoded fernet token
+containing the gzip-compressed json-encoded `JournalEntryItemData`
+"""
+
+DecryptedJournalEntryItem = Union[JournalEntryItemData, Exception]
+"""Either the decrypted item or the exception raised trying to decrypt it"""
+
+
+def decrypt_journal_entry_item_sync(
+    journal_master_key: cryptography.fernet.Fernet, master_encrypted_data: str
+) -> JournalEntryItemData:
+    """Decrypts, decompresses, and parses the given journal entry item. This is
+    cpu-bound and should not be called on the event loop for more than a handful
+    of items.
+    """
+    return JournalEntryItemData.model_validate_json(
+        gzip.decompress(journal_master_key.decrypt(master_encrypted_data, ttl=None))
+    )
+
+
+def should_decrypt_inline(items: Sequence[EncryptedJournalEntryItem]) -> bool:
+    """Determines if the given journal entry items are few and small enough that
+    decrypting them on the event loop is cheaper than using the worker pool
+    """
+    if len(items) > INLINE_MAX_ITEMS:
+        return False
+
+    total_bytes = 0
+    for _, master_encrypted_data in items:
+        total_bytes += len(master_encrypted_data)
+        if total_bytes > INLINE_MAX_BYTES:
+            return False
+    return True
+
+
+def _decrypt_batch_sync(
+    batch: Sequence[EncryptedJournalEntryItem],
+) -> List[DecryptedJournalEntryItem]:
+    result: List[DecryptedJournalEntryItem] = []
+    for journal_master_key, master_encrypted_data in batch:
+        try:
+            result.append(
+                decrypt_journal_entry_item_sync(
+                    journal_master_key, master_encrypted_data
+                )
+            )
+        except Exception as e:
+            result.append(e)
+    return result
+
+
+async def iter_decrypted_journal_entry_items(
+    items: Sequence[EncryptedJournalEntryItem],
+) -> AsyncGenerator[DecryptedJournalEntryItem, None]:
+    """Decrypts the given journal entry items on the worker pool, yielding the
+    results in the same order as the items as soon as they are available.
+    Failing to decrypt an item yields the exception rather than raising it so
+    that the caller can decide how to handle it. If there are only a few small
+    items (see `should_decrypt_inline`), they are decrypted on the event loop
+    instead.
+
+    Callers which stop iterating early should `aclose()` the iterator so that
+    any batches not yet started are cancelled.
+    """
+    if not items:
+        return
+
+    if should_decrypt_inline(items):
+        for decrypted in _decrypt_batch_sync(items):
+            yield decrypted
+        return
+
+    batches = [
+        items[start : start + DECRYPT_BATCH_SIZE]
+        for start in range(0, len(items), DECRYPT_BATCH_SIZE)
+    ]
+    pending: List[asyncio.Task[List[DecryptedJournalEntryItem]]] = []
+    next_batch_idx = 0
+    try:
+        while next_batch_idx < len(batches) or pending:
+            while (
+                next_batch_idx < len(batches) and len(pending) < MAX_CONCURRENT_BATCHES
+            ):
+                pending.append(
+                    asyncio.create_task(
+                        run_in_threadpool(_decrypt_batch_sync, batches[next_batch_idx])
+                    )
+                )
+                next_batch_idx += 1
+
+            batch_result = await pending.pop(0)
+            for decrypted in batch_result:
+                yield decrypted
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+
+async def decrypt_journal_entry_items(
+    items: Sequence[EncryptedJournalEntryItem],
+) -> List[DecryptedJournalEntryItem]:
+    """Decrypts the given journal entry items on the worker pool, returning the
+    results in the same order as the items. See `iter_decrypted_journal_entry_items`
+    """
+    return [decrypted async for decrypted in iter_decrypted_journal_entry_items(items)]
@@ -0,0 +1,147 @@
+"""A process-wide cache of the parts of journeys needed by `data_to_client`
+which are the same for every user (title, instructor, duration, image uids,
+etc). Per-user information (e.g., when the user last took the journey) and
+JWTs are never stored here.
+
+Entries are evicted whenever the journey is evicted from the external journey
+cache (see `journeys.lib.read_one_external.evict_external_journey`), and
+otherwise expire after a short ttl to pick up changes which don't evict the
+journey, such as an instructor changing their profile picture.
+"""
+
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+import io
+import time
+from typing import Optional, Tuple
+
+from error_middleware import handle_error
+from journeys.lib.read_one_external import JourneysExternalPushCachePubSubMessage
+from lifespan import lifespan_handler
+import perpetual_pub_sub as pps
+
+
+CACHE_TTL_SECONDS = 60 * 5
+"""How long a journey is kept in memory after it was loaded"""
+
+MAX_CACHED_JOURNEYS = 2048
+"""The maximum number of journeys kept in memory at once; the least recently
+used journeys are evicted first
+"""
+
+
+@dataclass
+class SharedJourneyMetadata:
+    """The information about a journey needed by `data_to_client` that does not
+    depend on the user
+    """
+
+    uid: str
+    """The unique identifier for the journey"""
+    title: str
+    """The title of the journey"""
+    description: str
+    """The description of the journey"""
+    darkened_background_image_uid: str
+    """The uid of the darkened background image file for the journey"""
+    duration_seconds: float
+    """The duration of the audio portion of the journey in seconds"""
+    instructor_name: str
+    """The name of the instructor"""
+    instructor_image_uid: Optional[str]
+    """The uid of the instructors profile image file, if they have one"""
+    requires_pro: bool
+    """True if only pro users can access this journey"""
+
+
+_journeys: "OrderedDict[str, Tuple[Optional[SharedJourneyMetadata], float]]" = (
+    OrderedDict()
+)
+"""Maps from journey uid to the metadata (None if the journey does not exist)
+and when the entry expires
+"""
+
+generation: int = 0
+"""Incremented whenever any entry is evicted. Fills should capture this before
+they start loading and pass it to `write_shared_journey_metadata`, so that a
+fill which raced an eviction is not stored
+"""
+
+
+def read_shared_journey_metadata(
+    uid: str, /
+) -> Tuple[bool, Optional[SharedJourneyMetadata]]:
+    """Returns (True, metadata) if the journey with the given uid is cached,
+    where metadata is None if the journey does not exist, otherwise (False, None)
+
+    O(1)
+    """
+    entry = _journeys.get(uid)
+    if entry is None:
+        return False, None
+
+    if entry[1] <= time.time():
+        del _journeys[uid]
+        return False, None
+
+    _journeys.move_to_end(uid)
+    return True, entry[0]
+
+
+def write_shared_journey_metadata(
+    uid: str, metadata: Optional[SharedJourneyMetadata], /, *, fill_generation: int
+) -> None:
+    """Stores the metadata for the journey with the given uid, unless an
+    eviction occurred since `fill_generation` was captured
+
+    O(1)
+    """
+    if fill_generation != generation:
+        return
+
+    _journeys[uid] = (metadata, time.time() + CACHE_TTL_SECONDS)
+    _journeys.move_to_end(uid)
+    while len(_journeys) > MAX_CACHED_JOURNEYS:
+        _journeys.popitem(last=False)
+
+
+def evict_shared_journey_metadata(uid: str, /) -> None:
+    """Removes the journey with the given uid from this instance"""
+    global generation
+    generation += 1
+    _journeys.pop(uid, None)
+
+
+async def _subscribe_journey_evictions() -> None:
+    assert pps.instance is not None
+    try:
+        async with pps.PPSSubscription(
+            pps.instance, "ps:journeys:external:push_cache", "jmc-evict"
+        ) as sub:
+            async for raw_message_bytes in sub:
+                raw_message = io.BytesIO(raw_message_bytes)
+                initial_part_length = int.from_bytes(
+                    raw_message.read(4), "big", signed=False
+                )
+                message = JourneysExternalPushCachePubSubMessage.model_validate_json(
+                    raw_message.read(initial_part_length)
+                )
+                if not message.have_updated:
+                    # have_updated messages are just other instances sharing
+                    # a fill, which always follows an eviction
+                    evict_shared_journey_metadata(message.uid)
+    except Exception as e:
+        if pps.instance.exit_event.is_set() and isinstance(e, pps.PPSShutdownException):
+            return
+        await handle_error(e)
+    finally:
+        print(
+            "lib.journals.journey_metadata_cache#_subscribe_journey_evictions exiting"
+        )
+
+
+@lifespan_handler
+async def _do_subscribe_journey_evictions():
+    task = asyncio.create_task(_subscribe_journey_evictions())
+    yield
@@ -0,0 +1,182 @@
+"""An in-memory cache of parsed journal master keys, which avoids downloading the
+key from s3 on every journal operation. Keys are never written to disk, are only
+kept for a short time, and are purged on every instance when the user is deleted
+or their keys are rotated.
+
+This only replaces the s3 download; callers still verify via the database that
+the key exists and belongs to the user before using a cached key.
+"""
+
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+import io
+import time
+from typing import Optional
+
+import cryptography.fernet
+
+from error_middleware import handle_error
+from itgs import Itgs
+from lifespan import lifespan_handler
+import perpetual_pub_sub as pps
+
+
+CACHE_TTL_SECONDS = 60 * 15
+"""How long a journal master key is kept in memory after it was downloaded"""
+
+MAX_CACHED_KEYS = 1024
+"""The maximum number of journal master keys kept in memory at once; the least
+recently used keys are evicted first
+"""
+
+
+@dataclass
+class CachedJournalMasterKey:
+    user_sub: str
+    """The sub of the user who owned the key when it was cached"""
+    journal_master_key: cryptography.fernet.Fernet
+    """The parsed key"""
+    journal_master_key_data: bytes
+    """The raw key data"""
+    expires_at: float
+    """When this entry should no longer be used, in seconds since the epoch"""
+
+
+@dataclass
+class JournalMasterKeyCacheStats:
+    hits: int = 0
+    """How many lookups were answered from memory"""
+    misses: int = 0
+    """How many lookups were not in memory (including expired entries)"""
+    expired: int = 0
+    """How many entries were discarded because they outlived the ttl"""
+    evicted: int = 0
+    """How many entries were discarded to stay within the size cap"""
+    purged: int = 0
+    """How many entries were discarded because of a purge message"""
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        """The fraction of lookups answered from memory, or None if there were none"""
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else None
+
+
+_keys: "OrderedDict[str, CachedJournalMasterKey]" = OrderedDict()
+stats = JournalMasterKeyCacheStats()
+
+
+def read_journal_master_key_from_cache(
+    *, journal_master_key_uid: str, user_sub: str
+) -> Optional[CachedJournalMasterKey]:
+    """Returns the cached journal master key with the given uid if it's in memory,
+    hasn't expired, and was owned by the given user when it was cached.
+
+    O(1)
+    """
+    entry = _keys.get(journal_master_key_uid)
+    if entry is None or entry.user_sub != user_sub:
+        stats.misses += 1
+        return None
+
+    if entry.expires_at <= time.time():
+        del _keys[journal_master_key_uid]
+        stats.expired += 1
+        stats.misses += 1
+        return None
+
+    _keys.move_to_end(journal_master_key_uid)
+    stats.hits += 1
+    return entry
+
+
+def write_journal_master_key_to_cache(
+    *,
+    journal_master_key_uid: str,
+    user_sub: str,
+    journal_master_key: cryptography.fernet.Fernet,
+    journal_master_key_data: bytes,
+) -> None:
+    """Stores the given journal master key in memory, evicting the least recently
+    used keys if the cache is full.
+
+    O(1)
+    """
+    _keys[journal_master_key_uid] = CachedJournalMasterKey(
+        user_sub=user_sub,
+        journal_master_key=journal_master_key,
+        journal_master_key_data=journal_master_key_data,
+        expires_at=time.time() + CACHE_TTL_SECONDS,
+    )
+    _keys.move_to_end(journal_master_key_uid)
+    while len(_keys) > MAX_CACHED_KEYS:
+        _keys.popitem(last=False)
+        stats.evicted += 1
+
+
+def get_journal_master_key_cache_stats() -> JournalMasterKeyCacheStats:
+    """Returns a copy of the hit statistics for the journal master key cache on
+    this instance
+    """
+    return JournalMasterKeyCacheStats(
+        hits=stats.hits,
+        misses=stats.misses,
+        expired=stats.expired,
+        evicted=stats.evicted,
+        purged=stats.purged,
+    )
+
+
+async def purge_journal_master_keys_for_user(itgs: Itgs, /, *, user_sub: str) -> None:
+    """Purges every cached journal master key for the user with the given sub from
+    every instance. Should be used whenever a users journal master keys are rotated
+    or deleted.
+    """
+    encoded_sub = user_sub.encode("utf-8")
+    redis = await itgs.redis()
+    await redis.publish(
+        b"ps:journal_master_keys:purge",
+        len(encoded_sub).to_bytes(4, "big", signed=False) + encoded_sub,
+    )
+
+
+def handle_received_journal_master_keys_purge(*, user_sub: str) -> None:
+    """Removes every cached journal master key for the user with the given sub
+    from this instance
+
+    O(n)
+    """
+    to_remove = [uid for uid, entry in _keys.items() if entry.user_sub == user_sub]
+    for uid in to_remove:
+        del _keys[uid]
+    stats.purged += len(to_remove)
+
+
+async def _subscribe_journal_master_key_purges() -> None:
+    assert pps.instance is not None
+    try:
+        async with pps.PPSSubscription(
+            pps.instance,
+            "ps:journal_master_keys:purge",
+            "subscribe_journal_master_key_purges",
+        ) as sub:
+            async for message in sub:
+                msg = io.BytesIO(message)
+                sub_len = int.from_bytes(msg.read(4), "big", signed=False)
+                user_sub = msg.read(sub_len).decode("utf-8")
+                handle_received_journal_master_keys_purge(user_sub=user_sub)
+    except Exception as e:
+        if pps.instance.exit_event.is_set() and isinstance(e, pps.PPSShutdownException):
+            return
+        await handle_error(e)
+    finally:
+        print(
+            "lib.journals.master_key_cache#_subscribe_journal_master_key_purges exiting"
+        )
+
+
+@lifespan_handler
+async def _do_subscribe_journal_master_key_purges():
+    task = asyncio.create_task(_subscribe_journal_master_key_purges())
+    yield
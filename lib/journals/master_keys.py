@@ -6,6 +6,10 @@ from itgs import Itgs
 from typing import Literal, Union, cast
 from dataclasses import dataclass
 import cryptography.fernet
+from lib.journals.master_key_cache import (
+    read_journal_master_key_from_cache,
+    write_journal_master_key_to_cache,
+)
 
 
 @dataclass
@@ -267,12 +271,19 @@ WHERE
     assert (
         response[2].rows_affected is not None and response[2].rows_affected > 0
     ), response
+    new_key = cryptography.fernet.Fernet(new_key_data)
+    write_journal_master_key_to_cache(
+        journal_master_key_uid=new_key_uid,
+        user_sub=user_sub,
+        journal_master_key=new_key,
+        journal_master_key_data=new_key_data,
+    )
     return GetJournalMasterKeyForEncryptionResultSuccess(
         type="success",
         fresh=True,
         user_sub=user_sub,
         journal_master_key_uid=new_key_uid,
-        journal_master_key=cryptography.fernet.Fernet(new_key_data),
+        journal_master_key=new_key,
         journal_master_key_data=new_key_data,
     )
 
@@ -290,7 +301,9 @@ async def get_journal_master_key_from_s3(
     GetJournalMasterKeyForEncryptionResultParseError,
     GetJournalMasterKeyForEncryptionResultLost,
 ]:
-    """Fetches the journal master key with the given uid from s3
+    """Fetches the journal master key with the given uid from s3, or from the
+    in-memory cache if it was recently fetched for the same user. The caller is
+    responsible for verifying that the key belongs to the user.
 
     Args:
         itgs (Itgs): the integrations to (re)use
@@ -299,6 +312,19 @@ async def get_journal_master_key_from_s3(
         user_sub (str): the sub of the user that owns the master key at the given s3 file
         s3_key (str): the key in s3 where the journal master key is stored
     """
+    cached = read_journal_master_key_from_cache(
+        journal_master_key_uid=user_journal_master_key_uid, user_sub=user_sub
+    )
+    if cached is not None:
+        return GetJournalMasterKeyForEncryptionResultSuccess(
+            type="success",
+            fresh=False,
+            user_sub=user_sub,
+            journal_master_key_uid=user_journal_master_key_uid,
+            journal_master_key=cached.journal_master_key,
+            journal_master_key_data=cached.journal_master_key_data,
+        )
+
     files = await itgs.files()
     key_reader = io.BytesIO()
     try:
@@ -331,6 +357,12 @@ async def get_journal_master_key_from_s3(
             exc=e,
         )
 
+    write_journal_master_key_to_cache(
+        journal_master_key_uid=user_journal_master_key_uid,
+        user_sub=user_sub,
+        journal_master_key=key,
+        journal_master_key_data=key_data,
+    )
     return GetJournalMasterKeyForEncryptionResultSuccess(
         type="success",
         fresh=False,
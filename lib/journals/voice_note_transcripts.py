@@ -0,0 +1,175 @@
+"""Allows waiting for the transcript of a voice note which is still processing
+without opening a redis connection per voice note. A single dedicated pubsub
+connection pattern-subscribes to `ps:voice_notes:transcripts:*` while anyone
+on this instance is waiting, and hands the transcript to every waiter for
+that voice note.
+
+This is not a replacement for checking `voice_notes:processing:{uid}` or the
+database: messages sent before the subscription was established are missed,
+so callers should register, wait for the subscription, and then check redis,
+and should keep polling in case the dedicated connection is lost.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import io
+import time
+from typing import Dict, List, Optional
+
+from error_middleware import handle_error
+from itgs import Itgs
+from loguru import logger
+
+
+TRANSCRIPTS_CHANNEL_PATTERN = b"ps:voice_notes:transcripts:*"
+"""The pattern matching the channels transcripts are published to"""
+
+IDLE_TIMEOUT_SECONDS = 60
+"""How long we keep the subscription open after the last waiter leaves, so that
+bursts of journal requests don't reconnect each time
+"""
+
+
+@dataclass
+class VoiceNoteTranscriptReady:
+    voice_note_uid: str
+    """The uid of the voice note whose transcript is ready"""
+    journal_master_key_uid: str
+    """The uid of the journal master key used to encrypt the transcript"""
+    encrypted_vtt_transcript: str
+    """The vtt transcript, encrypted with the journal master key"""
+
+
+def parse_voice_note_transcript_message(data: bytes) -> VoiceNoteTranscriptReady:
+    """Parses a message sent to `ps:voice_notes:transcripts:{uid}`"""
+    msg = io.BytesIO(data)
+
+    voice_note_uid_length = int.from_bytes(msg.read(4), "big", signed=False)
+    voice_note_uid = msg.read(voice_note_uid_length).decode("utf-8")
+    journal_master_key_uid_length = int.from_bytes(msg.read(4), "big", signed=False)
+    journal_master_key_uid = msg.read(journal_master_key_uid_length).decode("utf-8")
+    encrypted_vtt_transcript_length = int.from_bytes(msg.read(8), "big", signed=False)
+    encrypted_vtt_transcript = msg.read(encrypted_vtt_transcript_length).decode("utf-8")
+    return VoiceNoteTranscriptReady(
+        voice_note_uid=voice_note_uid,
+        journal_master_key_uid=journal_master_key_uid,
+        encrypted_vtt_transcript=encrypted_vtt_transcript,
+    )
+
+
+class VoiceNoteTranscriptDispatcher:
+    """Shares one redis pubsub connection between everyone on this instance who
+    is waiting for a voice note transcript. Not thread-safe; use from the main
+    event loop only.
+    """
+
+    def __init__(self) -> None:
+        self.waiters: Dict[str, List["asyncio.Future[VoiceNoteTranscriptReady]"]] = {}
+        """The futures to resolve when the transcript for a voice note arrives,
+        keyed by voice note uid
+        """
+
+        self.task: Optional[asyncio.Task] = None
+        """The task holding the subscription, if it's running"""
+
+        self.subscribed: Optional[asyncio.Event] = None
+        """Set while the current task is subscribed"""
+
+    def register(
+        self, voice_note_uid: str
+    ) -> "asyncio.Future[VoiceNoteTranscriptReady]":
+        """Returns a future which resolves when the transcript for the voice note
+        with the given uid is published, starting the subscription if necessary.
+        The caller must call `unregister` when it's no longer waiting.
+        """
+        future: "asyncio.Future[VoiceNoteTranscriptReady]" = (
+            asyncio.get_running_loop().create_future()
+        )
+        self.waiters.setdefault(voice_note_uid, []).append(future)
+        if self.task is None:
+            self.subscribed = asyncio.Event()
+            self.task = asyncio.create_task(self._run(self.subscribed))
+        return future
+
+    def unregister(
+        self,
+        voice_note_uid: str,
+        future: "asyncio.Future[VoiceNoteTranscriptReady]",
+    ) -> None:
+        """Stops waiting on a future returned from `register`"""
+        waiters = self.waiters.get(voice_note_uid)
+        if waiters is not None:
+            try:
+                waiters.remove(future)
+            except ValueError:
+                pass
+            if not waiters:
+                del self.waiters[voice_note_uid]
+        future.cancel()
+
+    async def wait_subscribed(self, *, timeout: float) -> bool:
+        """Waits up to the given number of seconds for the subscription to be
+        established, returning True if it was and False otherwise
+        """
+        subscribed = self.subscribed
+        if subscribed is None:
+            return False
+        try:
+            await asyncio.wait_for(subscribed.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _resolve(self, ready: VoiceNoteTranscriptReady) -> None:
+        for future in self.waiters.pop(ready.voice_note_uid, []):
+            if not future.done():
+                future.set_result(ready)
+
+    async def _run(self, subscribed: asyncio.Event) -> None:
+        try:
+            while True:
+                try:
+                    async with Itgs() as itgs:
+                        redis = await itgs.redis()
+                        pubsub = redis.pubsub()
+                        try:
+                            await pubsub.psubscribe(TRANSCRIPTS_CHANNEL_PATTERN)
+                            subscribed.set()
+                            idle_since: Optional[float] = None
+                            while True:
+                                message = await pubsub.get_message(
+                                    ignore_subscribe_messages=True, timeout=5
+                                )
+                                if message is not None:
+                                    data = message.get("data")
+                                    if isinstance(data, bytes):
+                                        self._resolve(
+                                            parse_voice_note_transcript_message(data)
+                                        )
+
+                                if self.waiters:
+                                    idle_since = None
+                                elif idle_since is None:
+                                    idle_since = time.time()
+                                elif time.time() - idle_since > IDLE_TIMEOUT_SECONDS:
+                                    # detach synchronously so the next register
+                                    # starts a fresh task rather than relying
+                                    # on this one while it closes
+                                    self.task = None
+                                    return
+                        finally:
+                            subscribed.clear()
+                            await pubsub.aclose()
+                except Exception as e:
+                    await handle_error(e, extra_info="voice note transcript dispatcher")
+                    if not self.waiters:
+                        return
+                    await asyncio.sleep(1)
+        finally:
+            if self.task is asyncio.current_task():
+                self.task = None
+            logger.debug("voice note transcript dispatcher exiting")
+
+
+voice_note_transcript_dispatcher = VoiceNoteTranscriptDispatcher()
+"""The dispatcher for this instance"""
@@ -46,6 +46,7 @@ import journeys.lib.read_one_external
 import interactive_prompts.routes.profile_pictures
 import interactive_prompts.lib.read_one_external
 import interactive_prompts.lib.read_interactive_prompt_meta
+import interactive_prompts.lib.event_buffer
 import admin.notifs.routes.read_daily_push_tokens
 import admin.notifs.routes.read_daily_push_tickets
 import admin.notifs.routes.read_daily_push_receipts
@@ -124,6 +125,11 @@ async def register_background_tasks():
             interactive_prompts.lib.read_interactive_prompt_meta.cache_push_loop()
         )
     )
+    background_tasks.add(
+        asyncio.create_task(
+            interactive_prompts.lib.event_buffer.sweep_buffered_events_forever()
+        )
+    )
     personalization.register_background_tasks.register_background_tasks(
         background_tasks
     )
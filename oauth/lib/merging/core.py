@@ -27,6 +27,7 @@ from lib.daily_reminders.registration_stats import (
     Channel,
     DailyReminderRegistrationStatsPreparer,
 )
+from lib.client_flows.queue_head_cache import evict_client_screen_queue_head
 from lib.daily_reminders.setting_stats import DailyReminderTimeRange
 from oauth.lib.merging.operation_order import OperationOrder
 from oauth.lib.merging.query import MergeContext, MergeQuery
@@ -815,11 +816,12 @@ async def _delete_user_client_screens(
     logged: Optional[bool] = None
     logged_original_rows: Optional[int] = None
     logged_merging_rows: Optional[int] = None
+    logged_merging_user_sub: Optional[str] = None
 
     async def handler(
         step: Literal["log", "delete_original", "delete_merging"], mctx: MergeContext
     ):
-        nonlocal logged, logged_original_rows, logged_merging_rows
+        nonlocal logged, logged_original_rows, logged_merging_rows, logged_merging_user_sub
 
         if step == "log":
             if not mctx.merging_expected:
@@ -858,9 +860,11 @@ async def _delete_user_client_screens(
 
             logged_original_rows = parsed_reason["context"]["original_rows"]
             logged_merging_rows = parsed_reason["context"]["merging_rows"]
+            logged_merging_user_sub = parsed_reason["context"]["merging_user_sub"]
 
             assert isinstance(logged_original_rows, int), response
             assert isinstance(logged_merging_rows, int), response
+            assert isinstance(logged_merging_user_sub, str), response
             assert logged_original_rows >= 0, response
             assert logged_merging_rows >= 0, response
             assert logged_original_rows + logged_merging_rows > 0, response
@@ -890,6 +894,7 @@ async def _delete_user_client_screens(
                 + str(logged_original_rows).encode("ascii")
                 + b" rows \n"
             )
+            await evict_client_screen_queue_head(itgs, user_sub=octx.original_user_sub)
         elif step == "delete_merging":
             if not mctx.merging_expected:
                 assert (
@@ -916,10 +921,12 @@ async def _delete_user_client_screens(
                 + str(logged_merging_rows).encode("ascii")
                 + b" rows \n"
             )
+            assert logged_merging_user_sub is not None
+            await evict_client_screen_queue_head(itgs, user_sub=logged_merging_user_sub)
         else:
             assert False, step
 
-    ctes, ctes_qargs = _merging_user_and_original_user_ctes(octx)
+    ctes, ctes_qargs = _merging_user_and_original_user_ctes(octx, merging_user_sub=True)
     return [
         MergeQuery(
             query=(
@@ -931,6 +938,7 @@ async def _delete_user_client_screens(
                 "  '{}'"
                 "  , '$.context.original_rows', (SELECT COUNT(*) FROM user_client_screens WHERE user_id = original_user.id)"
                 "  , '$.context.merging_rows', (SELECT COUNT(*) FROM user_client_screens WHERE user_id = merging_user.id)"
+                "  , '$.context.merging_user_sub', merging_user.sub"
                 " ), ? "
                 "FROM merging_user, original_user "
                 "WHERE"
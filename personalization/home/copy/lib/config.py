@@ -1,9 +1,9 @@
 import asyncio
-import io
 import random
 from typing import (
     Callable,
     Dict,
+    FrozenSet,
     Iterable,
     List,
     Optional,
@@ -18,7 +18,6 @@ from personalization.home.copy.lib.context import (
     HomescreenCopyContext,
 )
 from users.lib.time_of_day import get_time_of_day
-from users.lib.streak import read_user_streak
 import hashlib
 import base64
 import unix_dates
@@ -44,10 +43,24 @@ class HomescreenHeadlineGenerator(Protocol):
     """Describes something which can incorporate homescreen context to generate
     a headline, unless the context doesn't make sense for this generator, in which
     case it returns None.
+
+    Generators don't perform any io: everything they depend on is fetched in
+    advance and provided via the context, which means the tree of generators can
+    be evaluated without yielding to the event loop.
+    """
+
+    slugs: FrozenSet[str]
+    """The slugs of the headlines this generator may return (not including
+    composed slugs)
+    """
+
+    seen_slugs: FrozenSet[str]
+    """The slugs whose counts within `HomescreenCopyContext.seen_counts` this
+    generator (or any of its descendants) depends on
     """
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
-        """A faster, non-concurrent check to see if this generator will return a value.
+        """A faster check to see if this generator will return a value.
 
         Returns:
             True if its possible the generator will return a value, False if it will
@@ -55,9 +68,17 @@ class HomescreenHeadlineGenerator(Protocol):
         """
         ...
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]: ...
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]: ...
+
+
+def _union_slugs(generators: Iterable[HomescreenHeadlineGenerator]) -> FrozenSet[str]:
+    return frozenset(slug for g in generators for slug in g.slugs)
+
+
+def _union_seen_slugs(
+    generators: Iterable[HomescreenHeadlineGenerator],
+) -> FrozenSet[str]:
+    return frozenset(slug for g in generators for slug in g.seen_slugs)
 
 
 class SimpleHomescreenGenerator:
@@ -73,13 +94,13 @@ class SimpleHomescreenGenerator:
         self.headline = headline
         self.subheadline = subheadline
         self.slug = slug
+        self.slugs = frozenset((slug,))
+        self.seen_slugs: FrozenSet[str] = frozenset()
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
         return True
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
         if isinstance(self.headline, str):
             headline = self.headline
         else:
@@ -103,8 +124,9 @@ class RandomHomescreenGenerator:
     the sub-generators which have valid options, refreshing the list when they are exhausted.
 
     If `slugs_are_stable` is specified, the subgenerators must always return a
-    value and that value must have the same slug, and the query can be optimized
-    significantly (by not having to regenerate the list of slugs each time)
+    value and that value must have the same slug, and the selection can be optimized
+    significantly (by only evaluating the chosen subgenerator). Since that slug is
+    declared by the subgenerator, the mapping is built when this is constructed.
 
     If using split generators, this assumes you random the headline independently,
     then the subheadline independently, and then combine them after (so that this
@@ -118,145 +140,52 @@ class RandomHomescreenGenerator:
 
         self.generators = generators
         self.slugs_are_stable = slugs_are_stable
+        self.slugs = _union_slugs(generators)
+        self.seen_slugs = self.slugs | _union_seen_slugs(generators)
 
+        self._slugs: Optional[List[str]] = None
         self._generators_by_slug: Optional[Dict[str, HomescreenHeadlineGenerator]] = (
             None
         )
-        self._query: Optional[str] = None
-        self._slugs: Optional[List[str]] = None
-
-    def _get_query(self, slugs: Iterable[str]) -> str:
-        query = io.StringIO()
-        query.write("WITH batch(slug) AS (VALUES (?)")
-        for i, _ in enumerate(slugs):
-            if i > 0:
-                query.write(", (?)")
-        query.write(
-            """),
-seen_counts(slug, cnt) AS (
-SELECT
-    batch.slug,
-    (
-        SELECT COUNT(*) FROM user_home_screen_copy
-        WHERE
-            user_home_screen_copy.user_id = (SELECT users.id FROM users WHERE users.sub = ?)
-            AND (
-                user_home_screen_copy.slug = batch.slug
-                OR (
-                    json_array_length(user_home_screen_copy.composed_slugs) > 0
-                    AND json_extract(user_home_screen_copy.composed_slugs, '$[0]') = batch.slug
-                )
-                OR (
-                    json_array_length(user_home_screen_copy.composed_slugs) > 1
-                    AND json_extract(user_home_screen_copy.composed_slugs, '$[1]') = batch.slug
-                )
-            ) 
-    )
-FROM batch
-)
-SELECT
-    seen_counts.slug 
-FROM seen_counts 
-WHERE
-    seen_counts.cnt = (SELECT MIN(sc.cnt) FROM seen_counts AS sc)
-            """
-        )
-        return query.getvalue()
+        if slugs_are_stable:
+            assert all(
+                len(g.slugs) == 1 for g in generators
+            ), "if slugs_are_stable, each generator must have exactly one slug"
+            # duplicates are kept so that they are proportionally more likely
+            self._slugs = [next(iter(g.slugs)) for g in generators]
+            self._generators_by_slug = dict(zip(self._slugs, generators))
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
         if self.slugs_are_stable:
             return True
         return any(g.precheck(ctx) for g in self.generators)
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
-        if self.slugs_are_stable:
-            if (
-                self._query is None
-                or self._slugs is None
-                or self._generators_by_slug is None
-            ):
-                generated = await asyncio.gather(
-                    *[g(itgs, ctx) for g in self.generators]
-                )
-
-                assert all(
-                    g is not None for g in generated
-                ), "if slugs_are_stable, all generators must return a value"
-                generated = cast(List[HomescreenHeadline], generated)
-
-                assert all(
-                    not g.composed_slugs for g in generated
-                ), "RandomHomescreenGenerator does not support composed children"
-                slugs = [gen.slug for gen in generated]
-
-                self._query = self._get_query(slugs)
-                self._slugs = slugs
-                self._generators_by_slug = dict(
-                    (gen.slug, generator)
-                    for (gen, generator) in zip(generated, self.generators)
-                )
-
-                query = self._query
-                generators_by_slug = self._generators_by_slug
-            else:
-                generated = None
-                query = self._query
-                slugs = self._slugs
-                generators_by_slug = self._generators_by_slug
-        else:
-            generated = await asyncio.gather(*[g(itgs, ctx) for g in self.generators])
-            slugs = [
-                cast(HomescreenHeadline, gen).slug
-                for gen in generated
-                if gen is not None
-            ]
-            if not slugs:
-                return None
-
-            assert all(
-                gen is None or not gen.composed_slugs for gen in generated
-            ), "RandomHomescreenGenerator does not support composed children"
-
-            query = self._get_query(slugs)
-            generators_by_slug = dict(
-                (cast(HomescreenHeadline, gen).slug, generator)
-                for (gen, generator) in zip(generated, self.generators)
-                if gen is not None
-            )
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
+        if self._slugs is not None and self._generators_by_slug is not None:
+            least_seen = _least_seen(self._slugs, ctx)
+            result = self._generators_by_slug[random.choice(least_seen)](ctx)
+            assert result is not None, "if slugs_are_stable, generators must return"
+            return result
 
-        conn = await itgs.conn()
-        cursor = conn.cursor("weak")
-
-        if len(slugs) > 40:
-            # try a random one to see if it hasn't been taken before
-            optimistic_slug = random.choice(slugs)
-            optimistic_response = await cursor.execute(
-                "SELECT 1 FROM user_home_screen_copy, users "
-                "WHERE"
-                " user_home_screen_copy.slug = ?"
-                " AND user_home_screen_copy.user_id = users.id"
-                " AND users.sub = ?",
-                [optimistic_slug, ctx.user_sub],
-            )
-            if not optimistic_response.results:
-                return await generators_by_slug[optimistic_slug](itgs, ctx)
+        generated = [
+            gen for gen in (g(ctx) for g in self.generators) if gen is not None
+        ]
+        if not generated:
+            return None
 
-        response = await cursor.execute(query, slugs + [ctx.user_sub])
-        assert response.results, response
+        assert all(
+            not gen.composed_slugs for gen in generated
+        ), "RandomHomescreenGenerator does not support composed children"
 
-        number_of_options = len(response.results)
-        choice_index = random.randint(0, number_of_options - 1)
-        chosen_slug = response.results[choice_index][0]
+        chosen_slug = random.choice(_least_seen([gen.slug for gen in generated], ctx))
+        return next(gen for gen in generated if gen.slug == chosen_slug)
 
-        if generated is not None and len(generated) < 6:
-            return next(
-                gen for gen in generated if gen is not None and gen.slug == chosen_slug
-            )
 
-        generator = generators_by_slug[chosen_slug]
-        return await generator(itgs, ctx)
+def _least_seen(slugs: List[str], ctx: HomescreenCopyContext) -> List[str]:
+    """Returns the slugs (including duplicates) which the user has seen the least"""
+    counts = [ctx.seen_counts.get(slug, 0) for slug in slugs]
+    lowest = min(counts)
+    return [slug for slug, count in zip(slugs, counts) if count == lowest]
 
 
 class SplitHeadlineSubheadlineGenerator:
@@ -273,23 +202,24 @@ class SplitHeadlineSubheadlineGenerator:
         self.slug = slug
         self.headline_generator = headline_generator
         self.subheadline_generator = subheadline_generator
+        self.slugs = frozenset((slug,))
+        self.seen_slugs = _union_seen_slugs((headline_generator, subheadline_generator))
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
         return self.headline_generator.precheck(
             ctx
         ) and self.subheadline_generator.precheck(ctx)
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
         if not self.precheck(ctx):
             return None
 
-        headline, subheadline = await asyncio.gather(
-            self.headline_generator(itgs, ctx),
-            self.subheadline_generator(itgs, ctx),
-        )
-        if headline is None or subheadline is None:
+        headline = self.headline_generator(ctx)
+        if headline is None:
+            return None
+
+        subheadline = self.subheadline_generator(ctx)
+        if subheadline is None:
             return None
 
         return HomescreenHeadline(
@@ -315,6 +245,8 @@ class TimeOfDayGenerator:
         self.morning = morning
         self.afternoon = afternoon
         self.evening = evening
+        self.slugs = _union_slugs((morning, afternoon, evening))
+        self.seen_slugs = _union_seen_slugs((morning, afternoon, evening))
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
         tod = get_time_of_day(ctx.show_at, ctx.show_tz)
@@ -326,16 +258,14 @@ class TimeOfDayGenerator:
             return self.evening.precheck(ctx)
         return False
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
         tod = get_time_of_day(ctx.show_at, ctx.show_tz)
         if tod == "morning":
-            return await self.morning(itgs, ctx)
+            return self.morning(ctx)
         elif tod == "afternoon":
-            return await self.afternoon(itgs, ctx)
+            return self.afternoon(ctx)
         elif tod == "evening":
-            return await self.evening(itgs, ctx)
+            return self.evening(ctx)
         raise ValueError(f"Unexpected time of day: {tod}")
 
 
@@ -677,6 +607,8 @@ class GoalOneSessionAwaySubheadlineOnlyGenerator:
             ],
             slugs_are_stable=True,
         )
+        self.slugs = self.subgenerator.slugs
+        self.seen_slugs = self.subgenerator.seen_slugs
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
         if ctx.client_variant != "session_start" or ctx.taken_class_today:
@@ -690,13 +622,11 @@ class GoalOneSessionAwaySubheadlineOnlyGenerator:
 
         return True
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
         if not self.precheck(ctx):
             return None
 
-        return await self.subgenerator(itgs, ctx)
+        return self.subgenerator(ctx)
 
 
 class GoalTwoSessionsAwaySubheadlineOnlyGenerator:
@@ -718,6 +648,8 @@ class GoalTwoSessionsAwaySubheadlineOnlyGenerator:
             ],
             slugs_are_stable=True,
         )
+        self.slugs = self.subgenerator.slugs
+        self.seen_slugs = self.subgenerator.seen_slugs
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
         if ctx.client_variant != "session_start" or ctx.taken_class_today:
@@ -738,12 +670,10 @@ class GoalTwoSessionsAwaySubheadlineOnlyGenerator:
 
         return True
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
         if not self.precheck(ctx):
             return None
-        return await self.subgenerator(itgs, ctx)
+        return self.subgenerator(ctx)
 
 
 def _post_class(text: str) -> HomescreenHeadlineGenerator:
@@ -775,6 +705,8 @@ class ClassMilestoneGenerator:
         self.milestone = milestone
         self.headline = headline
         self.subheadline = subheadline
+        self.slugs = frozenset((f"class-milestone-{milestone}",))
+        self.seen_slugs: FrozenSet[str] = frozenset()
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
         if ctx.client_variant != "session_end":
@@ -785,9 +717,7 @@ class ClassMilestoneGenerator:
 
         return True
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
         if not self.precheck(ctx):
             return None
 
@@ -804,6 +734,8 @@ class ClassMilestonesGenerator:
     def __init__(self, milestones: List[ClassMilestoneGenerator]) -> None:
         self.milestones = milestones
         self._milestones_by_milestone = dict((m.milestone, m) for m in milestones)
+        self.slugs = _union_slugs(milestones)
+        self.seen_slugs = _union_seen_slugs(milestones)
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
         if ctx.client_variant != "session_end":
@@ -811,9 +743,7 @@ class ClassMilestonesGenerator:
 
         return ctx.streak.journeys in self._milestones_by_milestone
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
         if ctx.client_variant != "session_end":
             return None
 
@@ -821,7 +751,7 @@ class ClassMilestonesGenerator:
         if milestone is None:
             return None
 
-        return await milestone(itgs, ctx)
+        return milestone(ctx)
 
 
 _class_milestones = ClassMilestonesGenerator(
@@ -890,10 +820,9 @@ class AnniversaryGenerator:
         self.days = days
         self.headline = headline
         self.subheadline = subheadline
-
-    @property
-    def slug(self) -> str:
-        return f"anniversary-P{self.days}D"
+        self.slug = f"anniversary-P{days}D"
+        self.slugs = frozenset((self.slug,))
+        self.seen_slugs = self.slugs
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
         if ctx.client_variant != "session_end":
@@ -916,24 +845,11 @@ class AnniversaryGenerator:
 
         return True
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
         if not self.precheck(ctx):
             return None
 
-        conn = await itgs.conn()
-        cursor = conn.cursor("weak")
-
-        response = await cursor.execute(
-            "SELECT 1 FROM user_home_screen_copy, users "
-            "WHERE"
-            " user_home_screen_copy.slug = ?"
-            " AND user_home_screen_copy.user_id = users.id"
-            " AND users.sub = ?",
-            [self.slug, ctx.user_sub],
-        )
-        if response.results:
+        if ctx.seen_counts.get(self.slug, 0) > 0:
             return None
 
         if isinstance(self.subheadline, str):
@@ -954,6 +870,8 @@ class AnniversariesGenerator:
     def __init__(self, generators: List[AnniversaryGenerator]) -> None:
         self.generators = generators
         self._generators_by_days: Dict[int, AnniversaryGenerator] = dict()
+        self.slugs = _union_slugs(generators)
+        self.seen_slugs = _union_seen_slugs(generators)
 
         for generator in sorted(generators, key=lambda g: g.days):
             for days in range(generator.days, generator.days + 7):
@@ -973,9 +891,7 @@ class AnniversariesGenerator:
         days_since_created = now_unix_date - created_at_unix_date
         return days_since_created in self._generators_by_days
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
         if ctx.client_variant != "session_end":
             return None
 
@@ -991,7 +907,7 @@ class AnniversariesGenerator:
         if generator is None:
             return None
 
-        return await generator(itgs, ctx)
+        return generator(ctx)
 
 
 _anniversaries = AnniversariesGenerator(
@@ -1102,6 +1018,8 @@ class GoalCompleteGenerator:
             self.headline_only,
             self.subheadline_only,
         )
+        self.slugs = self.subgenerator.slugs
+        self.seen_slugs = self.subgenerator.seen_slugs
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
         if ctx.client_variant != "session_end":
@@ -1115,13 +1033,11 @@ class GoalCompleteGenerator:
 
         return self.subgenerator.precheck(ctx)
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
         if not self.precheck(ctx):
             return None
 
-        return await self.subgenerator(itgs, ctx)
+        return self.subgenerator(ctx)
 
 
 class StreaksGenerator:
@@ -1129,6 +1045,8 @@ class StreaksGenerator:
 
     def __init__(self, generator: HomescreenHeadlineGenerator) -> None:
         self.generator = generator
+        self.slugs = generator.slugs
+        self.seen_slugs = generator.seen_slugs
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
         if ctx.client_variant != "session_end":
@@ -1139,12 +1057,10 @@ class StreaksGenerator:
             or (ctx.streak.streak > 0 and ctx.streak.streak % 5 == 0)
         ) and self.generator.precheck(ctx)
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
         if not self.precheck(ctx):
             return None
-        return await self.generator(itgs, ctx)
+        return self.generator(ctx)
 
 
 class IfBestAllTimeStreakGenerator:
@@ -1152,6 +1068,8 @@ class IfBestAllTimeStreakGenerator:
 
     def __init__(self, generator: HomescreenHeadlineGenerator) -> None:
         self.generator = generator
+        self.slugs = generator.slugs
+        self.seen_slugs = generator.seen_slugs
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
         return (
@@ -1159,13 +1077,11 @@ class IfBestAllTimeStreakGenerator:
             and self.generator.precheck(ctx)
         )
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
         if ctx.streak.streak <= ctx.streak.prev_best_all_time_streak:
             return None
 
-        return await self.generator(itgs, ctx)
+        return self.generator(ctx)
 
 
 _streaks = StreaksGenerator(
@@ -1298,16 +1214,16 @@ class SimpleWeightedRandomGenerator:
     ) -> None:
         self.generators = generators
         self.weights = weights
+        self.slugs = _union_slugs(generators)
+        self.seen_slugs = _union_seen_slugs(generators)
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
         return any(generator.precheck(ctx) for generator in self.generators)
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
         # This is optimized for the case where generators do in fact return a value
         generator = random.choices(self.generators, self.weights)[0]
-        result = await generator(itgs, ctx)
+        result = generator(ctx)
 
         if result is not None:
             return result
@@ -1324,7 +1240,7 @@ class SimpleWeightedRandomGenerator:
 
         while remaining:
             item = random.choices(remaining, remaining_weights)[0]
-            result = await item(itgs, ctx)
+            result = item(ctx)
             if result is not None:
                 return result
 
@@ -1347,15 +1263,15 @@ class GreedyGenerator:
 
     def __init__(self, generators: List[HomescreenHeadlineGenerator]) -> None:
         self.generators = generators
+        self.slugs = _union_slugs(generators)
+        self.seen_slugs = _union_seen_slugs(generators)
 
     def precheck(self, ctx: HomescreenCopyContext) -> bool:
         return any(generator.precheck(ctx) for generator in self.generators)
 
-    async def __call__(
-        self, itgs: Itgs, ctx: HomescreenCopyContext
-    ) -> Optional[HomescreenHeadline]:
+    def __call__(self, ctx: HomescreenCopyContext) -> Optional[HomescreenHeadline]:
         for generator in self.generators:
-            if result := await generator(itgs, ctx):
+            if result := generator(ctx):
                 return result
         return None
 
@@ -1408,27 +1324,39 @@ _session_end_generator = GreedyGenerator(
 )
 
 
-async def generate_new_headline(
-    itgs: Itgs, ctx: HomescreenCopyContext
-) -> HomescreenHeadline:
+GENERATORS_BY_VARIANT: Dict[HomescreenClientVariant, HomescreenHeadlineGenerator] = {
+    "session_start": _session_start_generator,
+    "session_end": _session_end_generator,
+}
+"""The root of the generator tree for each client variant"""
+
+SEEN_SLUGS_BY_VARIANT: Dict[HomescreenClientVariant, FrozenSet[str]] = dict(
+    (variant, generator.seen_slugs)
+    for variant, generator in GENERATORS_BY_VARIANT.items()
+)
+"""For each client variant, the slugs whose seen counts need to be included in
+the context when generating a headline for that variant
+"""
+
+
+def generate_new_headline(ctx: HomescreenCopyContext) -> HomescreenHeadline:
     """Selects a new headline within the given context. This doesn't handle caching
     the value so we don't regenerate it excessively.
     """
-    if ctx.client_variant == "session_start":
-        res = await _session_start_generator(itgs, ctx)
-        assert res
-        return res
-    elif ctx.client_variant == "session_end":
-        res = await _session_end_generator(itgs, ctx)
-        assert res
-        return res
-    else:
+    generator = GENERATORS_BY_VARIANT.get(ctx.client_variant)
+    if generator is None:
         raise AssertionError(f"Unknown client variant: {ctx.client_variant}")
 
+    res = generator(ctx)
+    assert res
+    return res
+
 
 if __name__ == "__main__":
 
     async def _main():
+        from personalization.home.copy.lib.helper import fetch_homescreen_copy_context
+
         user_sub = input("user sub: ")
         client_variant_raw = input("client variant: ")
 
@@ -1436,41 +1364,18 @@ if __name__ == "__main__":
         client_variant = cast(HomescreenClientVariant, client_variant_raw)
         logger.info("GATHERING PREREQUISITES")
         async with Itgs() as itgs:
-            conn = await itgs.conn()
-            cursor = conn.cursor("none")
             show_tz = await get_user_timezone(itgs, user_sub=user_sub)
-            show_at = time.time()
-            show_unix_date = unix_dates.unix_timestamp_to_unix_date(show_at, tz=show_tz)
-            response = await cursor.executeunified3(
-                (
-                    (
-                        "SELECT given_name, created_at FROM users WHERE sub=?",
-                        (user_sub,),
-                    ),
-                    (
-                        "SELECT 1 FROM users, user_journeys WHERE users.sub=? AND user_journeys.user_id = users.id AND user_journeys.created_at_unix_date=?",
-                        (user_sub, show_unix_date),
-                    ),
-                )
-            )
-            assert response[0].results
-            given_name = cast(str, response[0].results[0][0])
-            created_at = cast(float, response[0].results[0][1])
-            taken_class = bool(response[1].results)
-            streak = await read_user_streak(itgs, sub=user_sub, prefer="model")
-            ctx = HomescreenCopyContext(
+            ctx = await fetch_homescreen_copy_context(
+                itgs,
                 user_sub=user_sub,
-                given_name=given_name,
-                client_variant=client_variant,
-                taken_class_today=taken_class,
-                user_created_at=created_at,
-                show_at=show_at,
+                variant=client_variant,
+                show_at=time.time(),
                 show_tz=show_tz,
-                streak=streak,
             )
+            assert ctx is not None
 
             logger.info("GENERATING HEADLINE")
-            headline = await generate_new_headline(itgs, ctx)
+            headline = generate_new_headline(ctx)
             print(f"{headline=}")
 
     asyncio.run(_main())
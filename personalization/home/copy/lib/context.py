@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Literal, Optional
+from typing import Dict, Literal, Optional
 import pytz
 
 from users.lib.streak import UserStreak
@@ -39,3 +39,10 @@ class HomescreenCopyContext:
 
     streak: UserStreak
     """The users current streak"""
+
+    seen_counts: Dict[str, int]
+    """How many times the user has been shown each slug, either as the slug of
+    the copy or as one of its composed slugs. Slugs which the user has never
+    seen may be omitted, and only the slugs the generator tree for the variant
+    depends on are included.
+    """
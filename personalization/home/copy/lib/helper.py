@@ -1,12 +1,14 @@
 import json
 import secrets
 import time
-from typing import List, Literal, Optional, Tuple, cast
+from typing import Dict, List, Literal, Optional, Tuple, cast
 
 import pytz
+from pydantic import BaseModel, Field
 from itgs import Itgs
 from lib.basic_redis_lock import basic_redis_lock
 from personalization.home.copy.lib.config import (
+    SEEN_SLUGS_BY_VARIANT,
     HomescreenHeadline,
     generate_new_headline,
 )
@@ -14,6 +16,7 @@ from personalization.home.copy.lib.context import (
     HomescreenCopyContext,
     HomescreenClientVariant,
 )
+from personalization.home.copy.lib.version import get_homescreen_copy_version_key
 from loguru import logger
 
 from users.lib.streak import read_user_streak
@@ -33,6 +36,130 @@ class _DBInfo:
     taken_class: bool
     given_name: Optional[str]
     created_at: float
+    seen_counts: Dict[str, int]
+
+
+MEMO_TTL_SECONDS = 3600
+"""How long the home screen copy is memoized for, at most. It's also
+invalidated whenever the users home screen copy version is bumped
+"""
+
+
+_SEEN_SLUGS_JSON_BY_VARIANT: Dict[HomescreenClientVariant, str] = dict(
+    (variant, json.dumps(sorted(slugs), separators=(",", ":")))
+    for variant, slugs in SEEN_SLUGS_BY_VARIANT.items()
+)
+"""The json-encoded list of slugs to fetch seen counts for, by variant"""
+
+
+class _HomescreenCopyMemo(BaseModel):
+    version: int = Field(
+        description="The users home screen copy version when the copy was generated"
+    )
+    headline: HomescreenHeadline = Field(description="The memoized copy")
+
+
+async def fetch_homescreen_copy_context(
+    itgs: Itgs,
+    *,
+    user_sub: str,
+    variant: HomescreenClientVariant,
+    show_at: float,
+    show_tz: pytz.BaseTzInfo,
+) -> Optional[HomescreenCopyContext]:
+    """Fetches everything the generator tree for the given variant depends on in
+    one round: the users streak (which includes their goal progress) concurrently
+    with a single database request for the user, whether they've taken a class
+    today, and how many times they've seen each relevant slug.
+
+    Returns:
+        (HomescreenCopyContext, None): the context, or None if the user doesn't
+            exist
+    """
+    unix_date_today = unix_dates.unix_timestamp_to_unix_date(show_at, tz=show_tz)
+    seen_slugs = _SEEN_SLUGS_JSON_BY_VARIANT[variant]
+
+    async def _get_db_info() -> Optional[_DBInfo]:
+        conn = await itgs.conn()
+        cursor = conn.cursor()
+
+        for consistency in cast(List[Literal["none", "strong"]], ["none", "strong"]):
+            response = await cursor.executeunified3(
+                (
+                    (
+                        "SELECT given_name, created_at FROM users WHERE sub=?",
+                        (user_sub,),
+                    ),
+                    (
+                        "SELECT 1 FROM users, user_journeys "
+                        "WHERE"
+                        " users.sub = ?"
+                        " AND user_journeys.user_id = users.id"
+                        " AND user_journeys.created_at_unix_date = ?",
+                        (user_sub, unix_date_today),
+                    ),
+                    (
+                        """
+WITH
+    target_user(id) AS (SELECT users.id FROM users WHERE users.sub = ?),
+    shown(uid, slug) AS (
+        SELECT uhsc.uid, uhsc.slug
+        FROM user_home_screen_copy AS uhsc
+        WHERE uhsc.user_id = (SELECT target_user.id FROM target_user)
+        UNION
+        SELECT uhsc.uid, json_extract(uhsc.composed_slugs, '$[0]')
+        FROM user_home_screen_copy AS uhsc
+        WHERE
+            uhsc.user_id = (SELECT target_user.id FROM target_user)
+            AND json_array_length(uhsc.composed_slugs) > 0
+        UNION
+        SELECT uhsc.uid, json_extract(uhsc.composed_slugs, '$[1]')
+        FROM user_home_screen_copy AS uhsc
+        WHERE
+            uhsc.user_id = (SELECT target_user.id FROM target_user)
+            AND json_array_length(uhsc.composed_slugs) > 1
+    )
+SELECT shown.slug, COUNT(*)
+FROM shown
+WHERE shown.slug IN (SELECT value FROM json_each(?))
+GROUP BY shown.slug
+                        """,
+                        (user_sub, seen_slugs),
+                    ),
+                ),
+                read_consistency=consistency,
+                freshness="1m",
+            )
+            if response[0].results:
+                return _DBInfo(
+                    taken_class=bool(response[1].results),
+                    given_name=cast(Optional[str], response[0].results[0][0]),
+                    created_at=cast(float, response[0].results[0][1]),
+                    seen_counts=dict(
+                        (cast(str, row[0]), cast(int, row[1]))
+                        for row in (response[2].results or [])
+                    ),
+                )
+
+        return None
+
+    streak, db_info = await asyncio.gather(
+        read_user_streak(itgs, sub=user_sub, prefer="model"), _get_db_info()
+    )
+    if db_info is None:
+        return None
+
+    return HomescreenCopyContext(
+        user_sub=user_sub,
+        given_name=db_info.given_name,
+        client_variant=variant,
+        taken_class_today=db_info.taken_class,
+        user_created_at=db_info.created_at,
+        show_at=show_at,
+        show_tz=show_tz,
+        streak=streak,
+        seen_counts=db_info.seen_counts,
+    )
 
 
 async def get_homescreen_copy(
@@ -46,10 +173,13 @@ async def get_homescreen_copy(
     """Fetches the current home screen copy for the given user and client-requested
     variant.
 
-    A different cache is used if the variant requested does not match the
-    expected state (i.e, session start after taking a class, session end before
-    taking a class), to avoid strange messages (e.g., "Only two more to go!"
-    when theres really 1 more to go not counting today, which is already done)
+    The copy is memoized per user, variant, and local date, stamped with the
+    users home screen copy version. The version is bumped whenever the facts the
+    copy depends on change (see `personalization.home.copy.lib.version`), e.g.,
+    when they take their first class of the day, to avoid strange messages (e.g.,
+    "Only two more to go!" when theres really 1 more to go not counting today,
+    which is already done). This means a memoized copy can be served without
+    touching the database.
 
     Args:
         itgs (Itgs): the integrations to (re)use
@@ -77,112 +207,68 @@ async def get_homescreen_copy(
         user_tz = await get_user_timezone(itgs, user_sub=user_sub)
 
     unix_date_today = unix_dates.unix_timestamp_to_unix_date(request_at, tz=user_tz)
-    cache_key_taken_class = (
-        f"users:{user_sub}:homescreen_copy:{variant}:{unix_date_today}:True".encode(
-            "utf-8"
-        )
-    )
-    cache_key_not_taken_class = (
-        f"users:{user_sub}:homescreen_copy:{variant}:{unix_date_today}:False".encode(
-            "utf-8"
-        )
+    memo_key = f"users:{user_sub}:homescreen_copy:{variant}:{unix_date_today}".encode(
+        "utf-8"
     )
+    version_key = get_homescreen_copy_version_key(user_sub)
 
-    async def _get_cached() -> Tuple[Optional[bytes], Optional[bytes]]:
+    async def _get_memoized() -> Tuple[Optional[HomescreenHeadline], int]:
+        """Returns the memoized headline, if it's for the current version, and
+        the current version
+        """
         redis = await itgs.redis()
         async with redis.pipeline(transaction=False) as pipe:
-            await pipe.get(cache_key_taken_class)
-            await pipe.get(cache_key_not_taken_class)
-            return tuple(await pipe.execute())
-
-    async def _get_db_info() -> Optional[_DBInfo]:
-        conn = await itgs.conn()
-        cursor = conn.cursor()
-
-        for consistency in cast(List[Literal["none", "strong"]], ["none", "strong"]):
-            response = await cursor.executeunified3(
-                (
-                    (
-                        "SELECT given_name, created_at FROM users WHERE sub=?",
-                        (user_sub,),
-                    ),
-                    (
-                        "SELECT 1 FROM users, user_journeys "
-                        "WHERE"
-                        " users.sub = ?"
-                        " AND user_journeys.user_id = users.id"
-                        " AND user_journeys.created_at_unix_date = ?",
-                        (user_sub, unix_date_today),
-                    ),
-                ),
-                read_consistency=consistency,
-                freshness="1m",
-            )
-            if response[0].results:
-                return _DBInfo(
-                    taken_class=bool(response[1].results),
-                    given_name=cast(Optional[str], response[0].results[0][0]),
-                    created_at=cast(float, response[0].results[0][1]),
-                )
-
-        return None
+            await pipe.get(memo_key)
+            await pipe.get(version_key)
+            raw_memo, raw_version = await pipe.execute()
 
-    cached_task = asyncio.create_task(_get_cached())
-    db_info_task = asyncio.create_task(_get_db_info())
+        version = int(raw_version) if raw_version is not None else 0
+        if raw_memo is None:
+            return None, version
 
-    cached_taken, cached_not_taken = await cached_task
-    if cached_taken is not None:
-        logger.info(f"{req_id=} CACHE HIT (taken class short-circuit)")
-        db_info_task.cancel()
-        return HomescreenHeadline.model_validate_json(cached_taken)
+        memo = _HomescreenCopyMemo.model_validate_json(raw_memo)
+        if memo.version != version:
+            return None, version
+        return memo.headline, version
 
-    if cached_not_taken is not None:
-        db_info_early = await db_info_task
-        if db_info_early is not None and not db_info_early.taken_class:
-            logger.info(f"{req_id=} CACHE HIT (not taken class)")
-            return HomescreenHeadline.model_validate_json(cached_not_taken)
+    cached, _ = await _get_memoized()
+    if cached is not None:
+        logger.info(f"{req_id=} CACHE HIT")
+        return cached
 
     logger.debug(f"{req_id=} cache miss")
 
-    streak = await read_user_streak(itgs, sub=user_sub, prefer="model")
-    db_info = await db_info_task
-    if db_info is None:
-        logger.error(f"{req_id=} user not found, returning None")
-        return None
-
-    cache_key = (
-        cache_key_taken_class if db_info.taken_class else cache_key_not_taken_class
-    )
     redis = await itgs.redis()
     async with basic_redis_lock(
         itgs,
-        f"users:{user_sub}:homescreen_copy:{variant}:{unix_date_today}:{db_info.taken_class}:lock".encode(
-            "utf-8"
-        ),
+        memo_key + b":lock",
         spin=True,
         timeout=3,
     ):
-        result = await redis.get(cache_key)
-        if result is not None:
+        cached, version = await _get_memoized()
+        if cached is not None:
             logger.info(f"{req_id=} CACHE HIT (post-lock)")
-            return HomescreenHeadline.model_validate_json(result)
-        logger.debug(f"{req_id=} cache miss (post-lock)")
+            return cached
+        logger.debug(f"{req_id=} cache miss (post-lock) at {version=}")
 
-        ctx = HomescreenCopyContext(
+        ctx = await fetch_homescreen_copy_context(
+            itgs,
             user_sub=user_sub,
-            given_name=db_info.given_name,
-            client_variant=variant,
-            taken_class_today=db_info.taken_class,
-            user_created_at=db_info.created_at,
+            variant=variant,
             show_at=request_at,
             show_tz=user_tz,
-            streak=streak,
         )
+        if ctx is None:
+            logger.error(f"{req_id=} user not found, returning None")
+            return None
+
         logger.debug(f"{req_id=} generating using {ctx=}")
-        model = await generate_new_headline(itgs, ctx)
-        raw = model.__pydantic_serializer__.to_json(model)
+        model = generate_new_headline(ctx)
+        raw = _HomescreenCopyMemo.__pydantic_serializer__.to_json(
+            _HomescreenCopyMemo(version=version, headline=model)
+        )
         logger.debug(f"{req_id=} generated {raw=}")
-        await redis.set(cache_key, raw, ex=3600)
+        await redis.set(memo_key, raw, ex=MEMO_TTL_SECONDS)
         logger.debug(f"{req_id=} cached, releasing lock before storing in db")
 
     queries: List[Tuple[str, list]] = []
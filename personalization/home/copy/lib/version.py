@@ -0,0 +1,33 @@
+"""The home screen copy shown to a user is memoized for the day; this module
+manages the per-user version which is bumped whenever the facts the copy is
+generated from change (e.g., they take a class or change their goal), which
+invalidates the memoized copy.
+"""
+
+from itgs import Itgs
+
+
+VERSION_TTL_SECONDS = 60 * 60 * 24
+"""How long the version key is kept after it was last bumped. This must exceed
+how long the copy is memoized, since a missing version is treated as 0
+"""
+
+
+def get_homescreen_copy_version_key(user_sub: str) -> bytes:
+    """Returns the redis key holding the home screen copy version for the user
+    with the given sub
+    """
+    return f"users:{user_sub}:homescreen_copy:version".encode("utf-8")
+
+
+async def bump_homescreen_copy_version(itgs: Itgs, *, user_sub: str) -> None:
+    """Invalidates the memoized home screen copy for the user with the given sub,
+    including any which is currently being generated
+    """
+    key = get_homescreen_copy_version_key(user_sub)
+    redis = await itgs.redis()
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.multi()
+        await pipe.incr(key)
+        await pipe.expire(key, VERSION_TTL_SECONDS)
+        await pipe.execute()
@@ -1,21 +1,34 @@
 import random
-from typing import Optional
+from typing import Dict, Optional, Sequence
 from error_middleware import handle_warning
 from personalization.lib.s01_find_combinations import (
     delete_instructor_category_and_biases_from_local_cache,
     delete_instructor_category_and_biases_from_redis,
     get_instructor_category_and_biases,
 )
-from personalization.lib.s02_lowest_view_count import map_to_lowest_view_counts
-from personalization.lib.s03a_find_feedback import find_feedback
-from personalization.lib.s03b_feedback_score import map_to_feedback_score
-from personalization.lib.s04a_times_seen_recently import map_to_times_seen_recently
-from personalization.lib.s04b_adjust_scores import map_to_adjusted_scores
+from personalization.lib.s02_lowest_view_count import (
+    delete_journeys_by_combination_from_local_cache,
+    get_journeys_by_combination,
+    get_lowest_view_counts_from_journeys,
+    map_to_lowest_view_counts_from_profile,
+)
+from personalization.lib.s03b_feedback_score import compute_feedback_scores
+from personalization.lib.s04a_times_seen_recently import (
+    map_to_times_seen_recently_from_instructor_uids,
+)
+from personalization.lib.s04b_adjust_scores import compute_adjusted_scores
 from personalization.lib.s05_compare_combinations import (
-    ComparableInstructorCategory,
-    find_best_combination_index,
+    find_best_combination_index_from_arrays,
+)
+from personalization.lib.s06_journey_for_combination import (
+    get_journey_for_combination_from_profile,
+    get_journeys_for_combination,
+)
+from personalization.lib.user_profile import (
+    get_personalization_profile,
+    read_selected_journey,
+    write_selected_journeys,
 )
-from personalization.lib.s06_journey_for_combination import get_journeys_for_combination
 from itgs import Itgs
 import asyncio
 
@@ -36,53 +49,41 @@ async def select_journey(
         (str or None): The uid of the journey to show the user, or None if
             either the emotion does not exist or has no content.
     """
+    selected_in_advance = await read_selected_journey(
+        itgs, user_sub=user_sub, premium=premium, emotion=emotion
+    )
+    if selected_in_advance is not None:
+        return selected_in_advance
 
     combinations_promise = asyncio.create_task(
         get_instructor_category_and_biases(itgs=itgs, emotion=emotion, premium=premium)
     )
-    feedback_promise = asyncio.create_task(find_feedback(itgs=itgs, user_sub=user_sub))
+    profile_promise = asyncio.create_task(
+        get_personalization_profile(itgs, user_sub=user_sub)
+    )
 
     combinations = await combinations_promise
     if not combinations:
-        feedback_promise.cancel()
+        profile_promise.cancel()
         return None
 
-    lowest_view_counts_promise = asyncio.create_task(
-        map_to_lowest_view_counts(
-            itgs=itgs,
-            combinations=combinations,
-            user_sub=user_sub,
-            emotion=emotion,
-            premium=premium,
-        )
-    )
-    times_seen_today_promise = asyncio.create_task(
-        map_to_times_seen_recently(itgs, instructors=combinations, user_sub=user_sub)
-    )
-
-    feedback = await feedback_promise
-    feedback_scores = await map_to_feedback_score(
-        itgs, combinations=combinations, feedback=feedback
+    profile = await profile_promise
+    lowest_view_counts = await map_to_lowest_view_counts_from_profile(
+        itgs,
+        combinations=combinations,
+        view_counts=profile.view_counts,
+        emotion=emotion,
+        premium=premium,
     )
-
-    times_seen_today = await times_seen_today_promise
-    adjusted_scores = await map_to_adjusted_scores(
-        itgs, unadjusted=feedback_scores, times_seen_recently=times_seen_today
+    times_seen_today = map_to_times_seen_recently_from_instructor_uids(
+        instructors=combinations,
+        recent_instructor_uids=profile.recent_instructor_uids,
     )
 
-    lowest_view_counts = await lowest_view_counts_promise
-    best_combination_index = find_best_combination_index(
-        [
-            ComparableInstructorCategory(
-                instructor_uid=combination.instructor_uid,
-                category_uid=combination.category_uid,
-                lowest_view_count=view_count,
-                adjusted_score=adj_score.score,
-            )
-            for combination, view_count, adj_score in zip(
-                combinations, lowest_view_counts, adjusted_scores
-            )
-        ]
+    feedback_scores = compute_feedback_scores(combinations, profile.feedback)
+    adjusted_scores = compute_adjusted_scores(feedback_scores, times_seen_today)
+    best_combination_index = find_best_combination_index_from_arrays(
+        lowest_view_counts=lowest_view_counts, adjusted_scores=adjusted_scores
     )
 
     best_combination = combinations[best_combination_index]
@@ -112,6 +113,9 @@ async def select_journey(
         await delete_instructor_category_and_biases_from_local_cache(
             itgs, emotion=emotion, premium=premium
         )
+        await delete_journeys_by_combination_from_local_cache(
+            itgs, emotion=emotion, premium=premium
+        )
 
         combination_indices = list(
             i for i in range(len(combinations)) if i != best_combination_index
@@ -134,3 +138,94 @@ async def select_journey(
             return None
 
     return journeys[0].uid
+
+
+async def select_journeys(
+    itgs: Itgs, *, emotions: Sequence[str], user_sub: str, premium: bool
+) -> Dict[str, Optional[str]]:
+    """Selects the journey the user should see for each of the given emotions at
+    once, e.g., for when they are presented with a list of emotions to choose
+    from, and stores the result so that `select_journey` for any of those emotions
+    returns the same journey without repeating the work, until the user takes or
+    rates a journey or a few minutes pass.
+
+    The users personalization profile is only loaded once, and the journeys for
+    each combination are chosen in memory from the cached journeys for each
+    emotion rather than via `get_journeys_for_combination`. Everything besides
+    the profile is shared by all users and typically cached on this instance, so
+    this usually costs a single redis round trip for the profile plus one to
+    store the result.
+
+    Args:
+        itgs (Itgs): the integrations to (re)use
+        emotions (list[str]): the emotions to select journeys for
+        user_sub (str): the user to select journeys for
+        premium (bool): true for premium classes, false for free classes
+
+    Returns:
+        dict[str, str or None]: maps from each emotion to the uid of the journey
+            to show the user, or None if the emotion does not exist or has no
+            content.
+    """
+    profile_promise = asyncio.create_task(
+        get_personalization_profile(itgs, user_sub=user_sub)
+    )
+    combinations_by_emotion = await asyncio.gather(
+        *(
+            get_instructor_category_and_biases(
+                itgs=itgs, emotion=emotion, premium=premium
+            )
+            for emotion in emotions
+        )
+    )
+    journeys_by_emotion = await asyncio.gather(
+        *(
+            get_journeys_by_combination(itgs, emotion=emotion, premium=premium)
+            for emotion in emotions
+        )
+    )
+    profile = await profile_promise
+
+    result: Dict[str, Optional[str]] = dict()
+    for emotion, combinations, journeys_by_combination in zip(
+        emotions, combinations_by_emotion, journeys_by_emotion
+    ):
+        if not combinations:
+            result[emotion] = None
+            continue
+
+        lowest_view_counts = get_lowest_view_counts_from_journeys(
+            combinations=combinations,
+            view_counts=profile.view_counts,
+            journeys_by_combination=journeys_by_combination,
+        )
+        times_seen_today = map_to_times_seen_recently_from_instructor_uids(
+            instructors=combinations,
+            recent_instructor_uids=profile.recent_instructor_uids,
+        )
+        feedback_scores = compute_feedback_scores(combinations, profile.feedback)
+        adjusted_scores = compute_adjusted_scores(feedback_scores, times_seen_today)
+        best_combination = combinations[
+            find_best_combination_index_from_arrays(
+                lowest_view_counts=lowest_view_counts, adjusted_scores=adjusted_scores
+            )
+        ]
+        result[emotion] = get_journey_for_combination_from_profile(
+            journeys=journeys_by_combination.get(
+                (best_combination.instructor_uid, best_combination.category_uid), []
+            ),
+            view_counts=profile.view_counts,
+        )
+
+    await write_selected_journeys(
+        itgs,
+        user_sub=user_sub,
+        premium=premium,
+        version=profile.version,
+        selected=dict(
+            (emotion, journey_uid)
+            for emotion, journey_uid in result.items()
+            if journey_uid is not None
+        ),
+    )
+    return result
@@ -1,6 +1,23 @@
-from typing import Sequence, List, Protocol
+from dataclasses import dataclass
+from typing import Dict, Sequence, List, Protocol, Tuple
 from itgs import Itgs
 from journeys.models.series_flags import SeriesFlags
+from personalization.lib.s01_find_combinations import DISKCACHE_CACHE_TIME_SECONDS
+import json
+
+
+@dataclass
+class CombinationJourney:
+    """A journey considered for an instructor/category combination"""
+
+    uid: str
+    """The uid of the journey"""
+    original_uid: str
+    """The uid of the journey this is a variation of, or the uid of the journey
+    if it's not a variation; view counts are shared by all variations
+    """
+    created_at: float
+    """When the journey was created in seconds since the epoch"""
 
 
 class InstructorAndCategory(Protocol):
@@ -201,3 +218,194 @@ async def map_to_lowest_view_counts(
         view_counts.extend(batch_view_counts)
 
     return view_counts
+
+
+async def map_to_lowest_view_counts_from_profile(
+    itgs: Itgs,
+    *,
+    combinations: Sequence[InstructorAndCategory],
+    view_counts: Dict[str, int],
+    emotion: str,
+    premium: bool,
+) -> List[int]:
+    """Produces the same result as `map_to_lowest_view_counts`, but using the view
+    counts from the users personalization profile (see `user_profile.py`) and
+    the journeys available for the emotion, which are cached on this instance,
+    rather than querying the database.
+
+    Args:
+        itgs (Itgs): the integrations to (re)use
+        combinations (list[InstructorAndCategory]): the combinations to map
+        view_counts (dict[str, int]): the view counts from the users
+            personalization profile, keyed by the uid of the original journey
+        emotion (str): Filters to only journeys tagged with this emotion word
+        premium (bool): True if we are looking at premium journeys, false if we are
+            looking at normal journeys
+
+    Returns:
+        list[int]: A list with the same length as combinations, where index i
+            in combinations as the minimum view count for the combination at
+            index i in this list.
+    """
+    journeys_by_combination = await get_journeys_by_combination(
+        itgs, emotion=emotion, premium=premium
+    )
+    return get_lowest_view_counts_from_journeys(
+        combinations=combinations,
+        view_counts=view_counts,
+        journeys_by_combination=journeys_by_combination,
+    )
+
+
+def get_lowest_view_counts_from_journeys(
+    *,
+    combinations: Sequence[InstructorAndCategory],
+    view_counts: Dict[str, int],
+    journeys_by_combination: Dict[Tuple[str, str], List[CombinationJourney]],
+) -> List[int]:
+    """The synchronous part of `map_to_lowest_view_counts_from_profile`, for when
+    the journeys for the emotion have already been fetched via
+    `get_journeys_by_combination`
+    """
+    result: List[int] = []
+    for combination in combinations:
+        journeys = journeys_by_combination.get(
+            (combination.instructor_uid, combination.category_uid)
+        )
+        if not journeys:
+            result.append(2**31 - 1)
+            continue
+        result.append(
+            min(view_counts.get(journey.original_uid, 0) for journey in journeys)
+        )
+    return result
+
+
+async def get_journeys_by_combination(
+    itgs: Itgs, *, emotion: str, premium: bool
+) -> Dict[Tuple[str, str], List[CombinationJourney]]:
+    """Fetches the journeys considered by `map_to_lowest_view_counts` (and
+    `get_journeys_for_combination`) for the given emotion, grouped by
+    (instructor uid, category uid).
+
+    This is the same for all users, so it is cached on this instance.
+    """
+    cache = await itgs.local_cache()
+    cache_key = f"personalization:journeys_by_combination:{emotion}:{premium}".encode(
+        "utf-8"
+    )
+    raw = cache.get(cache_key)
+    if raw is not None:
+        assert isinstance(raw, bytes), type(raw)
+        return dict(
+            (
+                (instructor_uid, category_uid),
+                [
+                    CombinationJourney(
+                        uid=uid, original_uid=original_uid, created_at=created_at
+                    )
+                    for uid, original_uid, created_at in journeys
+                ],
+            )
+            for instructor_uid, category_uid, journeys in json.loads(raw)
+        )
+
+    conn = await itgs.conn()
+    cursor = conn.cursor("none")
+    response = await cursor.execute(
+        """
+        SELECT
+            instructors.uid,
+            journey_subcategories.uid,
+            journeys.uid,
+            COALESCE(original_journeys.uid, journeys.uid),
+            journeys.created_at
+        FROM journeys
+        JOIN instructors ON instructors.id = journeys.instructor_id
+        JOIN journey_subcategories
+            ON journey_subcategories.id = journeys.journey_subcategory_id
+        LEFT OUTER JOIN journeys AS original_journeys
+            ON original_journeys.id = journeys.variation_of_journey_id
+        WHERE
+            journeys.deleted_at IS NULL
+            AND journeys.special_category IS NULL
+            AND NOT EXISTS (
+                SELECT 1 FROM course_journeys, courses
+                WHERE
+                    course_journeys.journey_id = journeys.id
+                    AND course_journeys.course_id = courses.id
+                    AND (courses.flags & ?) = 0
+            )
+            AND (? = 0 OR EXISTS (
+                SELECT 1 FROM course_journeys, courses
+                WHERE
+                    course_journeys.journey_id = journeys.id
+                    AND course_journeys.course_id = courses.id
+                    AND (courses.flags & ?) <> 0
+            ))
+            AND EXISTS (
+                SELECT 1 FROM journey_emotions, emotions
+                WHERE
+                    journey_emotions.journey_id = journeys.id
+                    AND journey_emotions.emotion_id = emotions.id
+                    AND emotions.word = ?
+            )
+        """,
+        (
+            int(
+                SeriesFlags.JOURNEYS_IN_SERIES_ARE_PREMIUM
+                if premium
+                else SeriesFlags.JOURNEYS_IN_SERIES_ARE_1MINUTE
+            ),
+            int(premium),
+            int(SeriesFlags.JOURNEYS_IN_SERIES_ARE_PREMIUM),
+            emotion,
+        ),
+    )
+
+    result: Dict[Tuple[str, str], List[CombinationJourney]] = dict()
+    for (
+        instructor_uid,
+        category_uid,
+        journey_uid,
+        original_uid,
+        created_at,
+    ) in (
+        response.results or []
+    ):
+        result.setdefault((instructor_uid, category_uid), []).append(
+            CombinationJourney(
+                uid=journey_uid, original_uid=original_uid, created_at=created_at
+            )
+        )
+
+    cache.set(
+        cache_key,
+        json.dumps(
+            [
+                [
+                    instructor_uid,
+                    category_uid,
+                    [
+                        [journey.uid, journey.original_uid, journey.created_at]
+                        for journey in journeys
+                    ],
+                ]
+                for (instructor_uid, category_uid), journeys in result.items()
+            ]
+        ).encode("utf-8"),
+        expire=DISKCACHE_CACHE_TIME_SECONDS,
+    )
+    return result
+
+
+async def delete_journeys_by_combination_from_local_cache(
+    itgs: Itgs, *, emotion: str, premium: bool
+) -> None:
+    """Deletes the journeys for the given emotion cached by
+    `get_journeys_by_combination` on this instance
+    """
+    cache = await itgs.local_cache()
+    cache.delete(
+        f"personalization:journeys_by_combination:{emotion}:{premium}".encode("utf-8")
+    )
@@ -52,6 +52,20 @@ class JourneyFeedbackWithoutDebugInfo(Protocol):
     debug_info: Literal[None]
 
 
+def get_feedback_rating(
+    feedback_version: int, feedback_response: int
+) -> Optional[float]:
+    """Converts the response to the given version of the journey feedback question
+    to the rating used for personalization, or None if that version of the question
+    isn't used for personalization
+    """
+    if feedback_version in (1, 2):
+        return (1, -1)[feedback_response - 1]
+    if feedback_version == 3:
+        return (1, 0, -1, -2)[feedback_response - 1]
+    return None
+
+
 async def find_feedback(
     itgs: Itgs, *, user_sub: str, debug: bool = False
 ) -> List[JourneyFeedback]:
@@ -116,10 +130,8 @@ async def find_feedback(
     result: List[JourneyFeedback] = []
     for row in response.results or []:
         (instructor_uid, category_uid, feedback_version, feedback_response) = row[:4]
-        if feedback_version in (1, 2):
-            rating = (1, -1)[feedback_response - 1]
-        else:
-            rating = (1, 0, -1, -2)[feedback_response - 1]
+        rating = get_feedback_rating(feedback_version, feedback_response)
+        assert rating is not None, (feedback_version, feedback_response)
 
         result.append(
             JourneyFeedback(
@@ -1,6 +1,15 @@
-from typing import List, Sequence, Literal, Optional, Protocol, cast as typing_cast
+from typing import (
+    Dict,
+    List,
+    Sequence,
+    Literal,
+    Optional,
+    Protocol,
+    cast as typing_cast,
+)
 from itgs import Itgs
 from dataclasses import dataclass
+import numpy as np
 from personalization.lib.s01_find_combinations import InstructorCategoryAndBias
 from personalization.lib.s03a_find_feedback import (
     JourneyFeedback,
@@ -9,6 +18,13 @@ from personalization.lib.s03a_find_feedback import (
 )
 
 
+VECTORIZE_MIN_COMBINATIONS = 12
+"""The minimum number of combinations for `compute_feedback_scores` to use numpy;
+below this the fixed overhead of numpy calls outweighs the per-combination
+python loop
+"""
+
+
 @dataclass
 class FeedbackScoreDebugInfoTerm:
     """Describes the components of a single summand in the feedback score"""
@@ -88,7 +104,13 @@ async def map_to_feedback_score(
             If true, the debug information will be included in the returned FeedbackScore
             for each combination
     """
-    return [get_feedback_score(comb, feedback, debug=debug) for comb in combinations]
+    if debug:
+        return [get_feedback_score(comb, feedback, debug=True) for comb in combinations]
+
+    return [
+        FeedbackScore(score=score, debug_info=None)
+        for score in compute_feedback_scores(combinations, feedback).tolist()
+    ]
 
 
 async def map_to_feedback_score_with_debug(
@@ -129,7 +151,7 @@ async def map_to_feedback_score_without_debug(
 
 def get_feedback_score(
     comb: InstructorCategoryAndBias,
-    feedback: List[JourneyFeedback],
+    feedback: Sequence[JourneyFeedback],
     debug: bool = False,
 ) -> FeedbackScore:
     terms: Optional[List[FeedbackScoreDebugInfoTerm]] = None if not debug else []
@@ -183,3 +205,103 @@ def get_feedback_score(
             )
         ),
     )
+
+
+def compute_feedback_scores(
+    combinations: Sequence[InstructorCategoryAndBias],
+    feedback: Sequence[JourneyFeedback],
+) -> np.ndarray:
+    """Computes the same scores as `get_feedback_score` without debug information
+    for every combination at once. The feedback is encoded as arrays of age
+    weights, ratings, and category/instructor indices, the combinations as
+    index arrays, and the terms for every combination are computed as a single
+    matrix.
+
+    The Kahan summation is performed one feedback item at a time across all the
+    combinations, i.e., with exactly the same floating point operations in the
+    same order as `get_feedback_score`, so the result is identical rather than
+    just close. This is only a python loop over the feedback, which is capped
+    at 100 items by `find_feedback`. With fewer than `VECTORIZE_MIN_COMBINATIONS`
+    combinations this just uses `get_feedback_score`.
+
+    Args:
+        combinations (list[InstructorCategoryAndBias]): the combinations to score
+        feedback (list[JourneyFeedback]): the feedback to use, most recent first
+
+    Returns:
+        np.ndarray: a float64 array with the score for each combination, in the
+            same order as the combinations
+    """
+    num_combinations = len(combinations)
+    if num_combinations < VECTORIZE_MIN_COMBINATIONS:
+        return np.array(
+            [get_feedback_score(comb, feedback).score for comb in combinations],
+            dtype=np.float64,
+        )
+
+    num_feedback = len(feedback)
+
+    category_indices: Dict[str, int] = dict()
+    instructor_indices: Dict[str, int] = dict()
+    combination_categories = np.fromiter(
+        (
+            category_indices.setdefault(comb.category_uid, len(category_indices))
+            for comb in combinations
+        ),
+        dtype=np.intp,
+        count=num_combinations,
+    )
+    combination_instructors = np.fromiter(
+        (
+            instructor_indices.setdefault(comb.instructor_uid, len(instructor_indices))
+            for comb in combinations
+        ),
+        dtype=np.intp,
+        count=num_combinations,
+    )
+    bias_sums = np.fromiter(
+        (comb.instructor_bias + comb.category_bias for comb in combinations),
+        dtype=np.float64,
+        count=num_combinations,
+    )
+
+    # feedback for a category or instructor not in any combination gets -1,
+    # which never matches
+    feedback_categories = np.fromiter(
+        (category_indices.get(item.category_uid, -1) for item in feedback),
+        dtype=np.intp,
+        count=num_feedback,
+    )
+    feedback_instructors = np.fromiter(
+        (instructor_indices.get(item.instructor_uid, -1) for item in feedback),
+        dtype=np.intp,
+        count=num_feedback,
+    )
+    feedback_ratings = np.fromiter(
+        (item.rating for item in feedback), dtype=np.float64, count=num_feedback
+    )
+    age_terms = 1 - 0.01 * np.arange(num_feedback, dtype=np.float64)
+
+    # relevance[f, c] is the number of matches between feedback f and combination c;
+    # laid out by feedback so each step of the summation is a contiguous row
+    relevance = (feedback_categories[:, np.newaxis] == combination_categories).astype(
+        np.float64
+    )
+    relevance += feedback_instructors[:, np.newaxis] == combination_instructors
+    net_scores = (age_terms[:, np.newaxis] * relevance) * feedback_ratings[
+        :, np.newaxis
+    ]
+
+    # Kahan summation algorithm
+    terms_sum = np.zeros(num_combinations, dtype=np.float64)
+    terms_compensation = np.zeros(num_combinations, dtype=np.float64)
+    y = np.empty(num_combinations, dtype=np.float64)
+    t = np.empty(num_combinations, dtype=np.float64)
+    for net_score in net_scores:
+        np.subtract(net_score, terms_compensation, out=y)
+        np.add(terms_sum, y, out=t)
+        np.subtract(t, terms_sum, out=terms_compensation)
+        terms_compensation -= y
+        terms_sum, t = t, terms_sum
+
+    return terms_sum + (bias_sums - terms_compensation)
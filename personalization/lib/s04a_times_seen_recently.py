@@ -1,5 +1,5 @@
 import time
-from typing import List, Optional, Sequence, Protocol, Tuple, cast
+from typing import Dict, List, Optional, Sequence, Protocol, Tuple, cast
 from itgs import Itgs
 
 
@@ -60,3 +60,33 @@ async def map_to_times_seen_recently(
         recent_instructors.get(instructor.instructor_uid, 0)
         for instructor in instructors
     ]
+
+
+def map_to_times_seen_recently_from_instructor_uids(
+    *, instructors: Sequence[Instructor], recent_instructor_uids: Sequence[str]
+) -> List[int]:
+    """Produces the same result as `map_to_times_seen_recently`, given the
+    instructors of the journeys the user took recently from their personalization
+    profile (see `user_profile.py`) rather than querying the database.
+
+    Args:
+        instructors (list[Instructor]): the instructors to map; may include
+            duplicates
+        recent_instructor_uids (list[str]): the instructors of the journeys
+            the user took recently, with one entry per journey
+
+    Returns:
+        list[int]: A list with the same length as instructors, where index i
+            in instructors has the times seen recently for the instructors at
+            index i in this list.
+    """
+    recent_instructors: Dict[str, int] = dict()
+    for instructor_uid in recent_instructor_uids:
+        recent_instructors[instructor_uid] = (
+            recent_instructors.get(instructor_uid, 0) + 1
+        )
+
+    return [
+        recent_instructors.get(instructor.instructor_uid, 0)
+        for instructor in instructors
+    ]
@@ -1,6 +1,7 @@
-from typing import List
+from typing import List, Sequence
 from dataclasses import dataclass
 import math
+import numpy as np
 from functools import cmp_to_key
 import random
 
@@ -86,6 +87,43 @@ def find_best_combination_index(
     return best
 
 
+def find_best_combination_index_from_arrays(
+    *, lowest_view_counts: Sequence[int], adjusted_scores: np.ndarray
+) -> int:
+    """Equivalent to `find_best_combination_index`, but with the combinations
+    provided as arrays, finding the best index with numpy rather than comparing
+    one combination at a time.
+
+    `compare_combination_raw` prefers non-negative scores over negative ones,
+    then the lowest view count, then the highest score, so the best combinations
+    are found by narrowing the candidates by each of those in turn. Ties are
+    broken uniformly at random, just like `find_best_combination_index`.
+
+    Args:
+        lowest_view_counts (list[int]): the lowest view count for each combination
+        adjusted_scores (np.ndarray): the float64 adjusted score for each combination,
+            as from `compute_adjusted_scores`
+
+    Returns:
+        int: the index of the best combination
+    """
+    if len(adjusted_scores) == 0:
+        return 0
+
+    view_counts = np.asarray(lowest_view_counts, dtype=np.int64)
+    candidates = adjusted_scores >= 0
+    if not candidates.any():
+        candidates = np.ones(len(adjusted_scores), dtype=np.bool_)
+
+    candidates &= view_counts == view_counts[candidates].min()
+    candidates &= adjusted_scores == adjusted_scores[candidates].max()
+
+    best = np.flatnonzero(candidates)
+    if len(best) == 1:
+        return int(best[0])
+    return int(best[random.randrange(len(best))])
+
+
 def sort_by_descending_preference(
     combinations: List[ComparableInstructorCategory],
 ) -> None:
@@ -1,8 +1,9 @@
 from itgs import Itgs
 from dataclasses import dataclass
-from typing import Optional, List, Protocol, Sequence, cast as typing_cast
+from typing import Dict, Optional, List, Protocol, Sequence, cast as typing_cast
 
 from journeys.models.series_flags import SeriesFlags
+from personalization.lib.s02_lowest_view_count import CombinationJourney
 
 
 @dataclass
@@ -264,3 +265,42 @@ async def get_journeys_for_combination_with_debug(
             debug=True,
         ),
     )
+
+
+def get_journey_for_combination_from_profile(
+    *, journeys: Sequence[CombinationJourney], view_counts: Dict[str, int]
+) -> Optional[str]:
+    """Selects the same journey as `get_journeys_for_combination` with limit=1,
+    but using the journeys for the combination from `get_journeys_by_combination`
+    and the view counts from the users personalization profile (see
+    `user_profile.py`) rather than querying the database.
+
+    Args:
+        journeys (list[CombinationJourney]): the journeys for the combination
+        view_counts (dict[str, int]): the view counts from the users
+            personalization profile, keyed by the uid of the original journey
+
+    Returns:
+        str, None: the uid of the preferred journey, or None if there are no
+            journeys
+    """
+    best: Optional[CombinationJourney] = None
+    best_views = 0
+    for journey in journeys:
+        views = view_counts.get(journey.original_uid, 0)
+        if (
+            best is None
+            or views < best_views
+            or (
+                views == best_views
+                and (
+                    journey.created_at > best.created_at
+                    or (
+                        journey.created_at == best.created_at and journey.uid < best.uid
+                    )
+                )
+            )
+        ):
+            best = journey
+            best_views = views
+    return best.uid if best is not None else None
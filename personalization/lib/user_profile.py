@@ -0,0 +1,572 @@
+"""Maintains a compact per-user personalization profile in redis, so that
+`select_journey` can get everything it needs about the user in a single redis
+round trip rather than several analytical queries. The profile contains:
+
+- the most recent feedback the user gave, for step 3 (see `find_feedback`)
+- the instructors of the most recent journeys the user took, for step 4 (see
+  `map_to_times_seen_recently`)
+- how many times the user has taken each journey, counting all variations of a
+  journey together, for step 2 (see `map_to_lowest_view_counts_from_profile`)
+
+The profile is rebuilt from the database when it's missing, and otherwise kept
+up to date incrementally via `record_journey_started` and `record_journey_feedback`,
+which must be called whenever we insert into `user_journeys` or `journey_feedback`
+respectively. Anything else which changes those tables should call
+`evict_personalization_profile`. The profile expires after a fixed duration
+(not extended by reads or updates), which bounds how long changes we aren't
+told about (e.g., journeys being deleted) go unnoticed.
+
+Incremental updates and rebuilds are ordered using a version key which is
+incremented before each incremental update is applied; a rebuild is only
+stored if the version did not change while it was loading, and an incremental
+update is only applied to profiles built before it was versioned. The version
+is also used to detect when journeys selected in advance from the profile (see
+`write_selected_journeys`) are stale.
+"""
+
+from dataclasses import dataclass
+import json
+import time
+from typing import Dict, List, Optional, Sequence, Tuple, cast
+
+from itgs import Itgs
+from personalization.lib.s03a_find_feedback import (
+    JourneyFeedback,
+    get_feedback_rating,
+)
+from redis_helpers.personalization_profile_push import (
+    ensure_personalization_profile_push_script_exists,
+    personalization_profile_push,
+)
+from redis_helpers.personalization_profile_write import (
+    ensure_personalization_profile_write_script_exists,
+    personalization_profile_write,
+)
+from redis_helpers.run_with_prep import run_with_prep
+
+
+PROFILE_TTL_SECONDS = 60 * 60
+"""How long a profile is kept in redis after it's built"""
+
+VERSION_TTL_SECONDS = 60 * 60 * 24
+"""How long the version key for a profile is kept after it's last used; must
+be comfortably longer than PROFILE_TTL_SECONDS
+"""
+
+MAX_FEEDBACK = 100
+"""The maximum number of feedback items kept, matching `find_feedback`"""
+
+FEEDBACK_MAX_AGE_SECONDS = 60 * 60 * 24 * 30 * 6
+"""The maximum age of feedback which is considered, matching `find_feedback`"""
+
+MAX_RECENT_VIEWS = 10
+"""The maximum number of recent views kept, matching `map_to_times_seen_recently`"""
+
+RECENT_VIEWS_MAX_AGE_SECONDS = 60 * 60 * 240
+"""The maximum age of views considered recent, matching `map_to_times_seen_recently`"""
+
+SELECTED_JOURNEYS_TTL_SECONDS = 60 * 5
+"""How long journeys selected in advance via `select_journeys` are kept"""
+
+
+@dataclass
+class PersonalizationProfile:
+    """The information about a user needed to select a journey for them"""
+
+    feedback: List[JourneyFeedback]
+    """The feedback to consider when selecting content, most recent first; the
+    same as `find_feedback` would return
+    """
+    recent_instructor_uids: List[str]
+    """The uids of the instructors of the journeys the user took recently, most
+    recent first, possibly with duplicates
+    """
+    view_counts: Dict[str, int]
+    """Maps from the uid of a journey which is not a variation of another journey
+    to the number of times the user took it or any of its variations. Omitted
+    journeys have not been taken.
+    """
+    version: int
+    """The version of the profile when it was read; anything derived from the
+    profile can be stored with this version and compared against the current
+    version (see `read_selected_journey`) to detect if it's stale
+    """
+
+
+def _profile_key(user_sub: str) -> bytes:
+    return f"personalization:profiles:{user_sub}".encode("utf-8")
+
+
+def _feedback_key(user_sub: str) -> bytes:
+    return f"personalization:profiles:{user_sub}:feedback".encode("utf-8")
+
+
+def _recent_key(user_sub: str) -> bytes:
+    return f"personalization:profiles:{user_sub}:recent".encode("utf-8")
+
+
+def _version_key(user_sub: str) -> bytes:
+    return f"personalization:profiles:{user_sub}:version".encode("utf-8")
+
+
+def _selected_key(user_sub: str, premium: bool) -> bytes:
+    return f"personalization:profiles:{user_sub}:selected:{premium}".encode("utf-8")
+
+
+async def get_personalization_profile(
+    itgs: Itgs, *, user_sub: str, now: Optional[float] = None
+) -> PersonalizationProfile:
+    """Fetches the personalization profile for the user with the given sub,
+    rebuilding it from the database if it's not in redis.
+
+    Args:
+        itgs (Itgs): the integrations to (re)use
+        user_sub (str): the sub of the user whose profile to fetch
+        now (float, None): the current time, for filtering out old feedback and
+            views, or None for the current system time
+
+    Returns:
+        PersonalizationProfile: the profile for the user
+    """
+    if now is None:
+        now = time.time()
+
+    redis = await itgs.redis()
+    async with redis.pipeline() as pipe:
+        pipe.multi()
+        await pipe.hgetall(_profile_key(user_sub))  # type: ignore
+        await pipe.lrange(_feedback_key(user_sub), 0, -1)  # type: ignore
+        await pipe.lrange(_recent_key(user_sub), 0, -1)  # type: ignore
+        await pipe.get(_version_key(user_sub))
+        raw_profile, raw_feedback, raw_recent, raw_version = await pipe.execute()
+
+    if not raw_profile:
+        raw_profile, raw_feedback, raw_recent, raw_version = await _rebuild_profile(
+            itgs, user_sub=user_sub, now=now
+        )
+
+    return _parse_profile(
+        cast(Dict[bytes, bytes], raw_profile),
+        cast(List[bytes], raw_feedback),
+        cast(List[bytes], raw_recent),
+        cast(Optional[bytes], raw_version),
+        now=now,
+    )
+
+
+async def write_selected_journeys(
+    itgs: Itgs,
+    *,
+    user_sub: str,
+    premium: bool,
+    version: int,
+    selected: Dict[str, str],
+) -> None:
+    """Stores the journeys selected in advance for the user with the given sub
+    for each emotion word in `selected`, replacing any previously stored for the
+    same value of premium. They are only returned by `read_selected_journey` until
+    the profile changes from the given version, or for a short while otherwise.
+
+    Args:
+        itgs (Itgs): the integrations to (re)use
+        user_sub (str): the sub of the user the journeys were selected for
+        premium (bool): true if the journeys are premium classes, false for free
+            classes
+        version (int): the version of the profile used to select the journeys
+        selected (dict[str, str]): maps from emotion word to journey uid
+    """
+    key = _selected_key(user_sub, premium)
+    mapping: Dict[bytes, bytes] = {b"version": str(version).encode("ascii")}
+    for emotion, journey_uid in selected.items():
+        mapping[f"e:{emotion}".encode("utf-8")] = journey_uid.encode("utf-8")
+
+    redis = await itgs.redis()
+    async with redis.pipeline() as pipe:
+        pipe.multi()
+        await pipe.delete(key)
+        await pipe.hset(key, mapping=mapping)  # type: ignore
+        await pipe.expire(key, SELECTED_JOURNEYS_TTL_SECONDS)
+        await pipe.execute()
+
+
+async def read_selected_journey(
+    itgs: Itgs, *, user_sub: str, premium: bool, emotion: str
+) -> Optional[str]:
+    """Fetches the journey selected in advance via `write_selected_journeys` for
+    the user with the given sub and the given emotion, if there is one and the
+    users profile hasn't changed since it was selected.
+
+    Args:
+        itgs (Itgs): the integrations to (re)use
+        user_sub (str): the sub of the user to select a journey for
+        premium (bool): true for a premium class, false for a free class
+        emotion (str): the emotion word to select a journey for
+
+    Returns:
+        str, None: the uid of the journey, or None if there isn't a usable one
+    """
+    redis = await itgs.redis()
+    async with redis.pipeline() as pipe:
+        pipe.multi()
+        await pipe.hmget(  # type: ignore
+            _selected_key(user_sub, premium),  # type: ignore
+            [b"version", f"e:{emotion}".encode("utf-8")],  # type: ignore
+        )
+        await pipe.get(_version_key(user_sub))
+        (selected_version, journey_uid), current_version = await pipe.execute()
+
+    if selected_version is None or journey_uid is None:
+        return None
+
+    if int(selected_version) != (
+        int(current_version) if current_version is not None else 0
+    ):
+        return None
+
+    return journey_uid.decode("utf-8")
+
+
+async def record_journey_started(
+    itgs: Itgs, *, user_sub: str, user_journey_uid: str
+) -> None:
+    """Updates the personalization profile for the user with the given sub, if it
+    exists, to reflect the user_journeys row with the given uid, which must have
+    just been inserted.
+    """
+    version, profile_exists = await _bump_version(itgs, user_sub=user_sub)
+    if not profile_exists:
+        return
+
+    conn = await itgs.conn()
+    cursor = conn.cursor("weak")
+    response = await cursor.execute(
+        """
+        SELECT
+            user_journeys.created_at,
+            COALESCE(original_journeys.uid, journeys.uid),
+            instructors.uid
+        FROM user_journeys
+        JOIN journeys ON journeys.id = user_journeys.journey_id
+        JOIN instructors ON instructors.id = journeys.instructor_id
+        LEFT OUTER JOIN journeys AS original_journeys
+            ON original_journeys.id = journeys.variation_of_journey_id
+        WHERE user_journeys.uid = ?
+        """,
+        (user_journey_uid,),
+    )
+    if not response.results:
+        await evict_personalization_profile(itgs, user_sub=user_sub)
+        return
+
+    created_at: float = response.results[0][0]
+    root_journey_uid: str = response.results[0][1]
+    instructor_uid: str = response.results[0][2]
+
+    await _push(
+        itgs,
+        user_sub=user_sub,
+        list_key=_recent_key(user_sub),
+        version=version,
+        view_field=f"v:{root_journey_uid}".encode("utf-8"),
+        list_item=_serialize_recent_view(created_at, instructor_uid),
+        max_list_length=MAX_RECENT_VIEWS,
+    )
+
+
+async def record_journey_feedback(
+    itgs: Itgs, *, user_sub: str, journey_feedback_uid: str
+) -> None:
+    """Updates the personalization profile for the user with the given sub, if it
+    exists, to reflect the journey_feedback row with the given uid, which must
+    have just been inserted.
+    """
+    version, profile_exists = await _bump_version(itgs, user_sub=user_sub)
+    if not profile_exists:
+        return
+
+    conn = await itgs.conn()
+    cursor = conn.cursor("weak")
+    response = await cursor.execute(
+        """
+        SELECT
+            journey_feedback.created_at,
+            journey_feedback.version,
+            journey_feedback.response,
+            instructors.uid,
+            journey_subcategories.uid,
+            journeys.deleted_at IS NULL AND journeys.special_category IS NULL
+        FROM journey_feedback
+        JOIN journeys ON journeys.id = journey_feedback.journey_id
+        JOIN instructors ON instructors.id = journeys.instructor_id
+        JOIN journey_subcategories
+            ON journey_subcategories.id = journeys.journey_subcategory_id
+        WHERE journey_feedback.uid = ?
+        """,
+        (journey_feedback_uid,),
+    )
+    if not response.results:
+        await evict_personalization_profile(itgs, user_sub=user_sub)
+        return
+
+    (
+        created_at,
+        feedback_version,
+        feedback_response,
+        instructor_uid,
+        category_uid,
+        is_eligible,
+    ) = response.results[0]
+    rating = get_feedback_rating(feedback_version, feedback_response)
+    if rating is None or not is_eligible:
+        return
+
+    await _push(
+        itgs,
+        user_sub=user_sub,
+        list_key=_feedback_key(user_sub),
+        version=version,
+        view_field=None,
+        list_item=_serialize_feedback(created_at, instructor_uid, category_uid, rating),
+        max_list_length=MAX_FEEDBACK,
+    )
+
+
+async def evict_personalization_profile(itgs: Itgs, *, user_sub: str) -> None:
+    """Removes the personalization profile for the user with the given sub from
+    redis, so it's rebuilt the next time it's needed. Any rebuild in progress
+    will not be stored.
+    """
+    redis = await itgs.redis()
+    async with redis.pipeline() as pipe:
+        pipe.multi()
+        await pipe.incr(_version_key(user_sub))
+        await pipe.expire(_version_key(user_sub), VERSION_TTL_SECONDS)
+        await pipe.delete(
+            _profile_key(user_sub), _feedback_key(user_sub), _recent_key(user_sub)
+        )
+        await pipe.execute()
+
+
+async def _bump_version(itgs: Itgs, *, user_sub: str) -> Tuple[int, bool]:
+    """Increments the version for the profile of the user with the given sub,
+    returning the new version and whether the profile currently exists
+    """
+    redis = await itgs.redis()
+    async with redis.pipeline() as pipe:
+        pipe.multi()
+        await pipe.incr(_version_key(user_sub))
+        await pipe.expire(_version_key(user_sub), VERSION_TTL_SECONDS)
+        await pipe.exists(_profile_key(user_sub))
+        version, _, exists = await pipe.execute()
+    return int(version), bool(exists)
+
+
+async def _push(
+    itgs: Itgs,
+    *,
+    user_sub: str,
+    list_key: bytes,
+    version: int,
+    view_field: Optional[bytes],
+    list_item: bytes,
+    max_list_length: int,
+) -> None:
+    redis = await itgs.redis()
+
+    async def _prepare(force: bool):
+        await ensure_personalization_profile_push_script_exists(redis, force=force)
+
+    async def _execute():
+        return await personalization_profile_push(
+            redis,
+            profile_key=_profile_key(user_sub),
+            list_key=list_key,
+            version=version,
+            view_field=view_field,
+            list_item=list_item,
+            max_list_length=max_list_length,
+        )
+
+    await run_with_prep(_prepare, _execute)
+
+
+async def _rebuild_profile(
+    itgs: Itgs, *, user_sub: str, now: float
+) -> Tuple[Dict[bytes, bytes], List[bytes], List[bytes], Optional[bytes]]:
+    """Loads the profile for the user with the given sub from the database and
+    stores it in redis unless it changed while we were loading it. Returns the
+    profile in the same format as it's stored in redis, plus the version it
+    was loaded at.
+    """
+    redis = await itgs.redis()
+    expected_version = cast(Optional[bytes], await redis.get(_version_key(user_sub)))
+
+    conn = await itgs.conn()
+    cursor = conn.cursor("weak")
+    response = await cursor.executeunified3(
+        (
+            (
+                """
+                SELECT
+                    journey_feedback.created_at,
+                    journey_feedback.version,
+                    journey_feedback.response,
+                    instructors.uid,
+                    journey_subcategories.uid
+                FROM journey_feedback, users, journeys, instructors, journey_subcategories
+                WHERE
+                    journey_feedback.user_id = users.id
+                    AND journey_feedback.journey_id = journeys.id
+                    AND journeys.instructor_id = instructors.id
+                    AND journeys.journey_subcategory_id = journey_subcategories.id
+                    AND users.sub = ?
+                    AND journey_feedback.created_at > ?
+                    AND journey_feedback.version IN (1, 2, 3)
+                    AND journeys.deleted_at IS NULL
+                    AND journeys.special_category IS NULL
+                ORDER BY journey_feedback.created_at DESC
+                LIMIT ?
+                """,
+                (user_sub, now - FEEDBACK_MAX_AGE_SECONDS, MAX_FEEDBACK),
+            ),
+            (
+                """
+                SELECT
+                    user_journeys.created_at,
+                    instructors.uid
+                FROM user_journeys, users, journeys, instructors
+                WHERE
+                    user_journeys.user_id = users.id
+                    AND user_journeys.journey_id = journeys.id
+                    AND journeys.instructor_id = instructors.id
+                    AND users.sub = ?
+                ORDER BY user_journeys.created_at DESC, user_journeys.id DESC
+                LIMIT ?
+                """,
+                (user_sub, MAX_RECENT_VIEWS),
+            ),
+            (
+                """
+                SELECT
+                    COALESCE(original_journeys.uid, journeys.uid) AS root_uid,
+                    COUNT(*)
+                FROM user_journeys
+                JOIN users ON users.id = user_journeys.user_id
+                JOIN journeys ON journeys.id = user_journeys.journey_id
+                LEFT OUTER JOIN journeys AS original_journeys
+                    ON original_journeys.id = journeys.variation_of_journey_id
+                WHERE users.sub = ?
+                GROUP BY root_uid
+                """,
+                (user_sub,),
+            ),
+        )
+    )
+
+    raw_feedback: List[bytes] = []
+    for (
+        created_at,
+        feedback_version,
+        feedback_response,
+        instructor_uid,
+        category_uid,
+    ) in (
+        response[0].results or []
+    ):
+        rating = get_feedback_rating(feedback_version, feedback_response)
+        assert rating is not None, (feedback_version, feedback_response)
+        raw_feedback.append(
+            _serialize_feedback(created_at, instructor_uid, category_uid, rating)
+        )
+
+    raw_recent: List[bytes] = [
+        _serialize_recent_view(created_at, instructor_uid)
+        for created_at, instructor_uid in (response[1].results or [])
+    ]
+
+    views: List[Tuple[bytes, int]] = [
+        (f"v:{root_journey_uid}".encode("utf-8"), view_count)
+        for root_journey_uid, view_count in (response[2].results or [])
+    ]
+
+    async def _prepare(force: bool):
+        await ensure_personalization_profile_write_script_exists(redis, force=force)
+
+    async def _execute():
+        return await personalization_profile_write(
+            redis,
+            profile_key=_profile_key(user_sub),
+            feedback_key=_feedback_key(user_sub),
+            recent_key=_recent_key(user_sub),
+            version_key=_version_key(user_sub),
+            expected_version=expected_version,
+            ttl=PROFILE_TTL_SECONDS,
+            version_ttl=VERSION_TTL_SECONDS,
+            built_at=now,
+            views=views,
+            feedback=raw_feedback,
+            recent=raw_recent,
+        )
+
+    await run_with_prep(_prepare, _execute)
+
+    raw_profile: Dict[bytes, bytes] = {
+        field: str(value).encode("ascii") for field, value in views
+    }
+    return raw_profile, raw_feedback, raw_recent, expected_version
+
+
+def _serialize_feedback(
+    created_at: float, instructor_uid: str, category_uid: str, rating: float
+) -> bytes:
+    return json.dumps([created_at, instructor_uid, category_uid, rating]).encode(
+        "utf-8"
+    )
+
+
+def _serialize_recent_view(created_at: float, instructor_uid: str) -> bytes:
+    return json.dumps([created_at, instructor_uid]).encode("utf-8")
+
+
+def _parse_profile(
+    raw_profile: Dict[bytes, bytes],
+    raw_feedback: Sequence[bytes],
+    raw_recent: Sequence[bytes],
+    raw_version: Optional[bytes],
+    *,
+    now: float,
+) -> PersonalizationProfile:
+    feedback: List[JourneyFeedback] = []
+    feedback_cutoff = now - FEEDBACK_MAX_AGE_SECONDS
+    for raw_item in raw_feedback:
+        created_at, instructor_uid, category_uid, rating = json.loads(raw_item)
+        if created_at <= feedback_cutoff:
+            break
+        feedback.append(
+            JourneyFeedback(
+                instructor_uid=instructor_uid,
+                category_uid=category_uid,
+                rating=rating,
+                debug_info=None,
+            )
+        )
+
+    recent_instructor_uids: List[str] = []
+    recent_cutoff = now - RECENT_VIEWS_MAX_AGE_SECONDS
+    for raw_item in raw_recent:
+        created_at, instructor_uid = json.loads(raw_item)
+        if created_at <= recent_cutoff:
+            break
+        recent_instructor_uids.append(instructor_uid)
+
+    view_counts: Dict[str, int] = dict()
+    for field, value in raw_profile.items():
+        if field.startswith(b"v:"):
+            view_counts[field[2:].decode("utf-8")] = int(value)
+
+    return PersonalizationProfile(
+        feedback=feedback,
+        recent_instructor_uids=recent_instructor_uids,
+        view_counts=view_counts,
+        version=int(raw_version) if raw_version is not None else 0,
+    )
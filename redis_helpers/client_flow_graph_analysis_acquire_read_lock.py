@@ -39,6 +39,12 @@ end
 local meta_key = key_base .. ':meta'
 
 local meta_expires_at_str = redis.call('HGET', meta_key, 'expires_at')
+if
+    meta_expires_at_str ~= false
+    and redis.call('ZSCORE', 'client_flow_graph_analysis:' .. version_str .. ':graphs', graph_id) == false
+then
+    meta_expires_at_str = false
+end
 local meta_expires_at = false
 if meta_expires_at_str ~= false then
     meta_expires_at = tonumber(meta_expires_at_str)
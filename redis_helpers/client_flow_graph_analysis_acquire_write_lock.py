@@ -39,8 +39,12 @@ end
 
 
 local meta_key = key_base .. ':meta'
+local graphs_key = 'client_flow_graph_analysis:' .. version_str .. ':graphs'
 
 local meta_expires_at_str = redis.call('HGET', meta_key, 'expires_at')
+if meta_expires_at_str ~= false and redis.call('ZSCORE', graphs_key, graph_id) == false then
+    meta_expires_at_str = false
+end
 local meta_expires_at = false
 local lock_expires_at = now + lock_time
 if meta_expires_at_str ~= false then
@@ -53,6 +57,9 @@ end
 if meta_expires_at == false or meta_expires_at - now < min_ttl then
     redis.call('HMSET', meta_key, 'uid', uid_if_initialize, 'initialized_at', now, 'expires_at', now + data_cache_time)
     redis.call('EXPIREAT', meta_key, now + data_cache_time)
+    redis.call('ZADD', graphs_key, now + data_cache_time, graph_id)
+    redis.call('EXPIREAT', graphs_key, now + data_cache_time, 'NX')
+    redis.call('EXPIREAT', graphs_key, now + data_cache_time, 'GT')
     redis.call('SET', writer_lock_key, lock_uid_if_acquired)
     redis.call('EXPIREAT', writer_lock_key, lock_expires_at)
     redis.call(
@@ -0,0 +1,244 @@
+from typing import Any, Optional, List
+import hashlib
+import time
+import redis.asyncio.client
+from dataclasses import dataclass
+
+from itgs import Itgs
+from redis_helpers.run_with_prep import run_with_prep
+
+CLIENT_FLOW_GRAPH_ANALYSIS_EVICT_FLOW_LUA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local slug = ARGV[2]
+local num_targets = tonumber(ARGV[3])
+
+redis.call('INCR', 'client_flow_graph_analysis:flows_version')
+
+local version_str = redis.call('GET', 'client_flow_graph_analysis:version')
+if version_str == false then
+    return {0, 0, 0}
+end
+
+local graphs_key = 'client_flow_graph_analysis:' .. version_str .. ':graphs'
+redis.call('ZREMRANGEBYSCORE', graphs_key, '-inf', now)
+local graph_ids = redis.call('ZRANGE', graphs_key, 0, -1)
+
+local evicted = 0
+local interrupted = 0
+for _, graph_id in ipairs(graph_ids) do
+    local key_base = 'client_flow_graph_analysis:' .. graph_id .. ':' .. version_str
+
+    if redis.call('DEL', key_base .. ':writer') == 1 then
+        interrupted = interrupted + 1
+        redis.call(
+            'PUBLISH',
+            'ps:client_flow_graph_analysis:lock_changed',
+            struct.pack('>I4', string.len(graph_id))
+                .. graph_id
+                .. struct.pack('>I2', 0)
+                .. struct.pack('>I1', 0)
+        )
+    end
+
+    local data_uid = redis.call('HGET', key_base .. ':meta', 'uid')
+    if data_uid ~= false then
+        local data_base = 'client_flow_graph_analysis:' .. data_uid
+
+        local touched = {}
+        touched[slug] = true
+        for target_idx = 1, num_targets do
+            touched[ARGV[3 + target_idx]] = true
+        end
+        local old_targets = redis.call('SMEMBERS', data_base .. ':reachable:' .. slug .. ':1')
+        for _, target in ipairs(old_targets) do
+            if target ~= '__computed__' then
+                touched[target] = true
+            end
+        end
+
+        local analyses_key = data_base .. ':analyses'
+        local analyses = redis.call('SMEMBERS', analyses_key)
+        for _, analysis in ipairs(analyses) do
+            local inverted = string.sub(analysis, 1, 1) == '1'
+            local source_sep = string.find(analysis, ':', 3, true)
+            local max_steps_str = string.sub(analysis, 3, source_sep - 1)
+            local source = string.sub(analysis, source_sep + 1)
+
+            local reachable_key =
+                data_base
+                .. ':'
+                .. (inverted and 'inverted_' or '')
+                .. 'reachable:'
+                .. source
+                .. (max_steps_str ~= '-' and (':' .. max_steps_str) or '')
+
+            local affected = false
+            if inverted then
+                affected = touched[source] == true
+                if not affected then
+                    for target, _ in pairs(touched) do
+                        if redis.call('SISMEMBER', reachable_key, target) == 1 then
+                            affected = true
+                            break
+                        end
+                    end
+                end
+            else
+                affected = source == slug or redis.call('SISMEMBER', reachable_key, slug) == 1
+            end
+
+            if affected then
+                local reachable = redis.call('SMEMBERS', reachable_key)
+                for _, target in ipairs(reachable) do
+                    redis.call('DEL', reachable_key .. ':paths:' .. target)
+                end
+                redis.call('DEL', reachable_key)
+                redis.call('SREM', analyses_key, analysis)
+                evicted = evicted + 1
+            end
+        end
+    end
+end
+
+return {#graph_ids, evicted, interrupted}
+"""
+
+CLIENT_FLOW_GRAPH_ANALYSIS_EVICT_FLOW_LUA_SCRIPT_HASH = hashlib.sha1(
+    CLIENT_FLOW_GRAPH_ANALYSIS_EVICT_FLOW_LUA_SCRIPT.encode("utf-8")
+).hexdigest()
+
+
+_last_client_flow_graph_analysis_evict_flow_ensured_at: Optional[float] = None
+
+
+async def ensure_client_flow_graph_analysis_evict_flow_script_exists(
+    redis: redis.asyncio.client.Redis, *, force: bool = False
+) -> None:
+    """Ensures the client_flow_graph_analysis_evict_flow lua script is loaded into redis."""
+    global _last_client_flow_graph_analysis_evict_flow_ensured_at
+
+    now = time.time()
+    if (
+        not force
+        and _last_client_flow_graph_analysis_evict_flow_ensured_at is not None
+        and (now - _last_client_flow_graph_analysis_evict_flow_ensured_at < 5)
+    ):
+        return
+
+    loaded: List[bool] = await redis.script_exists(
+        CLIENT_FLOW_GRAPH_ANALYSIS_EVICT_FLOW_LUA_SCRIPT_HASH
+    )
+    if not loaded[0]:
+        correct_hash = await redis.script_load(
+            CLIENT_FLOW_GRAPH_ANALYSIS_EVICT_FLOW_LUA_SCRIPT
+        )
+        assert (
+            correct_hash == CLIENT_FLOW_GRAPH_ANALYSIS_EVICT_FLOW_LUA_SCRIPT_HASH
+        ), f"{correct_hash=} != {CLIENT_FLOW_GRAPH_ANALYSIS_EVICT_FLOW_LUA_SCRIPT_HASH=}"
+
+    if (
+        _last_client_flow_graph_analysis_evict_flow_ensured_at is None
+        or _last_client_flow_graph_analysis_evict_flow_ensured_at < now
+    ):
+        _last_client_flow_graph_analysis_evict_flow_ensured_at = now
+
+
+@dataclass
+class ClientFlowGraphAnalysisEvictFlowResult:
+    graphs: int
+    """How many graphs were cached at the current version"""
+    evicted: int
+    """How many cached analyses (across all graphs) were evicted"""
+    interrupted: int
+    """How many writers had their lock taken away"""
+
+
+async def client_flow_graph_analysis_evict_flow(
+    redis: redis.asyncio.client.Redis,
+    /,
+    *,
+    slug: bytes,
+    targets: List[bytes],
+    now: int,
+) -> Optional[ClientFlowGraphAnalysisEvictFlowResult]:
+    """Evicts the cached analyses, within every graph cached at the current
+    version, which may depend on the outgoing edges of the client flow with the
+    given slug. The graphs are found via `client_flow_graph_analysis:{version}:graphs`
+    and the analyses within each graph via `client_flow_graph_analysis:{uid}:analyses`.
+    Always increments `client_flow_graph_analysis:flows_version`, so that in-memory
+    copies of the graph can detect the change.
+
+    A reachable analysis from a source depends on the flow if the flow is the
+    source or is reachable from the source. An inverted reachable analysis
+    depends on the flow if the flow, any of its old targets (from its cached
+    adjacency list), or any of the given new targets is the source or is in
+    the analysis.
+
+    Any held write locks are released, since the writer may be computing an
+    analysis from the old edges and would otherwise commit it after eviction.
+
+    Args:
+        redis (redis.asyncio.client.Redis): The redis client
+        slug (bytes): The slug of the flow whose outgoing edges changed
+        targets (list[bytes]): A superset of the slugs the flow has edges to
+            after the change, in any graph
+        now (int): The current time in seconds since the epoch
+
+    Returns:
+        ClientFlowGraphAnalysisEvictFlowResult, None: The result. None if executed
+            within a transaction, since the result is not known until the
+            transaction is executed.
+
+    Raises:
+        NoScriptError: If the script is not loaded into redis
+    """
+    res = await redis.evalsha(
+        CLIENT_FLOW_GRAPH_ANALYSIS_EVICT_FLOW_LUA_SCRIPT_HASH,
+        0,
+        now,  # type: ignore
+        slug,  # type: ignore
+        len(targets),  # type: ignore
+        *targets,  # type: ignore
+    )
+    if res is redis:
+        return None
+    return parse_client_flow_graph_analysis_evict_flow_result(res)
+
+
+async def safe_client_flow_graph_analysis_evict_flow(
+    itgs: Itgs,
+    /,
+    *,
+    slug: bytes,
+    targets: List[bytes],
+    now: int,
+) -> ClientFlowGraphAnalysisEvictFlowResult:
+    """Same as `client_flow_graph_analysis_evict_flow`, but uses the standard
+    redis instance (and thus definitely not a pipeline) and thus can guarrantee a result
+    and handle loading the script if necessary
+    """
+    redis = await itgs.redis()
+
+    async def _prepare(force: bool):
+        await ensure_client_flow_graph_analysis_evict_flow_script_exists(
+            redis, force=force
+        )
+
+    async def _execute():
+        return await client_flow_graph_analysis_evict_flow(
+            redis, slug=slug, targets=targets, now=now
+        )
+
+    result = await run_with_prep(_prepare, _execute)
+    assert result is not None
+    return result
+
+
+def parse_client_flow_graph_analysis_evict_flow_result(
+    res: Any,
+) -> ClientFlowGraphAnalysisEvictFlowResult:
+    assert isinstance(res, (list, tuple)), res
+    assert len(res) == 3, res
+    return ClientFlowGraphAnalysisEvictFlowResult(
+        graphs=int(res[0]), evicted=int(res[1]), interrupted=int(res[2])
+    )
@@ -47,6 +47,14 @@ local reachable_key =
     .. (max_steps_str ~= false and (':' .. max_steps_str) or '')
 
 if is_first then
+    local analyses_key = 'client_flow_graph_analysis:' .. data_uid .. ':analyses'
+    redis.call(
+        'SADD',
+        analyses_key,
+        (inverted and '1' or '0') .. ':' .. (max_steps_str or '-') .. ':' .. source
+    )
+    redis.call('EXPIREAT', analyses_key, expire_time_str)
+
     local cursor = nil
     while cursor ~= '0' do
         local scan_result = redis.call('SSCAN', reachable_key, cursor or 0)
@@ -0,0 +1,105 @@
+from typing import Optional, List, Union
+import hashlib
+import time
+import redis.asyncio.client
+
+CLIENT_SCREEN_QUEUE_HEAD_CAS_LUA_SCRIPT = """
+local key = KEYS[1]
+local expected_version = ARGV[1]
+local data = ARGV[2]
+local ttl = tonumber(ARGV[3])
+
+local current_version = redis.call("HGET", key, "version")
+if current_version == false then
+    current_version = "0"
+end
+
+if current_version ~= expected_version then
+    return false
+end
+
+local new_version = redis.call("HINCRBY", key, "version", 1)
+redis.call("HSET", key, "data", data)
+redis.call("EXPIRE", key, ttl)
+return new_version
+"""
+
+CLIENT_SCREEN_QUEUE_HEAD_CAS_LUA_SCRIPT_HASH = hashlib.sha1(
+    CLIENT_SCREEN_QUEUE_HEAD_CAS_LUA_SCRIPT.encode("utf-8")
+).hexdigest()
+
+
+_last_client_screen_queue_head_cas_ensured_at: Optional[float] = None
+
+
+async def ensure_client_screen_queue_head_cas_script_exists(
+    redis: redis.asyncio.client.Redis, *, force: bool = False
+) -> None:
+    """Ensures the client_screen_queue_head_cas lua script is loaded into redis."""
+    global _last_client_screen_queue_head_cas_ensured_at
+
+    now = time.time()
+    if (
+        not force
+        and _last_client_screen_queue_head_cas_ensured_at is not None
+        and (now - _last_client_screen_queue_head_cas_ensured_at < 5)
+    ):
+        return
+
+    loaded: List[bool] = await redis.script_exists(
+        CLIENT_SCREEN_QUEUE_HEAD_CAS_LUA_SCRIPT_HASH
+    )
+    if not loaded[0]:
+        correct_hash = await redis.script_load(CLIENT_SCREEN_QUEUE_HEAD_CAS_LUA_SCRIPT)
+        assert (
+            correct_hash == CLIENT_SCREEN_QUEUE_HEAD_CAS_LUA_SCRIPT_HASH
+        ), f"{correct_hash=} != {CLIENT_SCREEN_QUEUE_HEAD_CAS_LUA_SCRIPT_HASH=}"
+
+    if (
+        _last_client_screen_queue_head_cas_ensured_at is None
+        or _last_client_screen_queue_head_cas_ensured_at < now
+    ):
+        _last_client_screen_queue_head_cas_ensured_at = now
+
+
+async def client_screen_queue_head_cas(
+    redis: redis.asyncio.client.Redis,
+    key: Union[str, bytes],
+    expected_version: int,
+    data: Union[str, bytes],
+    ttl: int,
+) -> Optional[int]:
+    """Replaces the `data` field of the client screen queue head hash at the
+    given key if its `version` field matches the expected version, where a
+    missing version is treated as 0. When replaced, the version is incremented
+    and the expiration time of the key is reset.
+
+    Args:
+        redis (redis.asyncio.client.Redis): The redis client
+        key (str, bytes): The key of the hash to update
+        expected_version (int): The version we expect the hash to be at
+        data (str, bytes): The new value for the data field
+        ttl (int): The expiration time for the key in seconds
+
+    Returns:
+        int, None: The new version if the data was replaced, None if the
+            version did not match. None if executed within a transaction,
+            since the result is not known until the transaction is executed.
+
+    Raises:
+        NoScriptError: If the script is not loaded into redis
+    """
+    res = await redis.evalsha(  # type: ignore
+        CLIENT_SCREEN_QUEUE_HEAD_CAS_LUA_SCRIPT_HASH,
+        1,
+        key,  # type: ignore
+        str(expected_version).encode("ascii"),  # type: ignore
+        data,  # type: ignore
+        ttl,  # type: ignore
+    )
+    if res is redis:
+        return None
+    if res is None:
+        return None
+    assert isinstance(res, int), res
+    return res
@@ -0,0 +1,261 @@
+from typing import Any, List, Literal, Optional
+import hashlib
+import time
+import redis.asyncio.client
+
+INTERACTIVE_PROMPT_SESSION_ACCEPT_EVENT_LUA_SCRIPT = """
+local state_key = KEYS[1]
+local buffer_key = KEYS[2]
+
+local interactive_prompt_uid = ARGV[1]
+local user_sub = ARGV[2]
+local evtype = ARGV[3]
+local prompt_time_str = ARGV[4]
+local require_pressing = ARGV[5]
+local set_pressing = ARGV[6]
+local tracked_value = ARGV[7]
+local entry = ARGV[8]
+local ttl = tonumber(ARGV[9])
+
+local prompt_time = tonumber(prompt_time_str)
+
+local state = redis.call(
+    "HMGET", state_key,
+    "interactive_prompt_uid", "user_sub", "ended", "last_prompt_time", "last_evtypes", "pressing"
+)
+
+if evtype == "join" then
+    if state[1] ~= false then
+        return -6
+    end
+
+    redis.call(
+        "HSET", state_key,
+        "interactive_prompt_uid", interactive_prompt_uid,
+        "user_sub", user_sub,
+        "ended", "0",
+        "last_prompt_time", prompt_time_str,
+        "last_evtypes", evtype,
+        "pressing", "0"
+    )
+    redis.call("EXPIRE", state_key, ttl)
+    redis.call("RPUSH", buffer_key, "[null," .. entry .. "]")
+    return 1
+end
+
+if state[1] == false then
+    return 0
+end
+
+if state[1] ~= interactive_prompt_uid or state[2] ~= user_sub then
+    return -1
+end
+
+if state[3] == "1" then
+    return -2
+end
+
+local last_prompt_time = tonumber(state[4])
+if last_prompt_time > prompt_time then
+    return -3
+end
+
+if last_prompt_time == prompt_time then
+    for other_evtype in string.gmatch(state[5], "%S+") do
+        if other_evtype == evtype then
+            return -4
+        end
+    end
+end
+
+if require_pressing ~= "" and state[6] ~= require_pressing then
+    return -5
+end
+
+if last_prompt_time == prompt_time then
+    redis.call("HSET", state_key, "last_evtypes", state[5] .. " " .. evtype)
+else
+    redis.call("HSET", state_key, "last_prompt_time", prompt_time_str, "last_evtypes", evtype)
+end
+
+if evtype == "leave" then
+    redis.call("HSET", state_key, "ended", "1")
+end
+
+if set_pressing ~= "" then
+    redis.call("HSET", state_key, "pressing", set_pressing)
+end
+
+local previous_value = "null"
+if tracked_value ~= "" then
+    local value_field = "value:" .. evtype
+    local stored_value = redis.call("HGET", state_key, value_field)
+    if stored_value ~= false then
+        previous_value = stored_value
+    end
+    redis.call("HSET", state_key, value_field, tracked_value)
+end
+
+redis.call("EXPIRE", state_key, ttl)
+redis.call("RPUSH", buffer_key, "[" .. previous_value .. "," .. entry .. "]")
+return 1
+"""
+
+INTERACTIVE_PROMPT_SESSION_ACCEPT_EVENT_LUA_SCRIPT_HASH = hashlib.sha1(
+    INTERACTIVE_PROMPT_SESSION_ACCEPT_EVENT_LUA_SCRIPT.encode("utf-8")
+).hexdigest()
+
+
+_last_interactive_prompt_session_accept_event_ensured_at: Optional[float] = None
+
+
+async def ensure_interactive_prompt_session_accept_event_script_exists(
+    redis: redis.asyncio.client.Redis, *, force: bool = False
+) -> None:
+    """Ensures the interactive_prompt_session_accept_event lua script is loaded into redis."""
+    global _last_interactive_prompt_session_accept_event_ensured_at
+
+    now = time.time()
+    if (
+        not force
+        and _last_interactive_prompt_session_accept_event_ensured_at is not None
+        and (now - _last_interactive_prompt_session_accept_event_ensured_at < 5)
+    ):
+        return
+
+    loaded: List[bool] = await redis.script_exists(
+        INTERACTIVE_PROMPT_SESSION_ACCEPT_EVENT_LUA_SCRIPT_HASH
+    )
+    if not loaded[0]:
+        correct_hash = await redis.script_load(
+            INTERACTIVE_PROMPT_SESSION_ACCEPT_EVENT_LUA_SCRIPT
+        )
+        assert (
+            correct_hash == INTERACTIVE_PROMPT_SESSION_ACCEPT_EVENT_LUA_SCRIPT_HASH
+        ), f"{correct_hash=} != {INTERACTIVE_PROMPT_SESSION_ACCEPT_EVENT_LUA_SCRIPT_HASH=}"
+
+    if (
+        _last_interactive_prompt_session_accept_event_ensured_at is None
+        or _last_interactive_prompt_session_accept_event_ensured_at < now
+    ):
+        _last_interactive_prompt_session_accept_event_ensured_at = now
+
+
+InteractivePromptSessionAcceptEventResult = Literal[
+    "accepted",
+    "unbuffered",
+    "session_not_found",
+    "session_already_started",
+    "session_already_ended",
+    "session_has_later_event",
+    "session_has_same_event_at_same_time",
+    "press_mismatch",
+]
+
+
+async def interactive_prompt_session_accept_event(
+    redis: redis.asyncio.client.Redis,
+    state_key: bytes,
+    buffer_key: bytes,
+    *,
+    interactive_prompt_uid: str,
+    user_sub: str,
+    evtype: str,
+    prompt_time: float,
+    require_pressing: Optional[bool],
+    set_pressing: Optional[bool],
+    tracked_value: Optional[str],
+    entry: bytes,
+    ttl: int,
+) -> Optional[InteractivePromptSessionAcceptEventResult]:
+    """Validates the event against the interactive prompt session state stored
+    in the hash at the given state key and, if it's valid, updates the state
+    and appends the event to the list at the given buffer key.
+
+    A `join` event initializes the state, and is only accepted if there is no
+    state. Other events are only checked if there is state, and then must be
+    for the same interactive prompt and user, the session must not have ended
+    (via a `leave` event), there must not be a later event, and there must not
+    be an event of the same type at the same prompt time.
+
+    The item appended to the buffer is a json array of two elements, where
+    the first is the tracked value of the previous event of the same type in
+    the session (or null) and the second is the given entry.
+
+    Args:
+        redis (redis.asyncio.client.Redis): The redis client
+        state_key (bytes): The key of the session state hash
+        buffer_key (bytes): The key of the buffer list
+        interactive_prompt_uid (str): The uid of the interactive prompt the
+            event is for
+        user_sub (str): The sub of the user the event is for
+        evtype (str): The type of event
+        prompt_time (float): The prompt time of the event
+        require_pressing (bool, None): If specified, the event is only accepted
+            if the session is (True) or is not (False) pressing the press
+            prompt
+        set_pressing (bool, None): If specified, whether the session is pressing
+            the press prompt after this event
+        tracked_value (str, None): If specified, the json value to track for
+            this event type, which will be provided to the next event of the
+            same type in the session
+        entry (bytes): The json object to append to the buffer
+        ttl (int): How long in seconds to keep the state after this event
+
+    Returns:
+        InteractivePromptSessionAcceptEventResult, None: The result, where
+            `unbuffered` means there was no state, so the event was not checked.
+            None if executed within a transaction, since the result is not known
+            until the transaction is executed.
+
+    Raises:
+        NoScriptError: If the script is not loaded into redis
+    """
+    res = await redis.evalsha(  # type: ignore
+        INTERACTIVE_PROMPT_SESSION_ACCEPT_EVENT_LUA_SCRIPT_HASH,
+        2,
+        state_key,  # type: ignore
+        buffer_key,  # type: ignore
+        interactive_prompt_uid.encode("utf-8"),  # type: ignore
+        user_sub.encode("utf-8"),  # type: ignore
+        evtype.encode("utf-8"),  # type: ignore
+        repr(float(prompt_time)).encode("ascii"),  # type: ignore
+        _encode_optional_bool(require_pressing),  # type: ignore
+        _encode_optional_bool(set_pressing),  # type: ignore
+        tracked_value.encode("utf-8") if tracked_value is not None else b"",  # type: ignore
+        entry,  # type: ignore
+        ttl,  # type: ignore
+    )
+    if res is redis:
+        return None
+    return parse_interactive_prompt_session_accept_event_result(res)
+
+
+def _encode_optional_bool(value: Optional[bool]) -> bytes:
+    if value is None:
+        return b""
+    return b"1" if value else b"0"
+
+
+def parse_interactive_prompt_session_accept_event_result(
+    res: Any,
+) -> InteractivePromptSessionAcceptEventResult:
+    """Parses the result of the interactive_prompt_session_accept_event script"""
+    assert isinstance(res, int), res
+    if res == 1:
+        return "accepted"
+    if res == 0:
+        return "unbuffered"
+    if res == -1:
+        return "session_not_found"
+    if res == -2:
+        return "session_already_ended"
+    if res == -3:
+        return "session_has_later_event"
+    if res == -4:
+        return "session_has_same_event_at_same_time"
+    if res == -5:
+        return "press_mismatch"
+    if res == -6:
+        return "session_already_started"
+    raise ValueError(f"Unexpected result {res=}")
@@ -0,0 +1,82 @@
+from typing import Optional, List, Union
+import hashlib
+import time
+import redis.asyncio.client
+
+LTRIM_IF_MATCH_LUA_SCRIPT = """
+local key = KEYS[1]
+local count = tonumber(ARGV[1])
+local last_item = ARGV[2]
+
+if redis.call("LINDEX", key, count - 1) ~= last_item then
+    return 0
+end
+
+redis.call("LTRIM", key, count, -1)
+return 1
+"""
+
+LTRIM_IF_MATCH_LUA_SCRIPT_HASH = hashlib.sha1(
+    LTRIM_IF_MATCH_LUA_SCRIPT.encode("utf-8")
+).hexdigest()
+
+
+_last_ltrim_if_match_ensured_at: Optional[float] = None
+
+
+async def ensure_ltrim_if_match_script_exists(
+    redis: redis.asyncio.client.Redis, *, force: bool = False
+) -> None:
+    """Ensures the ltrim_if_match lua script is loaded into redis."""
+    global _last_ltrim_if_match_ensured_at
+
+    now = time.time()
+    if (
+        not force
+        and _last_ltrim_if_match_ensured_at is not None
+        and (now - _last_ltrim_if_match_ensured_at < 5)
+    ):
+        return
+
+    loaded: List[bool] = await redis.script_exists(LTRIM_IF_MATCH_LUA_SCRIPT_HASH)
+    if not loaded[0]:
+        correct_hash = await redis.script_load(LTRIM_IF_MATCH_LUA_SCRIPT)
+        assert (
+            correct_hash == LTRIM_IF_MATCH_LUA_SCRIPT_HASH
+        ), f"{correct_hash=} != {LTRIM_IF_MATCH_LUA_SCRIPT_HASH=}"
+
+    if _last_ltrim_if_match_ensured_at is None or _last_ltrim_if_match_ensured_at < now:
+        _last_ltrim_if_match_ensured_at = now
+
+
+async def ltrim_if_match(
+    redis: redis.asyncio.client.Redis,
+    key: Union[str, bytes],
+    count: int,
+    last_item: Union[str, bytes],
+) -> Optional[bool]:
+    """Removes the first `count` items from the list at the given key if the
+    item at index `count - 1` is the given item, and does nothing otherwise.
+    This is useful for removing items which have been processed from the
+    front of a queue, without risking removing items which were not processed
+    if the queue was modified in the meantime.
+
+    Args:
+        redis (redis.asyncio.client.Redis): The redis client
+        key (str, bytes): The key of the list
+        count (int): The number of items to remove from the front of the list
+        last_item (str, bytes): The expected value of the last item to remove
+
+    Returns:
+        bool, None: True if the items were removed, False otherwise. None if
+            executed within a transaction, since the result is not known until
+            the transaction is executed.
+
+    Raises:
+        NoScriptError: If the script is not loaded into redis
+    """
+    res = await redis.evalsha(LTRIM_IF_MATCH_LUA_SCRIPT_HASH, 1, key, count, last_item)  # type: ignore
+    if res is redis:
+        return None
+    assert isinstance(res, int), res
+    return bool(res)
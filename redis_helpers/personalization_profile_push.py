@@ -0,0 +1,122 @@
+from typing import Optional, List
+import hashlib
+import time
+import redis.asyncio.client
+
+PERSONALIZATION_PROFILE_PUSH_LUA_SCRIPT = """
+local profile_key = KEYS[1]
+local list_key = KEYS[2]
+
+local version = tonumber(ARGV[1])
+local view_field = ARGV[2]
+local list_item = ARGV[3]
+local max_list_length = tonumber(ARGV[4])
+
+local built_version = redis.call("HGET", profile_key, "built_version")
+if built_version == false or tonumber(built_version) >= version then
+    return 0
+end
+
+if view_field ~= "" then
+    redis.call("HINCRBY", profile_key, view_field, 1)
+end
+
+local ttl = redis.call("TTL", profile_key)
+redis.call("LPUSH", list_key, list_item)
+redis.call("LTRIM", list_key, 0, max_list_length - 1)
+if ttl > 0 then
+    redis.call("EXPIRE", list_key, ttl)
+end
+return 1
+"""
+
+PERSONALIZATION_PROFILE_PUSH_LUA_SCRIPT_HASH = hashlib.sha1(
+    PERSONALIZATION_PROFILE_PUSH_LUA_SCRIPT.encode("utf-8")
+).hexdigest()
+
+
+_last_personalization_profile_push_ensured_at: Optional[float] = None
+
+
+async def ensure_personalization_profile_push_script_exists(
+    redis: redis.asyncio.client.Redis, *, force: bool = False
+) -> None:
+    """Ensures the personalization_profile_push lua script is loaded into redis."""
+    global _last_personalization_profile_push_ensured_at
+
+    now = time.time()
+    if (
+        not force
+        and _last_personalization_profile_push_ensured_at is not None
+        and (now - _last_personalization_profile_push_ensured_at < 5)
+    ):
+        return
+
+    loaded: List[bool] = await redis.script_exists(
+        PERSONALIZATION_PROFILE_PUSH_LUA_SCRIPT_HASH
+    )
+    if not loaded[0]:
+        correct_hash = await redis.script_load(PERSONALIZATION_PROFILE_PUSH_LUA_SCRIPT)
+        assert (
+            correct_hash == PERSONALIZATION_PROFILE_PUSH_LUA_SCRIPT_HASH
+        ), f"{correct_hash=} != {PERSONALIZATION_PROFILE_PUSH_LUA_SCRIPT_HASH=}"
+
+    if (
+        _last_personalization_profile_push_ensured_at is None
+        or _last_personalization_profile_push_ensured_at < now
+    ):
+        _last_personalization_profile_push_ensured_at = now
+
+
+async def personalization_profile_push(
+    redis: redis.asyncio.client.Redis,
+    *,
+    profile_key: bytes,
+    list_key: bytes,
+    version: int,
+    view_field: Optional[bytes],
+    list_item: bytes,
+    max_list_length: int,
+) -> Optional[bool]:
+    """Applies an incremental update to a personalization profile written by
+    `personalization_profile_write`, as long as the profile exists and was built
+    before the change with the given version (i.e., its `built_version` is lower).
+    If it was built at or after that version it already reflects the change.
+
+    The update increments the given view field in the profile hash, if
+    specified, and pushes the item to the front of the given list, trimming it
+    to the given length. The list expires with the profile.
+
+    Args:
+        redis (redis.asyncio.client.Redis): The redis client
+        profile_key (bytes): The key of the profile hash
+        list_key (bytes): The key of the list to push to
+        version (int): The value of the version key after it was incremented
+            for this change
+        view_field (bytes, None): The field in the profile hash to increment,
+            or None not to increment any field
+        list_item (bytes): The item to push to the front of the list
+        max_list_length (int): The maximum length of the list
+
+    Returns:
+        bool, None: True if the profile was updated, False if it didn't exist
+            or already reflected the change. None if executed within a
+            transaction, since the result is not known until the transaction
+            is executed.
+
+    Raises:
+        NoScriptError: If the script is not loaded into redis
+    """
+    res = await redis.evalsha(  # type: ignore
+        PERSONALIZATION_PROFILE_PUSH_LUA_SCRIPT_HASH,
+        2,
+        profile_key,  # type: ignore
+        list_key,  # type: ignore
+        version,  # type: ignore
+        view_field if view_field is not None else b"",  # type: ignore
+        list_item,  # type: ignore
+        max_list_length,  # type: ignore
+    )
+    if res is redis:
+        return None
+    return bool(res)
@@ -0,0 +1,180 @@
+from typing import Optional, List, Sequence, Tuple, Union
+import hashlib
+import time
+import redis.asyncio.client
+
+PERSONALIZATION_PROFILE_WRITE_LUA_SCRIPT = """
+local profile_key = KEYS[1]
+local feedback_key = KEYS[2]
+local recent_key = KEYS[3]
+local version_key = KEYS[4]
+
+local expected_version = ARGV[1]
+local ttl = tonumber(ARGV[2])
+local version_ttl = tonumber(ARGV[3])
+local built_at = ARGV[4]
+
+local current_version = redis.call("GET", version_key)
+if current_version == false then
+    current_version = ""
+end
+if current_version ~= expected_version then
+    return 0
+end
+
+if expected_version == "" then
+    expected_version = "0"
+else
+    redis.call("EXPIRE", version_key, version_ttl)
+end
+
+redis.call("DEL", profile_key, feedback_key, recent_key)
+redis.call("HSET", profile_key, "built_at", built_at, "built_version", expected_version)
+
+local idx = 5
+local num_views = tonumber(ARGV[idx])
+idx = idx + 1
+local batch = {}
+for _ = 1, num_views do
+    table.insert(batch, ARGV[idx])
+    table.insert(batch, ARGV[idx + 1])
+    idx = idx + 2
+    if #batch >= 1000 then
+        redis.call("HSET", profile_key, unpack(batch))
+        batch = {}
+    end
+end
+if #batch > 0 then
+    redis.call("HSET", profile_key, unpack(batch))
+end
+
+local num_feedback = tonumber(ARGV[idx])
+idx = idx + 1
+if num_feedback > 0 then
+    redis.call("RPUSH", feedback_key, unpack(ARGV, idx, idx + num_feedback - 1))
+    idx = idx + num_feedback
+    redis.call("EXPIRE", feedback_key, ttl)
+end
+
+local num_recent = tonumber(ARGV[idx])
+idx = idx + 1
+if num_recent > 0 then
+    redis.call("RPUSH", recent_key, unpack(ARGV, idx, idx + num_recent - 1))
+    redis.call("EXPIRE", recent_key, ttl)
+end
+
+redis.call("EXPIRE", profile_key, ttl)
+return 1
+"""
+
+PERSONALIZATION_PROFILE_WRITE_LUA_SCRIPT_HASH = hashlib.sha1(
+    PERSONALIZATION_PROFILE_WRITE_LUA_SCRIPT.encode("utf-8")
+).hexdigest()
+
+
+_last_personalization_profile_write_ensured_at: Optional[float] = None
+
+
+async def ensure_personalization_profile_write_script_exists(
+    redis: redis.asyncio.client.Redis, *, force: bool = False
+) -> None:
+    """Ensures the personalization_profile_write lua script is loaded into redis."""
+    global _last_personalization_profile_write_ensured_at
+
+    now = time.time()
+    if (
+        not force
+        and _last_personalization_profile_write_ensured_at is not None
+        and (now - _last_personalization_profile_write_ensured_at < 5)
+    ):
+        return
+
+    loaded: List[bool] = await redis.script_exists(
+        PERSONALIZATION_PROFILE_WRITE_LUA_SCRIPT_HASH
+    )
+    if not loaded[0]:
+        correct_hash = await redis.script_load(PERSONALIZATION_PROFILE_WRITE_LUA_SCRIPT)
+        assert (
+            correct_hash == PERSONALIZATION_PROFILE_WRITE_LUA_SCRIPT_HASH
+        ), f"{correct_hash=} != {PERSONALIZATION_PROFILE_WRITE_LUA_SCRIPT_HASH=}"
+
+    if (
+        _last_personalization_profile_write_ensured_at is None
+        or _last_personalization_profile_write_ensured_at < now
+    ):
+        _last_personalization_profile_write_ensured_at = now
+
+
+async def personalization_profile_write(
+    redis: redis.asyncio.client.Redis,
+    *,
+    profile_key: bytes,
+    feedback_key: bytes,
+    recent_key: bytes,
+    version_key: bytes,
+    expected_version: Optional[bytes],
+    ttl: int,
+    version_ttl: int,
+    built_at: float,
+    views: Sequence[Tuple[bytes, int]],
+    feedback: Sequence[bytes],
+    recent: Sequence[bytes],
+) -> Optional[bool]:
+    """Replaces the personalization profile stored in the given keys, as long
+    as the version key still has the expected value (None meaning it doesn't
+    exist). The profile hash is written with `built_at` and `built_version`
+    fields, where `built_version` is the expected version (0 if None), plus one
+    field per view count. The feedback and recent lists are written in the given
+    order. The version key is not modified, except to extend its expiration so
+    it outlives the profile.
+
+    Args:
+        redis (redis.asyncio.client.Redis): The redis client
+        profile_key (bytes): The key of the profile hash
+        feedback_key (bytes): The key of the feedback list
+        recent_key (bytes): The key of the recent views list
+        version_key (bytes): The key incremented whenever the profile changes
+        expected_version (bytes, None): The value of the version key when the
+            profile was loaded, or None if it did not exist
+        ttl (int): The expiration in seconds for the profile
+        version_ttl (int): The expiration in seconds for the version key
+        built_at (float): When the profile was loaded
+        views (list[tuple[bytes, int]]): The fields and values for the view counts
+        feedback (list[bytes]): The items for the feedback list
+        recent (list[bytes]): The items for the recent views list
+
+    Returns:
+        bool, None: True if the profile was written, False if the version did
+            not match. None if executed within a transaction, since the result
+            is not known until the transaction is executed.
+
+    Raises:
+        NoScriptError: If the script is not loaded into redis
+    """
+    args: List[Union[bytes, int, float]] = [
+        expected_version if expected_version is not None else b"",
+        ttl,
+        version_ttl,
+        built_at,
+        len(views),
+    ]
+    for field, value in views:
+        args.append(field)
+        args.append(value)
+    args.append(len(feedback))
+    args.extend(feedback)
+    args.append(len(recent))
+    args.extend(recent)
+
+    res = await redis.evalsha(  # type: ignore
+        PERSONALIZATION_PROFILE_WRITE_LUA_SCRIPT_HASH,
+        4,
+        profile_key,  # type: ignore
+        feedback_key,  # type: ignore
+        recent_key,  # type: ignore
+        version_key,  # type: ignore
+        *args,  # type: ignore
+    )
+    if res is redis:
+        return None
+    return bool(res)
@@ -1,4 +1,14 @@
-from typing import Any, Generic, Optional, TypeVar, cast, get_args, Union, List
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Optional,
+    TypeVar,
+    cast,
+    get_args,
+    Union,
+    List,
+)
 from .standard_operator import StandardOperator
 from pydantic import BaseModel, ConfigDict, Field, validator
 from pypika import Parameter
@@ -294,6 +304,77 @@ class FilterItem(Generic[ValueT]):
         else:
             raise ValueError(f"Unsupported operator: {self.operator}")
 
+    def compile_constant_check(self) -> Callable[[Optional[ValueT]], bool]:
+        """Returns a function which is equivalent to `check_constant`, except the
+        operator dispatch and value unpacking are done once up front rather than
+        on every call. Useful when the same filter is checked many times, e.g.,
+        for cached client flow predicates.
+        """
+        op = self.operator
+        value = cast(Any, self.value)
+        if op == StandardOperator.EQUAL:
+            if value is None:
+                return lambda v: v is None
+            if value is True:
+                return lambda v: not not v
+            if value is False:
+                return lambda v: not v
+            return lambda v: v == value
+        if op == StandardOperator.NOT_EQUAL:
+            if value is None:
+                return lambda v: v is not None
+            if value is True:
+                return lambda v: not v
+            if value is False:
+                return lambda v: not not v
+            return lambda v: v is not None and v != value
+
+        null_passes = op in _NULL_PASSING_OPERATORS
+        if value is None:
+            if null_passes:
+                return lambda v: v is None
+            return lambda v: False
+
+        check: Callable[[Any], bool]
+        if op in (StandardOperator.GREATER_THAN, StandardOperator.GREATER_THAN_OR_NULL):
+            check = lambda v: v > value
+        elif op in (
+            StandardOperator.GREATER_THAN_OR_EQUAL,
+            StandardOperator.GREATER_THAN_OR_EQUAL_OR_NULL,
+        ):
+            check = lambda v: v >= value
+        elif op in (StandardOperator.LESS_THAN, StandardOperator.LESS_THAN_OR_NULL):
+            check = lambda v: v < value
+        elif op in (
+            StandardOperator.LESS_THAN_OR_EQUAL,
+            StandardOperator.LESS_THAN_OR_EQUAL_OR_NULL,
+        ):
+            check = lambda v: v <= value
+        elif op in (StandardOperator.BETWEEN, StandardOperator.BETWEEN_OR_NULL):
+            low, high = value[0], value[1]
+            check = lambda v: low <= v <= high
+        elif op in (
+            StandardOperator.BETWEEN_EXCLUSIVE_END,
+            StandardOperator.BETWEEN_EXCLUSIVE_END_OR_NULL,
+        ):
+            low, high = value[0], value[1]
+            check = lambda v: low <= v < high
+        elif op in (StandardOperator.OUTSIDE, StandardOperator.OUTSIDE_OR_NULL):
+            low, high = value[0], value[1]
+            check = lambda v: v < low or v > high
+        elif op in (
+            StandardOperator.OUTSIDE_EXCLUSIVE_END,
+            StandardOperator.OUTSIDE_EXCLUSIVE_END_OR_NULL,
+        ):
+            low, high = value[0], value[1]
+            check = lambda v: v < low or v >= high
+        else:
+            raise ValueError(f"Unsupported operator: {self.operator}")
+
+        if null_passes:
+            return lambda v: v is None or check(v)
+        return lambda v: v is not None and check(v)
+
     def to_model(self) -> "FilterItemModel[ValueT]":
         return FilterItemModel[self.__valuet__()].model_validate(
             {"operator": self.operator.value, "value": self.value}
@@ -309,6 +390,21 @@ class FilterItem(Generic[ValueT]):
         return get_args(orig_class)[0]
 
 
+_NULL_PASSING_OPERATORS = frozenset(
+    (
+        StandardOperator.GREATER_THAN_OR_NULL,
+        StandardOperator.GREATER_THAN_OR_EQUAL_OR_NULL,
+        StandardOperator.LESS_THAN_OR_NULL,
+        StandardOperator.LESS_THAN_OR_EQUAL_OR_NULL,
+        StandardOperator.BETWEEN_OR_NULL,
+        StandardOperator.BETWEEN_EXCLUSIVE_END_OR_NULL,
+        StandardOperator.OUTSIDE_OR_NULL,
+        StandardOperator.OUTSIDE_EXCLUSIVE_END_OR_NULL,
+    )
+)
+"""The ordered operators which match when the value being checked is null"""
+
+
 def _create_example_for_type(t: type) -> Union[None, int, float, str, bool, list, dict]:
     if t == int:
         return 0
@@ -0,0 +1,457 @@
+"""In-memory stand-ins for the integrations used by the client flow pipeline,
+for manual benchmarks that need to run without rqlite or redis. Only the
+subset of each interface which is actually used by the code under test is
+implemented; anything else raises NotImplementedError so that it's obvious
+what needs to be added rather than silently misbehaving.
+
+- `SqliteConnection` quacks like `rqdb.async_connection.AsyncConnection`,
+  backed by an in-memory sqlite database (rqlite is sqlite, so the same SQL
+  works unchanged)
+- `FakeRedis` quacks like `redis.asyncio.Redis` for strings, hashes, lists,
+  pipelines and the lua scripts registered in `FAKE_SCRIPTS`
+- `FakeItgs` quacks like `itgs.Itgs`, providing the above plus a diskcache in
+  a temporary directory
+"""
+
+import hashlib
+import sqlite3
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+import diskcache
+from rqdb.result import BulkResult, ResultItem
+from redis_helpers.client_screen_queue_head_cas import (
+    CLIENT_SCREEN_QUEUE_HEAD_CAS_LUA_SCRIPT_HASH,
+)
+from redis_helpers.del_if_match import DEL_IF_MATCH_LUA_SCRIPT_HASH
+from redis_helpers.ltrim_if_match import LTRIM_IF_MATCH_LUA_SCRIPT_HASH
+from redis_helpers.set_if_lower import SET_IF_LOWER_LUA_SCRIPT_HASH
+
+
+class SqliteCursor:
+    def __init__(self, db: sqlite3.Connection) -> None:
+        self.db = db
+
+    def _execute_one(self, operation: str, parameters: Iterable[Any]) -> ResultItem:
+        changes_before = self.db.total_changes
+        cursor = self.db.execute(operation, list(parameters or []))
+        rows = cursor.fetchall()
+        if cursor.description is not None:
+            return ResultItem(results=[list(r) for r in rows] if rows else None)
+        # cursor.rowcount is -1 for statements starting with WITH, whereas
+        # rqlite reports sqlite3_changes() for every statement
+        return ResultItem(
+            last_insert_id=cursor.lastrowid,
+            rows_affected=self.db.total_changes - changes_before,
+        )
+
+    def _execute_many(
+        self,
+        operation_and_parameters: Iterable[Tuple[str, Iterable[Any]]],
+        transaction: bool,
+    ) -> BulkResult:
+        items: List[ResultItem] = []
+        if transaction:
+            self.db.execute("BEGIN")
+        try:
+            for operation, parameters in operation_and_parameters:
+                items.append(self._execute_one(operation, parameters))
+        except BaseException:
+            if transaction:
+                self.db.execute("ROLLBACK")
+            raise
+        if transaction:
+            self.db.execute("COMMIT")
+        return BulkResult(items)
+
+    async def execute(
+        self,
+        operation: str,
+        parameters: Optional[Iterable[Any]] = None,
+        raise_on_error: bool = True,
+        read_consistency: Optional[str] = None,
+        freshness: Optional[str] = None,
+    ) -> ResultItem:
+        return self._execute_one(operation, parameters or [])
+
+    async def executemany2(
+        self,
+        operations: Iterable[str],
+        transaction: bool = True,
+        raise_on_error: bool = True,
+    ) -> BulkResult:
+        return self._execute_many(((op, []) for op in operations), transaction)
+
+    async def executemany3(
+        self,
+        operation_and_parameters: Iterable[Tuple[str, Iterable[Any]]],
+        transaction: bool = True,
+        raise_on_error: bool = True,
+    ) -> BulkResult:
+        return self._execute_many(operation_and_parameters, transaction)
+
+    async def executeunified3(
+        self,
+        operation_and_parameters: Iterable[Tuple[str, Iterable[Any]]],
+        transaction: bool = True,
+        raise_on_error: bool = True,
+        read_consistency: Optional[str] = None,
+        freshness: Optional[str] = None,
+    ) -> BulkResult:
+        return self._execute_many(operation_and_parameters, transaction)
+
+
+class SqliteConnection:
+    def __init__(self) -> None:
+        self.db = sqlite3.connect(":memory:", isolation_level=None)
+
+    def cursor(self, read_consistency: Optional[str] = None) -> SqliteCursor:
+        return SqliteCursor(self.db)
+
+
+RedisKey = Union[str, bytes]
+
+
+def _b(v: Any) -> bytes:
+    if isinstance(v, bytes):
+        return v
+    if isinstance(v, str):
+        return v.encode("utf-8")
+    if isinstance(v, (int, float)):
+        return str(v).encode("ascii")
+    raise TypeError(f"unsupported redis value: {v!r}")
+
+
+def _script_set_if_lower(redis: "FakeRedis", keys: list, args: list) -> int:
+    current = redis._get(keys[0])
+    if current is not None and float(current) <= float(args[0]):
+        return 0
+    redis._set(keys[0], args[0])
+    return 1
+
+
+def _script_client_screen_queue_head_cas(
+    redis: "FakeRedis", keys: list, args: list
+) -> Optional[int]:
+    current = redis._hget(keys[0], b"version")
+    if (current if current is not None else b"0") != _b(args[0]):
+        return None
+    new_version = redis._hincrby(keys[0], b"version", 1)
+    redis._hset(keys[0], mapping={b"data": args[1]})
+    redis._expire(keys[0], int(args[2]))
+    return new_version
+
+
+def _script_del_if_match(redis: "FakeRedis", keys: list, args: list) -> int:
+    if redis._get(keys[0]) != _b(args[0]):
+        return 0
+    return redis._delete(keys[0])
+
+
+def _script_ltrim_if_match(redis: "FakeRedis", keys: list, args: list) -> int:
+    count = int(args[0])
+    items = redis._list(keys[0], False) or []
+    if count < 1 or len(items) < count or items[count - 1] != _b(args[1]):
+        return 0
+    redis._ltrim(keys[0], count, -1)
+    return 1
+
+
+FAKE_SCRIPTS: Dict[str, Callable[["FakeRedis", list, list], Any]] = {
+    SET_IF_LOWER_LUA_SCRIPT_HASH: _script_set_if_lower,
+    CLIENT_SCREEN_QUEUE_HEAD_CAS_LUA_SCRIPT_HASH: _script_client_screen_queue_head_cas,
+    DEL_IF_MATCH_LUA_SCRIPT_HASH: _script_del_if_match,
+    LTRIM_IF_MATCH_LUA_SCRIPT_HASH: _script_ltrim_if_match,
+}
+"""Python implementations of the lua scripts the fake redis supports, by hash"""
+
+
+class FakeRedis:
+    def __init__(self) -> None:
+        self.data: Dict[bytes, Any] = dict()
+        self.expires_at: Dict[bytes, float] = dict()
+        self.loaded_scripts: set = set()
+
+    # internal synchronous implementations
+
+    def _alive(self, key: RedisKey) -> Optional[Any]:
+        k = _b(key)
+        exp = self.expires_at.get(k)
+        if exp is not None and exp <= time.time():
+            self.data.pop(k, None)
+            self.expires_at.pop(k, None)
+        return self.data.get(k)
+
+    def _get(self, key: RedisKey) -> Optional[bytes]:
+        return self._alive(key)
+
+    def _set(
+        self, key: RedisKey, value: Any, ex: Optional[int] = None, nx: bool = False
+    ) -> Optional[bool]:
+        k = _b(key)
+        if nx and self._alive(key) is not None:
+            return None
+        self.data[k] = _b(value)
+        self.expires_at.pop(k, None)
+        if ex is not None:
+            self.expires_at[k] = time.time() + ex
+        return True
+
+    def _delete(self, *keys: RedisKey) -> int:
+        removed = 0
+        for key in keys:
+            if self._alive(key) is not None:
+                removed += 1
+            self.data.pop(_b(key), None)
+            self.expires_at.pop(_b(key), None)
+        return removed
+
+    def _incrby(self, key: RedisKey, amount: int) -> int:
+        val = int(self._alive(key) or b"0") + amount
+        self.data[_b(key)] = _b(val)
+        return val
+
+    def _hash(self, key: RedisKey, create: bool) -> Optional[Dict[bytes, bytes]]:
+        h = self._alive(key)
+        if h is None and create:
+            h = dict()
+            self.data[_b(key)] = h
+        return h
+
+    def _hget(self, key: RedisKey, field: RedisKey) -> Optional[bytes]:
+        h = self._hash(key, False)
+        return None if h is None else h.get(_b(field))
+
+    def _hmget(self, key: RedisKey, fields: List[RedisKey]) -> List[Optional[bytes]]:
+        return [self._hget(key, f) for f in fields]
+
+    def _hset(
+        self,
+        key: RedisKey,
+        field: Optional[RedisKey] = None,
+        value: Any = None,
+        mapping: Optional[dict] = None,
+    ) -> int:
+        h = self._hash(key, True)
+        assert h is not None
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        added = 0
+        for f, v in items.items():
+            if _b(f) not in h:
+                added += 1
+            h[_b(f)] = _b(v)
+        return added
+
+    def _hdel(self, key: RedisKey, *fields: RedisKey) -> int:
+        h = self._hash(key, False)
+        if h is None:
+            return 0
+        removed = 0
+        for f in fields:
+            if h.pop(_b(f), None) is not None:
+                removed += 1
+        if not h:
+            self._delete(key)
+        return removed
+
+    def _hincrby(self, key: RedisKey, field: RedisKey, amount: int) -> int:
+        h = self._hash(key, True)
+        assert h is not None
+        val = int(h.get(_b(field), b"0")) + amount
+        h[_b(field)] = _b(val)
+        return val
+
+    def _list(self, key: RedisKey, create: bool) -> Optional[List[bytes]]:
+        lst = self._alive(key)
+        if lst is None and create:
+            lst = []
+            self.data[_b(key)] = lst
+        return lst
+
+    def _rpush(self, key: RedisKey, *values: Any) -> int:
+        lst = self._list(key, True)
+        assert lst is not None
+        lst.extend(_b(v) for v in values)
+        return len(lst)
+
+    def _lrange(self, key: RedisKey, start: int, end: int) -> List[bytes]:
+        lst = self._list(key, False) or []
+        return lst[start : (end + 1) or None]
+
+    def _llen(self, key: RedisKey) -> int:
+        return len(self._list(key, False) or [])
+
+    def _ltrim(self, key: RedisKey, start: int, end: int) -> bool:
+        lst = self._list(key, False)
+        if lst is None:
+            return True
+        lst[:] = lst[start : (end + 1) or None]
+        if not lst:
+            self._delete(key)
+        return True
+
+    def _expire(self, key: RedisKey, seconds: int, **kwargs: Any) -> bool:
+        if self._alive(key) is None:
+            return False
+        self.expires_at[_b(key)] = time.time() + seconds
+        return True
+
+    def _expireat(self, key: RedisKey, when: int, **kwargs: Any) -> bool:
+        if self._alive(key) is None:
+            return False
+        self.expires_at[_b(key)] = when
+        return True
+
+    def _evalsha(self, sha: str, numkeys: int, *keys_and_args: Any) -> Any:
+        from redis.exceptions import NoScriptError
+
+        if sha not in self.loaded_scripts:
+            raise NoScriptError("NOSCRIPT No matching script")
+        keys = [_b(k) for k in keys_and_args[:numkeys]]
+        args = list(keys_and_args[numkeys:])
+        return FAKE_SCRIPTS[sha](self, keys, args)
+
+    def _script_exists(self, *shas: str) -> List[bool]:
+        return [sha in self.loaded_scripts for sha in shas]
+
+    def _script_load(self, script: str) -> str:
+        sha = hashlib.sha1(script.encode("utf-8")).hexdigest()
+        if sha not in FAKE_SCRIPTS:
+            raise NotImplementedError(f"no python implementation of script {sha}")
+        self.loaded_scripts.add(sha)
+        return sha
+
+    def _publish(self, channel: RedisKey, message: Any) -> int:
+        return 0
+
+    # public interface
+
+    def _command(self, name: str, *args: Any, **kwargs: Any) -> Any:
+        async def _run():
+            return getattr(self, f"_{name}")(*args, **kwargs)
+
+        return _run()
+
+    def get(self, key):
+        return self._command("get", key)
+
+    def set(self, key, value, ex=None, nx=False):
+        return self._command("set", key, value, ex=ex, nx=nx)
+
+    def delete(self, *keys):
+        return self._command("delete", *keys)
+
+    def incrby(self, key, amount=1):
+        return self._command("incrby", key, amount)
+
+    def hget(self, key, field):
+        return self._command("hget", key, field)
+
+    def hmget(self, key, fields):
+        return self._command("hmget", key, fields)
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        return self._command("hset", key, field, value, mapping=mapping)
+
+    def hdel(self, key, *fields):
+        return self._command("hdel", key, *fields)
+
+    def hincrby(self, key, field, amount=1):
+        return self._command("hincrby", key, field, amount)
+
+    def rpush(self, key, *values):
+        return self._command("rpush", key, *values)
+
+    def lrange(self, key, start, end):
+        return self._command("lrange", key, start, end)
+
+    def llen(self, key):
+        return self._command("llen", key)
+
+    def ltrim(self, key, start, end):
+        return self._command("ltrim", key, start, end)
+
+    def expire(self, key, seconds, **kwargs):
+        return self._command("expire", key, seconds, **kwargs)
+
+    def expireat(self, key, when, **kwargs):
+        return self._command("expireat", key, when, **kwargs)
+
+    def evalsha(self, sha, numkeys, *keys_and_args):
+        return self._command("evalsha", sha, numkeys, *keys_and_args)
+
+    def script_exists(self, *shas):
+        return self._command("script_exists", *shas)
+
+    def script_load(self, script):
+        return self._command("script_load", script)
+
+    def publish(self, channel, message):
+        return self._command("publish", channel, message)
+
+    def pipeline(self, transaction: bool = True) -> "FakeRedisPipeline":
+        return FakeRedisPipeline(self)
+
+    def __getattr__(self, name: str) -> Any:
+        raise NotImplementedError(f"FakeRedis does not implement {name}")
+
+
+class FakeRedisPipeline(FakeRedis):
+    """Queues commands until `execute`, like a redis-py asyncio pipeline. Since
+    the fake is single threaded, every pipeline is trivially a transaction.
+    """
+
+    def __init__(self, redis: FakeRedis) -> None:
+        self.redis = redis
+        self.queued: List[Tuple[str, tuple, dict]] = []
+
+    def _command(self, name: str, *args: Any, **kwargs: Any) -> Any:
+        self.queued.append((name, args, kwargs))
+        return self
+
+    def __await__(self):
+        async def _self():
+            return self
+
+        return _self().__await__()
+
+    def multi(self) -> None:
+        pass
+
+    async def execute(self) -> list:
+        queued, self.queued = self.queued, []
+        return [getattr(self.redis, f"_{name}")(*a, **kw) for name, a, kw in queued]
+
+    async def __aenter__(self) -> "FakeRedisPipeline":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        self.queued = []
+
+
+class FakeItgs:
+    """Provides the integrations which have fakes; see the module docs"""
+
+    def __init__(self, *, cache_dir: str) -> None:
+        self._conn = SqliteConnection()
+        self._redis = FakeRedis()
+        self._local_cache = diskcache.Cache(cache_dir)
+
+    async def conn(self) -> SqliteConnection:
+        return self._conn
+
+    async def redis(self) -> FakeRedis:
+        return self._redis
+
+    async def local_cache(self) -> diskcache.Cache:
+        return self._local_cache
+
+    async def __aenter__(self) -> "FakeItgs":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        self._local_cache.close()
+
+    def __getattr__(self, name: str) -> Any:
+        raise NotImplementedError(f"FakeItgs does not implement {name}")
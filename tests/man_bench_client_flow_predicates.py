@@ -0,0 +1,134 @@
+"""Manual benchmark comparing the interpreted client flow predicate check
+(`check_flow_predicate`) against compiled predicates
+(`check_compiled_flow_predicate`). Also verifies they agree on a spread of
+inputs. Only uses facts that are either always available or already in the
+context, so no integrations are required. Run from the repository root with
+
+    python -m tests.man_bench_client_flow_predicates
+"""
+
+try:
+    import helper  # type: ignore
+except:
+    import tests.helper  # type: ignore
+
+import asyncio
+import time
+from typing import Any, List, cast
+from itgs import Itgs
+from lib.client_flows.client_flow_predicate import (
+    CheckFlowPredicateContext,
+    ClientFlowPredicate,
+    FlowPredicateFacts,
+    Wrapped,
+    check_compiled_flow_predicate,
+    check_flow_predicate,
+    compile_flow_predicate,
+)
+
+
+PREDICATES: List[ClientFlowPredicate] = [
+    ClientFlowPredicate.model_validate({"version": {"operator": "lt", "value": 67}}),
+    ClientFlowPredicate.model_validate(
+        {
+            "version": {"operator": "gten", "value": 67},
+            "account_age": {"operator": "bte", "value": [0, 86400]},
+            "or_predicate": {
+                "time_in_queue": {"operator": "gt", "value": 3600},
+                "or_predicate": {
+                    "account_created_at": {"operator": "lt", "value": 1704096000}
+                },
+            },
+        }
+    ),
+    ClientFlowPredicate.model_validate(
+        {
+            "version": {"operator": "gte", "value": 60},
+            "journeys_today": {"operator": "eq", "value": 0},
+            "last_journey_rating": {"operator": "lten", "value": 2},
+            "has_recoverable_identity": {"operator": "eq", "value": True},
+        }
+    ),
+]
+
+ITERATIONS = 20_000
+
+
+def _make_ctx() -> CheckFlowPredicateContext:
+    return CheckFlowPredicateContext(
+        last_journey_rating=Wrapped(1),
+        journeys_today=Wrapped(0),
+        journal_entries_in_history_today=Wrapped(0),
+        has_recoverable_identity=Wrapped(True),
+    )
+
+
+async def main():
+    itgs = cast(Itgs, None)
+    compiled = [compile_flow_predicate(p) for p in PREDICATES]
+
+    for version in (None, 50, 66, 67, 70):
+        for account_created_at in (1704000000, 1709270000):
+            for queued_at in (1709270000, 1709280000):
+                kwargs: Any = dict(
+                    version=version,
+                    queued_at=queued_at,
+                    account_created_at=account_created_at,
+                    now=1709280000,
+                )
+                for pred, comp in zip(PREDICATES, compiled):
+                    expected = await check_flow_predicate(
+                        itgs, pred, user_sub="bench", ctx=_make_ctx(), **kwargs
+                    )
+                    actual = await check_compiled_flow_predicate(
+                        itgs,
+                        comp,
+                        FlowPredicateFacts(**kwargs),
+                        user_sub="bench",
+                        ctx=_make_ctx(),
+                    )
+                    assert expected == actual, (pred, kwargs, expected, actual)
+    print("compiled predicates agree with the interpreter")
+
+    for idx, (pred, comp) in enumerate(zip(PREDICATES, compiled)):
+        ctx = _make_ctx()
+
+        started_at = time.perf_counter()
+        for i in range(ITERATIONS):
+            await check_flow_predicate(
+                itgs,
+                pred,
+                version=60 + (i % 10),
+                queued_at=1709280000,
+                account_created_at=1709270000,
+                now=1709280000,
+                user_sub="bench",
+                ctx=ctx,
+            )
+        interpreted = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        for i in range(ITERATIONS):
+            await check_compiled_flow_predicate(
+                itgs,
+                comp,
+                FlowPredicateFacts(
+                    version=60 + (i % 10),
+                    queued_at=1709280000,
+                    account_created_at=1709270000,
+                    now=1709280000,
+                ),
+                user_sub="bench",
+                ctx=ctx,
+            )
+        compiled_time = time.perf_counter() - started_at
+
+        print(
+            f"predicate {idx}: interpreted {interpreted / ITERATIONS * 1e6:7.2f}us, "
+            f"compiled {compiled_time / ITERATIONS * 1e6:7.2f}us "
+            f"({interpreted / compiled_time:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,598 @@
+"""Manual benchmark and replay harness for the client flow simulator. Loads a
+snapshot of client screens, client flows and users into in-memory fakes of the
+database, redis and the local cache (see `tests.fake_itgs`), then replays
+recorded peek/pop sequences through `execute_peek` / `execute_pop`, which
+covers `fetch_and_simulate_trigger`, `simulate_until_stable` and storing the
+result. Reports per-step latency and allocations, and verifies every replay
+produces the same screens so that behavioral changes show up alongside
+performance changes. Run from the repository root with
+
+    python -m tests.man_bench_client_flow_simulator [snapshot.json] [--iterations N]
+
+Without a snapshot, a small built-in snapshot containing the special flows plus
+a few chained flows is used. A snapshot is a json object with the keys
+
+- `client_screens`: list of `{uid, slug, schema, flags}`
+- `client_flows`: list of `{uid, slug, client_schema, server_schema, replaces,
+  screens, flags, rules}`, where `screens` and `rules` are in their json
+  representation (not the encoded database representation)
+- `users`: list of `{sub, created_at, pro, timezone}`
+- `sequences`: list of `{user_sub, platform, version, steps}`, where each step
+  is either `{"type": "peek", "trigger": null | {slug, client_parameters,
+  server_parameters}}` or `{"type": "pop", "trigger": null | {slug,
+  client_parameters}, "desync": false}`. Pops use the front returned by the
+  previous step unless `desync` is set
+
+Flow predicate facts which are backed by tables not in `SCHEMA` (e.g. sticky
+random groups) are not supported and will fail loudly.
+"""
+
+try:
+    import helper  # type: ignore
+except:
+    import tests.helper  # type: ignore
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Dict, List, Optional, cast
+from unittest import mock
+from loguru import logger
+from itgs import Itgs
+from client_flows.lib.parse_flow_screens import encode_flow_screens
+from lib.client_flows.client_flow_screen import ClientFlowScreen
+from lib.client_flows.executor import (
+    ClientScreenQueuePeekInfo,
+    TrustedTrigger,
+    UntrustedTrigger,
+    execute_peek,
+    execute_pop,
+)
+from users.lib.entitlements import CachedEntitlement
+import lib.client_flows.flow_cache as flow_cache
+import lib.client_flows.screen_cache as screen_cache
+from tests.fake_itgs import FakeItgs
+
+
+SCHEMA = [
+    "CREATE TABLE scratch (id INTEGER PRIMARY KEY, uid TEXT UNIQUE NOT NULL)",
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, sub TEXT UNIQUE NOT NULL, created_at REAL NOT NULL)",
+    "CREATE TABLE client_screens (id INTEGER PRIMARY KEY, uid TEXT UNIQUE NOT NULL, slug TEXT UNIQUE NOT NULL, schema TEXT NOT NULL, flags INTEGER NOT NULL)",
+    "CREATE TABLE client_flows (id INTEGER PRIMARY KEY, uid TEXT UNIQUE NOT NULL, slug TEXT UNIQUE NOT NULL, client_schema TEXT NOT NULL, server_schema TEXT NOT NULL, replaces BOOLEAN NOT NULL, screens TEXT NOT NULL, rules TEXT NOT NULL, flags INTEGER NOT NULL)",
+    """
+CREATE TABLE user_client_screens (
+    id INTEGER PRIMARY KEY,
+    uid TEXT UNIQUE NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    outer_counter INTEGER NOT NULL,
+    inner_counter INTEGER NOT NULL,
+    client_flow_id INTEGER NULL REFERENCES client_flows(id) ON DELETE SET NULL,
+    client_screen_id INTEGER NOT NULL REFERENCES client_screens(id) ON DELETE CASCADE,
+    flow_client_parameters TEXT NOT NULL,
+    flow_server_parameters TEXT NOT NULL,
+    screen TEXT NOT NULL,
+    added_at REAL NOT NULL
+)
+    """,
+    "CREATE UNIQUE INDEX user_client_screens_user_id_outer_counter_inner_counter_idx ON user_client_screens(user_id, outer_counter, inner_counter)",
+    "CREATE TABLE user_journeys (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, journey_id INTEGER NOT NULL, created_at REAL NOT NULL, created_at_unix_date INTEGER NOT NULL)",
+    "CREATE TABLE journey_feedback (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, journey_id INTEGER NOT NULL, response INTEGER NOT NULL, created_at REAL NOT NULL)",
+    "CREATE TABLE journal_entries (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, flags INTEGER NOT NULL, created_unix_date INTEGER NOT NULL)",
+    "CREATE TABLE user_identities (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, provider TEXT NOT NULL)",
+]
+"""The subset of the database schema used by the simulator and the flow
+predicate facts, with unused columns omitted
+"""
+
+ALL_PLATFORMS_SCREEN_FLAGS = 1 | 2 | 4 | 8
+ALL_PLATFORMS_FLOW_FLAGS = 1 | 4 | 8 | 16
+ALL_PLATFORMS_FLOW_SCREEN_FLAGS = 1 | 2 | 4 | 8 | 16
+
+
+def _screen(uid: str, slug: str, properties: dict) -> dict:
+    return {
+        "uid": uid,
+        "slug": slug,
+        "schema": {"type": "object", "properties": properties},
+        "flags": ALL_PLATFORMS_SCREEN_FLAGS,
+    }
+
+
+def _flow_screen(
+    slug: str,
+    *,
+    fixed: Optional[dict] = None,
+    variable: Optional[list] = None,
+    allowed_triggers: Optional[List[str]] = None,
+    flags: int = ALL_PLATFORMS_FLOW_SCREEN_FLAGS,
+    rules: Optional[dict] = None,
+) -> dict:
+    return {
+        "screen": {"slug": slug, "fixed": fixed or {}, "variable": variable or []},
+        "allowed_triggers": allowed_triggers or [],
+        "flags": flags,
+        "rules": rules or {},
+    }
+
+
+def _flow(
+    uid: str,
+    slug: str,
+    screens: List[dict],
+    *,
+    replaces: bool = False,
+    rules: Optional[list] = None,
+    client_schema: Optional[dict] = None,
+) -> dict:
+    return {
+        "uid": uid,
+        "slug": slug,
+        "client_schema": client_schema or {"type": "object"},
+        "server_schema": {"type": "object"},
+        "replaces": replaces,
+        "screens": screens,
+        "flags": ALL_PLATFORMS_FLOW_FLAGS,
+        "rules": rules or [],
+    }
+
+
+def _confirmation(header: str, **kwargs: Any) -> dict:
+    return _flow_screen(
+        "confirmation", fixed={"header": header, "message": header}, **kwargs
+    )
+
+
+DEFAULT_SNAPSHOT: Dict[str, Any] = {
+    "client_screens": [
+        _screen(
+            "oseh_cs_confirmation",
+            "confirmation",
+            {"header": {"type": "string"}, "message": {"type": "string"}},
+        ),
+        _screen(
+            "oseh_cs_home",
+            "home",
+            {
+                "header": {"type": "string", "default": "Welcome"},
+                "streak": {"type": "integer", "format": "int32", "default": 0},
+            },
+        ),
+        _screen(
+            "oseh_cs_choices",
+            "choices",
+            {
+                "header": {"type": "string"},
+                "choice": {"type": "string", "nullable": True, "default": None},
+            },
+        ),
+    ],
+    "client_flows": [
+        _flow(
+            "oseh_cf_empty",
+            "empty",
+            [
+                _flow_screen(
+                    "home",
+                    fixed={"header": "Welcome"},
+                    allowed_triggers=["settings", "journey_feedback", "upgrade"],
+                )
+            ],
+        ),
+        _flow("oseh_cf_skip", "skip", []),
+        _flow("oseh_cf_desync", "desync", []),
+        _flow("oseh_cf_not_found", "not_found", [_confirmation("Not found")]),
+        _flow(
+            "oseh_cf_wrong_platform",
+            "wrong_platform",
+            [_confirmation("Wrong platform")],
+        ),
+        _flow(
+            "oseh_cf_error_flow_schema",
+            "error_flow_schema",
+            [_confirmation("Bad parameters")],
+        ),
+        _flow(
+            "oseh_cf_error_screen_missing",
+            "error_screen_missing",
+            [_confirmation("Screen missing")],
+        ),
+        _flow("oseh_cf_forbidden", "forbidden", [_confirmation("Forbidden")]),
+        _flow(
+            "oseh_cf_journey_feedback",
+            "journey_feedback",
+            [
+                _flow_screen(
+                    "choices",
+                    fixed={"header": "How was it?"},
+                    variable=[
+                        {
+                            "type": "copy",
+                            "input_path": ["client", "choice"],
+                            "output_path": ["choice"],
+                        }
+                    ],
+                    allowed_triggers=["journey_feedback_followup"],
+                ),
+                _confirmation(
+                    "Thanks!",
+                    allowed_triggers=["settings"],
+                    rules={
+                        "trigger": {
+                            "last_journey_rating": {"operator": "eq", "value": 1}
+                        }
+                    },
+                ),
+                _confirmation(
+                    "Pro only",
+                    flags=1 | 2 | 4 | 16,
+                ),
+            ],
+            client_schema={
+                "type": "object",
+                "properties": {"choice": {"type": "string", "nullable": True}},
+            },
+        ),
+        _flow(
+            "oseh_cf_journey_feedback_followup",
+            "journey_feedback_followup",
+            [
+                _confirmation(
+                    "Followup",
+                    rules={"peek": {"journeys_today": {"operator": "gt", "value": 3}}},
+                )
+            ],
+        ),
+        _flow(
+            "oseh_cf_settings",
+            "settings",
+            [_confirmation("Settings", allowed_triggers=["settings"])],
+            rules=[
+                {
+                    "effect": {
+                        "type": "replace",
+                        "slug": "upgrade",
+                        "client_parameters": {"type": "omit"},
+                        "server_parameters": {"type": "omit"},
+                    },
+                    "condition": {"version": {"operator": "lt", "value": 70}},
+                }
+            ],
+        ),
+        _flow(
+            "oseh_cf_upgrade",
+            "upgrade",
+            [
+                _confirmation("Upgrade", flags=1 | 2 | 4 | 8),
+                _confirmation("Upgrade (browser)", flags=4 | 8),
+            ],
+            replaces=True,
+        ),
+    ],
+    "users": [
+        {
+            "sub": "oseh_u_bench_free",
+            "created_at": 1704096000,
+            "pro": False,
+            "timezone": "America/Los_Angeles",
+        },
+        {
+            "sub": "oseh_u_bench_pro",
+            "created_at": 1704096000,
+            "pro": True,
+            "timezone": "America/New_York",
+        },
+    ],
+    "sequences": [
+        {
+            "user_sub": sub,
+            "platform": platform,
+            "version": version,
+            "steps": [
+                {"type": "peek", "trigger": None},
+                {"type": "peek", "trigger": None},
+                {
+                    "type": "pop",
+                    "trigger": {
+                        "slug": "journey_feedback",
+                        "client_parameters": {"choice": "loved"},
+                    },
+                },
+                {
+                    "type": "pop",
+                    "trigger": {
+                        "slug": "journey_feedback_followup",
+                        "client_parameters": {},
+                    },
+                },
+                {"type": "pop", "trigger": None},
+                {"type": "pop", "trigger": {"slug": "settings"}},
+                {"type": "pop", "trigger": {"slug": "does_not_exist"}},
+                {"type": "pop", "trigger": None, "desync": True},
+                {
+                    "type": "peek",
+                    "trigger": {"slug": "settings", "server_parameters": {}},
+                },
+                {"type": "pop", "trigger": None},
+            ],
+        }
+        for sub, platform, version in (
+            ("oseh_u_bench_free", "ios", 69),
+            ("oseh_u_bench_pro", "browser", None),
+            ("oseh_u_bench_free", "android", 75),
+        )
+    ],
+}
+
+
+async def seed(itgs: FakeItgs, snapshot: Dict[str, Any]) -> None:
+    """Creates the schema and loads the snapshot into the fake integrations"""
+    conn = await itgs.conn()
+    cursor = conn.cursor()
+    await cursor.executemany2(SCHEMA)
+
+    await cursor.executemany3(
+        [
+            (
+                "INSERT INTO client_screens (uid, slug, schema, flags) VALUES (?, ?, ?, ?)",
+                [s["uid"], s["slug"], json.dumps(s["schema"]), s["flags"]],
+            )
+            for s in snapshot["client_screens"]
+        ]
+        + [
+            (
+                "INSERT INTO client_flows (uid, slug, client_schema, server_schema, replaces, screens, rules, flags) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    f["uid"],
+                    f["slug"],
+                    json.dumps(f["client_schema"]),
+                    json.dumps(f["server_schema"]),
+                    int(f["replaces"]),
+                    encode_flow_screens(
+                        [ClientFlowScreen.model_validate(s) for s in f["screens"]]
+                    ),
+                    json.dumps(f["rules"]),
+                    f["flags"],
+                ],
+            )
+            for f in snapshot["client_flows"]
+        ]
+        + [
+            (
+                "INSERT INTO users (sub, created_at) VALUES (?, ?)",
+                [u["sub"], u["created_at"]],
+            )
+            for u in snapshot["users"]
+        ]
+    )
+
+    redis = await itgs.redis()
+    for user in snapshot["users"]:
+        await redis.set(
+            f"user:timezones:{user['sub']}".encode("utf-8"),
+            user["timezone"].encode("utf-8"),
+        )
+        await redis.hset(
+            f"entitlements:{user['sub']}".encode("utf-8"),
+            mapping={
+                b"pro": CachedEntitlement(
+                    is_active=user["pro"],
+                    active_info=None,
+                    expires_at=None,
+                    checked_at=time.time(),
+                ).model_dump_json()
+            },
+        )
+
+
+async def reset_queues(itgs: FakeItgs, snapshot: Dict[str, Any]) -> None:
+    """Empties every users screen queue and cached queue head, so each replay
+    starts from the same state
+    """
+    conn = await itgs.conn()
+    cursor = conn.cursor()
+    await cursor.execute("DELETE FROM user_client_screens")
+
+    redis = await itgs.redis()
+    await redis.delete(
+        *[
+            f"client_screens:queue_head:{u['sub']}".encode("utf-8")
+            for u in snapshot["users"]
+        ]
+    )
+
+
+def reset_memory_caches() -> None:
+    """Clears the in-memory client flow and client screen caches"""
+    flow_cache.old_cache.clear()
+    flow_cache.latest_cache.clear()
+    flow_cache.valid_client_flows = None
+    screen_cache.old_cache.clear()
+    screen_cache.latest_cache.clear()
+
+
+async def run_step(
+    itgs: Itgs, sequence: Dict[str, Any], step: Dict[str, Any], front_uid: str
+) -> ClientScreenQueuePeekInfo:
+    trigger = step.get("trigger")
+    if step["type"] == "peek":
+        return await execute_peek(
+            itgs,
+            user_sub=sequence["user_sub"],
+            platform=sequence["platform"],
+            version=sequence["version"],
+            trigger=(
+                None
+                if trigger is None
+                else TrustedTrigger(
+                    flow_slug=trigger["slug"],
+                    client_parameters=trigger.get("client_parameters", {}),
+                    server_parameters=trigger.get("server_parameters", {}),
+                )
+            ),
+        )
+
+    assert step["type"] == "pop", step
+    return await execute_pop(
+        itgs,
+        user_sub=sequence["user_sub"],
+        platform=sequence["platform"],
+        version=sequence["version"],
+        expected_front_uid=(
+            "oseh_ucs_desync" if step.get("desync", False) else front_uid
+        ),
+        trigger=(
+            None
+            if trigger is None
+            else UntrustedTrigger(
+                flow_slug=trigger["slug"],
+                client_parameters=trigger.get("client_parameters", {}),
+            )
+        ),
+    )
+
+
+def describe_step(step: Dict[str, Any]) -> str:
+    trigger = step.get("trigger")
+    desc = step["type"]
+    if trigger is not None:
+        desc += f" {trigger['slug']}"
+    if step.get("desync", False):
+        desc += " (desync)"
+    return desc
+
+
+def describe_result(result: ClientScreenQueuePeekInfo) -> str:
+    name = result.front.flow_screen.screen.fixed.get("header")
+    return f"{result.front.screen.slug}:{name}+{len(result.prefetch)}"
+
+
+async def replay(
+    itgs: FakeItgs,
+    snapshot: Dict[str, Any],
+    *,
+    random_seed: int,
+    trace_allocations: bool,
+) -> List[Dict[str, Any]]:
+    """Replays every sequence from empty queues, returning one entry per step
+    with the outcome, the latency, and if `trace_allocations` the peak bytes
+    allocated during the step
+    """
+    await reset_queues(itgs, snapshot)
+    random.seed(random_seed)
+
+    results: List[Dict[str, Any]] = []
+    for sequence in snapshot["sequences"]:
+        front_uid = ""
+        for step in sequence["steps"]:
+            if trace_allocations:
+                tracemalloc.start()
+            started_at = time.perf_counter()
+            result = await run_step(cast(Itgs, itgs), sequence, step, front_uid)
+            latency = time.perf_counter() - started_at
+            peak_bytes = 0
+            if trace_allocations:
+                peak_bytes = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+            front_uid = result.front.user_client_screen_uid
+            results.append(
+                {
+                    "outcome": describe_result(result),
+                    "latency": latency,
+                    "peak_bytes": peak_bytes,
+                }
+            )
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("snapshot", nargs="?", default=None)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.snapshot is None:
+        snapshot = DEFAULT_SNAPSHOT
+    else:
+        with open(args.snapshot, "r") as f:
+            snapshot = json.load(f)
+
+    logger.remove()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        async with FakeItgs(cache_dir=cache_dir) as itgs:
+
+            @asynccontextmanager
+            async def _shared_itgs() -> AsyncGenerator[FakeItgs, None]:
+                # cache fills open their own integrations; point them at the fakes
+                yield itgs
+
+            with mock.patch.object(flow_cache, "Itgs", _shared_itgs), mock.patch.object(
+                screen_cache, "Itgs", _shared_itgs
+            ):
+                await _bench(itgs, snapshot, args)
+
+
+async def _bench(itgs: FakeItgs, snapshot: Dict[str, Any], args: Any) -> None:
+    await seed(itgs, snapshot)
+
+    reset_memory_caches()
+    started_at = time.perf_counter()
+    expected = await replay(
+        itgs, snapshot, random_seed=args.seed, trace_allocations=False
+    )
+    cold = time.perf_counter() - started_at
+
+    latencies: List[List[float]] = [[] for _ in expected]
+    for _ in range(args.iterations):
+        results = await replay(
+            itgs, snapshot, random_seed=args.seed, trace_allocations=False
+        )
+        for idx, (exp, res) in enumerate(zip(expected, results)):
+            assert (
+                exp["outcome"] == res["outcome"]
+            ), f"step {idx} not deterministic: {exp['outcome']} != {res['outcome']}"
+            latencies[idx].append(res["latency"])
+
+    allocations = await replay(
+        itgs, snapshot, random_seed=args.seed, trace_allocations=True
+    )
+
+    print(f"cold replay (empty in-memory caches): {cold * 1000:.2f}ms")
+    print(f"warm replays: {args.iterations} iterations, all outcomes identical\n")
+    print(
+        f"{'step':<44} {'outcome':<36} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'peak KiB':>9}"
+    )
+    step_idx = 0
+    for seq_idx, sequence in enumerate(snapshot["sequences"]):
+        for inner_idx, step in enumerate(sequence["steps"]):
+            samples = sorted(latencies[step_idx])
+            p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+            label = (
+                f"{seq_idx}.{inner_idx} {sequence['platform']} {describe_step(step)}"
+            )
+            print(
+                f"{label:<44} {expected[step_idx]['outcome']:<36} "
+                f"{statistics.median(samples) * 1000:8.3f} {p95 * 1000:8.3f} "
+                f"{samples[-1] * 1000:8.3f} "
+                f"{allocations[step_idx]['peak_bytes'] / 1024:9.1f}"
+            )
+            step_idx += 1
+
+    total = [sum(lat[i] for lat in latencies) for i in range(args.iterations)]
+    print(
+        f"\nper replay: median {statistics.median(total) * 1000:.2f}ms, "
+        f"{step_idx} steps"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""Manual benchmark comparing decrypting journal entry items inline on the event
+loop against `decrypt_journal_entry_items`, which only uses the worker pool for
+more than a few items, for entries of 1, 4, 10, 100, and 1000 items. Reports the total time and the longest stretch the event loop was
+blocked, which is what other requests on the same instance experience. Also
+verifies both produce the same items in the same order. Run from the
+repository root with
+
+    python -m tests.man_bench_journal_entry_decryption
+"""
+
+try:
+    import helper  # type: ignore
+except:
+    import tests.helper  # type: ignore
+
+import asyncio
+import gzip
+import time
+from typing import List, Tuple
+
+import cryptography.fernet
+
+from lib.journals.decrypt_items import (
+    EncryptedJournalEntryItem,
+    decrypt_journal_entry_item_sync,
+    decrypt_journal_entry_items,
+)
+from lib.journals.journal_entry_item_data import (
+    JournalEntryItemData,
+    JournalEntryItemDataDataTextual,
+    JournalEntryItemTextualPartParagraph,
+)
+
+
+def _make_items(count: int) -> List[EncryptedJournalEntryItem]:
+    key = cryptography.fernet.Fernet(cryptography.fernet.Fernet.generate_key())
+    result: List[EncryptedJournalEntryItem] = []
+    for idx in range(count):
+        data = JournalEntryItemData(
+            data=JournalEntryItemDataDataTextual(
+                parts=[
+                    JournalEntryItemTextualPartParagraph(
+                        type="paragraph",
+                        value=f"paragraph {idx}.{part} " + "some journal text " * 40,
+                    )
+                    for part in range(3)
+                ],
+                type="textual",
+            ),
+            display_author="self" if idx % 2 == 0 else "other",
+            processing_block=None,
+            type="chat",
+        )
+        result.append(
+            (
+                key,
+                key.encrypt(
+                    gzip.compress(
+                        JournalEntryItemData.__pydantic_serializer__.to_json(data),
+                        mtime=0,
+                    )
+                ).decode("ascii"),
+            )
+        )
+    return result
+
+
+async def _measure(coro_factory) -> Tuple[float, float, list]:
+    """Returns the total time, the longest event loop stall, and the result"""
+    stop = asyncio.Event()
+    longest_stall = 0.0
+
+    async def _ticker():
+        nonlocal longest_stall
+        last = time.perf_counter()
+        while not stop.is_set():
+            await asyncio.sleep(0)
+            now = time.perf_counter()
+            longest_stall = max(longest_stall, now - last)
+            last = now
+
+    ticker = asyncio.create_task(_ticker())
+    await asyncio.sleep(0)
+    started_at = time.perf_counter()
+    result = await coro_factory()
+    total = time.perf_counter() - started_at
+    stop.set()
+    await ticker
+    return total, longest_stall, result
+
+
+async def _inline(items: List[EncryptedJournalEntryItem]) -> list:
+    return [decrypt_journal_entry_item_sync(key, data) for key, data in items]
+
+
+async def main():
+    for count in (1, 4, 10, 100, 1000):
+        items = _make_items(count)
+        inline_total, inline_stall, expected = await _measure(lambda: _inline(items))
+        pool_total, pool_stall, actual = await _measure(
+            lambda: decrypt_journal_entry_items(items)
+        )
+        assert [v.model_dump_json() for v in expected] == [
+            v.model_dump_json() for v in actual
+        ]
+        print(
+            f"{count:5d} items: inline {inline_total * 1e3:8.2f}ms "
+            f"(longest stall {inline_stall * 1e3:8.2f}ms), "
+            f"decrypt_items {pool_total * 1e3:8.2f}ms "
+            f"(longest stall {pool_stall * 1e3:8.2f}ms)"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+"""Manual benchmark for the cpu-bound part of `personalization.lib.pipeline.select_journey`
+(scoring, adjusting, and picking the best instructor/category combination),
+comparing the per-combination python implementation against the numpy
+implementation the pipeline uses, with the maximum of 100 feedback items. Also
+verifies the scores are identical and the selected combinations tie. The steps
+which require integrations are not included. Run from the repository root with
+
+    python -m tests.man_bench_personalization_scoring
+"""
+
+try:
+    import helper  # type: ignore
+except:
+    import tests.helper  # type: ignore
+
+import random
+import time
+from typing import Callable, List, Tuple
+
+from personalization.lib.s01_find_combinations import InstructorCategoryAndBias
+from personalization.lib.s03a_find_feedback import JourneyFeedback
+from personalization.lib.s03b_feedback_score import (
+    compute_feedback_scores,
+    get_feedback_score,
+)
+from personalization.lib.s04b_adjust_scores import (
+    adjust_score,
+    compute_adjusted_scores,
+)
+from personalization.lib.s05_compare_combinations import (
+    ComparableInstructorCategory,
+    compare_combination_raw,
+    find_best_combination_index,
+    find_best_combination_index_from_arrays,
+)
+
+
+def _make_inputs(
+    rng: random.Random, num_combinations: int, num_feedback: int
+) -> Tuple[
+    List[InstructorCategoryAndBias], List[JourneyFeedback], List[int], List[int]
+]:
+    num_instructors = max(1, num_combinations // 4)
+    num_categories = max(1, num_combinations // 3)
+    combinations = [
+        InstructorCategoryAndBias(
+            instructor_uid=f"oseh_i_{idx % num_instructors}",
+            instructor_name=f"Instructor {idx % num_instructors}",
+            instructor_bias=rng.choice([0, 0, 0.5, 1.25]),
+            category_uid=f"oseh_c_{idx % num_categories}",
+            category_internal_name=f"category {idx % num_categories}",
+            category_bias=rng.choice([0, 0, 0.25, 1, 3.5]),
+        )
+        for idx in range(num_combinations)
+    ]
+    feedback = [
+        JourneyFeedback(
+            # a few rate content that is no longer available
+            instructor_uid=f"oseh_i_{rng.randrange(num_instructors + 2)}",
+            category_uid=f"oseh_c_{rng.randrange(num_categories + 2)}",
+            rating=rng.choice([1, 1, 0, -1, -2]),
+            debug_info=None,
+        )
+        for _ in range(num_feedback)
+    ]
+    times_seen_recently = [rng.choice([0, 0, 0, 1, 2, 5]) for _ in combinations]
+    lowest_view_counts = [rng.choice([0, 0, 1, 3]) for _ in combinations]
+    return combinations, feedback, times_seen_recently, lowest_view_counts
+
+
+def _python(combinations, feedback, times_seen_recently, lowest_view_counts):
+    scores = [get_feedback_score(comb, feedback) for comb in combinations]
+    adjusted = [
+        adjust_score(score, times_seen)
+        for score, times_seen in zip(scores, times_seen_recently)
+    ]
+    best = find_best_combination_index(
+        [
+            ComparableInstructorCategory(
+                instructor_uid=comb.instructor_uid,
+                category_uid=comb.category_uid,
+                lowest_view_count=view_count,
+                adjusted_score=adj.score,
+            )
+            for comb, view_count, adj in zip(combinations, lowest_view_counts, adjusted)
+        ]
+    )
+    return [s.score for s in scores], [a.score for a in adjusted], best
+
+
+def _numpy(combinations, feedback, times_seen_recently, lowest_view_counts):
+    scores = compute_feedback_scores(combinations, feedback)
+    adjusted = compute_adjusted_scores(scores, times_seen_recently)
+    best = find_best_combination_index_from_arrays(
+        lowest_view_counts=lowest_view_counts, adjusted_scores=adjusted
+    )
+    return scores.tolist(), adjusted.tolist(), best
+
+
+def _time(fn: Callable[[], object], iterations: int) -> float:
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started_at) / iterations
+
+
+def main():
+    rng = random.Random(42)
+    for num_combinations in (5, 20, 80, 320):
+        for _ in range(50):
+            inputs = _make_inputs(rng, num_combinations, rng.randint(0, 100))
+            expected_scores, expected_adjusted, expected_best = _python(*inputs)
+            actual_scores, actual_adjusted, actual_best = _numpy(*inputs)
+            assert expected_scores == actual_scores
+            assert expected_adjusted == actual_adjusted
+            comparable = [
+                ComparableInstructorCategory(
+                    instructor_uid="",
+                    category_uid="",
+                    lowest_view_count=view_count,
+                    adjusted_score=score,
+                )
+                for view_count, score in zip(inputs[3], expected_adjusted)
+            ]
+            assert (
+                compare_combination_raw(
+                    comparable[actual_best], comparable[expected_best]
+                )
+                == 0
+            )
+
+        inputs = _make_inputs(rng, num_combinations, 100)
+        iterations = max(20, 20_000 // num_combinations)
+        python_time = _time(lambda: _python(*inputs), iterations)
+        numpy_time = _time(lambda: _numpy(*inputs), iterations)
+        print(
+            f"{num_combinations:4d} combinations: python {python_time * 1e3:7.3f}ms, "
+            f"numpy {numpy_time * 1e3:7.3f}ms ({python_time / numpy_time:5.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
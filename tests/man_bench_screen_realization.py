@@ -0,0 +1,210 @@
+"""Manual benchmark comparing realizing client screen parameters by walking the
+raw schema against realizing them with the precompiled realization plan, which
+is what happens for the front and prefetch screens on every peek/pop. Also
+verifies both produce the same result, including key order. The extension
+format converters are replaced with fakes so no integrations are required. Run
+from the repository root with
+
+    python -m tests.man_bench_screen_realization
+"""
+
+try:
+    import helper  # type: ignore
+except:
+    import tests.helper  # type: ignore
+
+import asyncio
+import json
+import time
+from typing import Any, cast
+from itgs import Itgs
+import lib.client_flows.screen_schema as screen_schema
+
+
+def _image_schema(path_to_me: list) -> dict:
+    return {
+        "type": "object",
+        "nullable": True,
+        "default": None,
+        "properties": {
+            "image": {
+                "type": "string",
+                "format": "image_uid",
+                "x-dynamic-size": {
+                    "width": [*path_to_me, "width"],
+                    "height": [*path_to_me, "height"],
+                },
+            },
+            "width": {"type": "integer", "format": "int32", "default": 342},
+            "height": {"type": "integer", "format": "int32", "default": 237},
+        },
+    }
+
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "header": {"type": "string", "default": "Hello"},
+        "message": {"type": "string", "nullable": True, "default": None},
+        "image": _image_schema(["image"]),
+        "background": {
+            "type": "string",
+            "format": "image_uid",
+            "x-thumbhash": {"width": 1, "height": 1},
+        },
+        "journey": {"type": "string", "format": "journey_uid", "nullable": True},
+        "cta": {
+            "type": "object",
+            "x-enum-discriminator": "type",
+            "default": {"type": "pop"},
+            "oneOf": [
+                {
+                    "type": "object",
+                    "properties": {
+                        "type": {"type": "string", "enum": ["pop"]},
+                        "text": {"type": "string", "default": "Continue"},
+                    },
+                },
+                {
+                    "type": "object",
+                    "properties": {
+                        "type": {"type": "string", "enum": ["content"]},
+                        "content": {"type": "string", "format": "content_uid"},
+                    },
+                },
+            ],
+        },
+        "options": {
+            "type": "array",
+            "default": [],
+            "items": {
+                "type": "object",
+                "properties": {
+                    "text": {"type": "string"},
+                    "slug": {"type": "string", "format": "flow_slug"},
+                    "weight": {"type": "number", "format": "double", "default": 1},
+                },
+            },
+        },
+        "trace": {"type": "object", "default": {}},
+        "entrance": {"type": "boolean", "default": True},
+    },
+}
+
+INPUTS = [
+    {"background": "oseh_if_bg", "journey": None},
+    {
+        "header": "Hi",
+        "message": "Welcome",
+        "image": {"image": "oseh_if_img", "width": 100, "height": 50},
+        "background": "oseh_if_bg",
+        "journey": "oseh_j_1",
+        "cta": {"type": "content", "content": "oseh_cf_1"},
+        "options": [
+            {"text": "a", "slug": "a", "weight": 2.5},
+            {"text": "b", "slug": "b"},
+        ],
+        "trace": {"anything": [1, 2]},
+        "entrance": False,
+    },
+]
+
+NO_CONVERSIONS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "header": {"type": "string", "default": "Hello"},
+        "options": SCHEMA["properties"]["options"],
+        "entrance": {"type": "boolean", "default": True},
+    },
+}
+
+ITERATIONS = 20_000
+
+
+async def _fake_convert_image_uid(itgs, uid, width, height):
+    return {"uid": uid, "jwt": "fake", "thumbhash": f"{width}x{height}"}
+
+
+async def _fake_convert_content_uid(itgs, uid):
+    return {"uid": uid, "jwt": "fake"}
+
+
+async def _fake_convert_for_user(itgs, uid, user_sub):
+    return {"uid": uid, "user": user_sub}
+
+
+async def _bench(name: str, realizer: screen_schema.ScreenSchemaRealizer, input: Any):
+    itgs = cast(Itgs, None)
+    started_at = time.perf_counter()
+    for _ in range(ITERATIONS):
+        await realizer._convert_validated_to_realized_by_walking(
+            itgs, for_user_sub="bench", input=input
+        )
+    walking = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    for _ in range(ITERATIONS):
+        await realizer.convert_validated_to_realized(
+            itgs, for_user_sub="bench", input=input
+        )
+    planned = time.perf_counter() - started_at
+
+    print(
+        f"{name}: walking {walking / ITERATIONS * 1e6:7.2f}us, "
+        f"plan {planned / ITERATIONS * 1e6:7.2f}us "
+        f"({walking / planned:.1f}x)"
+    )
+
+
+async def main():
+    screen_schema.convert_image_uid = _fake_convert_image_uid
+    screen_schema.convert_content_uid = _fake_convert_content_uid
+    screen_schema.convert_journey_uid = _fake_convert_for_user
+    screen_schema.convert_course_uid = _fake_convert_for_user
+    screen_schema.convert_interactive_prompt_uid = _fake_convert_for_user
+    screen_schema.convert_journal_entry_uid = _fake_convert_for_user
+
+    itgs = cast(Itgs, None)
+    realizer = screen_schema.ScreenSchemaRealizer(SCHEMA)
+    assert realizer.plan is not None, "failed to compile realization plan"
+    for input in INPUTS:
+        expected = await realizer._convert_validated_to_realized_by_walking(
+            itgs, for_user_sub="bench", input=input
+        )
+        actual = await realizer.convert_validated_to_realized(
+            itgs, for_user_sub="bench", input=input
+        )
+        assert json.dumps(expected) == json.dumps(actual), (expected, actual)
+
+    for path in (
+        [],
+        ["background"],
+        ["image"],
+        ["image", "image"],
+        ["image", "width"],
+        ["options", screen_schema.SpecialIndex.ARRAY_INDEX, "slug"],
+        ["options", "0"],
+        ["cta", "type"],
+        ["missing"],
+    ):
+        plan = realizer.plan
+        realizer.plan = None
+        expected_safe = realizer.is_safe(path)
+        realizer.plan = plan
+        assert realizer.is_safe(path) == expected_safe, path
+    assert list(realizer.iter_enum_discriminators()) == list(
+        realizer._iter_enum_discriminators_by_walking()
+    )
+    print("realization plans agree with walking the schema")
+
+    await _bench("defaults only", realizer, INPUTS[0])
+    await _bench("all fields", realizer, INPUTS[1])
+    await _bench(
+        "no conversions",
+        screen_schema.ScreenSchemaRealizer(NO_CONVERSIONS_SCHEMA),
+        {"options": [{"text": "a", "slug": "a"}, {"text": "b", "slug": "b"}]},
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,144 @@
+"""Manual benchmark comparing `download` and `download_parallel` in file_service.
+
+Runs against `LocalFiles` and against a stub S3 client which emulates a
+per-request latency and a per-connection throughput cap, which is where
+ranged parallel downloads help. Run from the repository root with
+
+    python -m tests.man_file_service_parallel_download
+"""
+
+try:
+    import helper  # type: ignore
+except:
+    import tests.helper  # type: ignore
+
+import aiofiles
+import asyncio
+import io
+import os
+import time
+from typing import Optional
+import file_service
+from temp_files import temp_dir, temp_file
+
+
+OBJECT_SIZE = 128 * 1024 * 1024
+"""The size of the object downloaded in each trial"""
+
+STUB_LATENCY = 0.03
+"""Seconds of latency the stub S3 client adds to each request"""
+
+STUB_BYTES_PER_SECOND = 64 * 1024 * 1024
+"""The throughput cap the stub S3 client applies to each response body"""
+
+
+class _StubBody:
+    def __init__(self, data: memoryview) -> None:
+        self.data = data
+        self.offset = 0
+
+    async def read(self, n: int) -> bytes:
+        chunk = bytes(self.data[self.offset : self.offset + n])
+        self.offset += len(chunk)
+        if chunk:
+            await asyncio.sleep(len(chunk) / STUB_BYTES_PER_SECOND)
+        return chunk
+
+    def close(self) -> None:
+        pass
+
+
+class _StubS3Client:
+    """Implements just enough of the aiobotocore s3 client for downloads"""
+
+    def __init__(self, data: bytes) -> None:
+        self.data = memoryview(data)
+
+    async def head_object(self, *, Bucket: str, Key: str) -> dict:
+        await asyncio.sleep(STUB_LATENCY)
+        return {"ContentLength": len(self.data), "ETag": '"stub"'}
+
+    async def get_object(
+        self,
+        *,
+        Bucket: str,
+        Key: str,
+        Range: Optional[str] = None,
+        IfMatch: Optional[str] = None,
+    ) -> dict:
+        await asyncio.sleep(STUB_LATENCY)
+        if Range is None:
+            return {"Body": _StubBody(self.data)}
+        start_str, end_str = Range[len("bytes=") :].split("-")
+        return {"Body": _StubBody(self.data[int(start_str) : int(end_str) + 1])}
+
+
+async def _time(name: str, coro) -> None:
+    started_at = time.perf_counter()
+    await coro
+    elapsed = time.perf_counter() - started_at
+    print(
+        f"  {name:<40} {elapsed:8.3f}s {OBJECT_SIZE / elapsed / 1024 / 1024:10.1f} MiB/s"
+    )
+
+
+async def main():
+    data = os.urandom(OBJECT_SIZE)
+
+    print(f"LocalFiles ({OBJECT_SIZE} bytes):")
+    with temp_dir() as root:
+        local = file_service.LocalFiles(root, default_bucket="bench")
+        await local.upload(io.BytesIO(data), bucket="bench", key="obj", sync=True)
+
+        for concurrency in (1, 4, 8, 16):
+            buf = io.BytesIO()
+            await _time(
+                f"download_parallel (buffer, c={concurrency})",
+                local.download_parallel(
+                    buf, bucket="bench", key="obj", sync=True, concurrency=concurrency
+                ),
+            )
+            assert buf.getvalue() == data
+
+        buf = io.BytesIO()
+        await _time(
+            "download (buffer)",
+            local.download(buf, bucket="bench", key="obj", sync=True),
+        )
+        assert buf.getvalue() == data
+
+        with temp_file() as dst:
+            async with aiofiles.open(dst, "wb") as out:
+                await _time(
+                    "download_parallel (file, c=8)",
+                    local.download_parallel(out, bucket="bench", key="obj", sync=False),
+                )
+            with open(dst, "rb") as check:
+                assert check.read() == data
+
+    print(
+        f"stub S3 ({STUB_LATENCY * 1000:.0f}ms latency, "
+        f"{STUB_BYTES_PER_SECOND // 1024 // 1024} MiB/s per connection):"
+    )
+    s3 = file_service.S3(default_bucket="bench")
+    s3._s3 = _StubS3Client(data)  # type: ignore
+
+    buf = io.BytesIO()
+    await _time(
+        "download (buffer)", s3.download(buf, bucket="bench", key="obj", sync=True)
+    )
+    assert buf.getvalue() == data
+
+    for concurrency in (2, 4, 8, 16):
+        buf = io.BytesIO()
+        await _time(
+            f"download_parallel (buffer, c={concurrency})",
+            s3.download_parallel(
+                buf, bucket="bench", key="obj", sync=True, concurrency=concurrency
+            ),
+        )
+        assert buf.getvalue() == data
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,384 @@
+"""Manual load test for interactive prompt event ingestion. Simulates many
+users in the same interactive prompt joining, then liking and rating as fast
+as they can before leaving, once with buffered ingestion disabled and once
+with it enabled. Reports the sustained accepted events per second, the
+request latency, and how long the buffer took to drain, then verifies the
+stored stats match the accepted events and that each session's events were
+stored in order. Requires the dev environment (redis and rqlite). Run from
+the repository root with
+
+    python -m tests.man_load_interactive_prompt_events
+"""
+
+try:
+    import helper  # type: ignore
+except:
+    import tests.helper  # type: ignore
+
+import asyncio
+from collections import Counter
+import json
+import random
+import secrets
+import time
+from typing import Dict, List, Optional, Tuple
+
+from itgs import Itgs
+import interactive_prompts.events.helper as evhelper
+from interactive_prompts.events.models import (
+    NameEventData,
+    NoInteractivePromptEventData,
+)
+from interactive_prompts.events.routes.numeric_prompt_response import (
+    NumericPromptData,
+)
+import interactive_prompts.lib.event_buffer as event_buffer
+from interactive_prompts.lib.fenwick_replicas import FenwickReplica
+from interactive_prompts.models.prompt import NumericPrompt
+
+NUM_USERS = 200
+"""How many users are in the interactive prompt at the same time"""
+
+DURATION_SECONDS = 20
+"""The duration of the interactive prompt, which is also roughly how long
+each run lasts
+"""
+
+LIKE_PROBABILITY = 0.7
+"""The probability each event is a like rather than a rating"""
+
+
+class _Stats:
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.accepted: Counter = Counter()
+        self.rejected: Counter = Counter()
+        self.last_rating_by_session: Dict[str, int] = dict()
+
+
+async def _create_fixtures(itgs: Itgs) -> Tuple[str, List[Tuple[str, str]]]:
+    """Creates a numeric interactive prompt and a session for each of the
+    simulated users, returning the prompt uid and the (user sub, session uid)
+    pairs
+    """
+    conn = await itgs.conn()
+    cursor = conn.cursor("weak")
+    now = time.time()
+
+    prompt_uid = f"oseh_ip_{secrets.token_urlsafe(16)}"
+    await cursor.execute(
+        "INSERT INTO interactive_prompts (uid, prompt, duration_seconds, created_at) VALUES (?, ?, ?, ?)",
+        (
+            prompt_uid,
+            json.dumps(
+                {
+                    "style": "numeric",
+                    "text": "How are you?",
+                    "min": 1,
+                    "max": 5,
+                    "step": 1,
+                }
+            ),
+            DURATION_SECONDS,
+            now,
+        ),
+    )
+
+    participants: List[Tuple[str, str]] = []
+    for _ in range(NUM_USERS):
+        user_sub = f"oseh_u_{secrets.token_urlsafe(16)}"
+        session_uid = f"oseh_ips_{secrets.token_urlsafe(16)}"
+        await cursor.executemany3(
+            (
+                (
+                    "INSERT INTO users (sub, given_name, family_name, admin, timezone, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (user_sub, "Load", "Test", 0, "America/Los_Angeles", now),
+                ),
+                (
+                    "INSERT INTO interactive_prompt_sessions (interactive_prompt_id, user_id, uid) "
+                    "SELECT interactive_prompts.id, users.id, ? FROM interactive_prompts, users "
+                    "WHERE interactive_prompts.uid = ? AND users.sub = ?",
+                    (session_uid, prompt_uid, user_sub),
+                ),
+            )
+        )
+        participants.append((user_sub, session_uid))
+
+    return prompt_uid, participants
+
+
+async def _delete_fixtures(
+    itgs: Itgs, prompt_uid: str, participants: List[Tuple[str, str]]
+) -> None:
+    conn = await itgs.conn()
+    cursor = conn.cursor("weak")
+    await cursor.execute("DELETE FROM interactive_prompts WHERE uid=?", (prompt_uid,))
+    for user_sub, _ in participants:
+        await cursor.execute("DELETE FROM users WHERE sub=?", (user_sub,))
+
+
+async def _send(
+    itgs: Itgs,
+    stats: _Stats,
+    *,
+    prompt_uid: str,
+    user_sub: str,
+    session_uid: str,
+    event_type: str,
+    prompt_time: float,
+    rating: Optional[int] = None,
+) -> None:
+    started_at = time.perf_counter()
+    if event_type == "join" or event_type == "leave":
+        result = await evhelper.create_interactive_prompt_event(
+            itgs,
+            interactive_prompt_uid=prompt_uid,
+            user_sub=user_sub,
+            session_uid=session_uid,
+            event_type=event_type,
+            event_data=(
+                NameEventData(name="Load")
+                if event_type == "join"
+                else NoInteractivePromptEventData()
+            ),
+            prompt_time=prompt_time,
+            prefix_sum_updates=[
+                evhelper.PrefixSumUpdate(
+                    category="users",
+                    amount=1 if event_type == "join" else -1,
+                    simple=True,
+                    category_value=None,
+                    event_type=None,
+                    event_data_field=None,
+                )
+            ],
+            store_event_data=NoInteractivePromptEventData(),
+        )
+    elif event_type == "like":
+        result = await evhelper.create_interactive_prompt_event(
+            itgs,
+            interactive_prompt_uid=prompt_uid,
+            user_sub=user_sub,
+            session_uid=session_uid,
+            event_type=event_type,
+            event_data=NoInteractivePromptEventData(),
+            prompt_time=prompt_time,
+            prefix_sum_updates=[
+                evhelper.PrefixSumUpdate(
+                    category="likes",
+                    amount=1,
+                    simple=True,
+                    category_value=None,
+                    event_type=None,
+                    event_data_field=None,
+                )
+            ],
+        )
+    else:
+        assert rating is not None
+        result = await evhelper.create_interactive_prompt_event(
+            itgs,
+            interactive_prompt_uid=prompt_uid,
+            user_sub=user_sub,
+            session_uid=session_uid,
+            event_type=event_type,
+            event_data=NumericPromptData(rating=rating),
+            prompt_time=prompt_time,
+            # the route's bonus terms are omitted since the prompt is known
+            # to be a numeric prompt
+            prompt_check=lambda prompt: (
+                isinstance(prompt, NumericPrompt) and prompt.min <= rating <= prompt.max
+            ),
+            prefix_sum_updates=[
+                evhelper.PrefixSumUpdate(
+                    category="numeric_active",
+                    amount=1,
+                    simple=True,
+                    category_value=rating,
+                    event_type=None,
+                    event_data_field=None,
+                ),
+                evhelper.PrefixSumUpdate(
+                    category="numeric_active",
+                    amount=-1,
+                    simple=False,
+                    category_value=None,
+                    event_type="numeric_prompt_response",
+                    event_data_field="rating",
+                ),
+            ],
+        )
+    stats.latencies.append(time.perf_counter() - started_at)
+    if result.success:
+        stats.accepted[event_type] += 1
+        if rating is not None:
+            stats.last_rating_by_session[session_uid] = rating
+    else:
+        stats.rejected[result.error_type] += 1
+
+
+async def _simulate_user(
+    stats: _Stats, *, prompt_uid: str, user_sub: str, session_uid: str
+) -> None:
+    async with Itgs() as itgs:
+        started_at = time.time()
+        await _send(
+            itgs,
+            stats,
+            prompt_uid=prompt_uid,
+            user_sub=user_sub,
+            session_uid=session_uid,
+            event_type="join",
+            prompt_time=0,
+        )
+        while True:
+            # follow the wall clock, as a real client would
+            prompt_time = time.time() - started_at
+            if prompt_time >= DURATION_SECONDS - 1:
+                break
+            if random.random() < LIKE_PROBABILITY:
+                await _send(
+                    itgs,
+                    stats,
+                    prompt_uid=prompt_uid,
+                    user_sub=user_sub,
+                    session_uid=session_uid,
+                    event_type="like",
+                    prompt_time=prompt_time,
+                )
+            else:
+                await _send(
+                    itgs,
+                    stats,
+                    prompt_uid=prompt_uid,
+                    user_sub=user_sub,
+                    session_uid=session_uid,
+                    event_type="numeric_prompt_response",
+                    prompt_time=prompt_time,
+                    rating=random.randint(1, 5),
+                )
+        await _send(
+            itgs,
+            stats,
+            prompt_uid=prompt_uid,
+            user_sub=user_sub,
+            session_uid=session_uid,
+            event_type="leave",
+            prompt_time=DURATION_SECONDS - 1,
+        )
+
+
+async def _verify(
+    itgs: Itgs, stats: _Stats, prompt_uid: str, participants: List[Tuple[str, str]]
+) -> None:
+    conn = await itgs.conn()
+    cursor = conn.cursor("strong")
+
+    bins = evhelper.compute_bins(DURATION_SECONDS)
+    response = await cursor.execute(
+        """
+        SELECT category, category_value, idx, val
+        FROM interactive_prompt_event_fenwick_trees
+        WHERE
+            interactive_prompt_id = (
+                SELECT interactive_prompts.id FROM interactive_prompts
+                WHERE interactive_prompts.uid = ?
+            )
+        """,
+        (prompt_uid,),
+    )
+    replica = FenwickReplica(bins)
+    for category, category_value, idx, val in response.results or []:
+        replica.add_to_node(category, category_value, idx, val)
+
+    last_bin = bins - 1
+    assert replica.prefix_sum("users", None, last_bin) == 0
+    assert replica.prefix_sum("likes", None, last_bin) == stats.accepted["like"]
+    expected_ratings = Counter(stats.last_rating_by_session.values())
+    actual_ratings = dict(
+        (value, total)
+        for value, total in replica.prefix_sums_by_value(
+            "numeric_active", last_bin
+        ).items()
+        if total != 0
+    )
+    assert actual_ratings == dict(expected_ratings), (actual_ratings, expected_ratings)
+
+    response = await cursor.execute(
+        """
+        SELECT interactive_prompt_sessions.uid, interactive_prompt_events.prompt_time
+        FROM interactive_prompt_events, interactive_prompt_sessions
+        WHERE
+            interactive_prompt_sessions.id = interactive_prompt_events.interactive_prompt_session_id
+            AND interactive_prompt_sessions.interactive_prompt_id = (
+                SELECT interactive_prompts.id FROM interactive_prompts
+                WHERE interactive_prompts.uid = ?
+            )
+        ORDER BY interactive_prompt_events.id ASC
+        """,
+        (prompt_uid,),
+    )
+    last_prompt_time_by_session: Dict[str, float] = dict()
+    num_events = 0
+    for session_uid, prompt_time in response.results or []:
+        assert prompt_time >= last_prompt_time_by_session.get(session_uid, 0)
+        last_prompt_time_by_session[session_uid] = prompt_time
+        num_events += 1
+
+    assert num_events == sum(stats.accepted.values()), (num_events, stats.accepted)
+    assert len(last_prompt_time_by_session) == len(participants)
+
+
+async def _run(buffered: bool) -> None:
+    evhelper.BUFFERED_INGESTION_ENABLED = buffered
+    event_buffer.BUFFERED_INGESTION_ENABLED = buffered
+
+    async with Itgs() as itgs:
+        prompt_uid, participants = await _create_fixtures(itgs)
+        try:
+            stats = _Stats()
+            started_at = time.perf_counter()
+            await asyncio.gather(
+                *[
+                    _simulate_user(
+                        stats,
+                        prompt_uid=prompt_uid,
+                        user_sub=user_sub,
+                        session_uid=session_uid,
+                    )
+                    for user_sub, session_uid in participants
+                ]
+            )
+            accepting_time = time.perf_counter() - started_at
+
+            redis = await itgs.redis()
+            while await redis.llen(event_buffer.BUFFER_KEY) > 0:  # type: ignore
+                await event_buffer.flush_buffered_events(itgs, wait=True)
+            total_time = time.perf_counter() - started_at
+
+            num_accepted = sum(stats.accepted.values())
+            latencies = sorted(stats.latencies)
+            print(
+                f"{'buffered' if buffered else 'unbuffered':>10}: "
+                f"{num_accepted} events accepted in {accepting_time:.2f}s "
+                f"({num_accepted / accepting_time:.1f}/s), "
+                f"stored after {total_time:.2f}s "
+                f"({num_accepted / total_time:.1f}/s); "
+                f"latency p50 {latencies[len(latencies) // 2] * 1e3:.1f}ms, "
+                f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.1f}ms; "
+                f"rejected {dict(stats.rejected)}"
+            )
+
+            await _verify(itgs, stats, prompt_uid, participants)
+        finally:
+            await _delete_fixtures(itgs, prompt_uid, participants)
+
+
+async def main():
+    await _run(False)
+    await _run(True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,200 @@
+try:
+    import helper  # type: ignore
+except:
+    import tests.helper  # type: ignore
+
+import asyncio
+import json
+import secrets
+import tempfile
+import time
+import unittest
+from typing import List, Optional, cast
+from unittest import mock
+
+from itgs import Itgs
+from interactive_prompts.lib import event_buffer
+from interactive_prompts.lib.event_buffer import BufferedInteractivePromptEvent
+from interactive_prompts.lib.fenwick_deltas import FenwickTreeDelta
+from interactive_prompts.lib.fenwick_replicas import FenwickReplica
+from tests.fake_itgs import FakeItgs
+
+SCHEMA = """
+CREATE TABLE interactive_prompts (
+    id INTEGER PRIMARY KEY,
+    uid TEXT UNIQUE NOT NULL,
+    prompt TEXT NOT NULL,
+    duration_seconds INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    deleted_at REAL NULL
+);
+CREATE TABLE interactive_prompt_sessions (
+    id INTEGER PRIMARY KEY,
+    interactive_prompt_id INTEGER NOT NULL REFERENCES interactive_prompts(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL,
+    uid TEXT UNIQUE NOT NULL
+);
+CREATE TABLE interactive_prompt_events(
+    id INTEGER PRIMARY KEY,
+    uid TEXT UNIQUE NOT NULL,
+    interactive_prompt_session_id INTEGER NOT NULL REFERENCES interactive_prompt_sessions(id) ON DELETE CASCADE,
+    evtype TEXT NOT NULL,
+    data TEXT NOT NULL,
+    prompt_time REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE interactive_prompt_event_fenwick_trees (
+    id INTEGER PRIMARY KEY,
+    interactive_prompt_id INTEGER NOT NULL REFERENCES interactive_prompts(id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    category_value INTEGER NULL,
+    idx INTEGER NOT NULL,
+    val INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX interactive_prompt_event_fenwick_trees_ip_id_category_cvalue_idx_idx
+    ON interactive_prompt_event_fenwick_trees (interactive_prompt_id, category, category_value, idx);
+CREATE UNIQUE INDEX interactive_prompt_event_fenwick_trees_ip_id_category_idx_idx
+    ON interactive_prompt_event_fenwick_trees (interactive_prompt_id, category, idx) WHERE category_value IS NULL;
+CREATE TABLE interactive_prompt_event_counts (
+    id INTEGER PRIMARY KEY,
+    interactive_prompt_id INTEGER NOT NULL REFERENCES interactive_prompts(id) ON DELETE CASCADE,
+    bucket INTEGER NOT NULL,
+    total INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX interactive_prompt_counts_interactive_prompt_id_bucket_idx
+    ON interactive_prompt_event_counts(interactive_prompt_id, bucket);
+"""
+
+PROMPT_UID = "oseh_ip_test"
+SESSION_UID = "oseh_ips_test"
+BINS = 15
+
+
+def _item(
+    evtype: str,
+    prompt_time: float,
+    category: str,
+    amount: int,
+    *,
+    previous_value: Optional[int] = None,
+) -> bytes:
+    event = BufferedInteractivePromptEvent(
+        uid=f"oseh_ipe_{secrets.token_urlsafe(8)}",
+        interactive_prompt_uid=PROMPT_UID,
+        bins=BINS,
+        session_uid=SESSION_UID,
+        evtype=evtype,
+        data="{}",
+        prompt_time=prompt_time,
+        created_at=time.time(),
+        deltas=[
+            FenwickTreeDelta(
+                category=category,
+                category_value=None,
+                bin=int(prompt_time),
+                amount=amount,
+            )
+        ],
+        previous_value_deltas=[],
+        message="{}",
+    )
+    return json.dumps([previous_value, event.model_dump()]).encode("utf-8")
+
+
+async def _read_replica(itgs: FakeItgs) -> FenwickReplica:
+    conn = await itgs.conn()
+    response = await conn.cursor().execute(
+        "SELECT category, category_value, idx, val FROM interactive_prompt_event_fenwick_trees"
+    )
+    replica = FenwickReplica(BINS)
+    for category, category_value, idx, val in response.results or []:
+        replica.add_to_node(category, category_value, idx, val)
+    return replica
+
+
+async def _scalar(itgs: FakeItgs, query: str) -> int:
+    conn = await itgs.conn()
+    response = await conn.cursor().execute(query)
+    assert response.results is not None
+    return response.results[0][0]
+
+
+class Test(unittest.TestCase):
+    def test_replay_of_written_batch_with_new_items(self):
+        async def _inner():
+            with tempfile.TemporaryDirectory() as cache_dir:
+                async with FakeItgs(cache_dir=cache_dir) as itgs:
+                    conn = await itgs.conn()
+                    conn.db.executescript(SCHEMA)
+                    conn.db.execute(
+                        "INSERT INTO interactive_prompts (uid, prompt, duration_seconds, created_at) "
+                        "VALUES (?, '{}', ?, ?)",
+                        (PROMPT_UID, BINS, time.time()),
+                    )
+                    conn.db.execute(
+                        "INSERT INTO interactive_prompt_sessions (interactive_prompt_id, user_id, uid) "
+                        "SELECT id, 1, ? FROM interactive_prompts",
+                        (SESSION_UID,),
+                    )
+
+                    redis = await itgs.redis()
+                    first: List[bytes] = [
+                        _item("join", 0, "users", 1),
+                        _item("like", 1, "likes", 1),
+                        _item("like", 3, "likes", 1),
+                    ]
+                    await redis.rpush(event_buffer.BUFFER_KEY, *first)
+
+                    async def _fail_trim(*args, **kwargs):
+                        raise ConnectionError("simulated failure before trimming")
+
+                    with mock.patch.object(event_buffer, "ltrim_if_match", _fail_trim):
+                        with self.assertRaises(ConnectionError):
+                            await event_buffer.flush_buffered_events(cast(Itgs, itgs))
+
+                    # the batch was written but is still at the front of the buffer
+                    self.assertEqual(
+                        await redis.llen(event_buffer.BUFFER_KEY), len(first)
+                    )
+
+                    second: List[bytes] = [
+                        _item("like", 5, "likes", 1),
+                        _item("leave", 6, "users", -1),
+                    ]
+                    await redis.rpush(event_buffer.BUFFER_KEY, *second)
+
+                    flushed = await event_buffer.flush_buffered_events(cast(Itgs, itgs))
+                    self.assertEqual(flushed, len(first) + len(second))
+                    self.assertEqual(await redis.llen(event_buffer.BUFFER_KEY), 0)
+
+                    replica = await _read_replica(itgs)
+                    self.assertEqual(replica.prefix_sum("likes", None, BINS - 1), 3)
+                    self.assertEqual(replica.prefix_sum("likes", None, 2), 1)
+                    self.assertEqual(replica.prefix_sum("users", None, 5), 1)
+                    self.assertEqual(replica.prefix_sum("users", None, BINS - 1), 0)
+                    self.assertEqual(
+                        await _scalar(
+                            itgs, "SELECT COUNT(*) FROM interactive_prompt_events"
+                        ),
+                        len(first) + len(second),
+                    )
+                    self.assertEqual(
+                        await _scalar(
+                            itgs,
+                            "SELECT SUM(total) FROM interactive_prompt_event_counts",
+                        ),
+                        len(first) + len(second),
+                    )
+
+                    # replaying everything again changes nothing
+                    await redis.rpush(event_buffer.BUFFER_KEY, *first, *second)
+                    await event_buffer.flush_buffered_events(cast(Itgs, itgs))
+                    replica = await _read_replica(itgs)
+                    self.assertEqual(replica.prefix_sum("likes", None, BINS - 1), 3)
+                    self.assertEqual(replica.prefix_sum("users", None, 5), 1)
+
+        asyncio.run(_inner())
+
+
+if __name__ == "__main__":
+    unittest.main()
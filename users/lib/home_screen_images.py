@@ -1,11 +1,13 @@
 import asyncio
+from bisect import bisect_right
+from collections import OrderedDict
 from dataclasses import dataclass
 from datetime import date
 import io
 import random
 import secrets
 import time
-from typing import List, Optional, cast
+from typing import Dict, List, Optional, Tuple, cast
 from pydantic import BaseModel, Field, TypeAdapter
 from error_middleware import handle_error, handle_warning
 from itgs import Itgs
@@ -51,6 +53,76 @@ _available_home_screen_images_adapter: TypeAdapter[List[AvailableHomeScreenImage
 )
 
 
+@dataclass(frozen=True)
+class AvailableHomeScreenImagesIndex:
+    """The available home screen images for a given date, has_pro, and
+    wrapped_only, compiled so that the images available at a given time
+    of day can be found by binary search.
+
+    The time of day is split into segments at every start and end time of
+    every image, so that the same images are available throughout each segment.
+    """
+
+    breakpoints: List[float]
+    """The distinct start and end times of the images, ascending"""
+
+    uids_by_segment: List[Tuple[str, ...]]
+    """The uids of the home screen images available within
+    `[breakpoints[i], breakpoints[i + 1])` at index `i`. There is one fewer
+    segment than breakpoints
+    """
+
+    def available_at(self, seconds_since_midnight: float) -> Tuple[str, ...]:
+        """Returns the uids of the home screen images which can be shown at the
+        given time, in seconds from the start of the indicated day. O(log n)
+        """
+        idx = bisect_right(self.breakpoints, seconds_since_midnight) - 1
+        if idx < 0 or idx >= len(self.uids_by_segment):
+            return tuple()
+        return self.uids_by_segment[idx]
+
+
+def _compile_available(
+    available: List[AvailableHomeScreenImage],
+) -> AvailableHomeScreenImagesIndex:
+    breakpoints = sorted(
+        set(r.start_time for r in available) | set(r.end_time for r in available)
+    )
+    return AvailableHomeScreenImagesIndex(
+        breakpoints=breakpoints,
+        uids_by_segment=[
+            tuple(
+                r.home_screen_image_uid
+                for r in available
+                if r.start_time <= segment_start and r.end_time > segment_start
+            )
+            for segment_start in breakpoints[:-1]
+        ],
+    )
+
+
+_COMPILED_TTL_SECONDS = 86400 * 2
+"""How long a compiled index is kept in memory, at most; matches the local cache"""
+
+_MAX_COMPILED = 64
+"""The maximum number of compiled indices kept in memory at once; the least
+recently used are evicted first
+"""
+
+_compiled: (
+    "OrderedDict[Tuple[str, bool, bool], Tuple[AvailableHomeScreenImagesIndex, float]]"
+) = OrderedDict()
+"""Maps from (date_iso8601, has_pro, wrapped_only) to the compiled index and
+when it expires. Only replaced when new data is pushed to the local caches
+or the cache is purged
+"""
+
+_compiled_generation: int = 0
+"""Incremented whenever compiled indices are replaced or purged, so that a
+fill which raced the change is not stored
+"""
+
+
 async def read_home_screen_image(
     itgs: Itgs, *, user_sub: str, now: float, timezone: str
 ) -> UserHomeScreenImage:
@@ -84,38 +156,24 @@ async def read_home_screen_image(
     prev_date_iso8601 = unix_dates.unix_date_to_date(unix_date - 1).isoformat()
 
     prev_wrapped_available, available, recent_images = await asyncio.gather(
-        _read_available_home_screen_images(
+        _read_available_home_screen_images_index(
             itgs,
             date_iso8601=prev_date_iso8601,
             has_pro=is_pro,
             wrapped_only=True,
             now=now,
         ),
-        _read_available_home_screen_images(
+        _read_available_home_screen_images_index(
             itgs, date_iso8601=date_iso8601, has_pro=is_pro, wrapped_only=False, now=now
         ),
         recent_images_task,
     )
 
-    seconds_since_prev_midnight = seconds_since_midnight + 86400
-    relevant_prev = [
-        r
-        for r in prev_wrapped_available
-        if r.start_time <= seconds_since_prev_midnight
-        and r.end_time > seconds_since_prev_midnight
-    ]
-    relevant = [
-        r
-        for r in available
-        if r.start_time <= seconds_since_midnight
-        and r.end_time > seconds_since_midnight
-    ]
-
-    hsi_uids_by_times_seen = dict()
-    for img in relevant_prev:
-        hsi_uids_by_times_seen[img.home_screen_image_uid] = 0
-    for img in relevant:
-        hsi_uids_by_times_seen[img.home_screen_image_uid] = 0
+    hsi_uids_by_times_seen: Dict[str, int] = dict()
+    for uid in prev_wrapped_available.available_at(seconds_since_midnight + 86400):
+        hsi_uids_by_times_seen[uid] = 0
+    for uid in available.available_at(seconds_since_midnight):
+        hsi_uids_by_times_seen[uid] = 0
 
     for uid in recent_images:
         if uid in hsi_uids_by_times_seen:
@@ -324,6 +382,68 @@ WHERE
     return [r[0] for r in response.results or []]
 
 
+async def _read_available_home_screen_images_index(
+    itgs: Itgs, *, date_iso8601: str, has_pro: bool, wrapped_only: bool, now: float
+) -> AvailableHomeScreenImagesIndex:
+    """Determines what home screen images are available for the given date
+    for someone which does/does not have the `pro` revenuecat entitlement,
+    compiled for searching by time of day.
+
+    The compiled index is kept in memory and is only rebuilt when new data is
+    pushed to all the local caches (or the cache is purged), so in the typical
+    case this neither decompresses nor parses anything. Otherwise, this falls
+    back to `_read_available_home_screen_images`; see that function for details
+    on the arguments.
+    """
+    key = (date_iso8601, has_pro, wrapped_only)
+    entry = _compiled.get(key)
+    if entry is not None:
+        if entry[1] > time.time():
+            _compiled.move_to_end(key)
+            return entry[0]
+        del _compiled[key]
+
+    fill_generation = _compiled_generation
+    available = await _read_available_home_screen_images(
+        itgs,
+        date_iso8601=date_iso8601,
+        has_pro=has_pro,
+        wrapped_only=wrapped_only,
+        now=now,
+    )
+    index = _compile_available(available)
+    if fill_generation == _compiled_generation:
+        _store_compiled(key, index)
+    return index
+
+
+def _store_compiled(
+    key: Tuple[str, bool, bool], index: AvailableHomeScreenImagesIndex
+) -> None:
+    _compiled[key] = (index, time.time() + _COMPILED_TTL_SECONDS)
+    _compiled.move_to_end(key)
+    while len(_compiled) > _MAX_COMPILED:
+        _compiled.popitem(last=False)
+
+
+def _replace_compiled(
+    *, date_iso8601: str, has_pro: bool, wrapped_only: bool, available: bytes
+) -> None:
+    """Replaces the compiled index for the given key using freshly pushed data"""
+    global _compiled_generation
+    _compiled_generation += 1
+    _store_compiled(
+        (date_iso8601, has_pro, wrapped_only),
+        _compile_available(_convert_available_from_stored(available)),
+    )
+
+
+def _purge_compiled() -> None:
+    global _compiled_generation
+    _compiled_generation += 1
+    _compiled.clear()
+
+
 async def _read_available_home_screen_images(
     itgs: Itgs, *, date_iso8601: str, has_pro: bool, wrapped_only: bool, now: float
 ) -> List[AvailableHomeScreenImage]:
@@ -604,6 +724,7 @@ async def _push_purge_to_all_local_caches(itgs: Itgs) -> None:
 
 
 async def _handle_local_purge(itgs: Itgs, *, now: float) -> None:
+    _purge_compiled()
     iso8601_dates = _determine_purge_dates(now)
     await _delete_available_home_screen_images_from_local_cache(
         itgs, iso8601_dates=iso8601_dates
@@ -631,6 +752,12 @@ async def _handle_cache_pushes_forever() -> None:
                 available_len = int.from_bytes(msg.read(8), "big", signed=False)
                 available = msg.read(available_len)
 
+                _replace_compiled(
+                    date_iso8601=date_iso8601,
+                    has_pro=has_pro,
+                    wrapped_only=wrapped_only,
+                    available=available,
+                )
                 async with Itgs() as itgs:
                     await _write_available_home_screen_images_to_local_cache(
                         itgs,
@@ -6,6 +6,7 @@ from resources.patch.query import Query
 import unix_dates
 from itgs import Itgs
 from users.lib.timezones import get_user_timezone
+from personalization.home.copy.lib.version import bump_homescreen_copy_version
 import logging
 from rqdb.result import ResultItem
 
@@ -150,10 +151,13 @@ async def read_user_streak(
 
 
 async def purge_user_streak_cache(itgs: Itgs, *, sub: str) -> None:
-    """Purges the user streak cache for the user with the given sub"""
+    """Purges the user streak cache for the user with the given sub, and
+    invalidates their memoized home screen copy, which is derived from it
+    """
     logging.info(f"purging user streak cache for {sub=}")
     redis = await itgs.redis()
-    redis.delete(f"users:{sub}:streak".encode("utf-8"))
+    await redis.delete(f"users:{sub}:streak".encode("utf-8"))
+    await bump_homescreen_copy_version(itgs, user_sub=sub)
 
 
 async def _read_goal_days_per_week_query(
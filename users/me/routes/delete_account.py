@@ -15,6 +15,7 @@ from contextlib import asynccontextmanager
 from starlette.concurrency import run_in_threadpool
 import notifications.push.lib.token_stats
 import users.lib.entitlements
+from lib.journals.master_key_cache import purge_journal_master_keys_for_user
 import unix_dates
 import stripe
 import time
@@ -309,10 +310,14 @@ async def delete_account(force: bool, authorization: Optional[str] = Header(None
             await redis.delete(
                 f"oauth:valid_refresh_tokens:{auth_result.result.sub}".encode("utf-8"),
                 f"entitlements:{auth_result.result.sub}".encode("utf-8"),
+                f"client_screens:queue_head:{auth_result.result.sub}".encode("utf-8"),
             )
             await users.lib.entitlements.publish_purge_message(
                 itgs, user_sub=auth_result.result.sub, min_checked_at=time.time()
             )
+            await purge_journal_master_keys_for_user(
+                itgs, user_sub=auth_result.result.sub
+            )
 
             cache = await itgs.local_cache()
             cache.delete(f"users:{auth_result.result.sub}:created_at".encode("utf-8"))
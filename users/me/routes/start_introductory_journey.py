@@ -13,6 +13,8 @@ from itgs import Itgs
 import journeys.auth
 import unix_dates
 from users.lib.timezones import get_user_timezone
+from personalization.lib.user_profile import record_journey_started
+from users.lib.streak import purge_user_streak_cache
 
 
 router = APIRouter()
@@ -103,6 +105,11 @@ async def start_introductory_journey(
             await handle_contextless_error(
                 extra_info=f"failed to store introductory journey user_journey row: {auth_result.result.sub=}, {journey_uid=}"
             )
+        else:
+            await purge_user_streak_cache(itgs, sub=auth_result.result.sub)
+            await record_journey_started(
+                itgs, user_sub=auth_result.result.sub, user_journey_uid=user_journey_uid
+            )
 
         return journey_response
 
@@ -17,6 +17,8 @@ import logging
 import unix_dates
 
 from users.lib.timezones import get_user_timezone
+from personalization.lib.user_profile import record_journey_started
+from users.lib.streak import purge_user_streak_cache
 
 
 class StartJourneyFromHistoryRequest(BaseModel):
@@ -117,6 +119,7 @@ async def start_journey_from_history(
             return RACED_RESPONSE
 
         user_tz = await get_user_timezone(itgs, user_sub=auth_result.result.sub)
+        user_journey_uid = f"oseh_uj_{secrets.token_urlsafe(16)}"
         created_at = time.time()
         created_at_unix_date = unix_dates.unix_timestamp_to_unix_date(
             created_at, tz=user_tz
@@ -134,7 +137,7 @@ async def start_journey_from_history(
                 AND journeys.uid = ?
             """,
             (
-                f"oseh_uj_{secrets.token_urlsafe(16)}",
+                user_journey_uid,
                 created_at,
                 created_at_unix_date,
                 auth_result.result.sub,
@@ -145,6 +148,11 @@ async def start_journey_from_history(
             await handle_contextless_error(
                 extra_info=f"failed to store user_journey for {auth_result.result.sub=} and {args.journey_uid=} from history"
             )
+        else:
+            await purge_user_streak_cache(itgs, sub=auth_result.result.sub)
+            await record_journey_started(
+                itgs, user_sub=auth_result.result.sub, user_journey_uid=user_journey_uid
+            )
 
         await on_entering_lobby(
             itgs,
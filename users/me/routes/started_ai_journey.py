@@ -12,6 +12,8 @@ from itgs import Itgs
 from journeys.lib.notifs import on_entering_lobby
 from users.lib.timezones import get_user_timezone
 import unix_dates
+from personalization.lib.user_profile import record_journey_started
+from users.lib.streak import purge_user_streak_cache
 
 router = APIRouter()
 
@@ -85,5 +87,10 @@ async def started_ai_journey(
             await handle_contextless_error(
                 extra_info=f"failed to store ai journey user_journey row: {auth_result.result.sub=}, {journey_auth_result.result.journey_uid=}"
             )
+        else:
+            await purge_user_streak_cache(itgs, sub=auth_result.result.sub)
+            await record_journey_started(
+                itgs, user_sub=auth_result.result.sub, user_journey_uid=user_journey_uid
+            )
 
         return Response(status_code=204)
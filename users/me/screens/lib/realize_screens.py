@@ -1,10 +1,14 @@
+import asyncio
 import json
 import secrets
 import time
 from typing import List, Optional, Set
+from error_middleware import handle_warning
 from itgs import Itgs
 from lib.client_flows.executor import ClientScreenQueuePeekInfo
 from lib.client_flows.helper import produce_screen_input_parameters
+from lib.client_flows.screen_schema import ScreenRealizationMemo
+from lib.client_flows.simulator import ClientFlowSimulatorScreen
 from users.me.screens.lib.standard_parameters import (
     create_standard_parameters,
     get_requested_standard_parameters,
@@ -18,6 +22,12 @@ from users.me.screens.auth import create_jwt as create_screen_jwt
 from visitors.lib.get_or_create_visitor import VisitorSource, check_visitor_sanity
 from visitors.routes.associate_visitor_with_user import push_visitor_user_association
 
+PREFETCH_REALIZATION_TIMEOUT = 0.5
+"""How long, in seconds from the start of the request, we are willing to wait for
+the prefetch screens to be realized. Prefetch screens which are not realized by
+then are omitted rather than delaying the front screen any further
+"""
+
 
 async def realize_screens(
     itgs: Itgs,
@@ -45,37 +55,53 @@ async def realize_screens(
         platform=platform,
     )
 
-    active = PeekedScreenItem(
-        slug=result.front.screen.slug,
-        parameters=await result.front.screen.realizer.convert_validated_to_realized(
-            itgs,
-            for_user_sub=user_sub,
-            input=produce_screen_input_parameters(
-                flow_screen=result.front.flow_screen,
-                transformed_flow_client_parameters=result.front.flow_client_parameters,
-                transformed_flow_server_parameters=result.front.flow_server_parameters,
-                standard_parameters=standard_parameters,
+    memo = ScreenRealizationMemo(itgs, for_user_sub=user_sub)
+
+    async def _realize(screen: ClientFlowSimulatorScreen) -> PeekedScreenItem:
+        return PeekedScreenItem(
+            slug=screen.screen.slug,
+            parameters=await screen.screen.realizer.convert_validated_to_realized(
+                itgs,
+                for_user_sub=user_sub,
+                input=produce_screen_input_parameters(
+                    flow_screen=screen.flow_screen,
+                    transformed_flow_client_parameters=screen.flow_client_parameters,
+                    transformed_flow_server_parameters=screen.flow_server_parameters,
+                    standard_parameters=standard_parameters,
+                ),
+                memo=memo,
             ),
-        ),
-    )
+        )
+
+    prefetch_tasks = [asyncio.create_task(_realize(itm)) for itm in result.prefetch]
+    try:
+        active = await _realize(result.front)
+
+        if prefetch_tasks:
+            await asyncio.wait(
+                prefetch_tasks,
+                timeout=max(0, now + PREFETCH_REALIZATION_TIMEOUT - time.time()),
+            )
+    finally:
+        pending = [task for task in prefetch_tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        await memo.cancel_pending()
 
     prefetch: List[PeekedScreenItem] = []
-    for itm in result.prefetch:
-        prefetch.append(
-            PeekedScreenItem(
-                slug=itm.screen.slug,
-                parameters=await itm.screen.realizer.convert_validated_to_realized(
-                    itgs,
-                    for_user_sub=user_sub,
-                    input=produce_screen_input_parameters(
-                        flow_screen=itm.flow_screen,
-                        transformed_flow_client_parameters=itm.flow_client_parameters,
-                        transformed_flow_server_parameters=itm.flow_server_parameters,
-                        standard_parameters=standard_parameters,
-                    ),
-                ),
+    for itm, task in zip(result.prefetch, prefetch_tasks):
+        if task.cancelled():
+            # only keep the prefix that was realized in time, so the client still
+            # sees the prefetch screens in queue order
+            await handle_warning(
+                f"{__name__}:prefetch_timeout",
+                f"Realizing prefetch screen `{itm.screen.slug}` for `{user_sub}` took too long, "
+                "so it was not included in the prefetch list",
             )
-        )
+            break
+        prefetch.append(task.result())
 
     log_uid = f"oseh_ucsl_{secrets.token_urlsafe(16)}"
     new_visitor = f"oseh_v_{secrets.token_urlsafe(16)}"
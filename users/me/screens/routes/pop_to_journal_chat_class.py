@@ -29,6 +29,10 @@ from itgs import Itgs
 import auth as std_auth
 import unix_dates
 from users.lib.streak import purge_user_streak_cache
+from personalization.lib.user_profile import (
+    evict_personalization_profile,
+    record_journey_started,
+)
 from users.lib.timezones import get_user_timezone
 import users.me.screens.auth
 import users.lib.entitlements
@@ -558,6 +562,9 @@ WHERE
             )
         if not response[0].results:
             await purge_user_streak_cache(itgs, sub=user_sub)
+        await record_journey_started(
+            itgs, user_sub=user_sub, user_journey_uid=user_journey_uid
+        )
 
     master_key = await get_journal_master_key_for_encryption(
         itgs, user_sub=user_sub, now=entry_at
@@ -568,6 +575,7 @@ WHERE
                 "DELETE FROM user_journeys WHERE uid=?", (user_journey_uid,)
             )
             await purge_user_streak_cache(itgs, sub=user_sub)
+            await evict_personalization_profile(itgs, user_sub=user_sub)
 
         return JournalChatStoreUIEntryResultEncryptionError(
             type="encryption_error", subtype="get_master_key"
@@ -653,6 +661,7 @@ WHERE
                 "DELETE FROM user_journeys WHERE uid=?", (user_journey_uid,)
             )
             await purge_user_streak_cache(itgs, sub=user_sub)
+            await evict_personalization_profile(itgs, user_sub=user_sub)
 
         assert not response[1].results, response
 
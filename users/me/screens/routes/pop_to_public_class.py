@@ -17,6 +17,7 @@ from itgs import Itgs
 import auth as std_auth
 from users.lib.entitlements import get_entitlement
 from users.lib.streak import purge_user_streak_cache
+from personalization.lib.user_profile import record_journey_started
 from users.lib.timezones import get_user_timezone
 import users.me.screens.auth
 
@@ -149,6 +150,7 @@ premium_journeys(journey_id) AS (
 )
 """
 
+        user_journey_uid = f"oseh_uj_{secrets.token_urlsafe(16)}"
         all_responses = await cursor.executeunified3(
             (
                 (
@@ -198,7 +200,7 @@ WHERE
     ))
                     """,
                     (
-                        f"oseh_uj_{secrets.token_urlsafe(16)}",
+                        user_journey_uid,
                         request_at,
                         request_unix_date,
                         std_auth_result.result.sub,
@@ -254,6 +256,10 @@ WHERE
         if not had_class_today_response.results:
             await purge_user_streak_cache(itgs, sub=user_sub)
 
+        await record_journey_started(
+            itgs, user_sub=user_sub, user_journey_uid=user_journey_uid
+        )
+
         await on_entering_lobby(
             itgs,
             user_sub=std_auth_result.result.sub,
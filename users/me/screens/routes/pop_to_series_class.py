@@ -15,6 +15,7 @@ from typing import Annotated, Optional
 from itgs import Itgs
 import auth as std_auth
 from users.lib.streak import purge_user_streak_cache
+from personalization.lib.user_profile import record_journey_started
 from users.lib.timezones import get_user_timezone
 import users.me.screens.auth
 import courses.auth
@@ -167,6 +168,7 @@ async def pop_screen_to_series_class(
         conn = await itgs.conn()
         cursor = conn.cursor()
 
+        user_journey_uid = f"oseh_uj_{secrets.token_urlsafe(16)}"
         response = await cursor.executeunified3(
             (
                 (
@@ -197,7 +199,7 @@ WHERE
     AND journeys.deleted_at IS NULL
                     """,
                     (
-                        f"oseh_uj_{secrets.token_urlsafe(16)}",
+                        user_journey_uid,
                         request_at,
                         request_unix_date,
                         std_auth_result.result.sub,
@@ -224,6 +226,10 @@ WHERE
         if not response[0].results:
             await purge_user_streak_cache(itgs, sub=user_sub)
 
+        await record_journey_started(
+            itgs, user_sub=user_sub, user_journey_uid=user_journey_uid
+        )
+
         await on_entering_lobby(
             itgs,
             user_sub=std_auth_result.result.sub,